@@ -0,0 +1,512 @@
+""" Uploads many files to a Girder instance concurrently using asyncio """
+
+# imports
+import os
+import time
+import random
+import asyncio
+import hashlib
+from .directory_uploader import IMQCAMDirectoryUploader, DirectoryUploadSummary
+from ..utilities.async_girder import AsyncGirderClient
+from ..utilities.bandwidth import get_bandwidth_description
+from ..utilities.girder import get_girder_upload_parameters
+from ..utilities.hashing import HashingReader
+from ..utilities.mapped_files import open_file_reader
+from ..utilities.validation import (
+    DEFAULT_VALIDATION_MODE,
+    SERVER_HASH_ALGORITHM,
+    N_VALIDATION_SAMPLES,
+    VALIDATION_SAMPLE_SIZE,
+)
+
+
+class IMQCAMAsyncUploader(IMQCAMDirectoryUploader):
+    """Runnable that uploads many files to a Girder instance concurrently from a
+    single thread. Every Girder REST call (Folder creation, Item lookup, upload
+    chunks, metadata, and validation) is a coroutine sent through an
+    AsyncGirderClient. The number of requests in flight at once adjusts itself
+    between a floor and a ceiling (see AdaptiveConcurrencyLimit): it grows while
+    requests keep taking about as long as usual, and shrinks when they slow down or
+    the server reports being overloaded.
+
+    Uploads behave the same as "upload_file" (existing files are skipped, metadata
+    is added, uploads are validated, and the manifest is used if there is one),
+    except that Folders are created with a single request each and uploads aren't
+    resumable.
+
+    Args:
+        api_url (str): the URL of the Girder instance to connect to
+        api_key (str): the API key to use for connecting to Girder
+        args (list): passed to super().__init__()
+        kwargs (dict): passed to super().__init__()
+    """
+
+    DEFAULT_MAX_CONCURRENCY = AsyncGirderClient.DEFAULT_MAX_CONCURRENCY
+    DEFAULT_MIN_CONCURRENCY = 1
+    # Files larger than this are uploaded in chunks of this size
+    UPLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+
+    async def upload_directory_async(
+        self,
+        dirpath,
+        metadata=None,
+        relative_to=None,
+        root_folder_id=None,
+        collection_name=None,
+        root_folder_path=None,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        validation_mode=DEFAULT_VALIDATION_MODE,
+        min_concurrency=DEFAULT_MIN_CONCURRENCY,
+    ):
+        """Upload every file in a directory tree to the Girder instance concurrently.
+        Arguments are the same as for "upload_directory", except that the number of
+        threads is replaced by the maximum (and minimum) number of requests in flight
+        at once.
+
+        Returns:
+            DirectoryUploadSummary: counts of uploaded/skipped/failed files, with the
+                total number of bytes uploaded and the aggregate throughput
+
+        Raises:
+            ValueError: If "dirpath" is not relative to "relative_to"
+        """
+        return await self.upload_files_async(
+            self._walk_directory(dirpath),
+            metadata=metadata,
+            relative_to=self._check_relative_to(dirpath, relative_to),
+            root_folder_id=root_folder_id,
+            collection_name=collection_name,
+            root_folder_path=root_folder_path,
+            max_concurrency=max_concurrency,
+            validation_mode=validation_mode,
+            min_concurrency=min_concurrency,
+        )
+
+    async def upload_files_async(
+        self,
+        filepaths,
+        metadata=None,
+        relative_to=None,
+        root_folder_id=None,
+        collection_name=None,
+        root_folder_path=None,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        validation_mode=DEFAULT_VALIDATION_MODE,
+        min_concurrency=DEFAULT_MIN_CONCURRENCY,
+    ):
+        """Upload many files to the Girder instance concurrently, with optional
+        metadata added to each file. Errors uploading any individual file are logged
+        and counted without stopping the rest of the upload.
+
+        Args:
+            filepaths (iterable of pathlib.Path): Paths to the files to upload
+            metadata (dict, optional): dictionary of metadata to add to every file
+            relative_to (pathlib.Path, optional): An existing directory that should be
+                considered the "root" directory for the upload (see "upload_file")
+            root_folder_id (str, optional): The ID of the Girder Folder that should be
+                considered the "root" for the upload on the destination side.
+                Supersedes both "collection_name" and "root_folder_path".
+            collection_name (str, optional): The name of the Girder Collection under
+                which the files should be uploaded
+            root_folder_path (pathlib.Path, optional): A Path representation of the
+                Girder Folder (inside the "collection_name" Collection) that should
+                be considered the "root" on the upload side
+            max_concurrency (int, optional): The maximum number of Girder requests in
+                flight at once (also the number of files uploaded at once)
+            validation_mode (str, optional): How to check each file after it's
+                uploaded (see IMQCAMFileUploader.upload_file)
+            min_concurrency (int, optional): The fewest Girder requests to allow in
+                flight at once when adjusting to the server (the same as
+                "max_concurrency" to keep the number fixed)
+
+        Returns:
+            DirectoryUploadSummary: counts of uploaded/skipped/failed files, with the
+                total number of bytes uploaded and the aggregate throughput
+        """
+        # Find the root folder once (in a thread, since it's found with the
+        # synchronous client), and share Folder IDs between all of the files
+        upload_kwargs = {
+            "root_folder_id": await asyncio.to_thread(
+                self._get_root_folder_id,
+                root_folder_id,
+                collection_name,
+                root_folder_path,
+            ),
+            "folder_ids": {},
+            "metadata": metadata,
+            "relative_to": relative_to,
+            "validation_mode": validation_mode,
+        }
+        self.logger.info(
+            f"Uploading files with {min_concurrency} to {max_concurrency} concurrent "
+            "requests"
+        )
+        summary = DirectoryUploadSummary()
+        from tqdm import tqdm  # pylint: disable=import-outside-toplevel
+
+        progress_bar = tqdm(
+            desc="uploading files", total=0, ncols=120, unit="file", ascii=True
+        )
+        try:
+            async with AsyncGirderClient(
+                self.api_url,
+                token=self._girder_client.token,
+                max_concurrency=max_concurrency,
+                timer=self.timer,
+                retry_policy=self._girder_client.retry_policy,
+                min_concurrency=min_concurrency,
+                bandwidth_limiter=self._girder_client.bandwidth_limiter,
+            ) as client:
+                await self.__run_workers_async(
+                    filepaths,
+                    client,
+                    upload_kwargs,
+                    summary,
+                    progress_bar,
+                )
+            summary.finish()
+        finally:
+            progress_bar.close()
+        self.logger.info(
+            f"Done uploading files: {summary} "
+            f"(finished with {client.concurrency_limit.limit} concurrent requests)"
+        )
+        return summary
+
+    async def upload_file_async(
+        self,
+        client,
+        filepath,
+        root_folder_id,
+        metadata=None,
+        relative_to=None,
+        validation_mode=DEFAULT_VALIDATION_MODE,
+        folder_ids=None,
+    ):
+        """Upload a single file to the Girder instance using an AsyncGirderClient.
+
+        Args:
+            client (AsyncGirderClient): the authenticated client to use
+            filepath (pathlib.Path): Path to the file that should be uploaded
+            root_folder_id (str): The ID of the Girder Folder that the upload is
+                relative to
+            metadata (dict, optional): dictionary of metadata to add to the file
+            relative_to (pathlib.Path, optional): An existing directory that should be
+                considered the "root" directory for the upload
+            validation_mode (str, optional): How to check the file after it's uploaded
+            folder_ids (dict, optional): Folder IDs (or pending requests for them)
+                keyed by parent Folder ID and name, shared between files so that each
+                Folder is only found or created once
+
+        Returns:
+            bool: True if the file was uploaded, False if it was skipped because it
+                already exists in Girder
+
+        Raises:
+            ValueError: If "filepath" is not relative to "relative_to"
+            ValueError: If the file doesn't pass validation after it's uploaded
+        """
+        rel_filepath = self._get_relative_path(filepath, relative_to)
+        # where the file goes, as recorded in the manifest
+        destination = (filepath, rel_filepath, root_folder_id)
+        with self.timer.phase("manifest_check", filepath):
+            if self._is_in_manifest(*destination):
+                return False
+        with self.timer.phase("folder_resolution", filepath):
+            folder_id = await self.__get_folder_id_async(
+                client,
+                root_folder_id,
+                rel_filepath.parent.parts,
+                {} if folder_ids is None else folder_ids,
+            )
+        with self.timer.phase("existence_check", filepath):
+            existing_file = await self.__find_current_file_async(
+                client, folder_id, filepath
+            )
+        if existing_file is not None:
+            self.logger.info(f"{filepath} already exists in Girder and will be skipped")
+            self._add_to_manifest(*destination, existing_file)
+            return False
+        self.logger.info(f"Uploading {filepath} to {self.api_url}")
+        new_file, expected, file_stat = await self.__upload_and_hash_async(
+            client,
+            filepath,
+            folder_id,
+            (
+                ("sha256", SERVER_HASH_ALGORITHM)
+                if validation_mode == "server_hash"
+                else ("sha256",)
+            ),
+        )
+        await self.__add_metadata_and_validate_async(
+            client, filepath, new_file, expected, metadata, validation_mode
+        )
+        self._add_to_manifest(*destination, new_file, expected["sha256"], file_stat)
+        return True
+
+    async def __run_workers_async(
+        self, filepaths, client, upload_kwargs, summary, pbar
+    ):
+        """Upload every file in an iterable of paths using a pool of worker
+        coroutines (one per concurrent request) fed through a bounded queue
+        """
+        # enough workers for the highest the concurrency limit can go
+        n_workers = client.concurrency_limit.max_limit
+        work_queue = asyncio.Queue(maxsize=n_workers * self.QUEUE_SIZE_PER_THREAD)
+        workers = [
+            asyncio.ensure_future(
+                self.__upload_worker_async(
+                    work_queue, client, upload_kwargs, summary, pbar
+                )
+            )
+            for _ in range(n_workers)
+        ]
+        try:
+            for filepath in filepaths:
+                pbar.total += 1
+                pbar.refresh()
+                await work_queue.put(filepath)
+        finally:
+            for _ in workers:
+                await work_queue.put(None)
+            await asyncio.gather(*workers)
+
+    async def __upload_worker_async(
+        self, work_queue, client, upload_kwargs, summary, pbar
+    ):
+        while True:
+            filepath = await work_queue.get()
+            if filepath is None:
+                break
+            try:
+                summary.add_result(
+                    filepath,
+                    await self.upload_file_async(client, filepath, **upload_kwargs),
+                )
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                summary.add_failed(filepath)
+                self.logger.error(f"ERROR: failed to upload {filepath}", exc_info=exc)
+            pbar.set_postfix_str(
+                " ".join(
+                    (
+                        f"concurrency={client.concurrency_limit.limit}",
+                        get_bandwidth_description(client.bandwidth_limiter),
+                    )
+                ).strip(),
+                refresh=False,
+            )
+            pbar.update()
+
+    @staticmethod
+    async def __get_folder_id_async(client, root_folder_id, parts, folder_ids):
+        """Return the ID of the Folder at a relative path inside the root Folder,
+        creating Folders as needed with one request each. A request that fails is
+        forgotten, so that the next file in the same Folder tries again.
+        """
+        folder_id = root_folder_id
+        for folder_name in parts:
+            key = (folder_id, folder_name)
+            if key not in folder_ids:
+                folder_ids[key] = asyncio.ensure_future(
+                    client.post(
+                        "folder",
+                        parameters={
+                            "parentType": "folder",
+                            "parentId": folder_id,
+                            "name": folder_name,
+                            "public": "true",
+                            "reuseExisting": "true",
+                        },
+                    )
+                )
+            future = folder_ids[key]
+            try:
+                folder_id = (await future)["_id"]
+            except Exception:
+                if folder_ids.get(key) is future:
+                    del folder_ids[key]
+                raise
+        return folder_id
+
+    @staticmethod
+    async def __find_current_file_async(client, folder_id, filepath):
+        """Return the Girder File document for a file in a Folder if one exists with
+        the same name and size as the file on disk
+        """
+        for item in await client.get(
+            "item", parameters={"folderId": folder_id, "name": filepath.name}
+        ):
+            for file_doc in await client.list_resource(f"item/{item['_id']}/files"):
+                if file_doc["name"] == filepath.name:
+                    if file_doc["size"] == os.path.getsize(filepath):
+                        return file_doc
+                    return None
+        return None
+
+    async def __upload_and_hash_async(self, client, filepath, folder_id, algorithms):
+        """Upload a file to a new Item in a Girder Folder, in a single request or in
+        chunks, hashing it as it's read (in a worker thread). Large files are
+        memory-mapped, so their chunks are hashed and sent without being copied.
+        Returns the new Girder File document, a dictionary of the file's size and
+        hashes, and the result of os.stat for the file when it was opened.
+        """
+        with open_file_reader(filepath, self.MAPPED_READ_THRESHOLD) as fobj:
+            file_stat = os.fstat(fobj.fileno())
+            size = file_stat.st_size
+            hashing_reader = HashingReader(fobj, algorithms)
+            parameters = get_girder_upload_parameters(folder_id, filepath.name, size)
+            start = time.perf_counter()
+            if size <= self.UPLOAD_CHUNK_SIZE:
+                new_file = await client.post(
+                    "file",
+                    parameters=parameters,
+                    data=await asyncio.to_thread(hashing_reader.read, size),
+                )
+            else:
+                upload_id = (await client.post("file", parameters=parameters))["_id"]
+                while hashing_reader.n_bytes_read < size:
+                    offset = hashing_reader.n_bytes_read
+                    chunk = await asyncio.to_thread(
+                        hashing_reader.read, min(self.UPLOAD_CHUNK_SIZE, size - offset)
+                    )
+                    if not chunk:
+                        raise ValueError(f"{filepath} changed size while uploading!")
+                    new_file = await client.post(
+                        "file/chunk",
+                        parameters={"offset": offset, "uploadId": upload_id},
+                        data=chunk,
+                    )
+        self.timer.record_hashed_transfer(
+            time.perf_counter() - start, hashing_reader.hash_seconds, filepath
+        )
+        return new_file, {"size": size, **hashing_reader.hexdigests()}, file_stat
+
+    async def __add_metadata_and_validate_async(
+        self, client, filepath, new_file, expected, metadata, validation_mode
+    ):
+        """Add metadata to the Item for a newly-uploaded file and make sure the file
+        and its metadata are what they should be, raising a ValueError if not
+        """
+        # copy the metadata so that the same dictionary can be used for many files
+        metadata = {} if metadata is None else dict(metadata)
+        metadata["uploaderVersion"] = self._uploader_version
+        metadata["checksum"] = {"sha256": expected["sha256"]}
+        metadata["validationMode"] = validation_mode
+        with self.timer.phase("metadata", filepath):
+            item = await client.put(
+                f"item/{new_file['itemId']}/metadata", json_body=metadata
+            )
+        if validation_mode == "none":
+            return
+        with self.timer.phase("validation", filepath):
+            valid = await self.__validate_async(
+                client, filepath, new_file, expected, validation_mode
+            )
+        if not valid:
+            self.logger.error(
+                f"Contents of {filepath} do not match what's on Girder after upload!",
+                exc_type=ValueError,
+            )
+        if item["meta"] != metadata:
+            self.logger.error(
+                f"Metadata for {filepath} does not match what's on Girder after upload!",
+                exc_type=ValueError,
+            )
+
+    async def __validate_async(self, client, filepath, file_doc, expected, mode):
+        """Return True if an uploaded file passes the checks for a validation mode"""
+        if file_doc["size"] != expected["size"]:
+            return False
+        if mode == "metadata":
+            return True
+        if mode == "server_hash":
+            server_hash = file_doc.get(SERVER_HASH_ALGORITHM)
+            if server_hash is None:
+                server_hash = (await client.get(f"file/{file_doc['_id']}")).get(
+                    SERVER_HASH_ALGORITHM
+                )
+            if server_hash is not None:
+                return server_hash == expected[SERVER_HASH_ALGORITHM]
+            self.logger.warning(
+                f"Validation mode {mode} can't be used for {filepath}. "
+                "The whole file will be downloaded to validate it instead."
+            )
+        elif mode == "sample" and (
+            expected["size"] > N_VALIDATION_SAMPLES * VALIDATION_SAMPLE_SIZE
+        ):
+            offsets = random.sample(
+                range(expected["size"] - VALIDATION_SAMPLE_SIZE + 1),
+                N_VALIDATION_SAMPLES,
+            )
+            matches = await asyncio.gather(
+                *(
+                    self.__sample_matches_async(client, filepath, file_doc, offset)
+                    for offset in offsets
+                )
+            )
+            return all(matches)
+        file_hash = hashlib.sha256()
+        await client.get(f"file/{file_doc['_id']}/download", consumer=file_hash.update)
+        return file_hash.hexdigest() == expected["sha256"]
+
+    @staticmethod
+    async def __sample_matches_async(client, filepath, file_doc, offset):
+        """Return True if a range of bytes in a file on Girder matches the file on
+        disk
+        """
+        girder_bytes = bytearray()
+        await client.get(
+            f"file/{file_doc['_id']}/download",
+            parameters={"offset": offset, "endByte": offset + VALIDATION_SAMPLE_SIZE},
+            consumer=girder_bytes.extend,
+        )
+
+        def read_local_bytes():
+            with open(filepath, "rb") as fobj:
+                fobj.seek(offset)
+                return fobj.read(VALIDATION_SAMPLE_SIZE)
+
+        return bytes(girder_bytes) == await asyncio.to_thread(read_local_bytes)
+
+    def _upload_from_args(self, parsed_args):
+        summary = asyncio.run(
+            self.upload_directory_async(
+                parsed_args.dirpath,
+                max_concurrency=parsed_args.max_concurrency,
+                min_concurrency=min(
+                    parsed_args.min_concurrency, parsed_args.max_concurrency
+                ),
+                **self.get_upload_kwargs(parsed_args),
+            )
+        )
+        if summary.n_failed > 0:
+            self.logger.error(
+                f"{summary.n_failed} files in {parsed_args.dirpath} failed to upload!",
+                exc_type=RuntimeError,
+            )
+
+    @classmethod
+    def get_command_line_arguments(cls):
+        superargs, superkwargs = super().get_command_line_arguments()
+        # files are never packed or deduplicated by the asyncio uploader, and files
+        # that already exist are skipped on their sizes alone
+        args = [
+            arg
+            for arg in superargs
+            if arg not in ("pack_threshold", "dedup", "verify_existing")
+        ]
+        kwargs = {
+            **{k: v for k, v in superkwargs.items() if k != "n_threads"},
+            "max_concurrency": cls.DEFAULT_MAX_CONCURRENCY,
+            "min_concurrency": cls.DEFAULT_MIN_CONCURRENCY,
+        }
+        return args, kwargs
+
+
+def main(args=None):
+    """Run the "run_from_command_line" method of the IMQCAMAsyncUploader
+
+    Args:
+        args (list): list of command-line arguments to send to run_from_command_line
+    """
+    IMQCAMAsyncUploader.run_from_command_line(args)
@@ -0,0 +1,294 @@
+""" Compares a directory tree with its copy in a Girder instance, and syncs them """
+
+# imports
+import os
+import concurrent.futures
+from .directory_uploader import IMQCAMDirectoryUploader
+from .folder_downloader import FolderDownloadSummary
+from ..utilities.downloads import (
+    PARTIAL_DOWNLOAD_SUFFIX,
+    download_girder_file,
+    get_download_path,
+)
+from ..utilities.girder import get_girder_folder_id
+from ..utilities.packing import read_packed_file
+from ..utilities.sync import diff_local_and_girder_trees, index_girder_tree
+from ..utilities.validation import DEFAULT_VALIDATION_MODE, SERVER_HASH_ALGORITHM
+
+
+class IMQCAMDirectorySyncer(IMQCAMDirectoryUploader):
+    """Runnable that compares a local directory tree with its copy in Girder (where
+    "upload_directory" puts it), finding the files that are new, changed, or
+    missing (only in Girder), and optionally syncs the two.
+
+    The local tree is treated as the original: new and changed files are uploaded
+    like "upload_directory" would, and files that are only in Girder are downloaded
+    into the tree (checking their hashes, like IMQCAMFolderDownloader).
+
+    Args:
+        api_url (str): the URL of the Girder instance to connect to
+        api_key (str): the API key to use for connecting to Girder
+        args (list): passed to super().__init__()
+        verify_existing (bool, optional): passed to super().__init__(). True by
+            default, so that changed files with the same sizes as their copies in
+            Girder are uploaded instead of skipped.
+        kwargs (dict): passed to super().__init__()
+    """
+
+    def __init__(self, api_url, api_key, *args, verify_existing=True, **kwargs):
+        super().__init__(
+            api_url, api_key, *args, verify_existing=verify_existing, **kwargs
+        )
+
+    def diff_directory(
+        self,
+        dirpath,
+        relative_to=None,
+        root_folder_id=None,
+        collection_name=None,
+        root_folder_path=None,
+        n_threads=IMQCAMDirectoryUploader.DEFAULT_N_THREADS,
+    ):
+        """Compare a directory tree with its copy in Girder, without changing
+        either one.
+
+        Every Folder in the Girder copy is listed once (the time spent is recorded
+        as the "existence_check" phase) and the local tree is scanned once. Files
+        are compared by their relative paths and sizes, and by their sha256 hashes
+        if the Girder Items have recorded checksums (the time spent is recorded as
+        the "hash" phase; hashes in the manifest are used for unchanged files).
+
+        Args:
+            dirpath (pathlib.Path): Path to the directory to compare
+            relative_to (pathlib.Path, optional): the directory that "dirpath" was
+                uploaded relative to (see "upload_directory"), by default its parent
+            root_folder_id (str, optional): The ID of the Girder Folder that the
+                directory was uploaded relative to. Supersedes both
+                "collection_name" and "root_folder_path".
+            collection_name (str, optional): The name of the Girder Collection
+                holding the root Folder. Superseded by "root_folder_id" if that
+                argument is given.
+            root_folder_path (pathlib.Path, optional): A Path representation of the
+                root Girder Folder (inside the "collection_name" Collection).
+                Superseded by "root_folder_id" if that argument is given.
+            n_threads (int, optional): The number of Folders to list (and files to
+                hash) at once
+
+        Returns:
+            TreeDiff: the files that are new, changed, or missing
+
+        Raises:
+            ValueError: If "dirpath" is not relative to "relative_to"
+        """
+        relative_to = self._check_relative_to(dirpath, relative_to)
+        root_folder_id = self._get_root_folder_id(
+            root_folder_id, collection_name, root_folder_path
+        )
+        self.logger.info(f"Comparing {dirpath} with its copy in {self.api_url}")
+        self._girder_client.set_pool_size(n_threads)
+        with self.timer.phase("existence_check", dirpath):
+            try:
+                folder_id = get_girder_folder_id(
+                    self._girder_client,
+                    self._get_relative_path(dirpath, relative_to),
+                    root_folder_id=root_folder_id,
+                )
+            except ValueError:
+                # nothing from the directory has been uploaded yet
+                girder_entries = {}
+            else:
+                girder_entries = index_girder_tree(
+                    self._girder_client, folder_id, n_threads=n_threads
+                )
+        with self.timer.phase("hash", dirpath):
+            diff = diff_local_and_girder_trees(
+                dirpath, girder_entries, manifest=self._manifest, n_workers=n_threads
+            )
+        self.logger.info(f"Compared {dirpath} with Girder: {diff}")
+        return diff
+
+    def sync_directory(
+        self,
+        dirpath,
+        metadata=None,
+        relative_to=None,
+        root_folder_id=None,
+        collection_name=None,
+        root_folder_path=None,
+        n_threads=IMQCAMDirectoryUploader.DEFAULT_N_THREADS,
+        validation_mode=DEFAULT_VALIDATION_MODE,
+    ):
+        """Compare a directory tree with its copy in Girder (see "diff_directory"),
+        then upload every new and changed file and download every missing one.
+
+        Errors uploading or downloading any individual file are logged and counted
+        without stopping the rest.
+
+        Args:
+            dirpath (pathlib.Path): Path to the directory to sync
+            metadata (dict, optional): dictionary of metadata to add to every file
+                that's uploaded
+            relative_to (pathlib.Path, optional): see "diff_directory"
+            root_folder_id (str, optional): see "diff_directory"
+            collection_name (str, optional): see "diff_directory"
+            root_folder_path (pathlib.Path, optional): see "diff_directory"
+            n_threads (int, optional): The number of files to upload or download
+                concurrently
+            validation_mode (str, optional): How to check each file after it's
+                uploaded (see IMQCAMFileUploader.upload_file)
+
+        Returns:
+            tuple: the TreeDiff from before syncing, the DirectoryUploadSummary of
+                the files that were uploaded, and the FolderDownloadSummary of the
+                files that were downloaded
+
+        Raises:
+            ValueError: If "dirpath" is not relative to "relative_to"
+        """
+        upload_kwargs = self._get_directory_upload_kwargs(
+            dirpath,
+            relative_to=relative_to,
+            root_folder_id=root_folder_id,
+            collection_name=collection_name,
+            root_folder_path=root_folder_path,
+            metadata=metadata,
+            validation_mode=validation_mode,
+        )
+        diff = self.diff_directory(
+            dirpath,
+            relative_to=upload_kwargs["relative_to"],
+            root_folder_id=upload_kwargs["root_folder_id"],
+            n_threads=n_threads,
+        )
+        to_upload = [dirpath / rel_path for rel_path in (*diff.new, *diff.changed)]
+        try:
+            # (list the Folders' Items so that changed files can be checked without
+            # more requests for each one)
+            if to_upload:
+                self._plan_directory_folders(dirpath, upload_kwargs, n_threads)
+            upload_summary = self._upload_files(
+                to_upload, upload_kwargs, n_threads, f"uploading {dirpath.name}"
+            )
+        finally:
+            self._item_index.clear()
+        self.logger.info(f"Done uploading new and changed files: {upload_summary}")
+        download_summary = self.__download_missing_files(
+            dirpath, diff.missing, n_threads
+        )
+        self.logger.info(f"Done downloading missing files: {download_summary}")
+        return diff, upload_summary, download_summary
+
+    def __download_missing_files(self, dirpath, missing, n_threads):
+        """Download the files that are only in Girder into the local tree using a
+        pool of worker threads, and return the FolderDownloadSummary
+        """
+        summary = FolderDownloadSummary()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
+            futures = [
+                executor.submit(
+                    self.__download_missing_file, dirpath, rel_path, entry, summary
+                )
+                for rel_path, entry in missing.items()
+            ]
+            # (errors with single files are recorded in the summary, so anything
+            # raised here is unexpected)
+            for future in futures:
+                future.result()
+        summary.finish()
+        return summary
+
+    def __download_missing_file(self, dirpath, rel_path, entry, summary):
+        """Download a file that's only in Girder into the local tree, recording the
+        result in the summary (the time spent is recorded as the "transfer" phase).
+        Files whose paths include names that aren't plain file names fail, so that
+        nothing is written outside of the tree.
+        """
+        filepath = dirpath / rel_path
+        try:
+            filepath = get_download_path(dirpath, rel_path.split("/"))
+            filepath.parent.mkdir(parents=True, exist_ok=True)
+            with self.timer.phase("transfer", filepath):
+                summary.add_downloaded(self.__download_entry(filepath, entry))
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            summary.add_failed(filepath)
+            self.logger.error(
+                f"ERROR: failed to download missing file {filepath}", exc_info=exc
+            )
+
+    def __download_entry(self, filepath, entry):
+        """Download a file in Girder (from its pack, if it's in one) to a path,
+        checking its hashes, and return the number of bytes downloaded
+        """
+        size, checksum, item_id, member = entry
+        if member is not None:
+            partial_path = filepath.with_name(filepath.name + PARTIAL_DOWNLOAD_SUFFIX)
+            partial_path.write_bytes(
+                read_packed_file(self._girder_client, item_id, member)
+            )
+            os.replace(partial_path, filepath)
+            return size
+        file_docs = list(self._girder_client.listFile(item_id))
+        if len(file_docs) != 1:
+            raise ValueError(
+                f"ERROR: Item {item_id} has {len(file_docs)} Files, so it isn't a "
+                "copy of a single file!"
+            )
+        expected = {} if checksum is None else {"sha256": checksum}
+        if file_docs[0].get(SERVER_HASH_ALGORITHM):
+            expected[SERVER_HASH_ALGORITHM] = file_docs[0][SERVER_HASH_ALGORITHM]
+        return download_girder_file(
+            self._girder_client, file_docs[0], filepath, expected
+        )
+
+    @classmethod
+    def get_command_line_arguments(cls):
+        superargs, kwargs = super().get_command_line_arguments()
+        # files are compared and uploaded one at a time, so they're never packed, and
+        # changed files are always checked against their checksums
+        args = [
+            *(
+                arg
+                for arg in superargs
+                if arg not in ("pack_threshold", "verify_existing")
+            ),
+            "apply",
+        ]
+        return args, {**kwargs, "verify_existing": True}
+
+    def _upload_from_args(self, parsed_args):
+        upload_kwargs = self.get_upload_kwargs(parsed_args)
+        if not parsed_args.apply:
+            diff = self.diff_directory(
+                parsed_args.dirpath,
+                relative_to=upload_kwargs["relative_to"],
+                root_folder_id=upload_kwargs["root_folder_id"],
+                collection_name=upload_kwargs["collection_name"],
+                root_folder_path=upload_kwargs["root_folder_path"],
+                n_threads=parsed_args.n_threads,
+            )
+            for label, rel_paths in (
+                ("new", diff.new),
+                ("changed", diff.changed),
+                ("missing", diff.missing),
+            ):
+                for rel_path in rel_paths:
+                    self.logger.info(f"{label}: {rel_path}")
+            return
+        _, upload_summary, download_summary = self.sync_directory(
+            parsed_args.dirpath, n_threads=parsed_args.n_threads, **upload_kwargs
+        )
+        n_failed = upload_summary.n_failed + download_summary.n_failed
+        if n_failed > 0:
+            self.logger.error(
+                f"{n_failed} files in {parsed_args.dirpath} failed to sync!",
+                exc_type=RuntimeError,
+            )
+
+
+def main(args=None):
+    """Run the "run_from_command_line" method of the IMQCAMDirectorySyncer
+
+    Args:
+        args (list): list of command-line arguments to send to run_from_command_line
+    """
+    IMQCAMDirectorySyncer.run_from_command_line(args)
@@ -0,0 +1,613 @@
+""" Uploads all of the files in a directory tree to a Girder instance """
+
+# imports
+import os
+import time
+import queue
+import pathlib
+import threading
+from .file_uploader import IMQCAMFileUploader
+from ..utilities.bandwidth import get_bandwidth_description
+from ..utilities.file_watching import walk_files
+from ..utilities.girder import plan_girder_folders
+from ..utilities.packing import (
+    MAX_PACK_BYTES,
+    MAX_PACK_MEMBERS,
+    PACK_METADATA_KEY,
+    build_file_pack,
+    get_file_pack_name,
+)
+from ..utilities.validation import DEFAULT_VALIDATION_MODE
+
+
+class DirectoryUploadSummary:
+    """A thread-safe tally of what happened to each file in a directory upload.
+
+    Attributes:
+        n_uploaded (int): number of files that were uploaded
+        n_skipped (int): number of files that were skipped because they already exist
+        n_bytes_uploaded (int): total size of all the files that were uploaded
+        failed_filepaths (list): paths to all of the files that failed to upload
+    """
+
+    def __init__(self):
+        self.n_uploaded = 0
+        self.n_skipped = 0
+        self.n_bytes_uploaded = 0
+        self.failed_filepaths = []
+        self.__start_time = time.monotonic()
+        self.__end_time = None
+        self.__lock = threading.Lock()
+
+    @property
+    def n_failed(self):
+        """The number of files that raised errors while being uploaded"""
+        return len(self.failed_filepaths)
+
+    @property
+    def n_files(self):
+        """The total number of files that were processed"""
+        return self.n_uploaded + self.n_skipped + self.n_failed
+
+    @property
+    def elapsed_seconds(self):
+        """Wall time from the start of the upload until it finished (or until now)"""
+        end_time = self.__end_time if self.__end_time is not None else time.monotonic()
+        return end_time - self.__start_time
+
+    @property
+    def throughput(self):
+        """Aggregate upload rate in bytes per second"""
+        elapsed = self.elapsed_seconds
+        return self.n_bytes_uploaded / elapsed if elapsed > 0 else 0.0
+
+    def add_uploaded(self, n_bytes):
+        """Record a file that was uploaded
+
+        Args:
+            n_bytes (int): the size of the file that was uploaded
+        """
+        with self.__lock:
+            self.n_uploaded += 1
+            self.n_bytes_uploaded += n_bytes
+
+    def add_skipped(self):
+        """Record a file that was skipped because it already exists"""
+        with self.__lock:
+            self.n_skipped += 1
+
+    def add_result(self, filepath, uploaded):
+        """Record a file that was either uploaded or skipped
+
+        Args:
+            filepath (pathlib.Path): path to the file
+            uploaded (bool): True if the file was uploaded, False if it was skipped
+        """
+        if uploaded:
+            self.add_uploaded(os.stat(filepath).st_size)
+        else:
+            self.add_skipped()
+
+    def add_failed(self, filepath):
+        """Record a file that failed to upload
+
+        Args:
+            filepath (pathlib.Path): path to the file that failed
+        """
+        with self.__lock:
+            self.failed_filepaths.append(filepath)
+
+    def finish(self):
+        """Stop the clock used to compute the elapsed time and throughput"""
+        self.__end_time = time.monotonic()
+
+    def __str__(self):
+        return (
+            f"{self.n_files} files processed in {self.elapsed_seconds:.2f} seconds: "
+            f"{self.n_uploaded} uploaded, {self.n_skipped} skipped, "
+            f"{self.n_failed} failed ({self.n_bytes_uploaded} bytes uploaded at "
+            f"{self.throughput/1.0e6:.3f} MB/s)"
+        )
+
+
+class IMQCAMDirectoryUploader(IMQCAMFileUploader):
+    """Runnable that uploads every file in a directory tree to a Girder instance,
+    using a pool of worker threads that each run "upload_file" (or
+    "upload_file_pack", for small files if packing is enabled).
+
+    Args:
+        api_url (str): the URL of the Girder instance to connect to
+        api_key (str): the API key to use for connecting to Girder
+        args (list): passed to super().__init__()
+        kwargs (dict): passed to super().__init__()
+    """
+
+    DEFAULT_N_THREADS = 4
+    # The number of files waiting to be uploaded is capped at this many per thread
+    QUEUE_SIZE_PER_THREAD = 8
+
+    def upload_directory(
+        self,
+        dirpath,
+        metadata=None,
+        relative_to=None,
+        root_folder_id=None,
+        collection_name=None,
+        root_folder_path=None,
+        n_threads=DEFAULT_N_THREADS,
+        validation_mode=DEFAULT_VALIDATION_MODE,
+        pack_threshold=None,
+    ):
+        """Upload every file in a directory tree to the Girder instance, with
+        optional metadata added to each file.
+
+        Errors uploading any individual file are logged and counted without stopping
+        the rest of the upload. Files that already exist in Girder are skipped.
+
+        If "pack_threshold" is given, files smaller than that are uploaded in packs
+        (see "upload_file_pack") of files from the same directory instead of one at a
+        time, with up to MAX_PACK_MEMBERS files or MAX_PACK_BYTES bytes in each.
+
+        Args:
+            dirpath (pathlib.Path): Path to the directory whose files should be uploaded
+            metadata (dict, optional): dictionary of metadata to add to every file
+            relative_to (pathlib.Path, optional): An existing directory that should be
+                considered the "root" directory for the upload. The directory tree beyond
+                this point will be replicated in Girder, creating new Folders if needed.
+                Defaults to the parent of "dirpath", so that the directory itself is
+                recreated inside the root Folder.
+            root_folder_id (str, optional): The ID of the Girder Folder that should be
+                considered the "root" for the upload on the destination side.
+                Supersedes both "collection_name" and "root_folder_path".
+            collection_name (str, optional): The name of the Girder Collection under
+                which the files should be uploaded. Superseded by "root_folder_id" if
+                that argument is given.
+            root_folder_path (pathlib.Path, optional): A Path representation of the
+                Girder Folder (inside the "collection_name" Collection) that should
+                be considered the "root" on the upload side. Superseded by
+                "root_folder_id" if that argument is given.
+            n_threads (int, optional): The number of files to upload concurrently
+            validation_mode (str, optional): How to check each file after it's
+                uploaded (see IMQCAMFileUploader.upload_file)
+            pack_threshold (int, optional): Files smaller than this many bytes are
+                uploaded in packs (by default, every file is uploaded on its own)
+
+        Returns:
+            DirectoryUploadSummary: counts of uploaded/skipped/failed files, with the
+                total number of bytes uploaded and the aggregate throughput
+
+        Raises:
+            ValueError: If "dirpath" is not relative to "relative_to"
+        """
+        upload_kwargs = self._get_directory_upload_kwargs(
+            dirpath,
+            metadata,
+            relative_to,
+            root_folder_id,
+            collection_name,
+            root_folder_path,
+            validation_mode,
+        )
+        self.logger.info(f"Uploading files in {dirpath} using {n_threads} threads")
+        filepaths = self._walk_directory(dirpath)
+        if pack_threshold is not None:
+            filepaths = self.__group_small_files(filepaths, pack_threshold)
+        try:
+            self._plan_directory_folders(dirpath, upload_kwargs, n_threads)
+            summary = self._upload_files(
+                filepaths,
+                upload_kwargs,
+                n_threads,
+                f"uploading {dirpath.name}",
+            )
+        finally:
+            # the listings go stale as soon as anything else changes the Folders
+            self._item_index.clear()
+        self.logger.info(f"Done uploading {dirpath}: {summary}")
+        return summary
+
+    def upload_file_pack(
+        self,
+        filepaths,
+        metadata=None,
+        relative_to=None,
+        root_folder_id=None,
+        collection_name=None,
+        root_folder_path=None,
+        show_progress=True,
+        validation_mode=DEFAULT_VALIDATION_MODE,
+    ):
+        """Upload several small files from the same directory to the Girder instance
+        as a single Item holding an uncompressed zip archive of them (a "pack"), so
+        that the requests "upload_file" makes for every file are made once for all
+        of them.
+
+        The pack's Item gets the same metadata as a file uploaded by "upload_file",
+        plus a "pack" field listing the name, size, sha256 hash, and position in the
+        archive of every file in it (see "read_packed_file" and "extract_file_pack"
+        for getting them back). Files that were already uploaded according to the
+        manifest, or that already exist in Girder (on their own or in a pack), are
+        left out. Packed files are recorded in the manifest as the pack's Item.
+
+        Args:
+            filepaths (list): Paths to the files that should be packed, which must all
+                be in the same directory
+            metadata (dict, optional): dictionary of metadata to add to the pack
+            relative_to (pathlib.Path, optional): An existing directory that should be
+                considered the "root" directory for the upload (see "upload_file")
+            root_folder_id (str, optional): The ID of the Girder Folder that should be
+                considered the "root" for the upload on the destination side.
+                Supersedes both "collection_name" and "root_folder_path".
+            collection_name (str, optional): The name of the Girder Collection under
+                which the files should be uploaded. Superseded by "root_folder_id" if
+                that argument is given.
+            root_folder_path (pathlib.Path, optional): A Path representation of the
+                Girder Folder (inside the "collection_name" Collection) that should
+                be considered the "root" on the upload side. Superseded by
+                "root_folder_id" if that argument is given.
+            show_progress (bool, optional): If False, progress bars for the upload and
+                validation of the pack will not be shown
+            validation_mode (str, optional): How to check the pack after it's uploaded
+                (see "upload_file"; in "sample" mode the whole pack is checked)
+
+        Returns:
+            list: paths to the files that were packed and uploaded (empty if they
+                were all skipped)
+
+        Raises:
+            ValueError: If the files aren't all in the same directory
+            ValueError: If any file is not relative to "relative_to"
+            ValueError: If the pack doesn't pass validation after it's uploaded
+        """
+        if len({filepath.parent for filepath in filepaths}) > 1:
+            self.logger.error(
+                "ERROR: the files in a pack must all be in the same directory!",
+                exc_type=ValueError,
+            )
+        root_folder_id = self._get_root_folder_id(
+            root_folder_id, collection_name, root_folder_path
+        )
+        folder_id, to_pack = self.__find_files_to_pack(
+            filepaths, relative_to, root_folder_id
+        )
+        if not to_pack:
+            return []
+        self.logger.info(
+            f"Uploading {len(to_pack)} files from {filepaths[0].parent} as a pack to "
+            f"{self.api_url}"
+        )
+        self.__upload_pack(
+            to_pack,
+            folder_id,
+            root_folder_id,
+            metadata,
+            show_progress=show_progress,
+            validation_mode=validation_mode,
+        )
+        self.logger.info("Done!")
+        return [filepath for filepath, _, _ in to_pack]
+
+    def __find_files_to_pack(self, filepaths, relative_to, root_folder_id):
+        """Return the ID of the Girder Folder that files in a directory should be
+        uploaded to, and the path, relative path, and os.stat result of each of the
+        files that haven't been uploaded yet
+        """
+        folder_id = None
+        to_pack = []
+        for filepath in filepaths:
+            rel_filepath = self._get_relative_path(filepath, relative_to)
+            file_folder_id, _ = self._get_upload_folder_and_item_id(
+                filepath, rel_filepath, root_folder_id
+            )
+            if file_folder_id is not None:
+                folder_id = file_folder_id
+                to_pack.append((filepath, rel_filepath, os.stat(filepath)))
+        return folder_id, to_pack
+
+    def __upload_pack(
+        self,
+        to_pack,
+        folder_id,
+        root_folder_id,
+        metadata,
+        show_progress,
+        validation_mode,
+    ):
+        """Pack some files (timing it as part of the "hash" phase), upload and
+        validate the pack, and record the packed files in the manifest
+        """
+        with self.timer.phase("hash", to_pack[0][0].parent):
+            stream, size, members = build_file_pack(
+                [filepath for filepath, _, _ in to_pack]
+            )
+        with stream:
+            new_file = self._upload_and_validate_stream(
+                stream,
+                get_file_pack_name(members),
+                size,
+                folder_id,
+                {
+                    **(metadata or {}),
+                    PACK_METADATA_KEY: {"format": "zip", "members": members},
+                },
+                show_progress=show_progress,
+                validation_mode=validation_mode,
+            )
+        for (path, rel_path, stat), member in zip(to_pack, members):
+            self._add_to_manifest(
+                path,
+                rel_path,
+                root_folder_id,
+                new_file,
+                file_hash=member["sha256"],
+                file_stat=stat,
+                pack_member=member["name"],
+            )
+            self._item_index.set_item(
+                folder_id,
+                member["name"],
+                (new_file["itemId"], member["size"], member["sha256"], member["name"]),
+            )
+
+    def _get_directory_upload_kwargs(
+        self,
+        dirpath,
+        metadata,
+        relative_to,
+        root_folder_id,
+        collection_name,
+        root_folder_path,
+        validation_mode,
+    ):
+        """Return the keyword arguments for "upload_file" that every file in a
+        directory tree should be uploaded with, finding the root Folder once instead
+        of once per file (see "upload_directory" for the arguments)
+
+        Returns:
+            dict: keyword arguments for "upload_file"
+
+        Raises:
+            ValueError: If "dirpath" is not relative to "relative_to"
+        """
+        return {
+            "metadata": metadata,
+            "relative_to": self._check_relative_to(dirpath, relative_to),
+            "root_folder_id": self._get_root_folder_id(
+                root_folder_id, collection_name, root_folder_path
+            ),
+            "validation_mode": validation_mode,
+        }
+
+    def _plan_directory_folders(self, dirpath, upload_kwargs, n_threads):
+        """Find or create every Girder Folder that files in a directory tree will be
+        uploaded to before uploading any of them, one level of the tree at a time
+        (see "plan_girder_folders"). The Folder IDs are cached, so "upload_file" can
+        find them without any requests. Directories whose files have all been
+        uploaded according to the manifest are left out. Time spent is recorded as
+        part of the "folder_resolution" phase.
+
+        The Items already in the planned Folders are then listed with one paginated
+        request per Folder (see "GirderItemIndex"), so "upload_file" can tell which
+        files already exist in Girder without any per-file requests. Time spent
+        listing is recorded as part of the "existence_check" phase.
+
+        Args:
+            dirpath (pathlib.Path): Path to the directory whose files will be uploaded
+            upload_kwargs (dict): the keyword arguments for "upload_file" that every
+                file will be uploaded with
+            n_threads (int): The number of Folders to look up or create at once
+        """
+        root_folder_id = upload_kwargs["root_folder_id"]
+        self._girder_client.set_pool_size(n_threads)
+        folder_rel_paths = set()
+        with self.timer.phase("folder_resolution"):
+            for root, _, filenames in os.walk(dirpath):
+                rel_root = self._get_relative_path(
+                    pathlib.Path(root), upload_kwargs["relative_to"]
+                )
+                if any(
+                    self._manifest is None
+                    or not self._manifest.get_upload(
+                        pathlib.Path(root) / filename,
+                        self.api_url,
+                        root_folder_id,
+                        rel_root / filename,
+                    )
+                    for filename in filenames
+                ):
+                    folder_rel_paths.add(rel_root)
+            folder_ids = plan_girder_folders(
+                self._girder_client,
+                folder_rel_paths,
+                root_folder_id=root_folder_id,
+                n_threads=n_threads,
+            )
+        # list what's already in those Folders, so that files that exist in Girder
+        # can be skipped without any more requests
+        with self.timer.phase("existence_check"):
+            self._item_index.add_folders(
+                self._girder_client, folder_ids.values(), n_threads=n_threads
+            )
+        self.logger.debug(
+            f"Found or created {len(folder_ids)} Folders for {dirpath} and listed "
+            "the Items already in them"
+        )
+
+    def _upload_files(self, filepaths, upload_kwargs, n_threads, desc):
+        """Upload every file in an iterable of paths using a pool of worker threads,
+        showing a progress bar of the number of files processed
+
+        Args:
+            filepaths (iterable): paths to the files to upload (read as the workers
+                have room for more)
+            upload_kwargs (dict): keyword arguments for "upload_file"
+            n_threads (int): The number of files to upload concurrently
+            desc (str): the description for the progress bar
+
+        Returns:
+            DirectoryUploadSummary: counts of uploaded/skipped/failed files
+        """
+        summary = DirectoryUploadSummary()
+        # keep a connection open for every worker
+        self._girder_client.set_pool_size(n_threads)
+        from tqdm import tqdm  # pylint: disable=import-outside-toplevel
+
+        progress_bar = tqdm(desc=desc, total=0, ncols=120, unit="file", ascii=True)
+        try:
+            self.__run_workers(
+                filepaths, upload_kwargs, n_threads, summary, progress_bar
+            )
+        finally:
+            progress_bar.close()
+            summary.finish()
+        return summary
+
+    def _check_relative_to(self, dirpath, relative_to):
+        """Return the directory that an upload of a directory tree should be relative
+        to (the parent of the directory if it's not given)
+
+        Args:
+            dirpath (pathlib.Path): Path to the directory being uploaded
+            relative_to (pathlib.Path or None): the directory the upload should be
+                relative to, if given
+
+        Returns:
+            pathlib.Path: the directory that the upload is relative to
+
+        Raises:
+            ValueError: If "dirpath" is not relative to "relative_to"
+        """
+        if relative_to is None:
+            relative_to = dirpath.parent
+        _ = self._get_relative_path(dirpath, relative_to)
+        return relative_to
+
+    def __run_workers(self, filepaths, upload_kwargs, n_threads, summary, pbar):
+        """Upload every file in an iterable of paths using a pool of worker threads
+        fed through a bounded queue
+        """
+        work_queue = queue.Queue(maxsize=n_threads * self.QUEUE_SIZE_PER_THREAD)
+        pbar_lock = threading.Lock()
+        workers = [
+            threading.Thread(
+                target=self.__upload_worker,
+                args=(work_queue, upload_kwargs, summary, pbar, pbar_lock),
+            )
+            for _ in range(n_threads)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for work_item in filepaths:
+                with pbar_lock:
+                    pbar.total += len(work_item) if isinstance(work_item, list) else 1
+                    pbar.refresh()
+                work_queue.put(work_item)
+        finally:
+            for _ in workers:
+                work_queue.put(None)
+            for worker in workers:
+                worker.join()
+
+    def __upload_worker(self, work_queue, upload_kwargs, summary, pbar, pbar_lock):
+        while True:
+            work_item = work_queue.get()
+            if work_item is None:
+                break
+            n_files = self.__upload_work_item(work_item, upload_kwargs, summary)
+            with pbar_lock:
+                if self._girder_client.bandwidth_limiter is not None:
+                    pbar.set_postfix_str(
+                        get_bandwidth_description(
+                            self._girder_client.bandwidth_limiter
+                        ),
+                        refresh=False,
+                    )
+                pbar.update(n_files)
+
+    def __upload_work_item(self, work_item, upload_kwargs, summary):
+        """Upload a file, or a pack of files if given a list of paths, recording the
+        results in the summary. Returns the number of files handled.
+        """
+        filepaths = work_item if isinstance(work_item, list) else [work_item]
+        try:
+            if isinstance(work_item, list):
+                uploaded = self.upload_file_pack(
+                    work_item, show_progress=False, **upload_kwargs
+                )
+            elif self.upload_file(work_item, show_progress=False, **upload_kwargs):
+                uploaded = [work_item]
+            else:
+                uploaded = []
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            self.logger.error(
+                f"ERROR: failed to upload {', '.join(str(fp) for fp in filepaths)}",
+                exc_info=exc,
+            )
+            for filepath in filepaths:
+                summary.add_failed(filepath)
+        else:
+            for filepath in filepaths:
+                summary.add_result(filepath, filepath in uploaded)
+        return len(filepaths)
+
+    @staticmethod
+    def __group_small_files(filepaths, pack_threshold):
+        """Yield paths to files, replacing the files smaller than "pack_threshold"
+        bytes with lists of paths to small files in the same directory to upload as
+        packs (files walked in order, so each directory's files come together)
+        """
+        pack, pack_bytes = [], 0
+        for filepath in filepaths:
+            size = os.stat(filepath).st_size
+            if size >= pack_threshold:
+                yield filepath
+                continue
+            if pack and (
+                filepath.parent != pack[0].parent
+                or len(pack) >= MAX_PACK_MEMBERS
+                or pack_bytes + size > MAX_PACK_BYTES
+            ):
+                yield pack if len(pack) > 1 else pack[0]
+                pack, pack_bytes = [], 0
+            pack.append(filepath)
+            pack_bytes += size
+        if pack:
+            yield pack if len(pack) > 1 else pack[0]
+
+    @staticmethod
+    def _walk_directory(dirpath):
+        """Yield the path to every file in a directory tree, in sorted order"""
+        return walk_files(dirpath)
+
+    @classmethod
+    def get_command_line_arguments(cls):
+        superargs, superkwargs = super().get_command_line_arguments()
+        args = [
+            *("dirpath" if arg == "filepath" else arg for arg in superargs),
+            "pack_threshold",
+        ]
+        kwargs = {**superkwargs, "n_threads": cls.DEFAULT_N_THREADS}
+        return args, kwargs
+
+    def _upload_from_args(self, parsed_args):
+        summary = self.upload_directory(
+            parsed_args.dirpath,
+            n_threads=parsed_args.n_threads,
+            pack_threshold=parsed_args.pack_threshold,
+            **self.get_upload_kwargs(parsed_args),
+        )
+        if summary.n_failed > 0:
+            self.logger.error(
+                f"{summary.n_failed} files in {parsed_args.dirpath} failed to upload!",
+                exc_type=RuntimeError,
+            )
+
+
+def main(args=None):
+    """Run the "run_from_command_line" method of the IMQCAMDirectoryUploader
+
+    Args:
+        args (list): list of command-line arguments to send to run_from_command_line
+    """
+    IMQCAMDirectoryUploader.run_from_command_line(args)
@@ -0,0 +1,253 @@
+""" Continuously uploads files to a Girder instance as they're written into a
+directory tree
+"""
+
+# imports
+import time
+import threading
+from .directory_uploader import IMQCAMDirectoryUploader
+from ..utilities.file_watching import (
+    FileStabilityTracker,
+    get_file_watcher,
+    walk_files,
+)
+from ..utilities.validation import DEFAULT_VALIDATION_MODE
+
+
+class IMQCAMDirectoryWatcher(IMQCAMDirectoryUploader):
+    """Runnable that watches a directory tree and uploads every file that's created
+    or modified in it once the file has stopped changing, using a pool of worker
+    threads that each run "upload_file".
+
+    Changes are found with inotify on Linux, and by scanning the directory tree at
+    regular intervals everywhere else (or if requested, for example on network
+    filesystems where inotify doesn't see changes made by other machines).
+
+    Args:
+        api_url (str): the URL of the Girder instance to connect to
+        api_key (str): the API key to use for connecting to Girder
+        args (list): passed to super().__init__()
+        stable_seconds (float, optional): how long a file's size and modification
+            time must stay the same before it's uploaded
+        poll_interval (float, optional): seconds between scans of the directory tree
+            when polling for changes
+        use_polling (bool, optional): if True, poll for changes even if inotify is
+            available
+        upload_existing (bool, optional): if True (the default), files that are
+            already in the directory tree when watching starts are uploaded too
+            (files that already exist in Girder are skipped)
+        kwargs (dict): passed to super().__init__()
+    """
+
+    DEFAULT_STABLE_SECONDS = 5.0
+    DEFAULT_POLL_INTERVAL = 1.0
+    # files are never memory-mapped: instruments can truncate or rewrite files after
+    # they've been stable for a while, and reading past the end of a truncated map
+    # would kill the whole process instead of failing one upload
+    MAPPED_READ_THRESHOLD = None
+
+    def __init__(
+        self,
+        api_url,
+        api_key,
+        *args,
+        stable_seconds=DEFAULT_STABLE_SECONDS,
+        poll_interval=DEFAULT_POLL_INTERVAL,
+        use_polling=False,
+        upload_existing=True,
+        **kwargs,
+    ):
+        super().__init__(api_url, api_key, *args, **kwargs)
+        self.stable_seconds = stable_seconds
+        self.poll_interval = poll_interval
+        self.use_polling = use_polling
+        self.upload_existing = upload_existing
+        self.__stop_event = threading.Event()
+        # files this program writes itself, which shouldn't be uploaded
+        self.__own_filepaths = [
+            filepath.resolve()
+            for filepath in (
+                self._manifest.db_path if self._manifest is not None else None,
+                kwargs.get("timing_log_path"),
+                kwargs.get("timing_prometheus_path"),
+            )
+            if filepath is not None
+        ]
+
+    def watch_directory(
+        self,
+        dirpath,
+        metadata=None,
+        relative_to=None,
+        root_folder_id=None,
+        collection_name=None,
+        root_folder_path=None,
+        n_threads=IMQCAMDirectoryUploader.DEFAULT_N_THREADS,
+        validation_mode=DEFAULT_VALIDATION_MODE,
+        watch_seconds=None,
+    ):
+        """Upload files created or modified in a directory tree, with optional
+        metadata added to each file, until "stop" is called (from another thread),
+        "watch_seconds" have passed, or the program is interrupted.
+
+        Files are uploaded once their size and modification time have stayed the same
+        for "stable_seconds". Errors uploading any individual file are logged and
+        counted without stopping the rest of the uploads. Files that are still
+        changing when watching stops aren't uploaded.
+
+        Args:
+            dirpath (pathlib.Path): Path to the directory to watch
+            metadata (dict, optional): dictionary of metadata to add to every file
+            relative_to (pathlib.Path, optional): An existing directory that should be
+                considered the "root" directory for the uploads (see
+                "upload_directory"). Defaults to the parent of "dirpath".
+            root_folder_id (str, optional): The ID of the Girder Folder that should be
+                considered the "root" for the uploads on the destination side.
+                Supersedes both "collection_name" and "root_folder_path".
+            collection_name (str, optional): The name of the Girder Collection under
+                which the files should be uploaded. Superseded by "root_folder_id" if
+                that argument is given.
+            root_folder_path (pathlib.Path, optional): A Path representation of the
+                Girder Folder (inside the "collection_name" Collection) that should
+                be considered the "root" on the upload side. Superseded by
+                "root_folder_id" if that argument is given.
+            n_threads (int, optional): The number of files to upload concurrently
+            validation_mode (str, optional): How to check each file after it's
+                uploaded (see IMQCAMFileUploader.upload_file)
+            watch_seconds (float, optional): Stop watching after this many seconds
+                (by default, watch until stopped)
+
+        Returns:
+            DirectoryUploadSummary: counts of uploaded/skipped/failed files, with the
+                total number of bytes uploaded and the aggregate throughput
+
+        Raises:
+            ValueError: If "dirpath" is not relative to "relative_to"
+        """
+        upload_kwargs = self._get_directory_upload_kwargs(
+            dirpath,
+            metadata=metadata,
+            relative_to=relative_to,
+            root_folder_id=root_folder_id,
+            collection_name=collection_name,
+            root_folder_path=root_folder_path,
+            validation_mode=validation_mode,
+        )
+        self.__stop_event.clear()
+        try:
+            if self.upload_existing:
+                self._plan_directory_folders(dirpath, upload_kwargs, n_threads)
+            summary = self._upload_files(
+                self.__find_stable_files(dirpath, watch_seconds),
+                upload_kwargs,
+                n_threads,
+                f"uploading from {dirpath.name}",
+            )
+        finally:
+            self._item_index.clear()
+        self.logger.info(f"Done watching {dirpath}: {summary}")
+        return summary
+
+    def stop(self):
+        """Stop watching for new files. Files that have already been found are still
+        uploaded before "watch_directory" returns.
+        """
+        self.__stop_event.set()
+
+    def __find_stable_files(self, dirpath, watch_seconds):
+        """Yield paths to files in a directory tree as they become stable, until
+        watching should stop
+        """
+        deadline = None if watch_seconds is None else time.monotonic() + watch_seconds
+        tracker = FileStabilityTracker(self.stable_seconds)
+        # start watching before looking for existing files so nothing is missed
+        watcher = get_file_watcher(dirpath, self.use_polling, self.poll_interval)
+        self.logger.info(
+            f"Watching {dirpath} for new files with {type(watcher).__name__} "
+            f"(files are uploaded after they're unchanged for {self.stable_seconds} s)"
+        )
+        # check for stability often enough to upload files soon after they're done
+        check_interval = min(max(self.stable_seconds / 4.0, 0.05), 1.0)
+        try:
+            if self.upload_existing:
+                for filepath in walk_files(dirpath):
+                    if not self.__is_own_file(filepath):
+                        tracker.add(filepath)
+            while not self.__stop_event.is_set() and (
+                deadline is None or time.monotonic() < deadline
+            ):
+                for filepath in watcher.get_changed_paths(check_interval):
+                    if not self.__is_own_file(filepath):
+                        tracker.add(filepath)
+                yield from tracker.pop_stable()
+        finally:
+            watcher.close()
+            if len(tracker) > 0:
+                self.logger.warning(
+                    f"{len(tracker)} files in {dirpath} were still changing when "
+                    "watching stopped, and weren't uploaded"
+                )
+
+    def __is_own_file(self, filepath):
+        """Return True if a file was written by this program (like the manifest or
+        timing logs, including their temporary and journal files)
+        """
+        filepath = filepath.resolve()
+        return any(
+            filepath.parent == own_filepath.parent
+            and own_filepath.name in filepath.name
+            for own_filepath in self.__own_filepaths
+        )
+
+    @classmethod
+    def get_command_line_arguments(cls):
+        superargs, superkwargs = super().get_command_line_arguments()
+        # files are uploaded as soon as they're stable, so they're never packed
+        args = [
+            *(arg for arg in superargs if arg != "pack_threshold"),
+            "use_polling",
+            "watch_seconds",
+        ]
+        kwargs = {
+            **superkwargs,
+            "stable_seconds": cls.DEFAULT_STABLE_SECONDS,
+            "poll_interval": cls.DEFAULT_POLL_INTERVAL,
+        }
+        return args, kwargs
+
+    @classmethod
+    def get_init_args_kwargs(cls, parsed_args):
+        superargs, superkwargs = super().get_init_args_kwargs(parsed_args)
+        kwargs = {
+            **superkwargs,
+            "stable_seconds": parsed_args.stable_seconds,
+            "poll_interval": parsed_args.poll_interval,
+            "use_polling": parsed_args.use_polling,
+        }
+        return superargs, kwargs
+
+    def _upload_from_args(self, parsed_args):
+        try:
+            summary = self.watch_directory(
+                parsed_args.dirpath,
+                n_threads=parsed_args.n_threads,
+                watch_seconds=parsed_args.watch_seconds,
+                **self.get_upload_kwargs(parsed_args),
+            )
+        except KeyboardInterrupt:
+            self.logger.info(f"Stopped watching {parsed_args.dirpath}")
+            return
+        if summary.n_failed > 0:
+            self.logger.error(
+                f"{summary.n_failed} files in {parsed_args.dirpath} failed to upload!",
+                exc_type=RuntimeError,
+            )
+
+
+def main(args=None):
+    """Run the "run_from_command_line" method of the IMQCAMDirectoryWatcher
+
+    Args:
+        args (list): list of command-line arguments to send to run_from_command_line
+    """
+    IMQCAMDirectoryWatcher.run_from_command_line(args)
@@ -1,14 +1,52 @@
 """ Uploads a file to a Girder instance with some metadata """
 
+# pylint: disable=too-many-lines
+
 # imports
 import os
-import importlib.metadata
-from tqdm import tqdm
-import girder_client
+import time
+import pathlib
+import functools
+import threading
 from openmsitoolbox import Runnable, LogOwner
 from ..utilities.argument_parsing import IMQCAMArgumentParser
-from ..utilities.hashing import get_on_disk_file_hash, get_girder_file_hash
-from ..utilities.girder import get_girder_folder_id, get_girder_item_id
+from ..utilities.bandwidth import get_shared_token_bucket
+from ..utilities.dedup import GirderContentIndex
+from ..utilities.hashing import (
+    DEFAULT_HASH_READ_SIZE,
+    HashingReader,
+    get_on_disk_file_hashes,
+)
+from ..utilities.manifest import UploadManifest
+from ..utilities.mapped_files import DEFAULT_MAPPED_READ_THRESHOLD, open_file_reader
+from ..utilities.packing import FilePackItemIndex
+from ..utilities.retries import RetryPolicy
+from ..utilities.timing import UploadTimer
+from ..utilities.streams import as_readable_stream, buffer_stream, get_remaining_size
+from ..utilities.validation import (
+    DEFAULT_VALIDATION_MODE,
+    SERVER_HASH_ALGORITHM,
+    VALIDATORS,
+    validate_full_download,
+)
+from ..utilities.girder import (
+    get_girder_folder_id,
+    get_girder_item_file,
+    get_girder_upload_folder_and_item_id,
+    get_girder_upload_offset,
+    get_girder_upload_parameters,
+    upload_girder_chunks,
+)
+
+
+@functools.cache
+def _get_uploader_version():
+    """Return the installed version of this package (looked up only once, and only
+    when it's first needed, because scanning the installed distributions is slow)
+    """
+    import importlib.metadata  # pylint: disable=import-outside-toplevel
+
+    return importlib.metadata.version("imqcam_uploaders")
 
 
 class IMQCAMFileUploader(Runnable, LogOwner):
@@ -18,29 +56,119 @@ class IMQCAMFileUploader(Runnable, LogOwner):
         api_url (str): the URL of the Girder instance to connect to
         api_key (str): the API key to use for connecting to Girder
         args (list): passed to super().__init__()
+        manifest_path (pathlib.Path, optional): Path to a local manifest database
+            (created if it doesn't exist) recording which files have been uploaded,
+            so that unchanged files can be skipped without contacting Girder
+        timing_log_path (pathlib.Path, optional): Path to a file that the duration of
+            each upload phase and Girder request will be appended to as JSON lines
+        timing_prometheus_path (pathlib.Path, optional): Path to a file that the
+            totals of the timing measurements will be written to in the Prometheus
+            text format when the uploader is closed
+        max_retries (int, optional): the most times to retry a Girder request that
+            fails for a transient reason (like a dropped connection or a 502 error)
+        retry_backoff (float, optional): the longest wait (in seconds) before the
+            first retry of a request, which doubles for every retry after that
+        bandwidth_limit (BandwidthSchedule or str, optional): the most bytes per
+            second to upload, as a fixed rate or a schedule by time of day (see
+            BandwidthSchedule). The limit is shared by every upload in the process
+            that has the same one.
+        bandwidth_burst (int, optional): how many bytes can be uploaded at full speed
+            after a pause before "bandwidth_limit" applies
+        dedup (bool, optional): If True, files whose contents already exist
+            somewhere in the Collection they're uploaded into are copied on the
+            Girder server instead of being uploaded again (see GirderContentIndex)
+        verify_existing (bool, optional): If True, files that already exist in
+            Girder with the same size are only skipped if their sha256 hashes also
+            match the checksums recorded in their Items' metadata (which means
+            reading them unless the manifest has their hashes). By default files
+            are skipped on their sizes alone.
         kwargs (dict): passed to super().__init__()
 
     Raises:
         Exception: If authentication to the Girder instance fails
     """
 
+    # pylint: disable=too-many-instance-attributes
+
     ARGUMENT_PARSER_TYPE = IMQCAMArgumentParser
-    HASH_CHUNK_SIZE = 65536
+    HASH_CHUNK_SIZE = DEFAULT_HASH_READ_SIZE
+    # files at least this large are memory-mapped to hash and upload them
+    MAPPED_READ_THRESHOLD = DEFAULT_MAPPED_READ_THRESHOLD
 
-    def __init__(self, api_url, api_key, *args, **kwargs):
+    def __init__(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        api_url,
+        api_key,
+        *args,
+        manifest_path=None,
+        timing_log_path=None,
+        timing_prometheus_path=None,
+        max_retries=RetryPolicy.DEFAULT_MAX_RETRIES,
+        retry_backoff=RetryPolicy.DEFAULT_BACKOFF_SECONDS,
+        bandwidth_limit=None,
+        bandwidth_burst=None,
+        dedup=False,
+        verify_existing=False,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         self.api_url = api_url
-        # create the girder client and authenticate to the instance
+        # time every phase of uploads and every request made to Girder
+        self.timer = UploadTimer(json_lines_path=timing_log_path)
+        self.timing_prometheus_path = timing_prometheus_path
+        # create the girder client and authenticate to the instance (girder_client
+        # is only imported here, so that the command line can start without it)
+        # pylint: disable=import-outside-toplevel
+        from ..utilities.timed_girder_client import TimedGirderClient
+
         try:
-            self._girder_client = girder_client.GirderClient(apiUrl=self.api_url)
-            self._girder_client.authenticate(apiKey=api_key)
+            self.__main_client = TimedGirderClient(
+                apiUrl=self.api_url,
+                timer=self.timer,
+                retry_policy=RetryPolicy(max_retries, retry_backoff),
+                bandwidth_limiter=get_shared_token_bucket(
+                    bandwidth_limit, bandwidth_burst
+                ),
+            )
+            self.__main_client.authenticate(apiKey=api_key)
         except Exception as exc:  # pylint: disable=broad-exception-caught
             self.logger.error(
                 f"ERROR: failed to authenticate to Girder at {api_url}!",
                 exc_info=exc,
                 reraise=True,
             )
-        self._uploader_version = importlib.metadata.version("imqcam_uploaders")
+        # every other thread gets its own client, sharing this one's token and pool
+        # of connections
+        self.__thread_clients = threading.local()
+        self.__thread_clients.client = self.__main_client
+        # the Items in Folders that were listed in bulk before uploading many files
+        self._item_index = FilePackItemIndex()
+        self._manifest = None
+        if manifest_path is not None:
+            self._manifest = UploadManifest(manifest_path)
+        # where the contents of files already in Girder are, if deduplicating
+        self._content_index = None
+        if dedup:
+            self._content_index = GirderContentIndex(self.api_url, self._manifest)
+        self._verify_existing = verify_existing
+
+    @property
+    def _girder_client(self):
+        """The Girder client for the current thread (made the first time it's needed
+        in each thread)
+        """
+        client = getattr(self.__thread_clients, "client", None)
+        if client is None:
+            client = self.__main_client.get_worker_client()
+            self.__thread_clients.client = client
+        return client
+
+    @property
+    def _uploader_version(self):
+        """The version of this package, which is added to the metadata of every
+        uploaded file
+        """
+        return _get_uploader_version()
 
     def upload_file(
         self,
@@ -50,11 +178,19 @@ class IMQCAMFileUploader(Runnable, LogOwner):
         root_folder_id=None,
         collection_name=None,
         root_folder_path=None,
+        show_progress=True,
+        validation_mode=DEFAULT_VALIDATION_MODE,
     ):
         """Upload a file on disk to the Girder instance, with optional metadata.
 
         If the file already exists in Girder with the same size as on disk, it is
-        not edited at all.
+        not edited at all. If a manifest is in use and it records that the unchanged
+        file was already uploaded to the same place, Girder isn't checked at all.
+
+        If a manifest is in use, uploads of files too large to send in a single
+        request are recorded in it as they progress, and an unfinished upload of an
+        unchanged file (from a process that crashed, for example) is resumed from
+        wherever the Girder server left off instead of being started over.
 
         Args:
             filepath (pathlib.Path): Path to the file that should be uploaded on disk
@@ -75,131 +211,817 @@ class IMQCAMFileUploader(Runnable, LogOwner):
                 Girder Folder (inside the "collection_name" Collection) that should
                 be considered the "root" on the upload side. Superseded by
                 "root_folder_id" if that argument is given.
+            show_progress (bool, optional): If False, progress bars for the upload and
+                validation of the file will not be shown
+            validation_mode (str, optional): How to check the file after it's uploaded
+                (recorded in the "validationMode" metadata field). "full" downloads the
+                whole file to compare its hash, "server_hash" compares a hash computed
+                by the Girder server (falling back to "full" if the server doesn't
+                compute hashes), "metadata" only checks the size and metadata,
+                "sample" compares a few random byte ranges, and "none" skips checks.
+
+        Returns:
+            bool: True if the file was uploaded, False if it was skipped because it
+                already exists in Girder
 
         Raises:
             ValueError: If "filepath" is not relative to "relative_to"
+            ValueError: If the file doesn't pass validation after it's uploaded
         """
-        # Log a warning if a root folder ID was given alongside
-        # a collection name/root folder path
-        if root_folder_id is not None and (
-            collection_name is not None or root_folder_path is not None
-        ):
-            self.logger.warning(
-                (
-                    "WARNING: A root folder ID was given, so the collection name/root "
-                    "folder path arguments are being superseded!"
+        # If relative_to was given, make sure it can actually be used
+        rel_filepath = self._get_relative_path(filepath, relative_to)
+        # Get the ID of the Girder folder that the upload is relative to
+        root_folder_id = self._get_root_folder_id(
+            root_folder_id, collection_name, root_folder_path
+        )
+        # Create directories inside the root folder to match the relative filepath,
+        # unless the file already exists in the manifest or in Girder
+        upload_folder_id, item_id = self._get_upload_folder_and_item_id(
+            filepath, rel_filepath, root_folder_id
+        )
+        if upload_folder_id is None:
+            return False
+        # If deduplicating, copy the file on the server if its contents are already
+        # somewhere in the Collection
+        new_file = None
+        if self._content_index is not None:
+            new_file, expected, file_stat = self.__copy_existing_contents(
+                filepath,
+                upload_folder_id,
+                item_id,
+                root_folder_id,
+                self.__get_hash_algorithms(validation_mode),
+            )
+        # Otherwise upload the file, hashing the same chunks that are sent to Girder
+        # so that it only has to be read from disk once
+        if new_file is not None:
+            self.logger.info(f"Copied {filepath} from a file with the same contents")
+        else:
+            self.logger.info(f"Uploading {filepath} to {self.api_url}")
+            new_file, expected, file_stat = self.__upload_and_hash_file(
+                filepath,
+                upload_folder_id,
+                item_id,
+                show_progress=show_progress,
+                hash_algorithms=self.__get_hash_algorithms(validation_mode),
+            )
+        # A changed file replaces the contents of its Item
+        if item_id is not None:
+            self.__delete_other_files(item_id, new_file["_id"])
+        self.__add_metadata_and_validate(
+            filepath,
+            new_file,
+            expected,
+            metadata,
+            show_progress=show_progress,
+            validation_mode=validation_mode,
+            filepath=filepath,
+        )
+        if self._content_index is not None:
+            self._content_index.add(
+                self._girder_client,
+                root_folder_id,
+                expected["sha256"],
+                expected["size"],
+                new_file["itemId"],
+                new_file["_id"],
+            )
+        # keep the Item index current, so the file isn't uploaded again as a new
+        # Item if it's found again while watching (when it's touched, for example)
+        self._item_index.set_item(
+            upload_folder_id,
+            filepath.name,
+            (new_file["itemId"], expected["size"], expected["sha256"], None),
+        )
+        self._add_to_manifest(
+            filepath,
+            rel_filepath,
+            root_folder_id,
+            new_file,
+            file_hash=expected["sha256"],
+            file_stat=file_stat,
+        )
+        self.logger.info("Done!")
+        return True
+
+    def upload_stream(
+        self,
+        stream,
+        name,
+        size=None,
+        metadata=None,
+        root_folder_id=None,
+        collection_name=None,
+        root_folder_path=None,
+        show_progress=True,
+        validation_mode=DEFAULT_VALIDATION_MODE,
+    ):
+        """Upload data from a stream (like a download from another service) directly
+        to the Girder instance, with optional metadata, without writing it to disk.
+        The data are hashed as they're uploaded, and the same metadata are added and
+        the same checks are made as for "upload_file".
+
+        If an Item already exists at the same path in Girder with a File of the same
+        name and size, nothing is uploaded. Streams can't be recorded in the manifest
+        or resumed, and because there's no file on disk to sample, uploads that would
+        be validated in "sample" mode are validated in "full" mode instead.
+
+        Args:
+            stream (file-like or iterable): A readable binary file object, or an
+                iterable of chunks of bytes, holding the data to upload
+            name (str or pathlib.Path): The name of the file in Girder, or its path
+                relative to the root Folder (Folders are created as needed)
+            size (int, optional): The number of bytes in the stream. If it's not
+                given and the stream isn't seekable, the stream is read into a buffer
+                first to find its size (in memory for data that fit in a single
+                upload request, otherwise in a temporary file).
+            metadata (dict, optional): dictionary of metadata to add to the uploaded file
+            root_folder_id (str, optional): The ID of the Girder Folder that "name" is
+                relative to. If this parameter is given, it supersedes both
+                "collection_name" and "root_folder_path".
+            collection_name (str, optional): The name of the Girder Collection under
+                which the file should be uploaded. Superseded by "root_folder_id" if
+                that argument is given.
+            root_folder_path (pathlib.Path, optional): A Path representation of the
+                Girder Folder (inside the "collection_name" Collection) that "name" is
+                relative to. Superseded by "root_folder_id" if that argument is given.
+            show_progress (bool, optional): If False, progress bars for the upload and
+                validation of the file will not be shown
+            validation_mode (str, optional): How to check the file after it's uploaded
+                (see "upload_file")
+
+        Returns:
+            bool: True if the data were uploaded, False if they were skipped because
+                the file already exists in Girder
+
+        Raises:
+            ValueError: If the stream doesn't hold exactly "size" bytes
+            ValueError: If the file doesn't pass validation after it's uploaded
+        """
+        stream = as_readable_stream(stream)
+        upload_kwargs = {
+            "metadata": metadata,
+            "root_folder_id": self._get_root_folder_id(
+                root_folder_id, collection_name, root_folder_path
+            ),
+            "show_progress": show_progress,
+            "validation_mode": validation_mode,
+        }
+        if size is None:
+            size = get_remaining_size(stream)
+        if size is not None:
+            return self.__upload_sized_stream(stream, name, size, **upload_kwargs)
+        buffer, size = buffer_stream(stream, self._girder_client.MAX_CHUNK_SIZE)
+        with buffer:
+            return self.__upload_sized_stream(buffer, name, size, **upload_kwargs)
+
+    def __upload_sized_stream(
+        self,
+        stream,
+        name,
+        size,
+        metadata,
+        root_folder_id,
+        show_progress,
+        validation_mode,
+    ):
+        """Upload a readable binary stream with a known size (see "upload_stream")"""
+        rel_path = pathlib.Path(name)
+        with self.timer.phase("folder_resolution", name):
+            _ = get_girder_folder_id(
+                self._girder_client,
+                rel_path.parent,
+                root_folder_id=root_folder_id,
+                create_if_not_found=True,
+            )
+        with self.timer.phase("existence_check", name):
+            folder_id, item_id = get_girder_upload_folder_and_item_id(
+                self._girder_client, rel_path, root_folder_id=root_folder_id
+            )
+            existing_file = None
+            if item_id is not None:
+                existing_file = get_girder_item_file(
+                    self._girder_client, item_id, rel_path.name
                 )
+        if existing_file is not None and existing_file["size"] == size:
+            self.logger.info(f"{name} already exists in Girder and will be skipped")
+            return False
+        self.logger.info(f"Uploading {name} to {self.api_url}")
+        _ = self._upload_and_validate_stream(
+            stream,
+            name,
+            size,
+            folder_id,
+            metadata,
+            show_progress=show_progress,
+            validation_mode=validation_mode,
+        )
+        self.logger.info("Done!")
+        return True
+
+    def _upload_and_validate_stream(
+        self, stream, name, size, folder_id, metadata, show_progress, validation_mode
+    ):
+        """Upload a readable binary stream with a known size to a new Item in a
+        Girder Folder, hashing it as it's uploaded, then add metadata to the Item and
+        validate the upload. The "hash", "transfer", "metadata", and "validation"
+        phases are timed.
+
+        Args:
+            stream (file-like): the readable binary stream to upload
+            name (str or pathlib.Path): the name of the new file in Girder (only the
+                last part of a path is used, and the whole thing is used in messages)
+            size (int): the number of bytes the stream holds
+            folder_id (str): the ID of the Girder Folder to upload to
+            metadata (dict or None): metadata to add to the new Item
+            show_progress (bool): If False, progress bars aren't shown
+            validation_mode (str): How to check the upload (see "upload_file")
+
+        Returns:
+            dict: the new Girder File document
+
+        Raises:
+            ValueError: If the stream doesn't hold exactly "size" bytes
+            ValueError: If the file doesn't pass validation after it's uploaded
+        """
+        hashing_reader = HashingReader(
+            stream, self.__get_hash_algorithms(validation_mode)
+        )
+        start = time.perf_counter()
+        try:
+            new_file = self.__upload_stream(
+                hashing_reader, pathlib.Path(name).name, size, folder_id, show_progress
             )
-        # If relative_to was given, make sure it can actually be used
-        rel_filepath = filepath.relative_to(filepath.parent)
-        if relative_to is not None:
+        finally:
+            self.timer.record_hashed_transfer(
+                time.perf_counter() - start, hashing_reader.hash_seconds, name
+            )
+        if hashing_reader.n_bytes_read != size or hashing_reader.read(1):
+            self.logger.error(
+                f"The stream for {name} did not hold exactly {size} bytes!",
+                exc_type=ValueError,
+            )
+        self.__add_metadata_and_validate(
+            name,
+            new_file,
+            {"size": size, **hashing_reader.hexdigests()},
+            metadata,
+            show_progress=show_progress,
+            validation_mode=validation_mode,
+        )
+        return new_file
+
+    def close(self):
+        """Close the manifest database (if one is in use) and the timing log, and
+        write the totals of the timing measurements if a Prometheus file was given
+        """
+        if self._manifest is not None:
+            self._manifest.close()
+        self.timer.close()
+        self.logger.debug(f"Time spent in each upload phase: {self.timer}")
+        if self.timing_prometheus_path is not None:
+            self.timer.write_prometheus(self.timing_prometheus_path)
+
+    @staticmethod
+    def __get_hash_algorithms(validation_mode):
+        """Return the names of the hash algorithms to compute for a file while it's
+        uploaded (the server's own algorithm is needed to validate in "server_hash"
+        mode)
+        """
+        if validation_mode == "server_hash":
+            return ("sha256", SERVER_HASH_ALGORITHM)
+        return ("sha256",)
+
+    def __upload_and_hash_file(  # pylint: disable=too-many-arguments
+        self, filepath, folder_id, item_id, show_progress, hash_algorithms
+    ):
+        """Upload a file on disk to a new Item in a Girder Folder (or to an existing
+        Item, if "item_id" isn't None), hashing it as it's read and timing the
+        "hash" and "transfer" phases. Large files are
+        memory-mapped, so their chunks are hashed and sent without being copied
+        first. Returns the new Girder File document, a dictionary of the file's size
+        and hashes, and the result of os.stat for the file when it was opened.
+        """
+        with open_file_reader(filepath, self.MAPPED_READ_THRESHOLD) as fobj:
+            file_stat = os.fstat(fobj.fileno())
+            hashing_reader = HashingReader(fobj, hash_algorithms)
+            start = time.perf_counter()
             try:
-                rel_filepath = filepath.relative_to(relative_to)
-            except ValueError as exc:
-                self.logger.error(
-                    f"ERROR: {filepath} is not relative to {relative_to}!",
-                    exc_info=exc,
-                    reraise=True,
+                if (
+                    self._manifest is not None
+                    and file_stat.st_size > self._girder_client.MAX_CHUNK_SIZE
+                ):
+                    new_file = self.__resumable_upload(
+                        hashing_reader,
+                        filepath,
+                        file_stat,
+                        (folder_id, item_id),
+                        show_progress=show_progress,
+                    )
+                else:
+                    new_file = self.__upload_stream(
+                        hashing_reader,
+                        filepath.name,
+                        file_stat.st_size,
+                        folder_id,
+                        show_progress=show_progress,
+                        item_id=item_id,
+                    )
+            finally:
+                self.timer.record_hashed_transfer(
+                    time.perf_counter() - start, hashing_reader.hash_seconds, filepath
                 )
-        # check if the file already exists
-        if self.__file_already_exists(
-            filepath, rel_filepath, root_folder_id, collection_name, root_folder_path
-        ):
-            return
-        # Get the ID of the Girder folder to upload the file to
-        # If no root folder ID was given, find it based on the collection name
-        # and root folder path
-        if root_folder_id is None:
-            root_folder_id = get_girder_folder_id(
-                self._girder_client,
-                root_folder_path,
-                collection_name=collection_name,
+        return (
+            new_file,
+            {"size": file_stat.st_size, **hashing_reader.hexdigests()},
+            file_stat,
+        )
+
+    def __copy_existing_contents(  # pylint: disable=too-many-arguments
+        self, filepath, folder_id, item_id, root_folder_id, hash_algorithms
+    ):
+        """Hash a file on disk and, if a file with the same contents is in the
+        content index, copy it on the server to a new Item in a Girder Folder (or
+        to an existing Item, if "item_id" isn't None), timing the "hash" and
+        "dedup" phases. Returns the new Girder File document (or None if nothing was
+        copied), a dictionary of the file's size and hashes, and the result of
+        os.stat for the file when it was hashed. Files that aren't the same size as
+        any file in the index aren't hashed here (and None is returned for their
+        hashes and os.stat result), so that files that have to be uploaded anyway
+        are only read once.
+        """
+        from girder_client import HttpError  # pylint: disable=import-outside-toplevel
+
+        new_file, expected, file_stat = None, None, None
+        try:
+            with self.timer.phase("dedup", filepath):
+                if not self._content_index.has_size(
+                    self._girder_client, root_folder_id, os.path.getsize(filepath)
+                ):
+                    return new_file, expected, file_stat
+            with self.timer.phase("hash", filepath):
+                expected, file_stat = get_on_disk_file_hashes(
+                    filepath,
+                    hash_algorithms,
+                    chunk_size=self.HASH_CHUNK_SIZE,
+                    mapped_threshold=self.MAPPED_READ_THRESHOLD,
+                )
+            with self.timer.phase("dedup", filepath):
+                new_file = self._content_index.copy(
+                    self._girder_client,
+                    root_folder_id,
+                    expected["sha256"],
+                    expected["size"],
+                    folder_id,
+                    filepath.name,
+                    item_id=item_id,
+                )
+        except HttpError as exc:
+            self.logger.warning(
+                f"WARNING: failed to copy a file with the same contents as {filepath} "
+                f"({exc.status}), so it will be uploaded instead"
             )
-        # Create directories inside the root folder to match the relative filepath
-        upload_folder_id = get_girder_folder_id(
-            self._girder_client,
-            rel_filepath.parent,
-            root_folder_id=root_folder_id,
-            create_if_not_found=True,
+        return new_file, expected, file_stat
+
+    def __resumable_upload(
+        self, hashing_reader, filepath, file_stat, parent_ids, show_progress
+    ):
+        """Upload a file through a HashingReader to a new Item in a Girder Folder in
+        chunks (or to an existing Item; "parent_ids" is the IDs of the Folder and the
+        Item, or None), recording the progress of the upload in the manifest and
+        resuming an unfinished upload of the same file if there is one. Returns the
+        new Girder File document.
+        """
+        folder_id, item_id = parent_ids
+        size = file_stat.st_size
+        progress_bar = self.__get_progress_bar(
+            f"uploading {filepath.name}", size, show_progress
         )
-        # Upload the file
-        file_hash = get_on_disk_file_hash(filepath)
-        self.logger.info(f"Uploading {filepath} to {self.api_url}")
-        total_bytes = os.stat(filepath).st_size
-        progress_bar = tqdm(
-            desc=f"uploading {filepath.name}",
-            total=total_bytes,
-            ncols=120,
-            unit="byte",
-            unit_scale=True,
-            ascii=True,
+        pending = self._manifest.get_pending_upload(
+            filepath, self.api_url, folder_id, filepath.name, file_stat
         )
-        new_file = self._girder_client.uploadFileToFolder(
-            upload_folder_id,
-            filepath,
-            progressCallback=lambda x: self.__upload_callback(x, progress_bar),
+        offset = None
+        if pending is not None:
+            offset = get_girder_upload_offset(self._girder_client, pending["upload_id"])
+            if offset is None:
+                self._manifest.remove_pending_upload(pending["upload_id"])
+        if offset is None:
+            upload_id = self._girder_client.post(
+                "file",
+                parameters=get_girder_upload_parameters(
+                    folder_id, filepath.name, size, item_id=item_id
+                ),
+            )["_id"]
+            self._manifest.add_pending_upload(
+                filepath, self.api_url, folder_id, filepath.name, upload_id, file_stat
+            )
+            offset = 0
+        else:
+            upload_id = pending["upload_id"]
+            self.logger.info(f"Resuming upload of {filepath} from byte {offset}")
+            # hash the part of the file that the server already has
+            while hashing_reader.n_bytes_read < offset:
+                hashing_reader.read(
+                    min(self.HASH_CHUNK_SIZE, offset - hashing_reader.n_bytes_read)
+                )
+            progress_bar.update(offset)
+
+        def on_chunk_received(new_offset):
+            self._manifest.set_pending_upload_offset(upload_id, new_offset)
+            progress_bar.update(new_offset - progress_bar.n)
+
+        new_file = upload_girder_chunks(
+            self._girder_client,
+            upload_id,
+            hashing_reader,
+            size,
+            offset=offset,
+            progress_callback=on_chunk_received,
         )
-        progress_bar.update(new_file["size"] - progress_bar.n)
-        if metadata is None:
-            metadata = {}
-        metadata["uploaderVersion"] = self._uploader_version
-        metadata["checksum"] = {"sha256": file_hash}
-        self._girder_client.addMetadataToItem(new_file["itemId"], metadata)
+        self._manifest.remove_pending_upload(upload_id)
         progress_bar.close()
-        self.logger.info("Validating upload")
-        progress_bar = tqdm(
-            desc=f"validating {filepath.name}",
-            total=total_bytes,
-            ncols=120,
-            unit="byte",
-            unit_scale=True,
-            ascii=True,
+        return new_file
+
+    def __upload_stream(  # pylint: disable=too-many-arguments
+        self, stream, name, size, folder_id, show_progress, item_id=None
+    ):
+        """Upload a stream of binary data to a new Item in a Girder Folder (or to an
+        existing Item, if "item_id" isn't None), returning the new Girder File
+        document. Even files small enough to send in a single
+        request are sent in chunks of an upload started with its own request, so
+        that every request can be retried if it fails (see "TimedGirderClient").
+        """
+        progress_bar = self.__get_progress_bar(f"uploading {name}", size, show_progress)
+        new_file = self._girder_client.post(
+            "file",
+            parameters=get_girder_upload_parameters(
+                folder_id, name, size, item_id=item_id
+            ),
         )
-        if (
-            get_girder_file_hash(
-                self._girder_client, new_file["_id"], pbar=progress_bar
+        if size > 0:
+            new_file = upload_girder_chunks(
+                self._girder_client,
+                new_file["_id"],
+                stream,
+                size,
+                progress_callback=lambda offset: progress_bar.update(
+                    offset - progress_bar.n
+                ),
             )
-            != file_hash
-        ):
+        progress_bar.update(new_file["size"] - progress_bar.n)
+        progress_bar.close()
+        return new_file
+
+    def __delete_other_files(self, item_id, file_id):
+        """Delete every File in a Girder Item except the one with ID "file_id" (the
+        new contents of a changed file)
+        """
+        for file_doc in list(self._girder_client.listFile(item_id)):
+            if file_doc["_id"] != file_id:
+                self._girder_client.delete(f"file/{file_doc['_id']}")
+
+    def __add_metadata_and_validate(
+        self,
+        name,
+        new_file,
+        expected,
+        metadata,
+        show_progress,
+        validation_mode,
+        filepath=None,
+    ):
+        """Add metadata to a newly-uploaded file and check it and the file's contents,
+        timing the "metadata" and "validation" phases. "name" identifies the file in
+        messages, and "filepath" is the file on disk that was uploaded, if there is one.
+        """
+        with self.timer.phase("metadata", name):
+            self.__add_metadata(
+                name,
+                new_file["itemId"],
+                metadata,
+                expected["sha256"],
+                validation_mode,
+            )
+        self.logger.info(f"Validating upload ({validation_mode})")
+        with self.timer.phase("validation", name):
+            self.__validate_upload(
+                name,
+                new_file,
+                expected,
+                show_progress=show_progress,
+                validation_mode=validation_mode,
+                filepath=filepath,
+            )
+
+    def __add_metadata(self, name, item_id, metadata, file_hash, validation_mode):
+        """Add the uploader's own fields to a copy of some metadata and set it on a
+        newly-uploaded Item. Unless validation is skipped, the metadata in the Item
+        document returned by Girder is compared to what was sent (so the Item
+        doesn't have to be requested again), raising a ValueError if it doesn't match.
+        """
+        # copy the metadata so that the same dictionary can be used for many files
+        metadata = {} if metadata is None else dict(metadata)
+        metadata["uploaderVersion"] = self._uploader_version
+        metadata["checksum"] = {"sha256": file_hash}
+        metadata["validationMode"] = validation_mode
+        item = self._girder_client.addMetadataToItem(item_id, metadata)
+        if validation_mode != "none" and item.get("meta") != metadata:
             self.logger.error(
-                f"Hash for {filepath} does not match what's on Girder after upload!",
+                f"Metadata for {name} does not match what's on Girder after upload!",
                 exc_type=ValueError,
             )
-        if self._girder_client.getItem(new_file["itemId"])["meta"] != metadata:
+
+    def __validate_upload(
+        self, name, new_file, expected, show_progress, validation_mode, filepath=None
+    ):
+        """Make sure the contents of a newly-uploaded file match what was intended,
+        raising a ValueError if they don't
+        """
+        progress_bar = self.__get_progress_bar(
+            f"validating {new_file['name']}", new_file["size"], show_progress
+        )
+        validator = VALIDATORS[validation_mode]
+        valid = validator(
+            self._girder_client,
+            new_file,
+            expected,
+            filepath=filepath,
+            pbar=progress_bar,
+        )
+        if valid is None:
+            self.logger.warning(
+                f"Validation mode {validation_mode} can't be used for {name}. "
+                "The whole file will be downloaded to validate it instead."
+            )
+            valid = validate_full_download(
+                self._girder_client, new_file, expected, pbar=progress_bar
+            )
+        if not valid:
             self.logger.error(
-                f"Metadata for {filepath} does not match what's on Girder after upload!",
+                f"Contents of {name} do not match what's on Girder after upload!",
                 exc_type=ValueError,
             )
         progress_bar.update(new_file["size"] - progress_bar.n)
         progress_bar.close()
-        self.logger.info("Done!")
 
-    def __file_already_exists(
-        self, filepath, rel_filepath, root_folder_id, collection_name, root_folder_path
-    ):
+    def _get_relative_path(self, path, relative_to=None):
+        """Return a path relative to a directory, logging and re-raising the error
+        if it's not inside that directory
+
+        Args:
+            path (pathlib.Path): The path on disk
+            relative_to (pathlib.Path, optional): The directory "path" should be
+                relative to (by default, the directory that contains "path")
+
+        Returns:
+            pathlib.Path: "path" relative to "relative_to"
+
+        Raises:
+            ValueError: If "path" is not relative to "relative_to"
+        """
+        if relative_to is None:
+            relative_to = path.parent
         try:
-            if root_folder_id is not None:
-                item_id = get_girder_item_id(
-                    self._girder_client, rel_filepath, root_folder_id=root_folder_id
-                )
-            else:
-                item_id = get_girder_item_id(
-                    self._girder_client,
-                    root_folder_path / rel_filepath,
-                    collection_name=collection_name,
-                )
-            resp = self._girder_client.isFileCurrent(item_id, filepath.name, filepath)
-            if resp is not None and resp[1]:
-                self.logger.info(
-                    f"{filepath} already exists in Girder and will be skipped"
+            return path.relative_to(relative_to)
+        except ValueError as exc:
+            self.logger.error(
+                f"ERROR: {path} is not relative to {relative_to}!",
+                exc_info=exc,
+                reraise=True,
+            )
+        return None
+
+    def _get_root_folder_id(self, root_folder_id, collection_name, root_folder_path):
+        """Return the ID of the Girder Folder that uploads should be relative to,
+        finding it from the collection name and root folder path if no root folder
+        ID is given.
+
+        Args:
+            root_folder_id (str or None): The ID of the root Girder Folder, if known
+            collection_name (str or None): The name of the Girder Collection holding
+                the root Folder. Superseded by "root_folder_id" if that is given.
+            root_folder_path (pathlib.Path or None): The path to the root Folder
+                inside the Collection. Superseded by "root_folder_id" if that is given.
+
+        Returns:
+            str: the ID of the root Girder Folder
+
+        Raises:
+            ValueError: If the root Folder can't be found
+        """
+        # Log a warning if a root folder ID was given alongside
+        # a collection name/root folder path
+        if root_folder_id is not None:
+            if collection_name is not None or root_folder_path is not None:
+                self.logger.warning(
+                    (
+                        "WARNING: A root folder ID was given, so the collection "
+                        "name/root folder path arguments are being superseded!"
+                    )
                 )
-                return True
-        except ValueError:
-            pass
-        return False
+            return root_folder_id
+        return get_girder_folder_id(
+            self._girder_client,
+            root_folder_path,
+            collection_name=collection_name,
+        )
+
+    def _is_in_manifest(self, filepath, rel_filepath, root_folder_id):
+        """Return True (and log a message) if a manifest is in use and it records
+        that the unchanged file was already uploaded to the same place
+
+        Args:
+            filepath (pathlib.Path): Path to the file on disk
+            rel_filepath (pathlib.Path): Path to the file in Girder relative to the
+                root Folder
+            root_folder_id (str): The ID of the root Girder Folder of the upload
 
-    def __upload_callback(self, info_dict, pbar):
-        pbar.update(info_dict["current"] - pbar.n)
+        Returns:
+            bool: True if the file should be skipped
+        """
+        if self._manifest is None or not self._manifest.get_upload(
+            filepath, self.api_url, root_folder_id, rel_filepath
+        ):
+            return False
+        self.logger.info(
+            f"{filepath} was already uploaded according to the manifest "
+            "and will be skipped"
+        )
+        return True
+
+    def _add_to_manifest(  # pylint: disable=too-many-arguments
+        self,
+        filepath,
+        rel_filepath,
+        root_folder_id,
+        file_doc,
+        file_hash=None,
+        file_stat=None,
+        pack_member=None,
+    ):
+        """Record that a file was uploaded (or found in Girder), if a manifest is in
+        use. Hashes that aren't given are taken from the manifest if possible.
+
+        Args:
+            filepath (pathlib.Path): Path to the file on disk
+            rel_filepath (pathlib.Path): Path to the file in Girder relative to the
+                root Folder
+            root_folder_id (str): The ID of the root Girder Folder of the upload
+            file_doc (dict): The Girder File document for the file
+            file_hash (str, optional): the hexdigest of the file's sha256 hash
+            file_stat (os.stat_result, optional): the result of os.stat for the file
+                when it was uploaded
+            pack_member (str, optional): the name of the file in the pack holding it,
+                if it was packed ("file_doc" is then the pack's File document)
+        """
+        if self._manifest is None:
+            return
+        self._manifest.add_upload(
+            filepath,
+            self.api_url,
+            root_folder_id,
+            rel_filepath,
+            file_doc["itemId"],
+            file_id=file_doc["_id"],
+            file_hash=(
+                self._manifest.get_hash(filepath) if file_hash is None else file_hash
+            ),
+            file_stat=file_stat,
+            pack_member=pack_member,
+        )
+
+    def _get_upload_folder_and_item_id(self, filepath, rel_filepath, root_folder_id):
+        """Return the ID of the Girder Folder a file should be uploaded to (creating
+        it if needed) and the ID of the Item the file should replace the contents of
+        if there's already one for an older version of it, or (None, None) if the
+        file was already uploaded according to the manifest or already exists in
+        Girder. The lookups are timed as the "manifest_check", "folder_resolution",
+        and "existence_check" phases.
+
+        Args:
+            filepath (pathlib.Path): Path to the file on disk
+            rel_filepath (pathlib.Path): Path to the file in Girder relative to the
+                root Folder
+            root_folder_id (str): The ID of the root Girder Folder of the upload
+
+        Returns:
+            tuple: the ID of the Folder (or None if the file should be skipped) and
+                the ID of the existing Item to upload the file to (or None if a new
+                Item should be created)
+        """
+        with self.timer.phase("manifest_check", filepath):
+            if self._is_in_manifest(filepath, rel_filepath, root_folder_id):
+                return None, None
+        with self.timer.phase("folder_resolution", filepath):
+            folder_id = get_girder_folder_id(
+                self._girder_client,
+                rel_filepath.parent,
+                root_folder_id=root_folder_id,
+                create_if_not_found=True,
+            )
+        if self._item_index.has_folder(folder_id):
+            # the Folder's Items were listed in bulk, so no requests are needed
+            with self.timer.phase("existence_check", filepath):
+                entry = self._item_index.get_item(folder_id, filepath.name)
+                if entry is None:
+                    return folder_id, None
+                if self.__indexed_file_is_current(
+                    filepath, rel_filepath, root_folder_id, entry
+                ):
+                    return None, None
+            # (files in packs are uploaded to new Items of their own)
+            return folder_id, entry[0] if entry[3] is None else None
+        # the Folder's ID is cached now, so this only looks for the Item
+        with self.timer.phase("existence_check", filepath):
+            folder_id, item_id = get_girder_upload_folder_and_item_id(
+                self._girder_client, rel_filepath, root_folder_id=root_folder_id
+            )
+            if item_id is not None and self.__file_already_exists(
+                filepath, rel_filepath, root_folder_id, item_id
+            ):
+                return None, None
+        return folder_id, item_id
+
+    def __indexed_file_is_current(self, filepath, rel_filepath, root_folder_id, entry):
+        """Return True (and record the file in the manifest) if its entry in the Item
+        index shows that the file already exists in Girder with the same size (and
+        the same sha256 hash as its Item's checksum, if verifying existing files)
+        """
+        item_id, size, checksum, pack_member = entry
+        file_stat = os.stat(filepath)
+        if size != file_stat.st_size:
+            return False
+        matches, file_hash = self.__verify_existing_file(filepath, file_stat, checksum)
+        if not matches:
+            return False
+        self.logger.info(f"{filepath} already exists in Girder and will be skipped")
+        self._add_to_manifest(
+            filepath,
+            rel_filepath,
+            root_folder_id,
+            {"itemId": item_id, "_id": None},
+            file_hash=file_hash,
+            file_stat=file_stat,
+            pack_member=pack_member,
+        )
+        return True
+
+    def __file_already_exists(self, filepath, rel_filepath, root_folder_id, item_id):
+        resp = self._girder_client.isFileCurrent(item_id, filepath.name, filepath)
+        if resp is None or not resp[1]:
+            return False
+        checksum = None
+        if self._verify_existing:
+            item = self._girder_client.getItem(item_id)
+            checksum = (item.get("meta") or {}).get("checksum")
+        matches, file_hash = self.__verify_existing_file(
+            filepath,
+            None,
+            checksum.get("sha256") if isinstance(checksum, dict) else None,
+        )
+        if not matches:
+            return False
+        self.logger.info(f"{filepath} already exists in Girder and will be skipped")
+        self._add_to_manifest(
+            filepath,
+            rel_filepath,
+            root_folder_id,
+            {"itemId": item_id, "_id": resp[0]},
+            file_hash=file_hash,
+        )
+        return True
+
+    def __verify_existing_file(self, filepath, file_stat, checksum):
+        """Return whether a file that exists in Girder with the same size counts as
+        the same file, and its sha256 hash if it had to be found. Hashes are only
+        compared if verifying existing files and the Item has a recorded checksum.
+        """
+        if not self._verify_existing or checksum is None:
+            return True, None
+        file_hash = None
+        if self._manifest is not None:
+            file_hash = self._manifest.get_hash(filepath, file_stat)
+        if file_hash is None:
+            file_hash = get_on_disk_file_hashes(
+                filepath,
+                chunk_size=self.HASH_CHUNK_SIZE,
+                mapped_threshold=self.MAPPED_READ_THRESHOLD,
+            )[0]["sha256"]
+        return file_hash == checksum, file_hash
+
+    @staticmethod
+    def __get_progress_bar(desc, total, show_progress):
+        from tqdm import tqdm  # pylint: disable=import-outside-toplevel
+
+        return tqdm(
+            desc=desc,
+            total=total,
+            ncols=120,
+            unit="byte",
+            unit_scale=True,
+            ascii=True,
+            disable=not show_progress,
+        )
 
     @classmethod
     def get_command_line_arguments(cls):
@@ -215,9 +1037,30 @@ class IMQCAMFileUploader(Runnable, LogOwner):
             "root_folder_id",
             "collection_name",
             "root_folder_path",
+            "validation_mode",
+            "manifest_path",
+            "timing_log_path",
+            "timing_prometheus_path",
+            "max_retries",
+            "retry_backoff",
+            "bandwidth_limit",
+            "bandwidth_burst",
+            "dedup",
+            "verify_existing",
             *superargs,
         ]
-        kwargs = {**superkwargs, "logger_file_path": None, "logger_file_level": None}
+        kwargs = {
+            **superkwargs,
+            "logger_file_path": None,
+            "logger_file_level": None,
+            "max_retries": RetryPolicy.DEFAULT_MAX_RETRIES,
+            "retry_backoff": RetryPolicy.DEFAULT_BACKOFF_SECONDS,
+            # (defaults for programs that leave these arguments out, too)
+            "bandwidth_limit": None,
+            "bandwidth_burst": None,
+            "dedup": False,
+            "verify_existing": False,
+        }
         return args, kwargs
 
     @classmethod
@@ -228,7 +1071,19 @@ class IMQCAMFileUploader(Runnable, LogOwner):
             parsed_args.api_key,
             *superargs,
         ]
-        return args, superkwargs
+        kwargs = {
+            **superkwargs,
+            "manifest_path": parsed_args.manifest_path,
+            "timing_log_path": parsed_args.timing_log_path,
+            "timing_prometheus_path": parsed_args.timing_prometheus_path,
+            "max_retries": parsed_args.max_retries,
+            "retry_backoff": parsed_args.retry_backoff,
+            "bandwidth_limit": parsed_args.bandwidth_limit,
+            "bandwidth_burst": parsed_args.bandwidth_burst,
+            "dedup": parsed_args.dedup,
+            "verify_existing": parsed_args.verify_existing,
+        }
+        return args, kwargs
 
     @classmethod
     def run_from_command_line(cls, args=None):
@@ -238,15 +1093,40 @@ class IMQCAMFileUploader(Runnable, LogOwner):
         # make the uploader
         init_args, init_kwargs = cls.get_init_args_kwargs(args)
         uploader = cls(*init_args, **init_kwargs)
-        # upload the given file
-        uploader.upload_file(
-            args.filepath,
-            metadata=args.metadata_json,
-            relative_to=args.relative_to,
-            root_folder_id=args.root_folder_id,
-            collection_name=args.collection_name,
-            root_folder_path=args.root_folder_path,
-        )
+        # run the upload
+        try:
+            uploader._upload_from_args(args)
+        finally:
+            uploader.close()
+
+    def _upload_from_args(self, parsed_args):
+        """Upload the file given in a namespace of parsed command line arguments
+
+        Args:
+            parsed_args (argparse.Namespace): the parsed command line arguments
+        """
+        self.upload_file(parsed_args.filepath, **self.get_upload_kwargs(parsed_args))
+
+    @classmethod
+    def get_upload_kwargs(cls, parsed_args):
+        """Return the keyword arguments describing what metadata to add to uploaded
+        files, where to put them in Girder, and how to validate them, given a
+        namespace of parsed arguments
+
+        Args:
+            parsed_args (argparse.Namespace): the parsed command line arguments
+
+        Returns:
+            dict: keyword arguments for "upload_file"
+        """
+        return {
+            "metadata": parsed_args.metadata_json,
+            "relative_to": parsed_args.relative_to,
+            "root_folder_id": parsed_args.root_folder_id,
+            "collection_name": parsed_args.collection_name,
+            "root_folder_path": parsed_args.root_folder_path,
+            "validation_mode": parsed_args.validation_mode,
+        }
 
 
 def main(args=None):
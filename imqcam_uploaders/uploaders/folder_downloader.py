@@ -0,0 +1,388 @@
+""" Downloads all of the files in a Girder Folder tree to a local directory """
+
+# imports
+import time
+import pathlib
+import threading
+import concurrent.futures
+from .file_uploader import IMQCAMFileUploader
+from ..utilities.downloads import (
+    download_girder_file,
+    get_download_path,
+    get_expected_hashes,
+    local_file_matches,
+    walk_girder_folder,
+)
+from ..utilities.packing import (
+    extract_file_pack,
+    get_file_pack_members,
+    get_packed_files,
+)
+
+
+class FolderDownloadSummary:
+    """A thread-safe tally of what happened to each file in a Folder download.
+
+    Attributes:
+        n_downloaded (int): number of files that were downloaded
+        n_skipped (int): number of files that were skipped because they already
+            exist on disk with the same contents
+        n_bytes_downloaded (int): total number of bytes that were downloaded
+        failed_filepaths (list): paths to all of the files that failed to download
+    """
+
+    def __init__(self):
+        self.n_downloaded = 0
+        self.n_skipped = 0
+        self.n_bytes_downloaded = 0
+        self.failed_filepaths = []
+        self.__start_time = time.monotonic()
+        self.__end_time = None
+        self.__lock = threading.Lock()
+
+    @property
+    def n_files(self):
+        """The total number of files that were downloaded, skipped, or failed"""
+        return self.n_downloaded + self.n_skipped + self.n_failed
+
+    @property
+    def n_failed(self):
+        """The number of files that raised errors while being downloaded"""
+        return len(self.failed_filepaths)
+
+    @property
+    def elapsed_seconds(self):
+        """Wall time from the start of the download until it finished (or until now)"""
+        end_time = self.__end_time if self.__end_time is not None else time.monotonic()
+        return end_time - self.__start_time
+
+    def add_downloaded(self, n_bytes):
+        """Record a file that was downloaded
+
+        Args:
+            n_bytes (int): the number of bytes that were downloaded
+        """
+        with self.__lock:
+            self.n_downloaded += 1
+            self.n_bytes_downloaded += n_bytes
+
+    def add_skipped(self):
+        """Record a file that was skipped because it already exists on disk"""
+        with self.__lock:
+            self.n_skipped += 1
+
+    def add_failed(self, filepath):
+        """Record a file that failed to download
+
+        Args:
+            filepath (pathlib.Path): where the file would have been downloaded to
+        """
+        with self.__lock:
+            self.failed_filepaths.append(filepath)
+
+    def finish(self):
+        """Stop the clock used to compute the elapsed time"""
+        self.__end_time = time.monotonic()
+
+    def __str__(self):
+        elapsed = self.elapsed_seconds
+        rate = self.n_bytes_downloaded / elapsed if elapsed > 0 else 0.0
+        return (
+            f"{self.n_files} files processed in {elapsed:.2f} seconds: "
+            f"{self.n_downloaded} downloaded, {self.n_skipped} skipped, "
+            f"{self.n_failed} failed ({self.n_bytes_downloaded} bytes downloaded at "
+            f"{rate/1.0e6:.3f} MB/s)"
+        )
+
+
+class IMQCAMFolderDownloader(IMQCAMFileUploader):
+    """Runnable that mirrors a Girder Folder tree into a local directory, downloading
+    files with a pool of worker threads.
+
+    Each Item becomes a file named after it (or a directory of its Files, if it has
+    more than one), and each Folder becomes a subdirectory. Packs of files (see
+    "build_file_pack") become the files they hold, taking each file from the most
+    recent pack holding it, unless there's an Item with the same name. Files are
+    checked
+    against the sha256 checksum in their Items' metadata (and the hash computed by
+    the Girder server, if there is one) while they're downloaded. Files that
+    already exist on disk with the same size and hashes are skipped, and partial
+    downloads left by an earlier run are resumed (see "download_girder_file").
+
+    Args:
+        api_url (str): the URL of the Girder instance to connect to
+        api_key (str): the API key to use for connecting to Girder
+        args (list): passed to super().__init__()
+        kwargs (dict): passed to super().__init__()
+    """
+
+    DEFAULT_N_THREADS = 4
+    # The number of files waiting to be downloaded is capped at this many per thread
+    QUEUE_SIZE_PER_THREAD = 8
+
+    def download_folder(
+        self,
+        dirpath,
+        root_folder_id=None,
+        collection_name=None,
+        root_folder_path=None,
+        n_threads=DEFAULT_N_THREADS,
+    ):
+        """Download every file in a Girder Folder tree into a local directory,
+        recreating the tree's Folders as subdirectories.
+
+        Errors downloading any individual file are logged and counted without
+        stopping the rest of the download.
+
+        Args:
+            dirpath (pathlib.Path): Path to the directory to download the files into
+                (created if it doesn't exist)
+            root_folder_id (str, optional): The ID of the Girder Folder whose
+                contents should be downloaded. Supersedes both "collection_name" and
+                "root_folder_path".
+            collection_name (str, optional): The name of the Girder Collection
+                holding the Folder. Superseded by "root_folder_id" if that argument
+                is given.
+            root_folder_path (pathlib.Path, optional): A Path representation of the
+                Girder Folder (inside the "collection_name" Collection) whose
+                contents should be downloaded. Superseded by "root_folder_id" if
+                that argument is given.
+            n_threads (int, optional): The number of files to download concurrently
+                (and Folders to list at once)
+
+        Returns:
+            FolderDownloadSummary: counts of downloaded/skipped/failed files, with
+                the total number of bytes downloaded
+        """
+        root_folder_id = self._get_root_folder_id(
+            root_folder_id, collection_name, root_folder_path
+        )
+        dirpath = pathlib.Path(dirpath)
+        dirpath.mkdir(parents=True, exist_ok=True)
+        self.logger.info(
+            f"Downloading Folder {root_folder_id} into {dirpath} using {n_threads} "
+            "threads"
+        )
+        summary = FolderDownloadSummary()
+        # keep a connection open for every worker
+        self._girder_client.set_pool_size(n_threads)
+        from tqdm import tqdm  # pylint: disable=import-outside-toplevel
+
+        progress_bar = tqdm(
+            desc=f"downloading into {dirpath.name}",
+            total=0,
+            ncols=120,
+            unit="item",
+            ascii=True,
+        )
+        try:
+            self.__run_workers(
+                dirpath, root_folder_id, n_threads, summary, progress_bar
+            )
+        finally:
+            progress_bar.close()
+            summary.finish()
+        self.logger.info(f"Done downloading into {dirpath}: {summary}")
+        return summary
+
+    def __run_workers(self, dirpath, root_folder_id, n_threads, summary, pbar):
+        """Download every Item in a Folder tree as the tree is listed, using a pool
+        of worker threads with a bounded number of Items waiting at once
+        """
+        max_pending = n_threads * self.QUEUE_SIZE_PER_THREAD
+        pending = set()
+        pbar_lock = threading.Lock()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
+            for names, items in walk_girder_folder(
+                self._girder_client, root_folder_id, n_threads=n_threads
+            ):
+                packed_files = self.__get_packed_files_to_download(items)
+                for item in items:
+                    if item["_id"] in packed_files:
+                        worker_args = (
+                            self.__download_pack_worker,
+                            dirpath,
+                            names,
+                            item,
+                            packed_files[item["_id"]],
+                        )
+                    elif get_file_pack_members(item):
+                        # every file in the pack is in a newer one (or an Item)
+                        continue
+                    else:
+                        worker_args = (
+                            self.__download_worker,
+                            dirpath,
+                            (*names, item["name"]),
+                            item,
+                        )
+                    if len(pending) >= max_pending:
+                        _, pending = concurrent.futures.wait(
+                            pending, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                    with pbar_lock:
+                        pbar.total += 1
+                        pbar.refresh()
+                    pending.add(
+                        executor.submit(*worker_args, summary, (pbar, pbar_lock))
+                    )
+
+    @staticmethod
+    def __get_packed_files_to_download(items):
+        """Return the member dictionaries of the files to take from each pack among
+        the Items in a Folder (the ones that aren't in a newer pack and don't have
+        Items of their own), keyed by the ID of the pack's Item
+        """
+        item_names = {item["name"] for item in items if not get_file_pack_members(item)}
+        packed_files = {}
+        for name, (item_id, member) in get_packed_files(items).items():
+            if name not in item_names:
+                packed_files.setdefault(item_id, []).append(member)
+        return packed_files
+
+    def __download_pack_worker(  # pylint: disable=too-many-arguments
+        self, dirpath, names, item, members, summary, pbar_and_lock
+    ):
+        """Write the files from a pack that aren't already on disk, downloading the
+        pack once and checking each file's hash
+        """
+        pbar, pbar_lock = pbar_and_lock
+        to_extract = []
+        for member in members:
+            filepath = dirpath.joinpath(*names, member["name"])
+            try:
+                filepath = get_download_path(dirpath, (*names, member["name"]))
+                with self.timer.phase("existence_check", filepath):
+                    exists = local_file_matches(
+                        filepath, member["size"], {"sha256": member["sha256"]}
+                    )
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                self.logger.error(f"ERROR: failed to download {filepath}", exc_info=exc)
+                summary.add_failed(filepath)
+                continue
+            if exists:
+                self.logger.debug(f"Skipping {filepath}, which is already downloaded")
+                summary.add_skipped()
+            else:
+                to_extract.append(member)
+        if to_extract:
+            folder_path = dirpath.joinpath(*names)
+            try:
+                with self.timer.phase("transfer", folder_path):
+                    extract_file_pack(
+                        self._girder_client,
+                        item["_id"],
+                        folder_path,
+                        names=[member["name"] for member in to_extract],
+                    )
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                self.logger.error(
+                    f"ERROR: failed to download files from pack {item['name']} into "
+                    f"{folder_path}",
+                    exc_info=exc,
+                )
+                for member in to_extract:
+                    summary.add_failed(folder_path / member["name"])
+            else:
+                for member in to_extract:
+                    summary.add_downloaded(member["size"])
+        with pbar_lock:
+            pbar.update(1)
+
+    def __download_worker(self, dirpath, names, item, summary, pbar_and_lock):
+        pbar, pbar_lock = pbar_and_lock
+        try:
+            file_docs = list(self._girder_client.listFile(item["_id"]))
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            self.logger.error(
+                f"ERROR: failed to list the Files in Item {item['_id']}", exc_info=exc
+            )
+            summary.add_failed(dirpath.joinpath(*names))
+            file_docs = []
+        # an Item with more than one File becomes a directory of them
+        for file_doc in file_docs:
+            self.__download_file(
+                dirpath,
+                names if len(file_docs) == 1 else (*names, file_doc["name"]),
+                item,
+                file_doc,
+                len(file_docs),
+                summary,
+            )
+        with pbar_lock:
+            pbar.update(1)
+
+    def __download_file(self, dirpath, names, item, file_doc, n_files, summary):
+        """Download a single File (unless it's already on disk), recording the
+        result in the summary
+        """
+        filepath = dirpath.joinpath(*names)
+        try:
+            filepath = get_download_path(dirpath, names)
+            expected = get_expected_hashes(item, file_doc, n_files)
+            with self.timer.phase("existence_check", filepath):
+                exists = local_file_matches(filepath, file_doc["size"], expected)
+            if exists:
+                self.logger.debug(f"Skipping {filepath}, which is already downloaded")
+                summary.add_skipped()
+                return
+            if not expected:
+                self.logger.warning(
+                    f"WARNING: {filepath} has no recorded hashes, so only its size "
+                    "will be checked"
+                )
+            filepath.parent.mkdir(parents=True, exist_ok=True)
+            with self.timer.phase("transfer", filepath):
+                n_bytes = download_girder_file(
+                    self._girder_client, file_doc, filepath, expected
+                )
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            self.logger.error(f"ERROR: failed to download {filepath}", exc_info=exc)
+            summary.add_failed(filepath)
+        else:
+            summary.add_downloaded(n_bytes)
+
+    @classmethod
+    def get_command_line_arguments(cls):
+        _, kwargs = super().get_command_line_arguments()
+        args = [
+            "output_dir",
+            "api_url",
+            "api_key",
+            "root_folder_id",
+            "collection_name",
+            "root_folder_path",
+            "timing_log_path",
+            "timing_prometheus_path",
+            "max_retries",
+            "retry_backoff",
+            "n_threads",
+            "logger_stream_level",
+        ]
+        # (downloads aren't recorded in a manifest)
+        kwargs = {**kwargs, "manifest_path": None, "n_threads": cls.DEFAULT_N_THREADS}
+        return args, kwargs
+
+    def _upload_from_args(self, parsed_args):
+        summary = self.download_folder(
+            parsed_args.output_dir,
+            root_folder_id=parsed_args.root_folder_id,
+            collection_name=parsed_args.collection_name,
+            root_folder_path=parsed_args.root_folder_path,
+            n_threads=parsed_args.n_threads,
+        )
+        if summary.n_failed > 0:
+            self.logger.error(
+                f"{summary.n_failed} files failed to download into "
+                f"{parsed_args.output_dir}!",
+                exc_type=RuntimeError,
+            )
+
+
+def main(args=None):
+    """Run the "run_from_command_line" method of the IMQCAMFolderDownloader
+
+    Args:
+        args (list): list of command-line arguments to send to run_from_command_line
+    """
+    IMQCAMFolderDownloader.run_from_command_line(args)
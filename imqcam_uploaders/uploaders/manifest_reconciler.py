@@ -0,0 +1,69 @@
+""" Checks a local upload manifest against what's actually in a Girder instance """
+
+# imports
+from .file_uploader import IMQCAMFileUploader
+
+
+class IMQCAMManifestReconciler(IMQCAMFileUploader):
+    """Runnable that removes records from a local upload manifest if the files they
+    describe have changed on disk or no longer exist in Girder, so that those files
+    will be uploaded again the next time they're encountered.
+
+    Args:
+        api_url (str): the URL of the Girder instance to connect to
+        api_key (str): the API key to use for connecting to Girder
+        args (list): passed to super().__init__()
+        kwargs (dict): passed to super().__init__()
+    """
+
+    def reconcile_manifest(self):
+        """Check every upload recorded in the manifest for this Girder instance and
+        remove any that are out of date.
+
+        Returns:
+            tuple: the number of upload records that were checked, and the number
+                of them that were removed
+
+        Raises:
+            ValueError: If no manifest is in use
+        """
+        if self._manifest is None:
+            self.logger.error(
+                "ERROR: a manifest path is required to reconcile a manifest!",
+                exc_type=ValueError,
+            )
+        self.logger.info(f"Reconciling {self._manifest.db_path} against {self.api_url}")
+        n_checked, n_removed = self._manifest.reconcile(
+            self._girder_client, self.api_url
+        )
+        self.logger.info(
+            f"Checked {n_checked} uploads in the manifest and removed {n_removed}"
+        )
+        return n_checked, n_removed
+
+    def _upload_from_args(self, parsed_args):
+        _ = parsed_args
+        self.reconcile_manifest()
+
+    @classmethod
+    def get_command_line_arguments(cls):
+        superargs, kwargs = super().get_command_line_arguments()
+        args = [
+            "api_url",
+            "api_key",
+            "manifest_path",
+            "timing_log_path",
+            "timing_prometheus_path",
+            "logger_stream_level",
+        ]
+        _ = superargs
+        return args, kwargs
+
+
+def main(args=None):
+    """Run the "run_from_command_line" method of the IMQCAMManifestReconciler
+
+    Args:
+        args (list): list of command-line arguments to send to run_from_command_line
+    """
+    IMQCAMManifestReconciler.run_from_command_line(args)
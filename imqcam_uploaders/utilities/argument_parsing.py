@@ -5,7 +5,14 @@ import os
 import pathlib
 import json
 from openmsitoolbox import OpenMSIArgumentParser
-from openmsitoolbox.argument_parsing.parser_callbacks import existing_file, existing_dir
+from openmsitoolbox.argument_parsing.parser_callbacks import (
+    existing_file,
+    existing_dir,
+    positive_int,
+)
+from .bandwidth import BandwidthSchedule, parse_byte_size
+from .packing import DEFAULT_PACK_THRESHOLD
+from .validation import VALIDATION_MODES, DEFAULT_VALIDATION_MODE
 
 
 def json_str_or_filepath(argstring):
@@ -32,6 +39,46 @@ def json_str_or_filepath(argstring):
         raise ValueError(f"ERROR: {argstring} is not decodable as JSON!") from exc
 
 
+def non_negative_float(argstring):
+    """A number of seconds (or other quantity) that can't be negative, given as a str
+    and returned as a float
+    """
+    try:
+        value = float(argstring)
+    except ValueError as exc:
+        raise ValueError(f"ERROR: {argstring} is not a number!") from exc
+    if value < 0:
+        raise ValueError(f"ERROR: {argstring} is negative!")
+    return value
+
+
+def non_negative_int(argstring):
+    """A count that can be zero but not negative, given as a str and returned as
+    an int
+    """
+    try:
+        value = int(argstring)
+    except ValueError as exc:
+        raise ValueError(f"ERROR: {argstring} is not an integer!") from exc
+    if value < 0:
+        raise ValueError(f"ERROR: {argstring} is negative!")
+    return value
+
+
+def bandwidth_schedule(argstring):
+    """A fixed rate limit like "10MB", or a schedule of rate limits by time of day
+    like "08:00-18:00=5MB,50MB", given as a str and returned as a BandwidthSchedule
+    """
+    return BandwidthSchedule(argstring)
+
+
+def byte_size(argstring):
+    """A number of bytes with an optional prefix like "k", "M", or "Gi", given as a
+    str and returned as an int
+    """
+    return parse_byte_size(argstring)
+
+
 class IMQCAMArgumentParser(OpenMSIArgumentParser):
     """An OpenMSI-style ArgumentParser for IMQCAM uploader programs"""
 
@@ -44,6 +91,13 @@ class IMQCAMArgumentParser(OpenMSIArgumentParser):
                 "help": "Path to the file to upload",
             },
         ],
+        "dirpath": [
+            "positional",
+            {
+                "type": existing_dir,
+                "help": "Path to the directory whose files should be uploaded",
+            },
+        ],
         "relative_to": [
             "optional",
             {
@@ -107,6 +161,204 @@ class IMQCAMArgumentParser(OpenMSIArgumentParser):
                 ),
             },
         ],
+        "validation_mode": [
+            "optional",
+            {
+                "choices": VALIDATION_MODES,
+                "default": DEFAULT_VALIDATION_MODE,
+                "help": (
+                    "How to check each file after it's uploaded: 'full' downloads the "
+                    "whole file to compare its hash, 'server_hash' compares a hash "
+                    "computed by the Girder server, 'metadata' only checks the file "
+                    "size and metadata, 'sample' compares random byte ranges, and "
+                    "'none' skips validation"
+                ),
+            },
+        ],
+        "max_concurrency": [
+            "optional",
+            {
+                "type": positive_int,
+                "help": "Maximum number of Girder requests to have in flight at once",
+            },
+        ],
+        "min_concurrency": [
+            "optional",
+            {
+                "type": positive_int,
+                "help": (
+                    "Minimum number of Girder requests to have in flight at once. The "
+                    "number in flight starts here and adjusts itself up to "
+                    "'max_concurrency' based on how quickly the server responds. Set "
+                    "both to the same value to keep the number fixed."
+                ),
+            },
+        ],
+        "manifest_path": [
+            "optional",
+            {
+                "type": pathlib.Path,
+                "help": (
+                    "Path to a local database file (created if it doesn't exist) "
+                    "recording which files have been uploaded. Files that haven't "
+                    "changed since they were uploaded to the same place are skipped "
+                    "without contacting Girder."
+                ),
+            },
+        ],
+        "timing_log_path": [
+            "optional",
+            {
+                "type": pathlib.Path,
+                "help": (
+                    "Path to a file that the time taken by each phase of every upload "
+                    "and by each Girder request will be appended to as JSON lines"
+                ),
+            },
+        ],
+        "timing_prometheus_path": [
+            "optional",
+            {
+                "type": pathlib.Path,
+                "help": (
+                    "Path to a file that the total time taken by each upload phase and "
+                    "Girder endpoint will be written to in the Prometheus text format "
+                    "at the end of the run"
+                ),
+            },
+        ],
+        "max_retries": [
+            "optional",
+            {
+                "type": non_negative_int,
+                "help": (
+                    "The most times to retry a Girder request that fails for a "
+                    "transient reason, like a dropped connection or a 502 error "
+                    "(requests that aren't safe to send twice aren't retried)"
+                ),
+            },
+        ],
+        "retry_backoff": [
+            "optional",
+            {
+                "type": non_negative_float,
+                "help": (
+                    "The longest wait (in seconds) before the first retry of a failed "
+                    "Girder request. The wait doubles for every retry after that, and "
+                    "is chosen at random between half of and the full backoff."
+                ),
+            },
+        ],
+        "pack_threshold": [
+            "optional",
+            {
+                "type": byte_size,
+                "nargs": "?",
+                "const": DEFAULT_PACK_THRESHOLD,
+                "help": (
+                    "Upload files smaller than this many bytes (like '64ki', which is "
+                    "the default if no size is given) in packs: uncompressed zip "
+                    "archives of many files from the same directory, uploaded as one "
+                    "Item whose metadata lists each file's name, size, hash, and "
+                    "position in the archive. Default: upload every file on its own."
+                ),
+            },
+        ],
+        "bandwidth_limit": [
+            "optional",
+            {
+                "type": bandwidth_schedule,
+                "help": (
+                    "The most bytes per second to upload, shared by every concurrent "
+                    "upload, like '10MB' (or '80Mi'). Can also be a comma-separated "
+                    "schedule of limits by local time of day, like "
+                    "'08:00-18:00=5MB,22:00-06:00=0,50MB' (where 0 means no limit and "
+                    "the limit without a time window applies at all other times). "
+                    "Default: no limit."
+                ),
+            },
+        ],
+        "bandwidth_burst": [
+            "optional",
+            {
+                "type": byte_size,
+                "help": (
+                    "How many bytes can be uploaded at full speed after a pause "
+                    "before 'bandwidth_limit' applies (default: 1Mi)"
+                ),
+            },
+        ],
+        "verify_existing": [
+            "optional",
+            {
+                "action": "store_true",
+                "help": (
+                    "Only skip files that already exist in Girder with the same size "
+                    "if their sha256 hashes also match the checksums recorded in their "
+                    "Items' metadata (reading every such file unless the manifest has "
+                    "its hash), instead of skipping them on their sizes alone"
+                ),
+            },
+        ],
+        "dedup": [
+            "optional",
+            {
+                "action": "store_true",
+                "help": (
+                    "Before uploading each file, look for a file with the same sha256 "
+                    "hash anywhere in the Collection being uploaded into (from the "
+                    "'checksum' metadata of its Items, indexed once and kept in the "
+                    "manifest if one is used), and copy it on the Girder server "
+                    "instead of uploading the file's contents again if there is one"
+                ),
+            },
+        ],
+        "apply": [
+            "optional",
+            {
+                "action": "store_true",
+                "help": (
+                    "Sync the directory with its copy in Girder instead of only "
+                    "reporting the differences: upload files that are new or changed "
+                    "on disk, and download files that are only in Girder"
+                ),
+            },
+        ],
+        "stable_seconds": [
+            "optional",
+            {
+                "type": non_negative_float,
+                "help": (
+                    "How long (in seconds) a file's size and modification time must "
+                    "stay the same before it's uploaded"
+                ),
+            },
+        ],
+        "poll_interval": [
+            "optional",
+            {
+                "type": non_negative_float,
+                "help": "Seconds between scans of the directory tree when polling",
+            },
+        ],
+        "use_polling": [
+            "optional",
+            {
+                "action": "store_true",
+                "help": (
+                    "Scan the directory tree for changes at regular intervals instead "
+                    "of using inotify (needed on network filesystems, where inotify "
+                    "doesn't see changes made by other machines)"
+                ),
+            },
+        ],
+        "watch_seconds": [
+            "optional",
+            {
+                "type": non_negative_float,
+                "help": "Stop watching after this many seconds (default: run forever)",
+            },
+        ],
         "metadata_json": [
             "optional",
             {
@@ -0,0 +1,243 @@
+" An asyncio client for the Girder REST API "
+
+# imports
+import time
+import asyncio
+import functools
+import threading
+import concurrent.futures
+from .concurrency import AdaptiveConcurrencyLimit
+from .timing import get_girder_endpoint
+
+# girder_client (and requests) are imported only inside the functions that need
+# them, so that the command line programs can start without loading them
+
+
+class AsyncGirderClient:
+    """An asyncio client for the parts of the Girder REST API used by the uploaders.
+
+    Each request is sent by a TimedGirderClient in a pool of worker threads (one
+    client per thread, all sharing the same pool of persistent connections), so that
+    coroutines can have many requests in flight at once while requests handles the
+    HTTP itself (proxies, redirects, TLS, and chunked responses). The timing,
+    retries, and bandwidth limiting of requests are the TimedGirderClient's. The
+    number of requests in flight at once is limited by an AdaptiveConcurrencyLimit,
+    which is fixed at "max_concurrency" unless a lower "min_concurrency" is given, in
+    which case it adjusts itself between the two based on how long requests take and
+    whether the server reports being overloaded. Errors from the server are raised
+    as girder_client.HttpError, the same as for the synchronous client.
+
+    Use the client as an async context manager (or call "close") so that its
+    threads and connections are closed when it's done.
+
+    Args:
+        api_url (str): the full URL of the Girder instance's REST API
+        token (str, optional): a Girder authentication token to send with requests
+        max_concurrency (int, optional): the maximum number of requests in flight
+        timer (UploadTimer, optional): where to record how long each request takes,
+            and every change in the number of requests allowed in flight
+        retry_policy (RetryPolicy, optional): when to retry failed requests (by
+            default, with a RetryPolicy's default settings)
+        min_concurrency (int, optional): the fewest requests to allow in flight if
+            the limit adjusts itself (by default, it's fixed at "max_concurrency")
+        bandwidth_limiter (TokenBucket, optional): the token bucket limiting the rate
+            that request bodies are sent (by default, there's no limit)
+    """
+
+    DEFAULT_MAX_CONCURRENCY = 16
+    READ_SIZE = 65536
+
+    def __init__(
+        self,
+        api_url,
+        token=None,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        timer=None,
+        retry_policy=None,
+        min_concurrency=None,
+        bandwidth_limiter=None,
+    ):
+        # pylint: disable=import-outside-toplevel
+        from .timed_girder_client import TimedGirderClient, get_pooled_session
+
+        self.api_url = api_url.rstrip("/")
+        self.concurrency_limit = AdaptiveConcurrencyLimit(
+            max_concurrency if min_concurrency is None else min_concurrency,
+            max_concurrency,
+        )
+        self.timer = timer
+        self.__session = get_pooled_session(max_concurrency)
+        self.__client = TimedGirderClient(
+            apiUrl=self.api_url,
+            timer=timer,
+            retry_policy=retry_policy,
+            session=self.__session,
+            bandwidth_limiter=bandwidth_limiter,
+        )
+        self.__client.setToken(token)
+        self.__executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="AsyncGirderClient"
+        )
+        self.__thread_clients = threading.local()
+
+    @property
+    def token(self):
+        """The Girder authentication token sent with requests"""
+        return self.__client.token
+
+    @property
+    def retry_policy(self):
+        """The RetryPolicy for failed requests"""
+        return self.__client.retry_policy
+
+    @property
+    def bandwidth_limiter(self):
+        """The token bucket limiting the rate that request bodies are sent, or None"""
+        return self.__client.bandwidth_limiter
+
+    async def authenticate(self, api_key):
+        """Get a token for the client using an API key
+
+        Args:
+            api_key (str): the API key to use
+        """
+        resp = await self.post("api_key/token", parameters={"key": api_key})
+        self.__client.setToken(resp["authToken"]["token"])
+
+    async def get(self, path, parameters=None, consumer=None):
+        """Send a GET request (see "request")"""
+        return await self.request("GET", path, parameters=parameters, consumer=consumer)
+
+    async def post(self, path, parameters=None, data=None):
+        """Send a POST request (see "request")"""
+        return await self.request("POST", path, parameters=parameters, data=data)
+
+    async def put(self, path, parameters=None, json_body=None):
+        """Send a PUT request with an optional JSON body (see "request")"""
+        return await self.request(
+            "PUT", path, parameters=parameters, json_body=json_body
+        )
+
+    async def delete(self, path, parameters=None):
+        """Send a DELETE request (see "request")"""
+        return await self.request("DELETE", path, parameters=parameters)
+
+    async def list_resource(self, path, parameters=None, limit=50):
+        """Return every document from a paginated Girder listing endpoint
+
+        Args:
+            path (str): the path to the endpoint, relative to the API URL
+            parameters (dict, optional): query parameters for the request
+            limit (int, optional): the number of documents to request at a time
+
+        Returns:
+            list: every document in the listing
+        """
+        docs = []
+        while True:
+            page = await self.get(
+                path,
+                parameters={**(parameters or {}), "limit": limit, "offset": len(docs)},
+            )
+            docs.extend(page)
+            if len(page) < limit:
+                return docs
+
+    async def request(  # pylint: disable=too-many-arguments
+        self,
+        method,
+        path,
+        parameters=None,
+        data=None,
+        json_body=None,
+        consumer=None,
+    ):
+        """Send a request to the REST API (in a worker thread, once the concurrency
+        limit allows it) and return its response
+
+        Args:
+            method (str): the HTTP method to use
+            path (str): the path to the endpoint, relative to the API URL
+            parameters (dict, optional): query parameters for the request (any whose
+                values are None are left out)
+            data (bytes, optional): the body of the request
+            json_body (optional): an object to send as the JSON body of the request
+            consumer (callable, optional): if given, the body of a successful response
+                is passed to this function piece by piece (from the worker thread) as
+                it's received instead of being decoded as JSON
+
+        Returns:
+            The decoded JSON response, or None if a consumer was given
+
+        Raises:
+            girder_client.HttpError: if the server responds with an error status
+            requests.RequestException: if the connection to the server fails
+        """
+        from girder_client import HttpError  # pylint: disable=import-outside-toplevel
+
+        send = functools.partial(
+            self.__send, method, path, parameters, data, json_body, consumer
+        )
+        limit = self.concurrency_limit
+        async with limit:
+            old_limit = limit.limit
+            start = time.perf_counter()
+            status = 200
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self.__executor, send
+                )
+            except HttpError as exc:
+                status = exc.status
+                raise
+            except OSError:
+                # (requests' connection errors are OSErrors too)
+                limit.record_failure()
+                status = None
+                raise
+            finally:
+                if status is not None:
+                    n_bytes = 0 if data is None else len(data)
+                    # requests are compared with others to the same endpoint of
+                    # similar size
+                    limit.record(
+                        (method, get_girder_endpoint(path), n_bytes.bit_length()),
+                        time.perf_counter() - start,
+                        status,
+                        n_bytes=n_bytes,
+                    )
+                if self.timer is not None and limit.limit != old_limit:
+                    self.timer.record_concurrency(limit.limit)
+
+    def __send(  # pylint: disable=too-many-arguments
+        self, method, path, parameters, data, json_body, consumer
+    ):
+        """Send a request with this thread's client (see "request")"""
+        client = getattr(self.__thread_clients, "client", None)
+        if client is None:
+            client = self.__client.get_worker_client()
+            self.__thread_clients.client = client
+        elif client.token != self.__client.token:
+            client.setToken(self.__client.token)
+        if consumer is None:
+            return client.sendRestRequest(
+                method, path, parameters=parameters, data=data, json=json_body
+            )
+        resp = client.sendRestRequest(
+            method, path, parameters=parameters, stream=True, jsonResp=False
+        )
+        with resp:
+            for chunk in resp.iter_content(chunk_size=self.READ_SIZE):
+                consumer(chunk)
+        return None
+
+    async def close(self):
+        """Stop the client's worker threads and close all of its open connections"""
+        await asyncio.to_thread(self.__executor.shutdown)
+        self.__session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_tb):
+        await self.close()
@@ -0,0 +1,322 @@
+" Limiting the rate that uploads send data, shared by every upload in a process "
+
+# imports
+import io
+import os
+import re
+import time
+import asyncio
+import datetime
+import threading
+import collections
+
+# Matches sizes like "500", "2.5M", "10 MB", "1GiB/s" (the "B" and "/s" are optional)
+BYTE_SIZE_REGEX = re.compile(
+    r"^\s*(?P<number>\d+(?:\.\d*)?|\.\d+)\s*(?P<prefix>[kmgt]?i?)b?(?:/s)?\s*$",
+    re.IGNORECASE,
+)
+BYTE_SIZE_PREFIXES = {
+    "": 1,
+    "k": 1000,
+    "m": 1000**2,
+    "g": 1000**3,
+    "t": 1000**4,
+    "ki": 1024,
+    "mi": 1024**2,
+    "gi": 1024**3,
+    "ti": 1024**4,
+}
+# Matches one window of a schedule, like "08:00-18:00=5MB"
+SCHEDULE_WINDOW_REGEX = re.compile(
+    r"^\s*(?P<start>\d{1,2}:\d{2})\s*-\s*(?P<end>\d{1,2}:\d{2})\s*=(?P<rate>.+)$"
+)
+# Rates that mean "no limit"
+UNLIMITED_RATES = ("", "0", "none", "unlimited")
+
+
+def parse_byte_size(size_str):
+    """Return the number of bytes in a size given as a string with an optional
+    decimal (k, M, G, T) or binary (Ki, Mi, Gi, Ti) prefix, like "2.5MB" or "1GiB"
+    (a trailing "/s" is ignored, so rates can be given the same way)
+
+    Args:
+        size_str (str): the size
+
+    Returns:
+        int: the number of bytes
+
+    Raises:
+        ValueError: if the size can't be understood
+    """
+    match = BYTE_SIZE_REGEX.match(size_str)
+    if match is None:
+        raise ValueError(f"ERROR: {size_str} is not a size in bytes!")
+    prefix = BYTE_SIZE_PREFIXES[match.group("prefix").lower()]
+    return int(float(match.group("number")) * prefix)
+
+
+class BandwidthSchedule:
+    """The most bytes per second that uploads may send, either fixed or depending
+    on the (local) time of day.
+
+    A schedule is written as a comma-separated list of rates. Each rate can be
+    limited to a window of the day with "HH:MM-HH:MM=" in front of it (windows can
+    wrap around midnight), and one rate can be given without a window to apply at
+    all other times. The first window containing the current time is used. A rate
+    of "0" or "unlimited" (or no rate for the rest of the day) means no limit. For
+    example, "08:00-18:00=5MB,50MB" limits uploads to 5 MB/s during the working day
+    and to 50 MB/s otherwise.
+
+    Args:
+        spec (str): the schedule
+
+    Raises:
+        ValueError: if the schedule can't be understood
+    """
+
+    def __init__(self, spec):
+        self.spec = str(spec)
+        self.__windows = []
+        self.__default_rate = None
+        for entry in self.spec.split(","):
+            match = SCHEDULE_WINDOW_REGEX.match(entry)
+            if match is None:
+                self.__default_rate = self.__parse_rate(entry)
+                continue
+            self.__windows.append(
+                (
+                    self.__parse_time(match.group("start")),
+                    self.__parse_time(match.group("end")),
+                    self.__parse_rate(match.group("rate")),
+                )
+            )
+
+    def get_rate(self, now=None):
+        """Return the rate limit at some time of day
+
+        Args:
+            now (datetime.datetime, optional): the time (by default, the current
+                local time)
+
+        Returns:
+            int or None: the most bytes per second that may be sent, or None if
+                there's no limit
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self.__windows:
+            if (start <= minute < end) or (end <= start and not end <= minute < start):
+                return rate
+        return self.__default_rate
+
+    def __str__(self):
+        return self.spec
+
+    @staticmethod
+    def __parse_rate(rate_str):
+        if rate_str.strip().lower() in UNLIMITED_RATES:
+            return None
+        return parse_byte_size(rate_str) or None
+
+    @staticmethod
+    def __parse_time(time_str):
+        """Return the minute of the day for a time like "18:30" """
+        hours, minutes = (int(part) for part in time_str.split(":"))
+        if hours > 24 or minutes > 59 or hours * 60 + minutes > 24 * 60:
+            raise ValueError(f"ERROR: {time_str} is not a time of day!")
+        return hours * 60 + minutes
+
+
+class TokenBucket:
+    """A thread-safe (and asyncio-friendly) token bucket limiting the rate that
+    bytes are sent, following a BandwidthSchedule.
+
+    The bucket fills at the scheduled rate up to "burst_bytes", and every byte sent
+    takes a token. Sending more bytes than there are tokens puts the bucket in debt,
+    and the sender waits until the debt would be paid off, so that the aggregate rate
+    of everything sharing the bucket stays at the limit without breaking uploads
+    into smaller pieces.
+
+    Args:
+        schedule (BandwidthSchedule): the rate limit to follow
+        burst_bytes (int, optional): how many bytes can be sent at once without
+            waiting after a pause
+    """
+
+    DEFAULT_BURST_BYTES = 1024 * 1024
+    # how many seconds of recent sends are used to measure the throughput
+    THROUGHPUT_WINDOW_SECONDS = 5.0
+
+    def __init__(self, schedule, burst_bytes=DEFAULT_BURST_BYTES):
+        self.schedule = schedule
+        self.burst_bytes = burst_bytes
+        self.__tokens = float(burst_bytes)
+        self.__last_fill = time.monotonic()
+        self.__recent_sends = collections.deque()
+        self.__lock = threading.Lock()
+
+    @property
+    def throughput(self):
+        """The rate (in bytes per second) that bytes have been sent through the
+        bucket over the last few seconds
+        """
+        with self.__lock:
+            self.__forget_old_sends(time.monotonic())
+            n_bytes = sum(n for _, n in self.__recent_sends)
+        return n_bytes / self.THROUGHPUT_WINDOW_SECONDS
+
+    def consume(self, n_bytes):
+        """Take tokens for some bytes, waiting (by sleeping) until they can be sent
+
+        Args:
+            n_bytes (int): the number of bytes about to be sent
+        """
+        delay = self.__reserve(n_bytes)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def consume_async(self, n_bytes):
+        """Take tokens for some bytes, waiting (without blocking the event loop)
+        until they can be sent
+
+        Args:
+            n_bytes (int): the number of bytes about to be sent
+        """
+        delay = self.__reserve(n_bytes)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def __reserve(self, n_bytes):
+        """Take tokens for some bytes and return how long to wait before sending them"""
+        with self.__lock:
+            now = time.monotonic()
+            self.__recent_sends.append((now, n_bytes))
+            self.__forget_old_sends(now)
+            rate = self.schedule.get_rate()
+            if rate is None:
+                self.__tokens = float(self.burst_bytes)
+            else:
+                self.__tokens = min(
+                    float(self.burst_bytes),
+                    self.__tokens + (now - self.__last_fill) * rate,
+                )
+            self.__last_fill = now
+            self.__tokens -= n_bytes
+            if rate is None or self.__tokens >= 0:
+                return 0.0
+            return -self.__tokens / rate
+
+    def __forget_old_sends(self, now):
+        while (
+            self.__recent_sends
+            and self.__recent_sends[0][0] < now - self.THROUGHPUT_WINDOW_SECONDS
+        ):
+            self.__recent_sends.popleft()
+
+
+class RateLimitedReader(io.RawIOBase):
+    """A readable, seekable binary stream that takes tokens from a TokenBucket for
+    every byte read from it, so that an HTTP library sending it as a request body
+    (a block at a time) sends it no faster than the bucket allows
+
+    Args:
+        stream (bytes-like or file-like): the data to send, as bytes (or a
+            bytearray or memoryview) or as a readable, seekable binary stream
+        bucket (TokenBucket): the bucket to take tokens from
+    """
+
+    def __init__(self, stream, bucket):
+        super().__init__()
+        if isinstance(stream, (bytes, bytearray, memoryview)):
+            stream = io.BytesIO(stream)
+        self.__stream = stream
+        self.__bucket = bucket
+        position = self.__stream.tell()
+        self.__size = self.__stream.seek(0, os.SEEK_END)
+        self.__stream.seek(position)
+
+    def __len__(self):
+        return self.__size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self.__stream.read(size)
+        if data:
+            self.__bucket.consume(len(data))
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.__stream.seek(offset, whence)
+
+    def tell(self):
+        return self.__stream.tell()
+
+
+# Token buckets shared by every upload in the process, keyed by schedule and burst
+SHARED_TOKEN_BUCKETS = {}
+_SHARED_TOKEN_BUCKETS_LOCK = threading.Lock()
+
+
+def get_shared_token_bucket(schedule, burst_bytes=None):
+    """Return the TokenBucket shared by every upload in this process that follows
+    the same schedule, creating it if needed, so that uploads running in different
+    threads, coroutines, or uploaders all count toward the same limit
+
+    Args:
+        schedule (BandwidthSchedule or str): the rate limit to follow
+        burst_bytes (int, optional): how many bytes can be sent at once without
+            waiting after a pause (by default, TokenBucket.DEFAULT_BURST_BYTES)
+
+    Returns:
+        TokenBucket or None: the shared bucket, or None if "schedule" is None
+    """
+    if schedule is None:
+        return None
+    if not isinstance(schedule, BandwidthSchedule):
+        schedule = BandwidthSchedule(schedule)
+    if burst_bytes is None:
+        burst_bytes = TokenBucket.DEFAULT_BURST_BYTES
+    key = (schedule.spec, burst_bytes)
+    with _SHARED_TOKEN_BUCKETS_LOCK:
+        if key not in SHARED_TOKEN_BUCKETS:
+            SHARED_TOKEN_BUCKETS[key] = TokenBucket(schedule, burst_bytes)
+        return SHARED_TOKEN_BUCKETS[key]
+
+
+def get_bandwidth_description(bucket):
+    """Return a short description of the recent upload rate through a TokenBucket
+    and its current limit, for progress output
+
+    Args:
+        bucket (TokenBucket or None): the bucket (or None if there's no limit)
+
+    Returns:
+        str: like "upload=4.9MB/s (limit 5.0MB/s)", or an empty string if "bucket"
+            is None
+    """
+    if bucket is None:
+        return ""
+    rate = bucket.schedule.get_rate()
+    limit = "none" if rate is None else _format_rate(rate)
+    return f"upload={_format_rate(bucket.throughput)} (limit {limit})"
+
+
+def _format_rate(bytes_per_second):
+    for prefix in ("", "k", "M", "G"):
+        if bytes_per_second < 1000:
+            break
+        bytes_per_second /= 1000
+    return (
+        f"{bytes_per_second:.1f}{prefix}B/s"  # pylint: disable=undefined-loop-variable
+    )
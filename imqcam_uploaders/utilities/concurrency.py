@@ -0,0 +1,187 @@
+" Adjusting how many Girder requests are in flight at once based on how they go "
+
+# imports
+import time
+import asyncio
+
+# HTTP statuses that mean the server (or a proxy in front of it) is overloaded
+OVERLOAD_STATUSES = (429, 502, 503, 504)
+
+
+class LatencyTracker:
+    """Keeps track of how long requests take compared to the fastest they've been
+    seen to take, and of the rate that request bodies are sent.
+
+    Requests are grouped by a key (like their method, endpoint, and size), and each
+    group's "baseline" is the shortest time a request in it has taken, drifting
+    slowly upward so that a baseline measured when the server was idle doesn't
+    stay out of reach forever. The ratio of each request's time to its group's
+    baseline is averaged over recent requests.
+
+    Args:
+        latency_tolerance (float): how many times longer than the baseline requests
+            can take on average before the server is considered congested
+    """
+
+    # weight of the newest measurement in the moving average of latency ratios
+    SMOOTHING = 0.2
+    # factor that each baseline grows by (at most) with every measurement
+    BASELINE_DRIFT = 1.01
+    # baselines shorter than this many seconds are rounded up, so that the noise in
+    # very fast requests doesn't look like congestion
+    MIN_BASELINE_SECONDS = 0.005
+
+    def __init__(self, latency_tolerance):
+        self.latency_tolerance = latency_tolerance
+        self.latency_ratio = 1.0
+        self.n_bytes_sent = 0
+        self.__baselines = {}
+        self.__start = time.monotonic()
+
+    @property
+    def throughput(self):
+        """The average rate (in bytes per second) that request bodies have been sent
+        since tracking started
+        """
+        elapsed = time.monotonic() - self.__start
+        return self.n_bytes_sent / elapsed if elapsed > 0 else 0.0
+
+    def add(self, key, seconds, n_bytes=0):
+        """Record how long a successful request took
+
+        Args:
+            key (hashable): the group the request belongs to
+            seconds (float): how long the request took
+            n_bytes (int, optional): the size of the request's body
+
+        Returns:
+            bool: True if requests are taking so much longer than their baselines
+                that the server is probably congested
+        """
+        baseline = min(
+            seconds, self.__baselines.get(key, seconds) * self.BASELINE_DRIFT
+        )
+        self.__baselines[key] = baseline
+        ratio = seconds / max(baseline, self.MIN_BASELINE_SECONDS)
+        self.latency_ratio += self.SMOOTHING * (ratio - self.latency_ratio)
+        self.n_bytes_sent += n_bytes
+        return self.latency_ratio > self.latency_tolerance
+
+
+class AdaptiveConcurrencyLimit:
+    """An asyncio limit on the number of requests in flight at once that adjusts
+    itself with additive increase/multiplicative decrease (AIMD), like TCP
+    congestion control.
+
+    The limit starts at "min_limit" and grows by one for every successful request
+    (doubling every round trip) until the first sign of trouble, then by one per
+    round trip after that. It's cut in half when a request fails because the server
+    is overloaded (a 429 or 5xx gateway error, or a dropped connection), and cut by
+    a fifth when requests are taking much longer than usual (see LatencyTracker). It
+    is cut at most once per round trip (once as many requests have finished as the
+    limit allows), and always stays between "min_limit" and "max_limit". It only
+    grows while it's actually being reached, so that it doesn't run away when there
+    isn't enough work to use it. If "min_limit" and "max_limit" are the same, the
+    limit is fixed, like a semaphore.
+
+    Use "async with" around each request, and call "record" (or "record_failure")
+    when it's done.
+
+    Args:
+        min_limit (int): the lowest the limit can go (and where it starts)
+        max_limit (int): the highest the limit can go
+        latency_tolerance (float, optional): how many times longer than usual
+            requests can take before the limit is lowered
+    """
+
+    DEFAULT_LATENCY_TOLERANCE = 2.0
+    # how much the limit is multiplied by after an overload error
+    OVERLOAD_DECREASE = 0.5
+    # how much the limit is multiplied by when requests are taking too long
+    LATENCY_DECREASE = 0.8
+
+    def __init__(
+        self, min_limit, max_limit, latency_tolerance=DEFAULT_LATENCY_TOLERANCE
+    ):
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError(
+                f"ERROR: can't limit concurrency to between {min_limit} and {max_limit}!"
+            )
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency = LatencyTracker(latency_tolerance)
+        self.__limit = float(min_limit)
+        self.__in_flight = 0
+        self.__waiters = []
+        # requests finished since the limit was last lowered (None if it never has)
+        self.__n_since_decrease = None
+
+    @property
+    def limit(self):
+        """The number of requests currently allowed in flight at once"""
+        return int(self.__limit)
+
+    @property
+    def in_flight(self):
+        """The number of requests in flight right now"""
+        return self.__in_flight
+
+    async def __aenter__(self):
+        while self.__in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self.__waiters.append(waiter)
+            await waiter
+        self.__in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_tb):
+        self.__in_flight -= 1
+        self.__wake_waiters()
+
+    def record(self, key, seconds, status, n_bytes=0):
+        """Adjust the limit after a request has finished with a response
+
+        Args:
+            key (hashable): the group the request belongs to (see LatencyTracker)
+            seconds (float): how long the request took
+            status (int): the HTTP status of the response
+            n_bytes (int, optional): the size of the request's body
+        """
+        if status in OVERLOAD_STATUSES:
+            self.record_failure()
+        elif status < 400:
+            if self.latency.add(key, seconds, n_bytes):
+                self.__decrease(self.LATENCY_DECREASE)
+            else:
+                self.__increase()
+
+    def record_failure(self):
+        """Adjust the limit after a request has failed because the server is
+        overloaded (or because its connection was dropped)
+        """
+        self.__decrease(self.OVERLOAD_DECREASE)
+
+    def __increase(self):
+        if self.__n_since_decrease is not None:
+            self.__n_since_decrease += 1
+        # only grow if the limit is being reached (this request was still counted)
+        if self.__in_flight < self.limit:
+            return
+        step = 1.0 if self.__n_since_decrease is None else 1.0 / self.__limit
+        self.__limit = min(float(self.max_limit), self.__limit + step)
+        self.__wake_waiters()
+
+    def __decrease(self, factor):
+        if self.__n_since_decrease is not None:
+            self.__n_since_decrease += 1
+            if self.__n_since_decrease < self.limit:
+                return
+        self.__limit = max(float(self.min_limit), self.__limit * factor)
+        self.__n_since_decrease = 0
+
+    def __wake_waiters(self):
+        """Wake every waiting request so that they can check the limit again"""
+        for waiter in self.__waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self.__waiters.clear()
@@ -0,0 +1,310 @@
+""" Finding files that already exist in a Girder Collection by their contents, so
+that they can be copied on the server instead of uploaded again
+"""
+
+# imports
+import threading
+import collections
+import concurrent.futures
+
+# girder_client (and requests) are imported only inside the functions that need
+# them, so that the command line programs can start without loading them
+
+# The number of Folders listed at once while scanning a Collection
+DEFAULT_N_SCAN_THREADS = 8
+
+
+class GirderContentIndex:
+    """A thread-safe index from the sha256 hashes (and sizes) of files to Girder
+    Items holding them, covering every Item in the Collections (or User
+    directories) that files are uploaded into.
+
+    The index of a Collection is built the first time a file is looked up in it, by
+    listing every Folder and Item in it once and reading the "checksum" metadata
+    that the uploaders add to Items. If a manifest is given, the index is stored in
+    it, so that the Collection doesn't have to be listed again by later processes.
+    Entries for files uploaded afterward are added as they're uploaded, and entries
+    that turn out to be stale (because the Item was deleted, for example) are
+    removed when copying them fails.
+
+    Args:
+        api_url (str): the URL of the Girder instance's REST API
+        manifest (UploadManifest, optional): the manifest to store the index in
+        n_threads (int, optional): the number of Folders to list at once while
+            scanning a Collection
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, api_url, manifest=None, n_threads=DEFAULT_N_SCAN_THREADS):
+        self.api_url = api_url
+        self.n_threads = n_threads
+        self.__manifest = manifest
+        # (base parent type, base parent ID) keyed by root Folder ID
+        self.__scopes = {}
+        # {(sha256, size): [item ID, file ID or None]} keyed by base parent ID
+        self.__contents = {}
+        # the number of files of each size in "__contents", keyed by base parent ID
+        self.__sizes = {}
+        self.__lock = threading.Lock()
+        self.__scan_lock = threading.Lock()
+
+    def find(self, client, root_folder_id, file_hash, size):
+        """Return the Item and File holding a file with some contents in the
+        Collection (or User directory) containing a Folder, scanning the Collection
+        first if it hasn't been indexed yet
+
+        Args:
+            client (girder_client.GirderClient): The Girder client to use
+            root_folder_id (str): the ID of any Folder in the Collection
+            file_hash (str): the hexdigest of the file's sha256 hash
+            size (int): the size of the file in bytes
+
+        Returns:
+            dict or None: the "item_id" and "file_id" of a File with the same
+                contents, or None if there isn't one in the Collection
+
+        Raises:
+            girder_client.HttpError: if the Files in the Item holding the contents
+                can't be listed (in which case the contents are forgotten)
+        """
+        from girder_client import HttpError  # pylint: disable=import-outside-toplevel
+
+        scope_id = self.__get_scope_id(client, root_folder_id)
+        with self.__lock:
+            entry = self.__contents[scope_id].get((file_hash, size))
+            if entry is None:
+                return None
+            item_id, file_id = entry
+        if file_id is None:
+            # Items found while scanning only know their own IDs
+            try:
+                file_id = next(
+                    (
+                        girder_file["_id"]
+                        for girder_file in client.listFile(item_id)
+                        if girder_file["size"] == size
+                    ),
+                    None,
+                )
+            except HttpError:
+                # (the Item must have been deleted)
+                self.remove(client, root_folder_id, file_hash, size)
+                raise
+            if file_id is None:
+                self.remove(client, root_folder_id, file_hash, size)
+                return None
+            self.add(client, root_folder_id, file_hash, size, item_id, file_id)
+        return {"item_id": item_id, "file_id": file_id}
+
+    def has_size(self, client, root_folder_id, size):
+        """Return True if there are any files of some size in the Collection (or
+        User directory) containing a Folder, scanning the Collection first if it
+        hasn't been indexed yet. Files of other sizes can't have the same contents,
+        so they don't need to be hashed to look them up.
+
+        Args:
+            client (girder_client.GirderClient): The Girder client to use
+            root_folder_id (str): the ID of any Folder in the Collection
+            size (int): the size of the file in bytes
+
+        Returns:
+            bool: True if the index has any files of that size
+        """
+        scope_id = self.__get_scope_id(client, root_folder_id)
+        with self.__lock:
+            return self.__sizes[scope_id][size] > 0
+
+    def add(self, client, root_folder_id, file_hash, size, item_id, file_id=None):
+        """Record that a file with some contents is in the Collection (or User
+        directory) containing a Folder
+
+        Args:
+            client (girder_client.GirderClient): The Girder client to use
+            root_folder_id (str): the ID of any Folder in the Collection
+            file_hash (str): the hexdigest of the file's sha256 hash
+            size (int): the size of the file in bytes
+            item_id (str): the ID of the Item holding the file
+            file_id (str, optional): the ID of the File
+        """
+        scope_id = self.__get_scope_id(client, root_folder_id)
+        with self.__lock:
+            if (file_hash, size) not in self.__contents[scope_id]:
+                self.__sizes[scope_id][size] += 1
+            self.__contents[scope_id][(file_hash, size)] = [item_id, file_id]
+        if self.__manifest is not None:
+            self.__manifest.add_girder_contents(
+                self.api_url, scope_id, [(file_hash, size, item_id, file_id)]
+            )
+
+    def remove(self, client, root_folder_id, file_hash, size):
+        """Forget a file with some contents in the Collection (or User directory)
+        containing a Folder
+
+        Args:
+            client (girder_client.GirderClient): The Girder client to use
+            root_folder_id (str): the ID of any Folder in the Collection
+            file_hash (str): the hexdigest of the file's sha256 hash
+            size (int): the size of the file in bytes
+        """
+        scope_id = self.__get_scope_id(client, root_folder_id)
+        with self.__lock:
+            if self.__contents[scope_id].pop((file_hash, size), None) is not None:
+                self.__sizes[scope_id][size] -= 1
+        if self.__manifest is not None:
+            self.__manifest.remove_girder_content(
+                self.api_url, scope_id, file_hash, size
+            )
+
+    def copy(  # pylint: disable=too-many-arguments
+        self, client, root_folder_id, file_hash, size, folder_id, name, item_id=None
+    ):
+        """Copy a file with some contents from wherever it is in the Collection (or
+        User directory) containing a Folder to a new Item (or an existing one), on
+        the server (see "copy_girder_file"). If copying fails, the file is
+        forgotten, because its entry in the index must be stale.
+
+        Args:
+            client (girder_client.GirderClient): The Girder client to use
+            root_folder_id (str): the ID of any Folder in the Collection
+            file_hash (str): the hexdigest of the file's sha256 hash
+            size (int): the size of the file in bytes
+            folder_id (str): the ID of the Folder to create the new Item in
+            name (str): the name of the new Item and File
+            item_id (str, optional): the ID of an existing Item to copy the file to,
+                instead of creating a new one
+
+        Returns:
+            dict or None: the new Girder File document, or None if there's no file
+                with the same contents in the Collection
+
+        Raises:
+            girder_client.HttpError: if the file can't be copied
+        """
+        from girder_client import HttpError  # pylint: disable=import-outside-toplevel
+
+        existing = self.find(client, root_folder_id, file_hash, size)
+        if existing is None:
+            return None
+        try:
+            return copy_girder_file(
+                client, existing["file_id"], folder_id, name, item_id=item_id
+            )
+        except HttpError:
+            self.remove(client, root_folder_id, file_hash, size)
+            raise
+
+    def __get_scope_id(self, client, root_folder_id):
+        """Return the ID of the Collection (or User) containing a Folder, making
+        sure its contents are in the index
+        """
+        with self.__lock:
+            scope = self.__scopes.get(root_folder_id)
+        if scope is None:
+            folder = client.getFolder(root_folder_id)
+            scope = (folder["baseParentType"], folder["baseParentId"])
+            with self.__lock:
+                self.__scopes[root_folder_id] = scope
+        # only one Collection is scanned at a time, and never twice
+        with self.__scan_lock:
+            with self.__lock:
+                if scope[1] in self.__contents:
+                    return scope[1]
+            contents = None
+            if self.__manifest is not None:
+                contents = self.__manifest.get_girder_contents(self.api_url, scope[1])
+            if contents is None:
+                contents = self.__scan(client, *scope)
+                if self.__manifest is not None:
+                    self.__manifest.add_girder_contents(
+                        self.api_url, scope[1], contents, scanned=True
+                    )
+            with self.__lock:
+                self.__contents[scope[1]] = {
+                    (file_hash, size): [item_id, file_id]
+                    for file_hash, size, item_id, file_id in contents
+                }
+                self.__sizes[scope[1]] = collections.Counter(
+                    size for _, size in self.__contents[scope[1]]
+                )
+        return scope[1]
+
+    def __scan(self, client, scope_type, scope_id):
+        """List every Folder and Item in a Collection (or User directory), a level
+        of Folders at a time, returning the sha256 hash, size, and ID of every Item
+        whose metadata records its hash
+        """
+        contents = []
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.n_threads
+        ) as executor:
+            level = list(client.listFolder(scope_id, parentFolderType=scope_type))
+            while level:
+                folder_ids = [folder["_id"] for folder in level]
+                for items in executor.map(
+                    lambda fid: list(client.listItem(fid)), folder_ids
+                ):
+                    contents.extend(
+                        content
+                        for content in map(self.__get_content, items)
+                        if content is not None
+                    )
+                level = [
+                    folder
+                    for children in executor.map(
+                        lambda fid: list(client.listFolder(fid)), folder_ids
+                    )
+                    for folder in children
+                ]
+        return contents
+
+    @staticmethod
+    def __get_content(item):
+        """Return the recorded sha256 checksum, size, and ID of an Item document
+        (and None for its File ID), or None if it has no recorded checksum
+        """
+        checksum = (item.get("meta") or {}).get("checksum")
+        if not isinstance(checksum, dict) or not checksum.get("sha256"):
+            return None
+        return (checksum["sha256"], item.get("size"), item["_id"], None)
+
+
+def copy_girder_file(client, file_id, folder_id, name, item_id=None):
+    """Copy a File that's already in Girder to a new Item in a Folder (or to an
+    existing Item), on the server (so none of its contents are transferred),
+    deleting the new Item again if the copy fails for any reason
+
+    Args:
+        client (girder_client.GirderClient): The Girder client to use
+        file_id (str): the ID of the File to copy
+        folder_id (str): the ID of the Folder to create the new Item in
+        name (str): the name of the new Item and File
+        item_id (str, optional): the ID of an existing Item to copy the File to,
+            instead of creating a new one
+
+    Returns:
+        dict: the new Girder File document
+
+    Raises:
+        girder_client.HttpError: if the File can't be copied
+        requests.RequestException: if the connection to Girder fails
+    """
+    if item_id is not None:
+        return _copy_girder_file_to_item(client, file_id, item_id, name)
+    item = client.createItem(folder_id, name)
+    try:
+        return _copy_girder_file_to_item(client, file_id, item["_id"], name)
+    except Exception:
+        # (the empty Item would be found as an existing file by later uploads)
+        client.delete(f"item/{item['_id']}")
+        raise
+
+
+def _copy_girder_file_to_item(client, file_id, item_id, name):
+    """Copy a File to an Item on the server, naming the copy "name", and return the
+    new File document
+    """
+    new_file = client.post(f"file/{file_id}/copy", parameters={"itemId": item_id})
+    if new_file["name"] != name:
+        new_file = client.put(f"file/{new_file['_id']}", parameters={"name": name})
+    return new_file
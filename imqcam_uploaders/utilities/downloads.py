@@ -0,0 +1,206 @@
+""" Downloading Girder Folder trees to disk, checking the hashes of files as they're
+written and resuming downloads that were interrupted
+"""
+
+# imports
+import os
+import hashlib
+import concurrent.futures
+from .hashing import DEFAULT_HASH_READ_SIZE, get_on_disk_file_hashes
+from .mapped_files import open_file_reader, iter_file_chunks
+from .validation import SERVER_HASH_ALGORITHM
+
+# Files are downloaded to a path with this added to their names, and renamed once
+# they're complete and their hashes match
+PARTIAL_DOWNLOAD_SUFFIX = ".part"
+# The size of the chunks that downloads are streamed (and hashed) in
+DEFAULT_DOWNLOAD_CHUNK_SIZE = DEFAULT_HASH_READ_SIZE
+# The number of Folders listed at once while walking a Folder tree
+DEFAULT_N_LISTING_THREADS = 8
+
+
+def walk_girder_folder(client, folder_id, n_threads=DEFAULT_N_LISTING_THREADS):
+    """Yield every Folder in a Girder Folder tree (including the top one) with the
+    Items directly inside it, listing a whole level of Folders at once. Only the
+    listings for one level of the tree are held in memory at a time.
+
+    Args:
+        client (girder_client.GirderClient): The Girder client to use
+        folder_id (str): the ID of the Folder at the top of the tree
+        n_threads (int, optional): the number of Folders to list at once
+
+    Yields:
+        tuple: the names of the Folders leading from the top one to each Folder
+            (empty for the top Folder itself), and a list of the Item documents
+            directly inside it
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
+        level = [((), folder_id)]
+        while level:
+            folder_ids = [fid for _, fid in level]
+            yield from zip(
+                (names for names, _ in level),
+                executor.map(lambda fid: list(client.listItem(fid)), folder_ids),
+            )
+            level = [
+                ((*names, folder["name"]), folder["_id"])
+                for (names, _), children in zip(
+                    level,
+                    executor.map(lambda fid: list(client.listFolder(fid)), folder_ids),
+                )
+                for folder in children
+            ]
+
+
+def get_download_path(dirpath, names):
+    """Return the path that something in a Girder Folder tree should be downloaded to
+
+    Args:
+        dirpath (pathlib.Path): the directory the tree is downloaded into
+        names (iterable): the names of the Folders (and Item, and File) leading to
+            it from the top of the tree
+
+    Returns:
+        pathlib.Path: the path inside "dirpath"
+
+    Raises:
+        ValueError: if any of the names isn't a plain file name (so nothing can be
+            written outside of "dirpath")
+    """
+    for name in names:
+        if name != os.path.basename(name) or name in ("", ".", ".."):
+            raise ValueError(f"ERROR: {name} in Girder can't be used as a file name!")
+    return dirpath.joinpath(*names)
+
+
+def get_expected_hashes(item, file_doc, n_files):
+    """Return the hashes that a File downloaded from Girder should have: the sha256
+    checksum the uploaders add to an Item's metadata (if the File is the only one in
+    its Item), and the hash computed by the Girder server (if it computes them)
+
+    Args:
+        item (dict): the Girder Item document
+        file_doc (dict): the Girder File document
+        n_files (int): the number of Files in the Item
+
+    Returns:
+        dict: hexdigests keyed by the names of their algorithms (empty if none are
+            known)
+    """
+    expected = {}
+    checksum = (item.get("meta") or {}).get("checksum")
+    if n_files == 1 and isinstance(checksum, dict) and checksum.get("sha256"):
+        expected["sha256"] = checksum["sha256"]
+    if file_doc.get(SERVER_HASH_ALGORITHM):
+        expected[SERVER_HASH_ALGORITHM] = file_doc[SERVER_HASH_ALGORITHM]
+    return expected
+
+
+def local_file_matches(filepath, size, expected):
+    """Return True if a file on disk has some size and hashes (only the size is
+    compared if no hashes are given)
+
+    Args:
+        filepath (pathlib.Path): the path to the file on disk
+        size (int): the size the file should have
+        expected (dict): hexdigests the file should have, keyed by algorithm name
+
+    Returns:
+        bool: True if the file exists and matches
+    """
+    try:
+        if os.stat(filepath).st_size != size:
+            return False
+    except FileNotFoundError:
+        return False
+    if not expected:
+        return True
+    file_hashes, _ = get_on_disk_file_hashes(filepath, tuple(expected))
+    return all(file_hashes[name] == value for name, value in expected.items())
+
+
+def download_girder_file(
+    client,
+    file_doc,
+    filepath,
+    expected=None,
+    chunk_size=DEFAULT_DOWNLOAD_CHUNK_SIZE,
+):
+    """Download a File from Girder to disk, hashing the same chunks that are written
+    so the file never has to be read back to check it.
+
+    The data are written to a partial file next to "filepath" (with
+    PARTIAL_DOWNLOAD_SUFFIX added to its name), which is renamed to "filepath" once
+    the whole File is there and its size and hashes match. If a partial file was
+    left by a download that was interrupted, the data already in it are hashed and
+    only the rest of the File is downloaded.
+
+    Args:
+        client (girder_client.GirderClient): The Girder client to use
+        file_doc (dict): the Girder File document
+        filepath (pathlib.Path): where to put the file (its directory must exist)
+        expected (dict, optional): hexdigests the File should have, keyed by
+            algorithm name (see "get_expected_hashes")
+        chunk_size (int, optional): the size of the chunks to stream the File in
+
+    Returns:
+        int: the number of bytes downloaded (not counting any that were already in
+            a partial file)
+
+    Raises:
+        ValueError: if the size or hashes of the downloaded file don't match (in
+            which case the partial file is deleted, so the next download starts
+            over)
+    """
+    expected = expected or {}
+    file_hashes = {algorithm: hashlib.new(algorithm) for algorithm in expected}
+    partial_path = filepath.with_name(filepath.name + PARTIAL_DOWNLOAD_SUFFIX)
+    offset = _resume_partial_download(
+        partial_path, file_doc["size"], file_hashes, chunk_size
+    )
+    with open(partial_path, "ab") as fobj:
+        if offset < file_doc["size"]:
+            with client.sendRestRequest(
+                "GET",
+                f"file/{file_doc['_id']}/download",
+                parameters={"offset": offset},
+                jsonResp=False,
+                stream=True,
+            ) as response:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    fobj.write(chunk)
+                    for file_hash in file_hashes.values():
+                        file_hash.update(chunk)
+        size = fobj.tell()
+    mismatched = [
+        name
+        for name, file_hash in file_hashes.items()
+        if file_hash.hexdigest() != expected[name]
+    ]
+    if size != file_doc["size"] or mismatched:
+        partial_path.unlink()
+        raise ValueError(
+            f"ERROR: {file_doc['name']} downloaded from Girder has size {size} "
+            f"(expected {file_doc['size']}) and mismatched hashes {mismatched}!"
+        )
+    os.replace(partial_path, filepath)
+    return size - offset
+
+
+def _resume_partial_download(partial_path, size, file_hashes, chunk_size):
+    """Return how many bytes of a File are already in a partial download of it,
+    adding them to the hashes (a partial file larger than the File is deleted)
+    """
+    try:
+        n_bytes = os.stat(partial_path).st_size
+    except FileNotFoundError:
+        return 0
+    if n_bytes > size:
+        partial_path.unlink()
+        return 0
+    if file_hashes:
+        with open_file_reader(partial_path) as fobj:
+            for chunk in iter_file_chunks(fobj, chunk_size):
+                for file_hash in file_hashes.values():
+                    file_hash.update(chunk)
+    return n_bytes
@@ -0,0 +1,298 @@
+" Watching directory trees for files that are created or modified "
+
+# imports
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import pathlib
+
+# inotify event flags (from <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+INOTIFY_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+# struct inotify_event {int wd; uint32_t mask; uint32_t cookie; uint32_t len; ...}
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+
+
+def walk_files(dirpath):
+    """Yield the path to every file in a directory tree, in sorted order
+
+    Args:
+        dirpath (pathlib.Path): the root of the directory tree
+    """
+    for root, dirnames, filenames in os.walk(dirpath):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            yield pathlib.Path(root) / filename
+
+
+class FileStabilityTracker:
+    """Keeps track of files that have changed until their size and modification
+    time have stayed the same for some amount of time, so that files that are still
+    being written aren't uploaded
+
+    Args:
+        stable_seconds (float): how long a file's size and modification time must
+            stay the same before it's considered stable
+    """
+
+    def __init__(self, stable_seconds):
+        self.stable_seconds = stable_seconds
+        # (size, mtime_ns) and when they were first seen, keyed by path
+        self.__candidates = {}
+
+    def __len__(self):
+        return len(self.__candidates)
+
+    def add(self, filepath):
+        """Start (or restart) tracking a file that might have changed
+
+        Args:
+            filepath (pathlib.Path): path to the file
+        """
+        self.__candidates[filepath] = (None, time.monotonic())
+
+    def pop_stable(self):
+        """Stop tracking and return every file that has been stable for long enough.
+        Files that no longer exist are dropped.
+
+        Returns:
+            list: paths to the stable files, in the order they were first added
+        """
+        now = time.monotonic()
+        stable = []
+        for filepath, (last_stat, since) in list(self.__candidates.items()):
+            try:
+                file_stat = os.stat(filepath)
+            except OSError:
+                del self.__candidates[filepath]
+                continue
+            current_stat = (file_stat.st_size, file_stat.st_mtime_ns)
+            if current_stat != last_stat:
+                self.__candidates[filepath] = (current_stat, now)
+                if self.stable_seconds > 0:
+                    continue
+            elif now - since < self.stable_seconds:
+                continue
+            del self.__candidates[filepath]
+            stable.append(filepath)
+        return stable
+
+
+class PollingFileWatcher:
+    """Finds files in a directory tree that have been created or modified by
+    comparing the size and modification time of every file at regular intervals.
+    Works on every platform and filesystem (including network filesystems, where
+    inotify doesn't report changes made by other machines).
+
+    Args:
+        dirpath (pathlib.Path): the root of the directory tree to watch
+        poll_interval (float): seconds between scans of the directory tree
+    """
+
+    def __init__(self, dirpath, poll_interval):
+        self.dirpath = dirpath
+        self.poll_interval = poll_interval
+        self.__snapshot = self.__scan()
+        self.__next_poll = time.monotonic() + poll_interval
+
+    def get_changed_paths(self, timeout):
+        """Wait up to "timeout" seconds for the next scan, and return the files that
+        were created or modified since the last one
+
+        Args:
+            timeout (float): the most time to wait
+
+        Returns:
+            list: paths to files that changed (empty if it wasn't time to scan yet)
+        """
+        wait = self.__next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        if wait > 0:
+            time.sleep(wait)
+        self.__next_poll = time.monotonic() + self.poll_interval
+        snapshot = self.__scan()
+        changed = [
+            filepath
+            for filepath, file_stat in snapshot.items()
+            if self.__snapshot.get(filepath) != file_stat
+        ]
+        self.__snapshot = snapshot
+        return changed
+
+    def close(self):
+        """Nothing needs to be cleaned up for a polling watcher"""
+
+    def __scan(self):
+        snapshot = {}
+        for filepath in walk_files(self.dirpath):
+            try:
+                file_stat = os.stat(filepath)
+            except OSError:
+                continue
+            snapshot[filepath] = (file_stat.st_size, file_stat.st_mtime_ns)
+        return snapshot
+
+
+class InotifyFileWatcher:
+    """Finds files in a directory tree that have been created or modified using the
+    Linux inotify API (through ctypes), so changes are reported as soon as they
+    happen instead of at the next scan. New subdirectories are watched as they're
+    created, and if the kernel's event queue overflows, every file in the tree is
+    reported.
+
+    Args:
+        dirpath (pathlib.Path): the root of the directory tree to watch
+
+    Raises:
+        OSError: if inotify isn't available or the directory tree can't be watched
+    """
+
+    READ_SIZE = 65536
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+        self.__libc = get_inotify_libc()
+        if self.__libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available on this system")
+        self.__fd = self.__libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # the directory watched by each watch descriptor
+        self.__watched_dirs = {}
+        try:
+            _ = self.__watch_tree(dirpath)
+        except OSError:
+            self.close()
+            raise
+
+    def get_changed_paths(self, timeout):
+        """Wait up to "timeout" seconds for files to be created or modified, and
+        return any that were
+
+        Args:
+            timeout (float): the most time to wait
+
+        Returns:
+            list: paths to files that changed (possibly with repeats)
+        """
+        readable, _, _ = select.select([self.__fd], [], [], timeout)
+        if not readable:
+            return []
+        changed = []
+        while True:
+            try:
+                buffer = os.read(self.__fd, self.READ_SIZE)
+            except BlockingIOError:
+                break
+            changed.extend(self.__parse_events(buffer))
+        return changed
+
+    def close(self):
+        """Stop watching the directory tree"""
+        if self.__fd >= 0:
+            os.close(self.__fd)
+            self.__fd = -1
+
+    def __parse_events(self, buffer):
+        """Return paths to the files named in a buffer of inotify events, watching
+        any new subdirectories
+        """
+        changed = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, name_len = INOTIFY_EVENT_HEADER.unpack_from(buffer, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            name = buffer[offset : offset + name_len].rstrip(b"\0")
+            offset += name_len
+            if mask & IN_Q_OVERFLOW:
+                changed.extend(self.__watch_tree(self.dirpath))
+                continue
+            if mask & IN_IGNORED:
+                self.__watched_dirs.pop(wd, None)
+                continue
+            if wd not in self.__watched_dirs or not name:
+                continue
+            path = self.__watched_dirs[wd] / os.fsdecode(name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # files can be written before the new directory is watched
+                    changed.extend(self.__watch_tree(path))
+            else:
+                changed.append(path)
+        return changed
+
+    def __watch_tree(self, dirpath):
+        """Watch every directory in a tree, and return paths to the files in it"""
+        filepaths = []
+        for root, _, filenames in os.walk(dirpath):
+            root = pathlib.Path(root)
+            wd = self.__libc.inotify_add_watch(
+                self.__fd, os.fsencode(root), INOTIFY_WATCH_MASK
+            )
+            if wd < 0:
+                err = ctypes.get_errno()
+                if root == self.dirpath or err != errno.ENOENT:
+                    raise OSError(err, f"Failed to watch {root}: {os.strerror(err)}")
+                continue
+            self.__watched_dirs[wd] = root
+            filepaths.extend(root / filename for filename in filenames)
+        return filepaths
+
+
+def get_inotify_libc():
+    """Return the C library with its inotify functions set up for ctypes, or None if
+    inotify isn't available (like on platforms other than Linux)
+
+    Returns:
+        ctypes.CDLL or None: the C library
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_init1.restype = ctypes.c_int
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        libc.inotify_add_watch.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def get_file_watcher(dirpath, use_polling=False, poll_interval=1.0):
+    """Return an object that reports files created or modified in a directory tree:
+    an InotifyFileWatcher if inotify is available, otherwise (or if "use_polling" is
+    True) a PollingFileWatcher
+
+    Args:
+        dirpath (pathlib.Path): the root of the directory tree to watch
+        use_polling (bool, optional): if True, always poll instead of using inotify
+        poll_interval (float, optional): seconds between scans if polling
+
+    Returns:
+        InotifyFileWatcher or PollingFileWatcher: the watcher
+    """
+    if not use_polling:
+        try:
+            return InotifyFileWatcher(dirpath)
+        except OSError:
+            pass
+    return PollingFileWatcher(dirpath, poll_interval)
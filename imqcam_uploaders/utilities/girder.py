@@ -2,6 +2,292 @@
 
 # imports
 import pathlib
+import mimetypes
+import threading
+import collections
+import concurrent.futures
+
+# girder_client (and requests) are imported only inside the functions that need
+# them, so that the command line programs can start without loading them
+
+
+class GirderFolderIDCache:
+    """A thread-safe, least-recently-used cache of Girder Folder IDs keyed by the
+    location that Folders are relative to and the parts of their relative paths.
+
+    Looking up a path finds its longest cached prefix, so resolving a path next to
+    one that has already been resolved only walks the parts that aren't cached yet.
+
+    Args:
+        max_size (int, optional): the maximum number of Folder IDs to keep
+    """
+
+    DEFAULT_MAX_SIZE = 65536
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.__folder_ids = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__folder_ids)
+
+    def get_longest_prefix(self, root_key, parts):
+        """Return the ID of the deepest cached Folder on the way to a path
+
+        Args:
+            root_key (tuple): identifies the location that "parts" is relative to
+            parts (tuple): the parts of the path to the Folder
+
+        Returns:
+            tuple(int, str): the number of parts of the path that were found in the
+                cache and the ID of that Folder, or (0, None) if none were cached
+        """
+        with self.__lock:
+            for n_parts in range(len(parts), 0, -1):
+                key = (root_key, tuple(parts[:n_parts]))
+                if key in self.__folder_ids:
+                    self.__folder_ids.move_to_end(key)
+                    return n_parts, self.__folder_ids[key]
+        return 0, None
+
+    def add(self, root_key, parts, folder_id):
+        """Add a Folder ID to the cache, evicting the least recently used Folder IDs
+        if the cache is full
+
+        Args:
+            root_key (tuple): identifies the location that "parts" is relative to
+            parts (tuple): the parts of the path to the Folder
+            folder_id (str): the ID of the Folder
+        """
+        key = (root_key, tuple(parts))
+        with self.__lock:
+            self.__folder_ids[key] = folder_id
+            self.__folder_ids.move_to_end(key)
+            while len(self.__folder_ids) > self.max_size:
+                self.__folder_ids.popitem(last=False)
+
+    def invalidate(self, root_key, parts=()):
+        """Remove the ID of a Folder and the IDs of everything inside it from the cache
+
+        Args:
+            root_key (tuple): identifies the location that "parts" is relative to
+            parts (tuple, optional): the parts of the path to the Folder (by default,
+                everything relative to "root_key" is removed)
+        """
+        parts = tuple(parts)
+        with self.__lock:
+            for key in [
+                key
+                for key in self.__folder_ids
+                if key[0] == root_key and key[1][: len(parts)] == parts
+            ]:
+                del self.__folder_ids[key]
+
+    def clear(self):
+        """Remove everything from the cache"""
+        with self.__lock:
+            self.__folder_ids.clear()
+
+
+class GirderCollectionIndex:
+    """A thread-safe index of Girder Collection names to IDs, built with a single
+    listing of all Collections the first time each Girder session needs it.
+
+    Sessions are identified by the API URL and authentication token of the client,
+    so clients that share authentication share an index. Names that weren't in the
+    listing stay missing until the index is refreshed.
+    """
+
+    def __init__(self):
+        self.__collection_ids = {}
+        self.__lock = threading.Lock()
+
+    def get_id(self, client, collection_name, refresh=False):
+        """Return the ID of a Collection, listing all Collections from Girder only
+        if they haven't already been listed for this session or if "refresh" is True
+
+        Args:
+            client (girder_client.GirderClient): The Girder client to use
+            collection_name (str): The name of the Collection
+            refresh (bool, optional): If True, Collections will be listed again
+                even if they've already been listed for this session
+
+        Returns:
+            str: the ID of the Collection called "collection_name"
+
+        Raises:
+            ValueError: If there's no Collection called "collection_name"
+        """
+        session_key = (client.urlBase, client.token)
+        with self.__lock:
+            collection_ids = self.__collection_ids.get(session_key)
+            if refresh or collection_ids is None:
+                collection_ids = {
+                    resp["name"]: resp["_id"]
+                    for resp in client.listCollection()
+                    if resp["_modelType"] == "collection"
+                }
+                self.__collection_ids[session_key] = collection_ids
+        if collection_name not in collection_ids:
+            raise ValueError(
+                f"Failed to find a Girder Collection called {collection_name}!"
+            )
+        return collection_ids[collection_name]
+
+    def clear(self):
+        """Forget the Collections listed for every session"""
+        with self.__lock:
+            self.__collection_ids.clear()
+
+
+class GirderItemIndex:
+    """A thread-safe index of the Items in some Girder Folders, built with a single
+    (paginated) listing of each Folder, so that whether many files already exist in
+    Girder can be checked in memory instead of with requests for every file.
+
+    Only the ID, total size, and recorded sha256 checksum (from the "checksum"
+    metadata the uploaders add) of each Item are kept. Subclasses can index more
+    entries for the Items in each Folder by overriding "_get_folder_entries".
+    """
+
+    def __init__(self):
+        self.__folders = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__folders)
+
+    def add_folders(self, client, folder_ids, n_threads=1):
+        """List the Items in some Folders and add them to the index
+
+        Args:
+            client (girder_client.GirderClient): The Girder client to use
+            folder_ids (iterable): IDs of the Folders to list
+            n_threads (int, optional): The number of Folders to list at once
+        """
+        folder_ids = [fid for fid in set(folder_ids) if not self.has_folder(fid)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
+            for folder_id, items in zip(
+                folder_ids,
+                executor.map(lambda fid: list(client.listItem(fid)), folder_ids),
+            ):
+                entries = self._get_folder_entries(items)
+                with self.__lock:
+                    self.__folders[folder_id] = entries
+
+    def has_folder(self, folder_id):
+        """Return True if the Items in a Folder have been listed
+
+        Args:
+            folder_id (str): the ID of the Folder
+        """
+        with self.__lock:
+            return folder_id in self.__folders
+
+    def get_item(self, folder_id, name):
+        """Return what's known about the Item with some name in an indexed Folder
+
+        Args:
+            folder_id (str): the ID of the Folder
+            name (str): the name of the Item
+
+        Returns:
+            tuple or None: the Item's ID, size, recorded sha256 checksum (or None if
+                it has none), and the name of the entry inside the Item if it's one
+                of several files bundled in that Item (or None), or None if there's
+                no Item with that name
+        """
+        with self.__lock:
+            return self.__folders.get(folder_id, {}).get(name)
+
+    def set_item(self, folder_id, name, entry):
+        """Replace what's known about an Item in an indexed Folder (after a file is
+        uploaded to it, for example). Nothing is recorded for Folders that haven't
+        been listed.
+
+        Args:
+            folder_id (str): the ID of the Folder
+            name (str): the name of the Item
+            entry (tuple): the new entry for the Item, like the ones "get_item" returns
+        """
+        with self.__lock:
+            if folder_id in self.__folders:
+                self.__folders[folder_id][name] = entry
+
+    def clear(self):
+        """Forget every Folder that was listed"""
+        with self.__lock:
+            self.__folders.clear()
+
+    def _get_folder_entries(self, items):
+        """Return the entries to index for the Items listed in a Folder
+
+        Args:
+            items (list): the Item documents in the Folder
+
+        Returns:
+            dict: tuples like the ones "get_item" returns, keyed by name
+        """
+        return {item["name"]: self.__get_entry(item) for item in items}
+
+    @staticmethod
+    def __get_entry(item):
+        """Return the index entry for an Item document"""
+        checksum = (item.get("meta") or {}).get("checksum")
+        return (
+            item["_id"],
+            item.get("size"),
+            checksum.get("sha256") if isinstance(checksum, dict) else None,
+            None,
+        )
+
+
+# The number of concurrent requests used to resolve each level of Folders in a plan
+DEFAULT_N_PLANNING_THREADS = 8
+
+# The cache and index shared by every lookup that doesn't specify different ones
+FOLDER_ID_CACHE = GirderFolderIDCache()
+COLLECTION_INDEX = GirderCollectionIndex()
+
+
+def get_girder_collection_id(
+    client, collection_name, refresh=False, index=COLLECTION_INDEX
+):
+    """Return the ID of a Girder Collection from its name, using an index of
+    Collection names that's built once per Girder session.
+
+    Args:
+        client (girder_client.GirderClient): The Girder client to use
+        collection_name (str): The name of the Collection
+        refresh (bool, optional): If True, rebuild the index before looking up the name
+        index (GirderCollectionIndex, optional): The index of Collection names to use
+
+    Returns:
+        str: the ID of the Collection
+
+    Raises:
+        ValueError: If there's no Collection called "collection_name"
+    """
+    return index.get_id(client, collection_name, refresh=refresh)
+
+
+def get_folder_id_cache_root_key(client, root_folder_id=None, collection_name=None):
+    """Return the key identifying the location that cached Folder paths are
+    relative to (for use with GirderFolderIDCache)
+
+    Args:
+        client (girder_client.GirderClient): The Girder client in use
+        root_folder_id (str, optional): ID of the root Folder
+        collection_name (str, optional): Name of the root Collection (used if
+            "root_folder_id" isn't given)
+
+    Returns:
+        tuple: the cache key for the root location
+    """
+    if root_folder_id is not None:
+        return (client.urlBase, "folder", root_folder_id)
+    return (client.urlBase, "collection", collection_name)
 
 
 def get_girder_folder_id(
@@ -11,9 +297,13 @@ def get_girder_folder_id(
     collection_name=None,
     create_if_not_found=False,
     create_as_public=True,
+    cache=FOLDER_ID_CACHE,
 ):
     """Return the ID of a particular Girder Folder.
 
+    Folder IDs that are found or created are remembered in "cache", so later calls
+    only need to look up the parts of paths that haven't been seen before.
+
     Args:
         client (girder_client.GirderClient): The Girder client to use
         folder_rel_path (pathlib.Path or str): The path to the desired folder, relative
@@ -25,6 +315,8 @@ def get_girder_folder_id(
         create_if_not_found (bool, optional): If True, any missing Folders in the path to
             the desired Folder will be created
         create_as_public (bool, optional): If True, any created Folders will be public
+        cache (GirderFolderIDCache, optional): The cache of Folder IDs to use. Pass
+            None to always look up every part of the path in Girder.
 
     Returns:
         str: ID of the Girder Folder located at
@@ -36,6 +328,8 @@ def get_girder_folder_id(
         ValueError: If the desired Folder or any of its parents don't exist and
             "create_if_not_found" is False
     """
+    from girder_client import HttpError  # pylint: disable=import-outside-toplevel
+
     if (root_folder_id is not None and collection_name is not None) or (
         root_folder_id is None and collection_name is None
     ):
@@ -44,49 +338,281 @@ def get_girder_folder_id(
         )
     if isinstance(folder_rel_path, str):
         folder_rel_path = pathlib.Path(folder_rel_path)
+    parts = folder_rel_path.parts
+    root_key = get_folder_id_cache_root_key(client, root_folder_id, collection_name)
+    n_cached, current_folder_id = 0, None
+    if cache is not None:
+        n_cached, current_folder_id = cache.get_longest_prefix(root_key, parts)
+        if n_cached == len(parts) and current_folder_id is not None:
+            return current_folder_id
+    if n_cached == 0:
+        current_folder_id = _get_root_id(client, root_folder_id, collection_name)
+    try:
+        return _walk_folder_path(
+            client,
+            parts,
+            current_folder_id,
+            n_cached,
+            root_key,
+            collection_name,
+            create_if_not_found=create_if_not_found,
+            create_as_public=create_as_public,
+            cache=cache,
+        )
+    except HttpError:
+        # The deepest cached Folder may have been deleted since it was cached
+        if n_cached == 0:
+            raise
+        cache.invalidate(root_key, parts[:n_cached])
+        return get_girder_folder_id(
+            client,
+            folder_rel_path,
+            root_folder_id=root_folder_id,
+            collection_name=collection_name,
+            create_if_not_found=create_if_not_found,
+            create_as_public=create_as_public,
+            cache=cache,
+        )
+
+
+def _get_root_id(client, root_folder_id, collection_name):
+    """Return the ID of the root Folder or Collection for a relative path"""
     if root_folder_id is not None:
-        current_folder_id = root_folder_id
-        init_pftype = "folder"
-    else:
-        collection_id = None
-        for resp in client.listCollection():
-            if resp["_modelType"] == "collection" and resp["name"] == collection_name:
-                collection_id = resp["_id"]
-        if collection_id is None:
+        return root_folder_id
+    return get_girder_collection_id(client, collection_name)
+
+
+def _walk_folder_path(
+    client,
+    parts,
+    current_folder_id,
+    n_start,
+    root_key,
+    collection_name,
+    create_if_not_found,
+    create_as_public,
+    cache,
+):
+    """Walk down the parts of a Folder path starting from the Folder (or Collection)
+    "n_start" parts deep, finding or creating each Folder and adding them to the cache
+    """
+    for idepth in range(n_start, len(parts)):
+        pftype = (
+            "collection" if idepth == 0 and root_key[1] == "collection" else "folder"
+        )
+        current_folder_id, created = _find_or_create_folder(
+            client,
+            current_folder_id,
+            pftype,
+            parts[idepth],
+            create_if_not_found,
+            create_as_public,
+        )
+        if current_folder_id is None:
             raise ValueError(
-                f"Failed to find a Girder Collection called {collection_name}!"
-            )
-        current_folder_id = collection_id
-        init_pftype = "collection"
-    for idepth, folder_name in enumerate(folder_rel_path.parts):
-        pftype = init_pftype if idepth == 0 else "folder"
-        found = False
-        for resp in client.listFolder(
-            current_folder_id, parentFolderType=pftype, name=folder_name
-        ):
-            found = True
-            current_folder_id = resp["_id"]
-        if not found:
-            if create_if_not_found:
-                current_folder_id = client.createFolder(
-                    current_folder_id,
-                    folder_name,
-                    parentType=pftype,
-                    public=create_as_public,
-                )["_id"]
-            else:
-                raise ValueError(
-                    (
-                        "ERROR: failed to find the Girder Folder "
-                        f"{'/'.join(folder_rel_path.parts[:idepth+1])} in the "
-                        f"{collection_name} Collection!"
-                    )
+                (
+                    "ERROR: failed to find the Girder Folder "
+                    f"{'/'.join(parts[:idepth+1])} in the "
+                    f"{collection_name} Collection!"
                 )
+            )
+        if cache is not None:
+            # Anything cached inside an older Folder at this path is stale
+            if created:
+                cache.invalidate(root_key, parts[: idepth + 1])
+            cache.add(root_key, parts[: idepth + 1], current_folder_id)
     return current_folder_id
 
 
+def _find_or_create_folder(
+    client, parent_id, parent_type, folder_name, create_if_not_found, create_as_public
+):
+    """Return the ID of the Folder with some name in a parent Folder or Collection
+    (creating it if it doesn't exist and "create_if_not_found" is True, otherwise
+    returning None for its ID), and whether it was created
+    """
+    for resp in client.listFolder(
+        parent_id, parentFolderType=parent_type, name=folder_name
+    ):
+        return resp["_id"], False
+    if not create_if_not_found:
+        return None, False
+    # reuseExisting avoids failing if another upload created the same Folder after
+    # it was listed above
+    resp = client.createFolder(
+        parent_id,
+        folder_name,
+        parentType=parent_type,
+        public=create_as_public,
+        reuseExisting=True,
+    )
+    return resp["_id"], True
+
+
+def plan_girder_folders(
+    client,
+    folder_rel_paths,
+    root_folder_id=None,
+    collection_name=None,
+    create_if_not_found=True,
+    create_as_public=True,
+    cache=FOLDER_ID_CACHE,
+    n_threads=DEFAULT_N_PLANNING_THREADS,
+    _retried=False,
+):
+    """Find (or create) every Girder Folder that a batch of uploads needs at once,
+    instead of walking the path to each file's Folder separately.
+
+    The unique set of Folders (including every parent on the way to them) is
+    resolved breadth-first: all of the Folders at one depth are found or created
+    concurrently, then all of the Folders one level deeper, and so on, so the number
+    of requests grows with the number of unique Folders rather than with the number
+    of files. Folders that are already in "cache" aren't looked up again, and every
+    Folder that's found is added to it, so later lookups of the same paths (like in
+    "get_girder_folder_id") don't need any requests. If a request fails after any
+    cached IDs were used, the cached IDs under the root are forgotten (in case one of
+    the Folders was deleted) and the plan is retried once without them.
+
+    Args:
+        client (girder_client.GirderClient): The Girder client to use
+        folder_rel_paths (iterable): Paths (pathlib.Path or str) to the Folders,
+            relative to the root location determined by other arguments
+        root_folder_id (str, optional): ID of the folder that the paths are relative
+            to. Either this OR "collection_name" must be given.
+        collection_name (str, optional): Name of the Collection that the paths are
+            relative to. Either this OR "root_folder_id" must be given.
+        create_if_not_found (bool, optional): If True, missing Folders are created
+        create_as_public (bool, optional): If True, any created Folders will be public
+        cache (GirderFolderIDCache, optional): The cache of Folder IDs to use. Pass
+            None to look up every Folder in Girder.
+        n_threads (int, optional): The most requests to send at once for each level
+        _retried (bool, optional): True if this is the retry after a failure, which
+            isn't retried again
+
+    Returns:
+        dict: the ID of each Folder keyed by its relative path (as a pathlib.Path)
+
+    Raises:
+        ValueError: If both or neither of "root_folder_id" and "collection_name" are
+            given (exactly one of them is required)
+        ValueError: If any of the Folders don't exist and "create_if_not_found" is
+            False
+    """
+    from girder_client import HttpError  # pylint: disable=import-outside-toplevel
+
+    if (root_folder_id is not None and collection_name is not None) or (
+        root_folder_id is None and collection_name is None
+    ):
+        raise ValueError(
+            "Must specify exactly one of root_folder_id or collection_name"
+        )
+    folder_rel_paths = {
+        pathlib.Path(folder_rel_path) for folder_rel_path in folder_rel_paths
+    }
+    root_key = get_folder_id_cache_root_key(client, root_folder_id, collection_name)
+    folder_ids = {(): _get_root_id(client, root_folder_id, collection_name)}
+    create_kwargs = {
+        "create_if_not_found": create_if_not_found,
+        "create_as_public": create_as_public,
+    }
+    n_from_cache = 0
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
+            for level in _get_folder_levels(folder_rel_paths):
+                n_from_cache += _plan_folder_level(
+                    client,
+                    level,
+                    folder_ids,
+                    root_key,
+                    cache,
+                    executor,
+                    create_kwargs,
+                )
+    except HttpError:
+        # A cached Folder may have been deleted since it was cached, but if no
+        # cached IDs were used (or they were already forgotten) the error is real
+        if n_from_cache == 0 or _retried:
+            raise
+        cache.invalidate(root_key)
+        return plan_girder_folders(
+            client,
+            folder_rel_paths,
+            root_folder_id=root_folder_id,
+            collection_name=collection_name,
+            cache=cache,
+            n_threads=n_threads,
+            _retried=True,
+            **create_kwargs,
+        )
+    return {
+        folder_rel_path: folder_ids[folder_rel_path.parts]
+        for folder_rel_path in folder_rel_paths
+    }
+
+
+def _get_folder_levels(folder_rel_paths):
+    """Return the parts of the paths to every Folder on the way to each of some
+    Folders, grouped into sorted lists by depth (shallowest first)
+    """
+    levels = collections.defaultdict(set)
+    for folder_rel_path in folder_rel_paths:
+        parts = folder_rel_path.parts
+        for n_parts in range(1, len(parts) + 1):
+            levels[n_parts].add(parts[:n_parts])
+    return [sorted(levels[depth]) for depth in sorted(levels)]
+
+
+def _plan_folder_level(
+    client, level, folder_ids, root_key, cache, executor, create_kwargs
+):
+    """Find or create all of the Folders at one depth of a plan concurrently, adding
+    their IDs to "folder_ids" (whose keys are the parts of each Folder's path), and
+    return the number of them whose IDs came from the cache
+    """
+    to_resolve = []
+    for parts in level:
+        n_cached, folder_id = (
+            (0, None) if cache is None else cache.get_longest_prefix(root_key, parts)
+        )
+        if n_cached == len(parts):
+            folder_ids[parts] = folder_id
+        else:
+            to_resolve.append(parts)
+    futures = [
+        executor.submit(
+            _find_or_create_folder,
+            client,
+            folder_ids[parts[:-1]],
+            (
+                "collection"
+                if len(parts) == 1 and root_key[1] == "collection"
+                else "folder"
+            ),
+            parts[-1],
+            **create_kwargs,
+        )
+        for parts in to_resolve
+    ]
+    for parts, future in zip(to_resolve, futures):
+        folder_id, created = future.result()
+        if folder_id is None:
+            raise ValueError(
+                f"ERROR: failed to find the Girder Folder {'/'.join(parts)}!"
+            )
+        folder_ids[parts] = folder_id
+        if cache is not None:
+            if created:
+                cache.invalidate(root_key, parts)
+            cache.add(root_key, parts, folder_id)
+    return len(level) - len(to_resolve)
+
+
 def get_girder_item_id(
-    client, item_rel_path, root_folder_id=None, collection_name=None
+    client,
+    item_rel_path,
+    root_folder_id=None,
+    collection_name=None,
+    cache=FOLDER_ID_CACHE,
 ):
     """Return the ID of a particular Girder Item.
 
@@ -98,6 +624,8 @@ def get_girder_item_id(
             relative to. Either this OR "collection_name" must be given.
         collection_name (str, optional): Name of the Collection that "item_rel_path"
             is relative to. Either this OR "root_folder_id" must be given.
+        cache (GirderFolderIDCache, optional): The cache of Folder IDs to use in
+            finding the Item's parent Folder. Pass None to disable caching.
 
     Returns:
         str: The ID of the specified Girder item
@@ -106,15 +634,34 @@ def get_girder_item_id(
         ValueError: if not exactly one of "root_folder_id" and "collection_name" are given
         ValueError: if the Item can't be found at the given path
     """
+    from girder_client import HttpError  # pylint: disable=import-outside-toplevel
+
     folder_id = get_girder_folder_id(
         client,
         item_rel_path.parent,
         root_folder_id=root_folder_id,
         collection_name=collection_name,
+        cache=cache,
     )
     item_id = None
-    for resp in client.listItem(folder_id, name=item_rel_path.name):
-        item_id = resp["_id"]
+    try:
+        for resp in client.listItem(folder_id, name=item_rel_path.name):
+            item_id = resp["_id"]
+    except HttpError:
+        # The cached parent Folder may have been deleted since it was cached
+        if cache is None:
+            raise
+        cache.invalidate(
+            get_folder_id_cache_root_key(client, root_folder_id, collection_name),
+            item_rel_path.parent.parts,
+        )
+        return get_girder_item_id(
+            client,
+            item_rel_path,
+            root_folder_id=root_folder_id,
+            collection_name=collection_name,
+            cache=None,
+        )
     if item_id is None:
         errmsg = (
             f"Failed to find an Item called {item_rel_path.name} in "
@@ -124,8 +671,82 @@ def get_girder_item_id(
     return item_id
 
 
+def get_girder_upload_folder_and_item_id(
+    client,
+    item_rel_path,
+    root_folder_id=None,
+    collection_name=None,
+    create_as_public=True,
+    cache=FOLDER_ID_CACHE,
+):
+    """Return the ID of the Girder Folder that a file should be uploaded to
+    (creating it and any missing parent Folders if needed) and the ID of the Item
+    with the same name already in that Folder, if there is one.
+
+    Finding the Folder with "create_if_not_found" before looking for the Item means
+    Folder paths are only walked once per file, whether or not it already exists.
+
+    Args:
+        client (girder_client.GirderClient): The Girder client to use
+        item_rel_path (pathlib.Path or str): The path to the Item, relative to some
+            root location determined by other arguments
+        root_folder_id (str, optional): ID of the folder that "item_rel_path" is
+            relative to. Either this OR "collection_name" must be given.
+        collection_name (str, optional): Name of the Collection that "item_rel_path"
+            is relative to. Either this OR "root_folder_id" must be given.
+        create_as_public (bool, optional): If True, any created Folders will be public
+        cache (GirderFolderIDCache, optional): The cache of Folder IDs to use. Pass
+            None to disable caching.
+
+    Returns:
+        tuple(str, str or None): The ID of the parent Folder, and the ID of the Item
+            (or None if there's no Item with that name in the Folder)
+
+    Raises:
+        ValueError: if not exactly one of "root_folder_id" and "collection_name" are given
+    """
+    from girder_client import HttpError  # pylint: disable=import-outside-toplevel
+
+    if isinstance(item_rel_path, str):
+        item_rel_path = pathlib.Path(item_rel_path)
+    folder_id = get_girder_folder_id(
+        client,
+        item_rel_path.parent,
+        root_folder_id=root_folder_id,
+        collection_name=collection_name,
+        create_if_not_found=True,
+        create_as_public=create_as_public,
+        cache=cache,
+    )
+    item_id = None
+    try:
+        for resp in client.listItem(folder_id, name=item_rel_path.name):
+            item_id = resp["_id"]
+    except HttpError:
+        # The cached parent Folder may have been deleted since it was cached
+        if cache is None:
+            raise
+        cache.invalidate(
+            get_folder_id_cache_root_key(client, root_folder_id, collection_name),
+            item_rel_path.parent.parts,
+        )
+        return get_girder_upload_folder_and_item_id(
+            client,
+            item_rel_path,
+            root_folder_id=root_folder_id,
+            collection_name=collection_name,
+            create_as_public=create_as_public,
+            cache=None,
+        )
+    return folder_id, item_id
+
+
 def get_girder_item_and_file_id(
-    client, file_rel_path, root_folder_id=None, collection_name=None
+    client,
+    file_rel_path,
+    root_folder_id=None,
+    collection_name=None,
+    cache=FOLDER_ID_CACHE,
 ):
     """Return the IDs of a particular Girder File and its Item with the same name.
 
@@ -137,6 +758,8 @@ def get_girder_item_and_file_id(
             relative to. Either this OR "collection_name" must be given.
         collection_name (str, optional): Name of the Collection that "file_rel_path"
             is relative to. Either this OR "root_folder_id" must be given.
+        cache (GirderFolderIDCache, optional): The cache of Folder IDs to use in
+            finding the File's parent Folder. Pass None to disable caching.
 
     Returns:
         tuple(str, str): The ID of the specified Girder Item and File, in that order
@@ -150,7 +773,108 @@ def get_girder_item_and_file_id(
         file_rel_path,
         root_folder_id=root_folder_id,
         collection_name=collection_name,
+        cache=cache,
     )
     for resp in client.listFile(item_id):
         file_id = resp["_id"]
     return item_id, file_id
+
+
+def get_girder_item_file(client, item_id, name):
+    """Return the document for the File with a particular name in a Girder Item.
+
+    Args:
+        client (girder_client.GirderClient): The Girder client to use
+        item_id (str): The ID of the Item
+        name (str): The name of the File
+
+    Returns:
+        dict or None: The File document, or None if there's no File with that name
+    """
+    for file_doc in client.listFile(item_id):
+        if file_doc["name"] == name:
+            return file_doc
+    return None
+
+
+def get_girder_upload_parameters(folder_id, name, size, item_id=None):
+    """Return the query parameters for starting an upload of a new file to a
+    Girder Folder (creating a new Item for it, unless it's uploaded to an existing
+    Item).
+
+    Args:
+        folder_id (str): The ID of the Folder to upload to
+        name (str): The name of the new file
+        size (int): The size of the new file in bytes
+        item_id (str, optional): The ID of an existing Item in the Folder to add
+            the new file to, instead of creating a new Item
+
+    Returns:
+        dict: parameters for a POST request to the "file" endpoint
+    """
+    return {
+        "parentType": "folder" if item_id is None else "item",
+        "parentId": folder_id if item_id is None else item_id,
+        "name": name,
+        "size": size,
+        "mimeType": mimetypes.guess_type(name)[0],
+    }
+
+
+def get_girder_upload_offset(client, upload_id):
+    """Return the number of bytes a Girder server has received for an unfinished
+    upload.
+
+    Args:
+        client (girder_client.GirderClient): The Girder client to use
+        upload_id (str): The ID of the upload
+
+    Returns:
+        int or None: The offset the next chunk of the upload should start at, or None
+            if the upload no longer exists on the server
+    """
+    from girder_client import HttpError  # pylint: disable=import-outside-toplevel
+
+    try:
+        return client.get("file/offset", parameters={"uploadId": upload_id})["offset"]
+    except HttpError:
+        return None
+
+
+def upload_girder_chunks(
+    client, upload_id, stream, size, offset=0, progress_callback=None
+):
+    """Send the rest of a stream to an unfinished Girder upload in chunks.
+
+    Args:
+        client (girder_client.GirderClient): The Girder client to use
+        upload_id (str): The ID of the upload
+        stream (file-like): Readable binary stream positioned at "offset"
+        size (int): The total size of the file being uploaded
+        offset (int, optional): The number of bytes the server has already received
+        progress_callback (callable, optional): Called with the new offset after
+            each chunk is received by the server
+
+    Returns:
+        dict: The Girder File document created when the last chunk is received
+
+    Raises:
+        ValueError: if the stream ends before "size" bytes have been sent
+    """
+    file_doc = None
+    while offset < size:
+        chunk = stream.read(min(client.MAX_CHUNK_SIZE, size - offset))
+        if not chunk:
+            raise ValueError(
+                f"Stream ended after {offset} bytes but upload {upload_id} "
+                f"expects {size} bytes"
+            )
+        file_doc = client.post(
+            "file/chunk",
+            parameters={"offset": offset, "uploadId": upload_id},
+            data=chunk,
+        )
+        offset += len(chunk)
+        if progress_callback is not None:
+            progress_callback(offset)
+    return file_doc
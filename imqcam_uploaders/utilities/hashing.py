@@ -1,10 +1,28 @@
 " Functions dealing with hashes of files "
 
 # imports
+import os
+import time
+import hashlib
+import itertools
+import functools
+import concurrent.futures
 from hashlib import sha256
+from .mapped_files import (
+    DEFAULT_MAPPED_READ_THRESHOLD,
+    iter_file_chunks,
+    open_file_reader,
+)
 
+# Files are read this many bytes at a time to hash them. hashlib releases the GIL
+# while it hashes buffers this large, so files hashed in different threads are
+# hashed on different cores.
+DEFAULT_HASH_READ_SIZE = 1024 * 1024
+# The number of files hashed at once by "hash_files" by default
+DEFAULT_N_HASHING_WORKERS = os.cpu_count() or 1
 
-def get_on_disk_file_hash(filepath, chunk_size=65536):
+
+def get_on_disk_file_hash(filepath, chunk_size=DEFAULT_HASH_READ_SIZE):
     """Return the hexdigest of the sha256 hash of a file on disk.
 
     Args:
@@ -15,14 +33,175 @@ def get_on_disk_file_hash(filepath, chunk_size=65536):
     Returns:
         str: The hexdigest of the sha256 hash of the file at "filepath"
     """
-    file_hash = sha256()
-    with open(filepath, "rb") as fobj:
-        while True:
-            data = fobj.read(chunk_size)
-            if not data:
-                break
+    file_hashes, _ = get_on_disk_file_hashes(filepath, chunk_size=chunk_size)
+    return file_hashes["sha256"]
+
+
+class HashingReader:
+    """A read-only binary file-like object that wraps another one and computes the
+    hashes of everything read through it, so that a file can be hashed using the
+    same chunks that are read to upload it. The time spent updating the hashes is
+    added up in "hash_seconds".
+
+    Args:
+        fobj (file-like): the readable binary file object to wrap
+        algorithms (tuple, optional): names of the hashlib algorithms to compute
+    """
+
+    def __init__(self, fobj, algorithms=("sha256",)):
+        self.__fobj = fobj
+        self.__hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+        self.n_bytes_read = 0
+        self.hash_seconds = 0.0
+
+    def read(self, size=-1):
+        """Read and return up to "size" bytes from the wrapped file object, adding
+        them to the hashes
+
+        Args:
+            size (int, optional): the maximum number of bytes to read (-1 reads until
+                the end of the file)
+
+        Returns:
+            bytes: the data that were read (or a memoryview, if that's what the
+                wrapped file object returns)
+        """
+        data = self.__fobj.read(size)
+        start = time.perf_counter()
+        for file_hash in self.__hashes.values():
             file_hash.update(data)
-    return file_hash.hexdigest()
+        self.hash_seconds += time.perf_counter() - start
+        self.n_bytes_read += len(data)
+        return data
+
+    def hexdigest(self, algorithm="sha256"):
+        """Return the hexdigest of one of the hashes of everything read so far
+
+        Args:
+            algorithm (str, optional): the name of the hash algorithm
+
+        Returns:
+            str: the hexdigest of the hash
+        """
+        return self.__hashes[algorithm].hexdigest()
+
+    def hexdigests(self):
+        """Return the hexdigests of all of the hashes of everything read so far
+
+        Returns:
+            dict: hexdigests keyed by the names of their hash algorithms
+        """
+        return {
+            algorithm: file_hash.hexdigest()
+            for algorithm, file_hash in self.__hashes.items()
+        }
+
+
+def get_on_disk_file_hashes(
+    filepath,
+    algorithms=("sha256",),
+    chunk_size=DEFAULT_HASH_READ_SIZE,
+    mapped_threshold=DEFAULT_MAPPED_READ_THRESHOLD,
+):
+    """Return the size of a file on disk and the hexdigests of some of its hashes,
+    computed by reading it once without allocating a new bytes object for every
+    chunk (large files are memory-mapped, and smaller ones are read into the same
+    buffer over and over; see "open_file_reader")
+
+    Args:
+        filepath (pathlib.Path): the path to the file on disk
+        algorithms (tuple, optional): names of the hashlib algorithms to compute
+        chunk_size (int, optional): the chunk size to use in incrementally reading
+            the file from disk
+        mapped_threshold (int, optional): files at least this large are
+            memory-mapped (None never maps files)
+
+    Returns:
+        tuple: a dictionary of the file's "size" and the hexdigests keyed by the
+            names of their algorithms, and the result of os.stat for the file when
+            it was opened
+    """
+    file_hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    with open_file_reader(filepath, mapped_threshold) as fobj:
+        file_stat = os.fstat(fobj.fileno())
+        for chunk in iter_file_chunks(fobj, chunk_size):
+            for file_hash in file_hashes.values():
+                file_hash.update(chunk)
+    return (
+        {
+            "size": file_stat.st_size,
+            **{name: file_hash.hexdigest() for name, file_hash in file_hashes.items()},
+        },
+        file_stat,
+    )
+
+
+def hash_files(
+    filepaths,
+    algorithms=("sha256",),
+    n_workers=DEFAULT_N_HASHING_WORKERS,
+    use_processes=False,
+    chunk_size=DEFAULT_HASH_READ_SIZE,
+):
+    """Hash many files on disk at once, yielding the results for each file as soon
+    as it's done (so not necessarily in the same order as "filepaths"). Every file
+    is read only once no matter how many hashes are computed.
+
+    Files are hashed in a pool of threads by default, which keeps every core busy
+    because hashlib releases the GIL while it hashes large buffers. Processes can be
+    used instead if something else in the program holds the GIL a lot. Only a few
+    files per worker are waiting to be hashed at any time, so "filepaths" can be a
+    generator over a huge directory tree.
+
+    Args:
+        filepaths (iterable): paths to the files on disk
+        algorithms (tuple, optional): names of the hashlib algorithms to compute
+            (like "sha256", "md5", and "blake2b")
+        n_workers (int, optional): the number of files to hash at once
+        use_processes (bool, optional): if True, hash the files in a pool of
+            processes instead of threads
+        chunk_size (int, optional): the chunk size to use in incrementally reading
+            each file from disk
+
+    Yields:
+        tuple: the path to a file, a dictionary of its "size" and the hexdigests
+            keyed by the names of their algorithms, and the result of os.stat for
+            the file when it was opened (the last two are None if the file couldn't
+            be read, because it was deleted, for example)
+    """
+    hash_file = functools.partial(
+        get_on_disk_file_hashes, algorithms=tuple(algorithms), chunk_size=chunk_size
+    )
+    executor_type = (
+        concurrent.futures.ProcessPoolExecutor
+        if use_processes
+        else concurrent.futures.ThreadPoolExecutor
+    )
+    filepaths = iter(filepaths)
+    pending = {}
+    with executor_type(max_workers=n_workers) as executor:
+        try:
+            while True:
+                for filepath in itertools.islice(
+                    filepaths, 2 * n_workers - len(pending)
+                ):
+                    pending[executor.submit(hash_file, filepath)] = filepath
+                if not pending:
+                    return
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    filepath = pending.pop(future)
+                    try:
+                        file_hashes, file_stat = future.result()
+                    except OSError:
+                        file_hashes, file_stat = None, None
+                    yield filepath, file_hashes, file_stat
+        finally:
+            # don't hash files that are no longer wanted if the caller stops early
+            for future in pending:
+                future.cancel()
 
 
 def get_girder_file_hash(client, file_id, pbar=None):
@@ -42,3 +221,21 @@ def get_girder_file_hash(client, file_id, pbar=None):
         if pbar is not None:
             pbar.update(len(chunk))
     return file_hash.hexdigest()
+
+
+def get_girder_server_file_hash(client, file_id, algorithm="sha512"):
+    """Return the hexdigest of a hash of a file on Girder that was computed by the
+    server itself (by the Girder "hashsum_download" plugin), without downloading
+    the file.
+
+    Args:
+        client (girder_client.GirderClient): the authenticated client to use in
+            connecting to Girder
+        file_id (str): ID of the file to get the hash of
+        algorithm (str, optional): the name of the hash algorithm
+
+    Returns:
+        str or None: the hexdigest of the hash, or None if the server doesn't
+            provide hashes of that type
+    """
+    return client.getFile(file_id).get(algorithm)
@@ -0,0 +1,524 @@
+" A local database of files that have been hashed and uploaded "
+
+# imports
+import os
+import time
+import pathlib
+import sqlite3
+import threading
+from .hashing import get_on_disk_file_hash
+from .packing import get_file_pack_members
+
+# girder_client (and requests) are imported only inside the functions that need
+# them, so that the command line programs can start without loading them
+
+# Files are identified by their absolute path along with these fields of os.stat
+STAT_FIELDS = ("st_size", "st_mtime_ns", "st_ino")
+
+CREATE_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS file_hashes (
+    filepath TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (filepath, size, mtime_ns, inode)
+);
+CREATE TABLE IF NOT EXISTS uploads (
+    filepath TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    api_url TEXT NOT NULL,
+    root_folder_id TEXT NOT NULL,
+    girder_path TEXT NOT NULL,
+    sha256 TEXT,
+    item_id TEXT NOT NULL,
+    file_id TEXT,
+    uploaded_at REAL NOT NULL,
+    pack_member TEXT,
+    PRIMARY KEY (filepath, api_url, root_folder_id, girder_path)
+);
+CREATE TABLE IF NOT EXISTS pending_uploads (
+    filepath TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    api_url TEXT NOT NULL,
+    folder_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    upload_id TEXT NOT NULL UNIQUE,
+    offset INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    PRIMARY KEY (filepath, api_url, folder_id, name)
+);
+CREATE TABLE IF NOT EXISTS girder_contents (
+    api_url TEXT NOT NULL,
+    scope_id TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    item_id TEXT NOT NULL,
+    file_id TEXT,
+    PRIMARY KEY (api_url, scope_id, sha256, size)
+);
+CREATE TABLE IF NOT EXISTS girder_content_scans (
+    api_url TEXT NOT NULL,
+    scope_id TEXT NOT NULL,
+    scanned_at REAL NOT NULL,
+    PRIMARY KEY (api_url, scope_id)
+);
+"""
+
+# Columns added to tables after they were first created, with their types
+ADDED_COLUMNS = {"uploads": {"pack_member": "TEXT"}}
+
+
+class UploadManifest:
+    """A SQLite database on local disk recording the sha256 hashes of files and
+    where they've been uploaded in Girder, so that files that haven't changed since
+    they were last hashed or uploaded don't need to be read or looked up again.
+
+    Files are identified by their absolute path, size, modification time (in ns),
+    and inode number, so editing or replacing a file invalidates its entries. The
+    database is opened in write-ahead-log mode so that several threads or processes
+    can safely use the same manifest at once.
+
+    Args:
+        db_path (pathlib.Path): Path to the database file (created if it doesn't exist)
+        timeout (float, optional): seconds to wait for other writers to release
+            the database before raising an error
+    """
+
+    def __init__(self, db_path, timeout=60.0):
+        self.db_path = pathlib.Path(db_path)
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(
+            self.db_path, timeout=timeout, check_same_thread=False
+        )
+        with self.__lock, self.__connection:
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute("PRAGMA synchronous=NORMAL")
+            self.__connection.executescript(CREATE_TABLES_SQL)
+            self.__add_missing_columns()
+
+    @staticmethod
+    def get_file_key(filepath, file_stat=None):
+        """Return the tuple of values that identifies a file in the manifest
+
+        Args:
+            filepath (pathlib.Path): Path to the file on disk
+            file_stat (os.stat_result, optional): the result of os.stat for the file,
+                if it's already known
+
+        Returns:
+            tuple: the file's absolute path (as a str), size, mtime_ns, and inode
+        """
+        if file_stat is None:
+            file_stat = os.stat(filepath)
+        return (
+            str(pathlib.Path(filepath).absolute()),
+            *(getattr(file_stat, field) for field in STAT_FIELDS),
+        )
+
+    def get_hash(self, filepath, file_stat=None):
+        """Return the sha256 hash of a file recorded in the manifest, if the file
+        hasn't changed since it was recorded.
+
+        Args:
+            filepath (pathlib.Path): Path to the file on disk
+            file_stat (os.stat_result, optional): the result of os.stat for the file
+
+        Returns:
+            str or None: the hexdigest of the file's sha256 hash, or None if it's not
+                in the manifest
+        """
+        row = self.__fetchone(
+            "SELECT sha256 FROM file_hashes WHERE filepath=? AND size=? "
+            "AND mtime_ns=? AND inode=?",
+            self.get_file_key(filepath, file_stat),
+        )
+        return None if row is None else row[0]
+
+    def get_file_hash(self, filepath):
+        """Return the sha256 hash of a file, computing and recording it only if it
+        isn't already in the manifest.
+
+        Args:
+            filepath (pathlib.Path): Path to the file on disk
+
+        Returns:
+            str: the hexdigest of the file's sha256 hash
+        """
+        file_stat = os.stat(filepath)
+        file_hash = self.get_hash(filepath, file_stat)
+        if file_hash is None:
+            file_hash = get_on_disk_file_hash(filepath)
+            self.add_hash(filepath, file_hash, file_stat)
+        return file_hash
+
+    def add_hash(self, filepath, file_hash, file_stat=None):
+        """Record the sha256 hash of a file
+
+        Args:
+            filepath (pathlib.Path): Path to the file on disk
+            file_hash (str): the hexdigest of the file's sha256 hash
+            file_stat (os.stat_result, optional): the result of os.stat for the file
+                when it was hashed
+        """
+        self.__execute(
+            "INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?)",
+            (*self.get_file_key(filepath, file_stat), file_hash),
+        )
+
+    def get_upload(self, filepath, api_url, root_folder_id, girder_path):
+        """Return the record of a file's upload to a particular place in Girder, if
+        the file hasn't changed since it was uploaded there.
+
+        Args:
+            filepath (pathlib.Path): Path to the file on disk
+            api_url (str): the URL of the Girder instance's REST API
+            root_folder_id (str): the ID of the root Folder of the upload
+            girder_path (pathlib.Path): the path to the Item in Girder, relative to
+                the root Folder
+
+        Returns:
+            dict or None: the sha256 hash, Girder Item and File IDs, upload time, and
+                name in its pack ("sha256", "item_id", "file_id", "uploaded_at", and
+                "pack_member") of the file, or None if the unchanged file hasn't been
+                uploaded there
+        """
+        row = self.__fetchone(
+            "SELECT sha256, item_id, file_id, uploaded_at, pack_member FROM uploads "
+            "WHERE filepath=? AND size=? AND mtime_ns=? AND inode=? "
+            "AND api_url=? AND root_folder_id=? AND girder_path=?",
+            (
+                *self.get_file_key(filepath),
+                api_url,
+                root_folder_id,
+                pathlib.PurePath(girder_path).as_posix(),
+            ),
+        )
+        if row is None:
+            return None
+        return dict(
+            zip(("sha256", "item_id", "file_id", "uploaded_at", "pack_member"), row)
+        )
+
+    def add_upload(  # pylint: disable=too-many-arguments
+        self,
+        filepath,
+        api_url,
+        root_folder_id,
+        girder_path,
+        item_id,
+        file_id=None,
+        file_hash=None,
+        file_stat=None,
+        pack_member=None,
+    ):
+        """Record that a file was uploaded to (or found in) Girder. If its sha256
+        hash is given, that's recorded too. Files in packs (see "build_file_pack")
+        are recorded with the ID of the pack's Item and their name in the pack.
+
+        Args:
+            filepath (pathlib.Path): Path to the file on disk
+            api_url (str): the URL of the Girder instance's REST API
+            root_folder_id (str): the ID of the root Folder of the upload
+            girder_path (pathlib.Path): the path to the Item in Girder, relative to
+                the root Folder
+            item_id (str): the ID of the Girder Item holding the file
+            file_id (str, optional): the ID of the Girder File
+            file_hash (str, optional): the hexdigest of the file's sha256 hash
+            file_stat (os.stat_result, optional): the result of os.stat for the file
+                when it was uploaded
+            pack_member (str, optional): the name of the file in the pack holding it,
+                if it was packed
+        """
+        file_key = self.get_file_key(filepath, file_stat)
+        with self.__lock, self.__connection:
+            if file_hash is not None:
+                self.__connection.execute(
+                    "INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?)",
+                    (*file_key, file_hash),
+                )
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO uploads (filepath, size, mtime_ns, inode, "
+                "api_url, root_folder_id, girder_path, sha256, item_id, file_id, "
+                "uploaded_at, pack_member) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    *file_key,
+                    api_url,
+                    root_folder_id,
+                    pathlib.PurePath(girder_path).as_posix(),
+                    file_hash,
+                    item_id,
+                    file_id,
+                    time.time(),
+                    pack_member,
+                ),
+            )
+
+    def get_pending_upload(self, filepath, api_url, folder_id, name, file_stat=None):
+        """Return the unfinished upload of a file to a Girder Folder, if the file
+        hasn't changed since the upload was started.
+
+        Args:
+            filepath (pathlib.Path): Path to the file on disk
+            api_url (str): the URL of the Girder instance's REST API
+            folder_id (str): the ID of the Girder Folder the file is being uploaded to
+            name (str): the name of the file in Girder
+            file_stat (os.stat_result, optional): the result of os.stat for the file
+
+        Returns:
+            dict or None: the Girder upload ID ("upload_id") and the last offset
+                known to have been received by the server ("offset"), or None if
+                there's no unfinished upload of the unchanged file
+        """
+        row = self.__fetchone(
+            "SELECT upload_id, offset FROM pending_uploads "
+            "WHERE filepath=? AND size=? AND mtime_ns=? AND inode=? "
+            "AND api_url=? AND folder_id=? AND name=?",
+            (*self.get_file_key(filepath, file_stat), api_url, folder_id, name),
+        )
+        if row is None:
+            return None
+        return dict(zip(("upload_id", "offset"), row))
+
+    def add_pending_upload(
+        self, filepath, api_url, folder_id, name, upload_id, file_stat=None
+    ):
+        """Record that an upload of a file was started, replacing any earlier
+        unfinished upload of the file to the same place.
+
+        Args:
+            filepath (pathlib.Path): Path to the file on disk
+            api_url (str): the URL of the Girder instance's REST API
+            folder_id (str): the ID of the Girder Folder the file is being uploaded to
+            name (str): the name of the file in Girder
+            upload_id (str): the ID of the Girder upload
+            file_stat (os.stat_result, optional): the result of os.stat for the file
+                when the upload was started
+        """
+        self.__execute(
+            "INSERT OR REPLACE INTO pending_uploads VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                *self.get_file_key(filepath, file_stat),
+                api_url,
+                folder_id,
+                name,
+                upload_id,
+                0,
+                time.time(),
+            ),
+        )
+
+    def set_pending_upload_offset(self, upload_id, offset):
+        """Record the number of bytes the server has received for an unfinished upload
+
+        Args:
+            upload_id (str): the ID of the Girder upload
+            offset (int): the number of bytes received by the server
+        """
+        self.__execute(
+            "UPDATE pending_uploads SET offset=? WHERE upload_id=?",
+            (offset, upload_id),
+        )
+
+    def remove_pending_upload(self, upload_id):
+        """Forget about an upload that finished or can't be resumed
+
+        Args:
+            upload_id (str): the ID of the Girder upload
+        """
+        self.__execute("DELETE FROM pending_uploads WHERE upload_id=?", (upload_id,))
+
+    def get_girder_contents(self, api_url, scope_id):
+        """Return the files recorded in a Girder Collection (or User directory) by
+        their contents, if it was ever scanned (see "GirderContentIndex")
+
+        Args:
+            api_url (str): the URL of the Girder instance's REST API
+            scope_id (str): the ID of the Collection (or User)
+
+        Returns:
+            list or None: the sha256 hash, size, Item ID, and File ID (or None) of
+                every file recorded, or None if the Collection was never scanned
+        """
+        with self.__lock:
+            scanned = self.__connection.execute(
+                "SELECT scanned_at FROM girder_content_scans "
+                "WHERE api_url=? AND scope_id=?",
+                (api_url, scope_id),
+            ).fetchone()
+            if scanned is None:
+                return None
+            return self.__connection.execute(
+                "SELECT sha256, size, item_id, file_id FROM girder_contents "
+                "WHERE api_url=? AND scope_id=?",
+                (api_url, scope_id),
+            ).fetchall()
+
+    def add_girder_contents(self, api_url, scope_id, contents, scanned=False):
+        """Record files in a Girder Collection (or User directory) by their contents
+
+        Args:
+            api_url (str): the URL of the Girder instance's REST API
+            scope_id (str): the ID of the Collection (or User)
+            contents (list): the sha256 hash, size, Item ID, and File ID (or None)
+                of each file
+            scanned (bool, optional): True if "contents" are everything found by
+                scanning the whole Collection
+        """
+        with self.__lock, self.__connection:
+            self.__connection.executemany(
+                "INSERT OR REPLACE INTO girder_contents VALUES (?, ?, ?, ?, ?, ?)",
+                [(api_url, scope_id, *content) for content in contents],
+            )
+            if scanned:
+                self.__connection.execute(
+                    "INSERT OR REPLACE INTO girder_content_scans VALUES (?, ?, ?)",
+                    (api_url, scope_id, time.time()),
+                )
+
+    def remove_girder_content(self, api_url, scope_id, file_hash, size):
+        """Forget a file with some contents in a Girder Collection (or User
+        directory)
+
+        Args:
+            api_url (str): the URL of the Girder instance's REST API
+            scope_id (str): the ID of the Collection (or User)
+            file_hash (str): the hexdigest of the file's sha256 hash
+            size (int): the size of the file in bytes
+        """
+        self.__execute(
+            "DELETE FROM girder_contents WHERE api_url=? AND scope_id=? "
+            "AND sha256=? AND size=?",
+            (api_url, scope_id, file_hash, size),
+        )
+
+    def reconcile(self, client, api_url):
+        """Remove every upload record for a Girder instance whose local file has
+        changed or been deleted, or whose Girder File no longer exists or has a
+        different size (or, for a packed file, whose pack no longer lists it with
+        the same size), along with hashes of files that have changed. Unfinished
+        uploads of files that have changed are cancelled.
+
+        Args:
+            client (girder_client.GirderClient): an authenticated client for the
+                Girder instance
+            api_url (str): the URL of the Girder instance's REST API, as recorded
+                in the manifest
+
+        Returns:
+            tuple: the number of upload records that were checked, and the number
+                of them that were removed
+        """
+        from girder_client import HttpError  # pylint: disable=import-outside-toplevel
+
+        with self.__lock:
+            rows = self.__connection.execute(
+                "SELECT rowid, filepath, size, mtime_ns, inode, item_id, file_id, "
+                "pack_member FROM uploads WHERE api_url=?",
+                (api_url,),
+            ).fetchall()
+        stale_rowids = []
+        for rowid, filepath, size, mtime_ns, inode, *girder_ids in rows:
+            if not self.__is_unchanged(filepath, (filepath, size, mtime_ns, inode)):
+                stale_rowids.append(rowid)
+                continue
+            try:
+                current = self.__is_in_girder(client, size, *girder_ids)
+            except HttpError:
+                current = False
+            if not current:
+                stale_rowids.append(rowid)
+        with self.__lock, self.__connection:
+            self.__connection.executemany(
+                "DELETE FROM uploads WHERE rowid=?",
+                [(rowid,) for rowid in stale_rowids],
+            )
+            hash_rows = self.__connection.execute(
+                "SELECT filepath, size, mtime_ns, inode FROM file_hashes"
+            ).fetchall()
+            self.__connection.executemany(
+                "DELETE FROM file_hashes WHERE filepath=? AND size=? "
+                "AND mtime_ns=? AND inode=?",
+                [row for row in hash_rows if not self.__is_unchanged(row[0], row)],
+            )
+        self.__cancel_stale_pending_uploads(client, api_url)
+        return len(rows), len(stale_rowids)
+
+    @staticmethod
+    def __is_in_girder(client, size, item_id, file_id, pack_member):
+        """Return True if an uploaded file is still in Girder with the same size"""
+        if pack_member is not None:
+            member = get_file_pack_members(client.getItem(item_id)).get(pack_member)
+            return member is not None and member["size"] == size
+        if file_id is None:
+            return any(
+                girder_file["size"] == size
+                for girder_file in list(client.listFile(item_id))
+            )
+        return client.getFile(file_id)["size"] == size
+
+    def __cancel_stale_pending_uploads(self, client, api_url):
+        from girder_client import HttpError  # pylint: disable=import-outside-toplevel
+
+        with self.__lock:
+            rows = self.__connection.execute(
+                "SELECT filepath, size, mtime_ns, inode, upload_id "
+                "FROM pending_uploads WHERE api_url=?",
+                (api_url,),
+            ).fetchall()
+        for row in rows:
+            if self.__is_unchanged(row[0], row[:4]):
+                continue
+            try:
+                client.delete(f"file/upload/{row[4]}")
+            except HttpError:
+                pass
+            self.remove_pending_upload(row[4])
+
+    def close(self):
+        """Close the connection to the database"""
+        with self.__lock:
+            self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self.__fetchone("SELECT COUNT(*) FROM uploads", ())[0]
+
+    def __add_missing_columns(self):
+        """Add the columns in ADDED_COLUMNS to the tables of a manifest made before
+        they existed (must be called while holding the lock)
+        """
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {
+                row[1]
+                for row in self.__connection.execute(f"PRAGMA table_info({table})")
+            }
+            for column, column_type in columns.items():
+                if column not in existing:
+                    self.__connection.execute(
+                        f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"
+                    )
+
+    def __is_unchanged(self, filepath, file_key):
+        try:
+            return self.get_file_key(filepath) == tuple(file_key)
+        except OSError:
+            return False
+
+    def __execute(self, sql, parameters):
+        with self.__lock, self.__connection:
+            self.__connection.execute(sql, parameters)
+
+    def __fetchone(self, sql, parameters):
+        with self.__lock:
+            return self.__connection.execute(sql, parameters).fetchone()
@@ -0,0 +1,171 @@
+""" Reading large files on disk through memory maps, so that they can be hashed and
+uploaded without copying their contents into new bytes objects
+"""
+
+# imports
+import io
+import os
+import mmap
+
+# Files at least this large are memory-mapped by "open_file_reader" by default
+DEFAULT_MAPPED_READ_THRESHOLD = 16 * 1024 * 1024
+
+
+def advise_sequential(fileno):
+    """Tell the kernel that a file will be read from start to end once, so that it
+    reads ahead more aggressively (does nothing on platforms without
+    posix_fadvise)
+
+    Args:
+        fileno (int): the file descriptor of the open file
+    """
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fileno, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+
+class MappedFileReader(io.RawIOBase):
+    """A read-only, seekable binary file-like object over a memory map of a file on
+    disk. "read" returns memoryview slices of the map instead of bytes, so nothing
+    is copied into new bytes objects: hashlib hashes the slices directly, and
+    requests sends them as request bodies as they are (as long as they're posted
+    directly, like "upload_girder_chunks" and the asyncio uploader do, and not
+    through girder_client's own upload methods, which copy every chunk into a
+    BytesIO). The map is advised for sequential access.
+
+    The file must not be truncated while it's mapped: reading a part of the map
+    past the new end of the file kills the process with SIGBUS. That's why only
+    large files are mapped by "open_file_reader", and why files that may still be
+    changing (like the ones IMQCAMDirectoryWatcher uploads) shouldn't be mapped.
+
+    Args:
+        filepath (pathlib.Path): the path to the file on disk
+    """
+
+    def __init__(self, filepath):
+        super().__init__()
+        self.__fobj = None
+        self.__map = None
+        self.__view = memoryview(b"")
+        self.__position = 0
+        try:
+            # pylint: disable-next=consider-using-with
+            self.__fobj = open(filepath, "rb", buffering=0)
+            advise_sequential(self.__fobj.fileno())
+            if os.fstat(self.__fobj.fileno()).st_size > 0:
+                self.__map = mmap.mmap(self.__fobj.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(mmap, "MADV_SEQUENTIAL"):
+                    self.__map.madvise(mmap.MADV_SEQUENTIAL)
+                self.__view = memoryview(self.__map)
+        except BaseException:
+            self.close()
+            raise
+
+    def __len__(self):
+        return len(self.__view)
+
+    def fileno(self):
+        return self.__fobj.fileno()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        """Return up to "size" bytes of the file from the current position as a
+        memoryview of the map, without copying them
+
+        Args:
+            size (int, optional): the maximum number of bytes to read (-1 reads
+                until the end of the file)
+
+        Returns:
+            memoryview: the data that were read (empty at the end of the file)
+        """
+        start = self.__position
+        end = len(self.__view) if size is None or size < 0 else start + size
+        data = self.__view[start:end]
+        self.__position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.__position
+        elif whence == os.SEEK_END:
+            offset += len(self.__view)
+        if offset < 0:
+            raise ValueError(f"ERROR: can't seek to negative position {offset}!")
+        self.__position = offset
+        return self.__position
+
+    def tell(self):
+        return self.__position
+
+    def close(self):
+        """Unmap the file and close it. If memoryviews of the map are still in use
+        somewhere, the map is closed once the last of them is gone instead.
+        """
+        self.__view.release()
+        if self.__map is not None:
+            try:
+                self.__map.close()
+            except BufferError:
+                pass
+        if self.__fobj is not None:
+            self.__fobj.close()
+        super().close()
+
+
+def open_file_reader(filepath, mapped_threshold=DEFAULT_MAPPED_READ_THRESHOLD):
+    """Open a file on disk to be read once from start to end: large files are
+    memory-mapped (see MappedFileReader), and smaller ones are opened normally
+    with a hint to the kernel that they'll be read sequentially
+
+    Args:
+        filepath (pathlib.Path): the path to the file on disk
+        mapped_threshold (int, optional): files at least this large are mapped
+            (None never maps files)
+
+    Returns:
+        file-like: a readable, seekable binary file object (to be closed when it's
+            no longer needed)
+    """
+    if mapped_threshold is not None and os.path.getsize(filepath) >= mapped_threshold:
+        return MappedFileReader(filepath)
+    fobj = open(filepath, "rb")  # pylint: disable=consider-using-with
+    advise_sequential(fobj.fileno())
+    return fobj
+
+
+def iter_file_chunks(fobj, chunk_size):
+    """Yield the rest of an open binary file as memoryviews of up to "chunk_size"
+    bytes each, without allocating new bytes objects: slices of the map for a
+    MappedFileReader, or of one buffer that every chunk is read into otherwise
+    (so each chunk is only valid until the next one is yielded)
+
+    Args:
+        fobj (file-like): the open file
+        chunk_size (int): the largest number of bytes in each chunk
+
+    Yields:
+        memoryview: the next chunk of the file
+    """
+    if isinstance(fobj, MappedFileReader):
+        while True:
+            chunk = fobj.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    while True:
+        n_bytes = fobj.readinto(buffer)
+        if not n_bytes:
+            return
+        yield view[:n_bytes]
@@ -0,0 +1,239 @@
+""" Bundling many small files into single zip archives ("packs") so that they can be
+uploaded to Girder as one Item, and finding and reading the files in packs later
+"""
+
+# imports
+import os
+import struct
+import hashlib
+import pathlib
+import zipfile
+import tempfile
+from .girder import GirderItemIndex
+
+# The metadata field of a pack's Item that lists the files in it
+PACK_METADATA_KEY = "pack"
+# Pack Items are named this followed by a hash of what's in them
+PACK_NAME_PREFIX = "imqcam_pack_"
+# Files smaller than this many bytes are packed by default when packing is enabled
+DEFAULT_PACK_THRESHOLD = 65536
+# Packs are closed once they hold this many bytes or this many files
+MAX_PACK_BYTES = 64 * 1024 * 1024
+MAX_PACK_MEMBERS = 1000
+# Packs larger than this are built in a temporary file instead of in memory
+MAX_PACK_BYTES_IN_MEMORY = 16 * 1024 * 1024
+# The fixed-size part of a zip local file header, which is followed by the name and
+# "extra" field whose lengths are the last two fields of the header
+ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+
+
+def build_file_pack(filepaths):
+    """Write some files into an uncompressed zip archive, recording the size, sha256
+    hash, and position in the archive of each file's data (so that a single file can
+    be read back with one byte-range request, without reading the rest of the pack)
+
+    Args:
+        filepaths (list): paths to the files to pack, which must all have different
+            names (they're stored by name only, without their directories)
+
+    Returns:
+        tuple: the archive (a readable binary stream positioned at the start), its
+            size, and a list of dictionaries with the "name", "size", "sha256", and
+            "offset" of each file in it (in the same order as "filepaths")
+
+    Raises:
+        ValueError: if two of the files have the same name
+    """
+    names = [filepath.name for filepath in filepaths]
+    if len(set(names)) != len(names):
+        raise ValueError(f"ERROR: can't pack files with the same names: {names}")
+    buffer = tempfile.SpooledTemporaryFile(  # pylint: disable=consider-using-with
+        max_size=MAX_PACK_BYTES_IN_MEMORY
+    )
+    members = []
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for filepath in filepaths:
+            with open(filepath, "rb") as fobj:
+                data = fobj.read()
+            archive.writestr(filepath.name, data)
+            members.append(
+                {
+                    "name": filepath.name,
+                    "size": len(data),
+                    "sha256": hashlib.sha256(data).hexdigest(),
+                    "offset": archive.getinfo(filepath.name).header_offset,
+                }
+            )
+    size = buffer.tell()
+    # find where the data for each member start (after its local header)
+    for member in members:
+        buffer.seek(member["offset"])
+        header = ZIP_LOCAL_HEADER.unpack(buffer.read(ZIP_LOCAL_HEADER.size))
+        member["offset"] += ZIP_LOCAL_HEADER.size + header[-2] + header[-1]
+    buffer.seek(0)
+    return buffer, size, members
+
+
+def get_file_pack_name(members):
+    """Return the name of the Item for a pack, which depends only on the names and
+    hashes of the files in it (so the same files are always packed under the same
+    name)
+
+    Args:
+        members (list): the members of the pack (see "build_file_pack")
+
+    Returns:
+        str: the name for the pack's Item
+    """
+    pack_hash = hashlib.sha256()
+    for member in sorted(members, key=lambda member: member["name"]):
+        pack_hash.update(f"{member['name']}\0{member['sha256']}\0".encode())
+    return f"{PACK_NAME_PREFIX}{pack_hash.hexdigest()[:16]}.zip"
+
+
+def get_file_pack_members(item):
+    """Return the files in a pack, from the metadata of its Item
+
+    Args:
+        item (dict): a Girder Item document
+
+    Returns:
+        dict: dictionaries with the "name", "size", "sha256", and "offset" of each
+            file in the pack keyed by name (empty if the Item isn't a pack)
+    """
+    pack = (item.get("meta") or {}).get(PACK_METADATA_KEY)
+    if not isinstance(pack, dict):
+        return {}
+    return {member["name"]: member for member in pack.get("members", [])}
+
+
+def get_packed_files(items):
+    """Return every file in the packs among some Items. If a file with the same name
+    is in more than one pack (because it changed and was packed again), the one in
+    the most recently created pack is returned.
+
+    Args:
+        items (iterable): Girder Item documents (like the Items in a Folder)
+
+    Returns:
+        dict: the ID of the pack's Item and the member dictionary for each file (see
+            "get_file_pack_members"), keyed by the file's name
+    """
+    packed_files = {}
+    for item in sorted(items, key=lambda item: item.get("created") or ""):
+        for name, member in get_file_pack_members(item).items():
+            packed_files[name] = (item["_id"], member)
+    return packed_files
+
+
+class FilePackItemIndex(GirderItemIndex):
+    """A GirderItemIndex that also indexes the files inside packs, as if they were
+    Items of their own in the pack's Folder (from the most recent pack holding each
+    one). The ID of a packed file's entry is the pack's Item ID, and its name is the
+    name of the file in the pack.
+    """
+
+    def _get_folder_entries(self, items):
+        entries = {
+            name: (item_id, member["size"], member["sha256"], name)
+            for name, (item_id, member) in get_packed_files(items).items()
+        }
+        entries.update(super()._get_folder_entries(items))
+        return entries
+
+
+def find_packed_file(client, folder_id, name):
+    """Find the (most recent) pack holding a file with some name in a Girder Folder
+
+    Args:
+        client (girder_client.GirderClient): The Girder client to use
+        folder_id (str): the ID of the Folder to look in
+        name (str): the name of the file
+
+    Returns:
+        tuple or None: the ID of the pack's Item and the member dictionary for the
+            file (see "get_file_pack_members"), or None if no pack in the Folder
+            holds a file with that name
+    """
+    return get_packed_files(client.listItem(folder_id)).get(name)
+
+
+def read_packed_file(client, item_id, member):
+    """Download a single file from a pack with one byte-range request, checking its
+    sha256 hash
+
+    Args:
+        client (girder_client.GirderClient): The Girder client to use
+        item_id (str): the ID of the pack's Item
+        member (dict): the member dictionary for the file (see "find_packed_file")
+
+    Returns:
+        bytes: the contents of the file
+
+    Raises:
+        ValueError: if the downloaded contents don't match the recorded hash
+    """
+    file_id = next(iter(client.listFile(item_id)))["_id"]
+    data = client.sendRestRequest(
+        "GET",
+        f"file/{file_id}/download",
+        parameters={
+            "offset": member["offset"],
+            "endByte": member["offset"] + member["size"],
+        },
+        jsonResp=False,
+    ).content
+    if hashlib.sha256(data).hexdigest() != member["sha256"]:
+        raise ValueError(
+            f"ERROR: contents of {member['name']} in pack {item_id} don't match "
+            "its recorded hash!"
+        )
+    return data
+
+
+def extract_file_pack(client, item_id, dirpath, names=None):
+    """Download a whole pack and write the files in it to a directory, checking
+    each file's sha256 hash
+
+    Args:
+        client (girder_client.GirderClient): The Girder client to use
+        item_id (str): the ID of the pack's Item
+        dirpath (pathlib.Path): the directory to write the files to (created if it
+            doesn't exist)
+        names (iterable, optional): the names of the files in the pack to write (by
+            default, every file in it)
+
+    Returns:
+        list: paths to the files that were written
+
+    Raises:
+        ValueError: if the Item isn't a pack, if a file's name isn't a plain file
+            name, or if a file's contents don't match its recorded hash
+        KeyError: if one of the "names" isn't in the pack
+    """
+    members = get_file_pack_members(client.getItem(item_id))
+    if not members:
+        raise ValueError(f"ERROR: Item {item_id} is not a pack of files!")
+    if names is not None:
+        members = {name: members[name] for name in names}
+    dirpath = pathlib.Path(dirpath)
+    dirpath.mkdir(parents=True, exist_ok=True)
+    file_id = next(iter(client.listFile(item_id)))["_id"]
+    filepaths = []
+    with tempfile.TemporaryFile() as buffer:
+        client.downloadFile(file_id, buffer)
+        buffer.seek(0)
+        with zipfile.ZipFile(buffer) as archive:
+            for name, member in members.items():
+                if name != os.path.basename(name) or name in ("", ".", ".."):
+                    raise ValueError(f"ERROR: {name} in pack {item_id} isn't a name!")
+                data = archive.read(name)
+                if hashlib.sha256(data).hexdigest() != member["sha256"]:
+                    raise ValueError(
+                        f"ERROR: contents of {name} in pack {item_id} don't match "
+                        "its recorded hash!"
+                    )
+                filepath = dirpath / name
+                filepath.write_bytes(data)
+                filepaths.append(filepath)
+    return filepaths
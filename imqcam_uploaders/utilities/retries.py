@@ -0,0 +1,74 @@
+" Deciding when and how long to wait before retrying failed Girder requests "
+
+# imports
+import random
+
+# HTTP methods that can be sent again without changing the result
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+# HTTP statuses that mean a request might succeed if it's sent again
+RETRYABLE_STATUSES = (408, 429, 502, 503, 504)
+
+
+class RetryPolicy:
+    """How many times to retry a request that failed for a transient reason (like a
+    dropped connection or a 502 from a proxy), and how long to wait before each
+    retry: an exponentially-growing backoff with random jitter, so that many workers
+    that failed at the same time don't all retry at the same time.
+
+    Args:
+        max_retries (int, optional): the most times to retry a request (0 disables
+            retries)
+        backoff_seconds (float, optional): the longest wait before the first retry
+            (doubled for every retry after that)
+        max_backoff_seconds (float, optional): the longest wait before any retry
+    """
+
+    DEFAULT_MAX_RETRIES = 5
+    DEFAULT_BACKOFF_SECONDS = 0.5
+    DEFAULT_MAX_BACKOFF_SECONDS = 30.0
+
+    def __init__(
+        self,
+        max_retries=DEFAULT_MAX_RETRIES,
+        backoff_seconds=DEFAULT_BACKOFF_SECONDS,
+        max_backoff_seconds=DEFAULT_MAX_BACKOFF_SECONDS,
+    ):
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+    def get_delay(self, attempt, retry_after=None):
+        """Return how long to wait before retrying a request. The wait is at least
+        half of (and at most) the backoff for the attempt, chosen at random.
+
+        Args:
+            attempt (int): how many times the request has been retried already
+            retry_after (str, optional): the value of a "Retry-After" header in the
+                failed response, which is used as the shortest wait if it's a number
+                of seconds
+
+        Returns:
+            float: the number of seconds to wait
+        """
+        backoff = min(self.max_backoff_seconds, self.backoff_seconds * 2**attempt)
+        delay = random.uniform(backoff / 2.0, backoff)
+        try:
+            delay = max(delay, min(float(retry_after), self.max_backoff_seconds))
+        except (TypeError, ValueError):
+            pass
+        return delay
+
+    def should_retry(self, attempt, status=None):
+        """Return True if a request that failed should be retried
+
+        Args:
+            attempt (int): how many times the request has been retried already
+            status (int, optional): the HTTP status of the error response, or None if
+                no response was received (like if the connection was dropped)
+
+        Returns:
+            bool: whether the request should be retried
+        """
+        return attempt < self.max_retries and (
+            status is None or status in RETRYABLE_STATUSES
+        )
@@ -0,0 +1,108 @@
+" Helpers for uploading data from streams instead of files on disk "
+
+# imports
+import os
+import shutil
+import tempfile
+
+
+class ChunkIteratorReader:
+    """A read-only binary file-like object that reads from an iterable of chunks of
+    bytes (like the "iter_content" of a streamed HTTP response), so that it can be
+    uploaded the same way as an open file.
+
+    Args:
+        chunks (iterable): an iterable of bytes-like objects
+    """
+
+    def __init__(self, chunks):
+        self.__chunks = iter(chunks)
+        self.__buffer = bytearray()
+
+    def readable(self):
+        """Return True, since this object can always be read from"""
+        return True
+
+    def read(self, size=-1):
+        """Read and return up to "size" bytes (fewer only at the end of the chunks)
+
+        Args:
+            size (int, optional): the maximum number of bytes to read (-1 reads
+                everything that's left)
+
+        Returns:
+            bytes: the data that were read
+        """
+        while size is None or size < 0 or len(self.__buffer) < size:
+            try:
+                self.__buffer.extend(next(self.__chunks))
+            except StopIteration:
+                break
+        if size is None or size < 0:
+            size = len(self.__buffer)
+        data = bytes(self.__buffer[:size])
+        del self.__buffer[:size]
+        return data
+
+
+def as_readable_stream(stream):
+    """Return a readable binary file-like object for a stream
+
+    Args:
+        stream (file-like or iterable): a readable binary file object, or an iterable
+            of chunks of bytes
+
+    Returns:
+        file-like: "stream" itself if it has a "read" method, otherwise a
+            ChunkIteratorReader for it
+    """
+    if hasattr(stream, "read"):
+        return stream
+    return ChunkIteratorReader(stream)
+
+
+def get_remaining_size(stream):
+    """Return the number of bytes left to read in a seekable stream, or None if the
+    stream isn't seekable
+
+    Args:
+        stream (file-like): a readable binary file object
+
+    Returns:
+        int or None: the number of bytes between the current position and the end
+    """
+    try:
+        if not stream.seekable():
+            return None
+        position = stream.tell()
+        size = stream.seek(0, os.SEEK_END) - position
+        stream.seek(position)
+        return size
+    except (AttributeError, OSError):
+        return None
+
+
+def buffer_stream(stream, max_in_memory):
+    """Read the rest of a stream whose size can't be found any other way into a
+    buffer, which is kept in memory unless it grows past "max_in_memory" bytes (in
+    which case it's moved to a temporary file)
+
+    Args:
+        stream (file-like): a readable binary file object
+        max_in_memory (int): the largest number of bytes to keep in memory
+
+    Returns:
+        tuple(tempfile.SpooledTemporaryFile, int): the buffer, positioned at its
+            start (which should be closed when it's no longer needed), and its size
+    """
+    buffer = tempfile.SpooledTemporaryFile(  # pylint: disable=consider-using-with
+        max_size=max_in_memory
+    )
+    try:
+        shutil.copyfileobj(stream, buffer)
+        size = buffer.tell()
+        buffer.seek(0)
+    except BaseException:
+        buffer.close()
+        raise
+    return buffer, size
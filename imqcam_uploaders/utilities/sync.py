@@ -0,0 +1,183 @@
+""" Comparing a local directory tree with its copy in a Girder Folder tree, using one
+bulk listing of each side
+"""
+
+# imports
+import os
+from .downloads import (
+    DEFAULT_N_LISTING_THREADS,
+    PARTIAL_DOWNLOAD_SUFFIX,
+    walk_girder_folder,
+)
+from .hashing import DEFAULT_N_HASHING_WORKERS, hash_files
+from .packing import get_file_pack_members, get_packed_files
+
+
+class TreeDiff:
+    """The differences between a local directory tree and a Girder Folder tree, by
+    the paths of files relative to the top of each tree ("/"-separated)
+
+    Attributes:
+        new (list): files that are only on disk
+        changed (list): files whose size or sha256 hash differs between disk and
+            Girder
+        missing (dict): what's known about each file that's only in Girder (see
+            "index_girder_tree"), keyed by relative path
+        n_unchanged (int): the number of files that are the same on both sides
+    """
+
+    def __init__(self):
+        self.new = []
+        self.changed = []
+        self.missing = {}
+        self.n_unchanged = 0
+
+    @property
+    def n_differences(self):
+        """The number of files that are new, changed, or missing"""
+        return len(self.new) + len(self.changed) + len(self.missing)
+
+    def add_compared(self, rel_path, matches):
+        """Record a file on both sides that was compared
+
+        Args:
+            rel_path (str): the path to the file relative to the top of the trees
+            matches (bool): True if the file is the same on both sides
+        """
+        if matches:
+            self.n_unchanged += 1
+        else:
+            self.changed.append(rel_path)
+
+    def __str__(self):
+        return (
+            f"{len(self.new)} new, {len(self.changed)} changed, "
+            f"{len(self.missing)} missing, and {self.n_unchanged} unchanged files"
+        )
+
+
+def scan_local_tree(dirpath):
+    """Yield every file in a directory tree with its path relative to the top of the
+    tree, reading each directory once with os.scandir. Symbolic links to
+    directories aren't followed, and partial downloads (see "download_girder_file")
+    are left out.
+
+    Args:
+        dirpath (pathlib.Path): the directory at the top of the tree
+
+    Yields:
+        tuple: the "/"-separated path to the file relative to "dirpath", and the
+            result of os.stat for it
+    """
+    stack = [(dirpath, "")]
+    while stack:
+        path, prefix = stack.pop()
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, f"{prefix}{entry.name}/"))
+                elif entry.is_file() and not entry.name.endswith(
+                    PARTIAL_DOWNLOAD_SUFFIX
+                ):
+                    yield f"{prefix}{entry.name}", entry.stat()
+
+
+def index_girder_tree(client, folder_id, n_threads=DEFAULT_N_LISTING_THREADS):
+    """Return what's in a Girder Folder tree, from one listing of each Folder in it
+    (see "walk_girder_folder"). Files in packs are included as if they were Items
+    of their own, and the packs themselves are left out. If there's more than one
+    Item (or packed file) with the same name in a Folder, the most recent is kept.
+
+    Args:
+        client (girder_client.GirderClient): The Girder client to use
+        folder_id (str): the ID of the Folder at the top of the tree
+        n_threads (int, optional): the number of Folders to list at once
+
+    Returns:
+        dict: tuples of the size, recorded sha256 checksum (or None), and Item ID of
+            each file, and its member dictionary if it's in a pack (or None),
+            keyed by "/"-separated path relative to the top Folder. The names come
+            straight from Girder, so check them (see "get_download_path") before
+            writing anything to these paths.
+    """
+    entries = {}
+    for names, items in walk_girder_folder(client, folder_id, n_threads=n_threads):
+        prefix = "".join(f"{name}/" for name in names)
+        for name, (item_id, member) in get_packed_files(items).items():
+            entries[f"{prefix}{name}"] = (
+                member["size"],
+                member["sha256"],
+                item_id,
+                member,
+            )
+        for item in sorted(items, key=lambda item: item.get("created") or ""):
+            if get_file_pack_members(item):
+                continue
+            checksum = (item.get("meta") or {}).get("checksum")
+            entries[f"{prefix}{item['name']}"] = (
+                item.get("size"),
+                checksum.get("sha256") if isinstance(checksum, dict) else None,
+                item["_id"],
+                None,
+            )
+    return entries
+
+
+def diff_local_and_girder_trees(
+    dirpath, girder_entries, manifest=None, n_workers=DEFAULT_N_HASHING_WORKERS
+):
+    """Compare a local directory tree with what's in a Girder Folder tree, by the
+    relative path, size, and sha256 hash of every file.
+
+    The local tree is scanned once (see "scan_local_tree"), removing each file that's
+    found from "girder_entries", so that what's left at the end is only in Girder.
+    Files whose sizes match a Girder entry with a recorded checksum are then hashed
+    all at once with a pool of workers (see "hash_files"), unless the manifest
+    already has the hash of the unchanged file. Files in Girder without a recorded
+    checksum are compared by size only.
+
+    Args:
+        dirpath (pathlib.Path): the directory at the top of the local tree
+        girder_entries (dict): what's in the Girder tree (see "index_girder_tree"),
+            which is emptied
+        manifest (UploadManifest, optional): where to look up the hashes of files
+            that haven't changed since they were last hashed (the hashes of files
+            that are hashed are added to it)
+        n_workers (int, optional): the number of files to hash at once
+
+    Returns:
+        TreeDiff: the differences between the trees, with every list sorted
+    """
+    diff = TreeDiff()
+    # the expected checksum of each file that has to be hashed, keyed by its path
+    to_hash = {}
+    for rel_path, file_stat in scan_local_tree(dirpath):
+        entry = girder_entries.pop(rel_path, None)
+        if entry is None:
+            diff.new.append(rel_path)
+        elif entry[0] != file_stat.st_size:
+            diff.changed.append(rel_path)
+        elif entry[1] is None:
+            diff.n_unchanged += 1
+        else:
+            filepath = dirpath / rel_path
+            file_hash = None
+            if manifest is not None:
+                file_hash = manifest.get_hash(filepath, file_stat)
+            if file_hash is None:
+                to_hash[filepath] = (rel_path, entry[1])
+            else:
+                diff.add_compared(rel_path, file_hash == entry[1])
+    for filepath, file_hashes, file_stat in hash_files(to_hash, n_workers=n_workers):
+        rel_path, checksum = to_hash[filepath]
+        # (a file that can't be read anymore can't be shown to be unchanged)
+        diff.add_compared(
+            rel_path, file_hashes is not None and file_hashes["sha256"] == checksum
+        )
+        if manifest is not None and file_hashes is not None:
+            manifest.add_hash(filepath, file_hashes["sha256"], file_stat)
+    diff.new.sort()
+    diff.changed.sort()
+    diff.missing = dict(sorted(girder_entries.items()))
+    girder_entries.clear()
+    return diff
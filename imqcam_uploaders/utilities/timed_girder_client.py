@@ -0,0 +1,220 @@
+""" A Girder client that times its REST requests. It's kept apart from the rest of
+the timing code so that girder_client (and requests) are only imported when a client
+is actually made.
+"""
+
+# imports
+import time
+import urllib.parse
+import requests
+import requests.adapters
+import girder_client
+from .bandwidth import RateLimitedReader
+from .retries import IDEMPOTENT_METHODS, RetryPolicy
+from .timing import get_girder_endpoint
+
+# The number of connections to each host kept open for reuse by default
+DEFAULT_POOL_SIZE = 10
+
+
+def get_pooled_session(pool_size=DEFAULT_POOL_SIZE):
+    """Return a requests Session that keeps up to "pool_size" connections to each
+    host open for reuse (so that concurrent requests don't each have to open a new
+    TCP/TLS connection)
+
+    Args:
+        pool_size (int, optional): the most connections to keep open to each host
+
+    Returns:
+        requests.Session: the new Session
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class TimedGirderClient(girder_client.GirderClient):
+    """A GirderClient that records how long each of its REST requests takes in an
+    UploadTimer, grouped by HTTP method and endpoint. Requests that stream their
+    responses are timed until the response headers are received.
+
+    Requests are sent through a Session with a pool of persistent connections, which
+    can be shared by clients made for other threads with "get_worker_client".
+    Requests that fail for a transient reason are retried according to a
+    RetryPolicy, if they can't change anything when sent again: idempotent requests,
+    requests that create Folders or Items with "reuseExisting", requests starting
+    (non-empty) uploads, and chunks of uploads that the server hasn't received any
+    of yet. If there's a bandwidth limiter, the bodies of POST
+    requests (like chunks of uploads) are sent no faster than it allows.
+
+    Args:
+        args (list): passed to girder_client.GirderClient
+        timer (UploadTimer, optional): where to record the timing of each request
+        retry_policy (RetryPolicy, optional): when to retry failed requests (by
+            default, with a RetryPolicy's default settings)
+        session (requests.Session, optional): the Session to send requests through
+            (by default, a new one with a pool of DEFAULT_POOL_SIZE connections)
+        bandwidth_limiter (TokenBucket, optional): the token bucket limiting the rate
+            that request bodies are sent (by default, there's no limit)
+        kwargs (dict): passed to girder_client.GirderClient
+    """
+
+    def __init__(
+        self,
+        *args,
+        timer=None,
+        retry_policy=None,
+        session=None,
+        bandwidth_limiter=None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.timer = timer
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.bandwidth_limiter = bandwidth_limiter
+        self._session = session if session is not None else get_pooled_session()
+
+    def get_worker_client(self):
+        """Return a new client for another thread to use, which shares this client's
+        authentication token, timer, retry policy, bandwidth limiter, and pool of
+        connections
+
+        Returns:
+            TimedGirderClient: the new client
+        """
+        client = TimedGirderClient(
+            apiUrl=self.urlBase,
+            timer=self.timer,
+            retry_policy=self.retry_policy,
+            session=self._session,
+            bandwidth_limiter=self.bandwidth_limiter,
+        )
+        client.setToken(self.token)
+        # pylint: disable=protected-access,attribute-defined-outside-init
+        client._serverApiDescription = self._serverApiDescription
+        client._serverVersion = self._serverVersion
+        return client
+
+    def set_pool_size(self, pool_size):
+        """Make sure the pool of connections shared with worker clients can keep at
+        least "pool_size" connections to each host open (for example, one for each
+        of a number of worker threads)
+
+        Args:
+            pool_size (int): the number of connections needed
+        """
+        adapter = self._session.get_adapter(self.urlBase)
+        # pylint: disable=protected-access
+        if getattr(adapter, "_pool_maxsize", pool_size) >= pool_size:
+            return
+        new_session = get_pooled_session(pool_size)
+        for prefix, new_adapter in new_session.adapters.items():
+            self._session.mount(prefix, new_adapter)
+
+    def sendRestRequest(
+        self, method, path, *args, **kwargs
+    ):  # pylint: disable=invalid-name
+        if self.bandwidth_limiter is not None and method.upper() == "POST":
+            args, kwargs = self.__limit_request_data(args, kwargs)
+        attempt = 0
+        while True:
+            try:
+                return self.__send_timed_request(method, path, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                status, retry_after, error = None, None, exc
+            except girder_client.HttpError as exc:
+                status, error = exc.status, exc
+                retry_after = (
+                    exc.response.headers.get("Retry-After")
+                    if exc.response is not None
+                    else None
+                )
+            if not self.retry_policy.should_retry(
+                attempt, status
+            ) or not self.__can_retry(method, path, *args, **kwargs):
+                raise error
+            time.sleep(self.retry_policy.get_delay(attempt, retry_after))
+            attempt += 1
+
+    def __send_timed_request(self, method, path, *args, **kwargs):
+        """Send a single request, recording how long it took if there's a timer"""
+        if self.timer is None:
+            return super().sendRestRequest(method, path, *args, **kwargs)
+        start = time.perf_counter()
+        status = None
+        try:
+            return super().sendRestRequest(method, path, *args, **kwargs)
+        except girder_client.HttpError as exc:
+            status = exc.status
+            raise
+        finally:
+            self.timer.record_request(
+                method.upper(),
+                get_girder_endpoint(path),
+                time.perf_counter() - start,
+                status=status,
+            )
+
+    def __limit_request_data(self, args, kwargs):
+        """Return the arguments for a request with its data (if it's bytes-like or a
+        seekable stream) wrapped so that they're sent no faster than the bandwidth
+        limiter allows
+        """
+        if len(args) > 1:
+            data = args[1]
+        else:
+            data = kwargs.get("data")
+        if not (
+            isinstance(data, (bytes, bytearray, memoryview))
+            or (hasattr(data, "read") and hasattr(data, "seek"))
+        ):
+            return args, kwargs
+        data = RateLimitedReader(data, self.bandwidth_limiter)
+        if len(args) > 1:
+            return (args[0], data, *args[2:]), kwargs
+        return args, {**kwargs, "data": data}
+
+    def __can_retry(self, method, path, *args, **kwargs):
+        """Return True if a request that failed can safely be sent again: if it's
+        idempotent, if it creates a Folder or Item only if there isn't one already,
+        if it starts an upload without sending any data (which only creates an Item
+        once the upload is finished), or if it's a chunk of an upload that the server
+        hasn't received any of (in which case its data are rewound so they can be
+        sent again)
+        """
+        if method.upper() in IDEMPOTENT_METHODS:
+            return True
+        if method.upper() != "POST":
+            return False
+        url = urllib.parse.urlsplit(path)
+        route = url.path.strip("/")
+        parameters = {
+            **dict(urllib.parse.parse_qsl(url.query)),
+            **((args[0] if args else kwargs.get("parameters")) or {}),
+        }
+        data = args[1] if len(args) > 1 else kwargs.get("data")
+        if route in ("folder", "item"):
+            return str(parameters.get("reuseExisting")).lower() == "true"
+        if route == "file":
+            return data is None and int(parameters.get("size", 0)) > 0
+        return route == "file/chunk" and self.__can_retry_chunk(parameters, data)
+
+    def __can_retry_chunk(self, parameters, data):
+        """Return True if the server hasn't received any of a chunk of an upload that
+        failed, rewinding its data so they can be sent again
+        """
+        try:
+            offset = self.get(
+                "file/offset", parameters={"uploadId": parameters["uploadId"]}
+            )["offset"]
+        except (KeyError, girder_client.HttpError, requests.RequestException):
+            return False
+        if offset != int(parameters.get("offset", 0)):
+            return False
+        if hasattr(data, "seek"):
+            data.seek(0)
+        return True
@@ -0,0 +1,275 @@
+" Timing measurements for the phases of uploads and the Girder requests they make "
+
+# imports
+import os
+import re
+import json
+import time
+import threading
+import contextlib
+
+# Matches the 24-character hexadecimal ObjectIds of Girder resources in REST paths
+OBJECT_ID_REGEX = re.compile(r"(?<![^/])[0-9a-f]{24}(?![^/])")
+
+
+def get_girder_endpoint(path):
+    """Return the name of the Girder REST endpoint for a request path, with any
+    query string and API URL removed and resource IDs replaced by "{id}" (so that
+    requests to the same endpoint for different resources are grouped together)
+
+    Args:
+        path (str): the path (or full URL) of the request
+
+    Returns:
+        str: the name of the endpoint, like "item/{id}/metadata"
+    """
+    path = path.split("?")[0]
+    if "/api/v1/" in path:
+        path = path.split("/api/v1/", 1)[1]
+    return OBJECT_ID_REGEX.sub("{id}", path.strip("/"))
+
+
+class UploadTimer:
+    """A thread-safe collection of timing measurements for the phases of uploading
+    files and for the Girder REST requests made along the way.
+
+    Every measurement is added to running totals (the number of measurements and
+    their total, minimum, and maximum duration) for its phase or endpoint. If a
+    JSON lines path is given, each measurement is also appended to that file as it's
+    made. The totals can be written to a file in the Prometheus text format (for
+    example, for the node_exporter "textfile" collector).
+
+    Args:
+        json_lines_path (pathlib.Path, optional): Path to a file that every
+            measurement should be appended to as a line of JSON
+    """
+
+    # The phases of uploads that are timed, in the order they're reported
+    PHASES = (
+        "manifest_check",
+        "folder_resolution",
+        "existence_check",
+        "hash",
+        "dedup",
+        "transfer",
+        "metadata",
+        "validation",
+    )
+    PHASE_METRIC = "imqcam_upload_phase_seconds"
+    REQUEST_METRIC = "imqcam_girder_request_seconds"
+    CONCURRENCY_METRIC = "imqcam_girder_request_concurrency"
+
+    def __init__(self, json_lines_path=None):
+        self.json_lines_path = json_lines_path
+        self.__totals = {"phase": {}, "request": {}}
+        # the most recent number of Girder requests allowed in flight, if recorded
+        self.__concurrency = None
+        self.__json_lines_file = None
+        self.__lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name, filepath=None):
+        """A context manager that records the time spent inside it as a phase
+
+        Args:
+            name (str): the name of the phase
+            filepath (pathlib.Path, optional): the file the phase is for
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.perf_counter() - start, filepath=filepath)
+
+    def record_phase(self, name, seconds, filepath=None):
+        """Record the time spent in a phase of an upload
+
+        Args:
+            name (str): the name of the phase
+            seconds (float): the time spent in the phase
+            filepath (pathlib.Path, optional): the file the phase is for
+        """
+        self.__record(
+            "phase",
+            (name,),
+            seconds,
+            {"phase": name, "file": None if filepath is None else str(filepath)},
+        )
+
+    def record_hashed_transfer(self, seconds, hash_seconds, filepath=None):
+        """Record the time taken to read a file, hash it, and send it to Girder as
+        separate "hash" and "transfer" phases
+
+        Args:
+            seconds (float): the total time taken
+            hash_seconds (float): the part of that time spent updating hashes
+            filepath (pathlib.Path, optional): the file that was sent
+        """
+        self.record_phase("hash", hash_seconds, filepath=filepath)
+        self.record_phase("transfer", seconds - hash_seconds, filepath=filepath)
+
+    def record_request(self, method, endpoint, seconds, status=None):
+        """Record the time taken by a Girder REST request
+
+        Args:
+            method (str): the HTTP method of the request
+            endpoint (str): the name of the endpoint (see "get_girder_endpoint")
+            seconds (float): the time between sending the request and getting its
+                response
+            status (int, optional): the HTTP status of an error response
+        """
+        self.__record(
+            "request",
+            (method, endpoint),
+            seconds,
+            {"method": method, "endpoint": endpoint, "status": status},
+        )
+
+    def record_concurrency(self, limit):
+        """Record a change in the number of Girder requests allowed in flight at once
+
+        Args:
+            limit (int): the new number of requests allowed in flight
+        """
+        with self.__lock:
+            self.__concurrency = limit
+            self.__write_json_line(
+                {"timestamp": time.time(), "kind": "concurrency", "limit": limit}
+            )
+
+    @property
+    def concurrency(self):
+        """The most recently recorded number of Girder requests allowed in flight at
+        once (or None if it was never recorded)
+        """
+        with self.__lock:
+            return self.__concurrency
+
+    def phase_totals(self):
+        """Return the totals of the measurements for each phase, in the order of
+        "PHASES" (followed by any other phases, by name)
+
+        Returns:
+            dict: dictionaries with the "count", "total", "min", and "max" of the
+                measurements, keyed by phase name
+        """
+        with self.__lock:
+            totals = {
+                key[0]: dict(totals) for key, totals in self.__totals["phase"].items()
+            }
+        return {name: totals[name] for name in sorted(totals, key=self.__phase_order)}
+
+    def request_totals(self):
+        """Return the totals of the measurements for each REST endpoint
+
+        Returns:
+            dict: dictionaries with the "count", "total", "min", and "max" of the
+                measurements, keyed by (method, endpoint) tuples
+        """
+        with self.__lock:
+            return {
+                key: dict(totals) for key, totals in self.__totals["request"].items()
+            }
+
+    def write_prometheus(self, filepath):
+        """Write the totals of every measurement to a file in the Prometheus text
+        format. The file is replaced all at once, so a collector never reads part of it.
+
+        Args:
+            filepath (pathlib.Path): Path to the file to write
+        """
+        lines = self.__get_prometheus_lines(
+            self.PHASE_METRIC,
+            "Time spent in each phase of uploading files",
+            ("phase",),
+            {(name,): value for name, value in self.phase_totals().items()},
+            sort_key=lambda key: self.__phase_order(key[0]),
+        )
+        lines += self.__get_prometheus_lines(
+            self.REQUEST_METRIC,
+            "Time taken by Girder REST requests",
+            ("method", "endpoint"),
+            self.request_totals(),
+        )
+        concurrency = self.concurrency
+        if concurrency is not None:
+            lines += [
+                f"# HELP {self.CONCURRENCY_METRIC} Number of Girder requests allowed "
+                "in flight at once",
+                f"# TYPE {self.CONCURRENCY_METRIC} gauge",
+                f"{self.CONCURRENCY_METRIC} {concurrency}",
+            ]
+        temp_filepath = filepath.with_name(f".{filepath.name}.tmp")
+        temp_filepath.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        os.replace(temp_filepath, filepath)
+
+    def close(self):
+        """Close the JSON lines file, if it's open"""
+        with self.__lock:
+            if self.__json_lines_file is not None:
+                self.__json_lines_file.close()
+                self.__json_lines_file = None
+
+    def __str__(self):
+        return ", ".join(
+            f"{name}: {value['total']:.3f} s ({value['count']} times)"
+            for name, value in self.phase_totals().items()
+        )
+
+    @classmethod
+    def __phase_order(cls, name):
+        """Sort key putting phases in the order of "PHASES", then any others by name"""
+        if name in cls.PHASES:
+            return (cls.PHASES.index(name), "")
+        return (len(cls.PHASES), name)
+
+    @staticmethod
+    def __get_prometheus_lines(metric, description, label_names, totals, sort_key=None):
+        """Return the lines of Prometheus text for a summary metric (the count and
+        sum of the measurements) and a gauge of the longest measurement
+        """
+        label_strs = {
+            key: ",".join(f'{name}="{part}"' for name, part in zip(label_names, key))
+            for key in totals
+        }
+        lines = [f"# HELP {metric} {description}", f"# TYPE {metric} summary"]
+        for key in sorted(totals, key=sort_key):
+            lines.append(f"{metric}_count{{{label_strs[key]}}} {totals[key]['count']}")
+            lines.append(
+                f"{metric}_sum{{{label_strs[key]}}} {totals[key]['total']:.6f}"
+            )
+        lines += [
+            f"# HELP {metric}_max {description} (longest single measurement)",
+            f"# TYPE {metric}_max gauge",
+        ]
+        for key in sorted(totals, key=sort_key):
+            lines.append(f"{metric}_max{{{label_strs[key]}}} {totals[key]['max']:.6f}")
+        return lines
+
+    def __record(self, kind, key, seconds, fields):
+        with self.__lock:
+            totals = self.__totals[kind].get(key)
+            if totals is None:
+                totals = {"count": 0, "total": 0.0, "min": seconds, "max": seconds}
+                self.__totals[kind][key] = totals
+            totals["count"] += 1
+            totals["total"] += seconds
+            totals["min"] = min(totals["min"], seconds)
+            totals["max"] = max(totals["max"], seconds)
+            record = {"timestamp": time.time(), "kind": kind, "seconds": seconds}
+            record.update({k: v for k, v in fields.items() if v is not None})
+            self.__write_json_line(record)
+
+    def __write_json_line(self, record):
+        """Append a record to the JSON lines file, if there is one (must be called
+        while holding the lock)
+        """
+        if self.json_lines_path is None:
+            return
+        if self.__json_lines_file is None:
+            # line buffered so that every measurement is written as it's made
+            # pylint: disable=consider-using-with
+            self.__json_lines_file = open(
+                self.json_lines_path, "a", encoding="utf-8", buffering=1
+            )
+        self.__json_lines_file.write(json.dumps(record) + "\n")
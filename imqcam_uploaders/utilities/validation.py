@@ -0,0 +1,146 @@
+" Ways to check that files were uploaded to Girder correctly "
+
+# imports
+import random
+from .hashing import get_girder_file_hash, get_girder_server_file_hash
+
+# The hash algorithm used by the Girder "hashsum_download" plugin
+SERVER_HASH_ALGORITHM = "sha512"
+# The number and size of the byte ranges compared in "sample" mode
+N_VALIDATION_SAMPLES = 8
+VALIDATION_SAMPLE_SIZE = 65536
+
+
+def validate_full_download(client, file_doc, expected, filepath=None, pbar=None):
+    """Download an entire file from Girder and compare its sha256 hash.
+
+    Args:
+        client (girder_client.GirderClient): the authenticated client to use
+        file_doc (dict): the Girder File document for the uploaded file
+        expected (dict): the size ("size") and hashes (keyed by algorithm name)
+            of the data that were uploaded
+        filepath (pathlib.Path, optional): unused
+        pbar (tqdm.tqdm, optional): a progress bar to update as the file is downloaded
+
+    Returns:
+        bool: True if the hash of the file on Girder matches the expected hash
+    """
+    _ = filepath
+    return (
+        get_girder_file_hash(client, file_doc["_id"], pbar=pbar) == expected["sha256"]
+    )
+
+
+def validate_server_hash(client, file_doc, expected, filepath=None, pbar=None):
+    """Compare the hash of a file computed by the Girder server itself
+    (using the "hashsum_download" plugin), without downloading the file.
+
+    Args:
+        client (girder_client.GirderClient): the authenticated client to use
+        file_doc (dict): the Girder File document for the uploaded file
+        expected (dict): the size ("size") and hashes (keyed by algorithm name)
+            of the data that were uploaded. Must include SERVER_HASH_ALGORITHM.
+        filepath (pathlib.Path, optional): unused
+        pbar (tqdm.tqdm, optional): unused
+
+    Returns:
+        bool or None: True if the server's hash matches the expected hash, or None
+            if the server doesn't provide hashes
+    """
+    _ = filepath, pbar
+    server_hash = file_doc.get(SERVER_HASH_ALGORITHM)
+    if server_hash is None:
+        server_hash = get_girder_server_file_hash(
+            client, file_doc["_id"], SERVER_HASH_ALGORITHM
+        )
+    if server_hash is None:
+        return None
+    return server_hash == expected[SERVER_HASH_ALGORITHM]
+
+
+def validate_size(client, file_doc, expected, filepath=None, pbar=None):
+    """Only check that the size of a file on Girder is what it should be (the
+    checksum metadata is compared separately for every mode except "none").
+
+    Args:
+        client (girder_client.GirderClient): unused
+        file_doc (dict): the Girder File document for the uploaded file
+        expected (dict): the size ("size") and hashes (keyed by algorithm name)
+            of the data that were uploaded
+        filepath (pathlib.Path, optional): unused
+        pbar (tqdm.tqdm, optional): unused
+
+    Returns:
+        bool: True if the size of the file on Girder is as expected
+    """
+    _ = client, filepath, pbar
+    return file_doc["size"] == expected["size"]
+
+
+def validate_samples(client, file_doc, expected, filepath=None, pbar=None):
+    """Compare a few randomly-chosen byte ranges of a file on Girder to the same
+    ranges of the file on disk.
+
+    Args:
+        client (girder_client.GirderClient): the authenticated client to use
+        file_doc (dict): the Girder File document for the uploaded file
+        expected (dict): the size ("size") and hashes (keyed by algorithm name)
+            of the data that were uploaded
+        filepath (pathlib.Path, optional): path to the file on disk that was uploaded
+        pbar (tqdm.tqdm, optional): a progress bar to update as samples are downloaded
+
+    Returns:
+        bool or None: True if the size and every sampled range match, or None if
+            there's no file on disk to compare to
+    """
+    if filepath is None:
+        return None
+    size = expected["size"]
+    if file_doc["size"] != size:
+        return False
+    if size <= N_VALIDATION_SAMPLES * VALIDATION_SAMPLE_SIZE:
+        return validate_full_download(client, file_doc, expected, pbar=pbar)
+    offsets = sorted(
+        random.sample(range(size - VALIDATION_SAMPLE_SIZE + 1), N_VALIDATION_SAMPLES)
+    )
+    with open(filepath, "rb") as fobj:
+        for offset in offsets:
+            fobj.seek(offset)
+            local_bytes = fobj.read(VALIDATION_SAMPLE_SIZE)
+            girder_bytes = client.sendRestRequest(
+                "GET",
+                f"file/{file_doc['_id']}/download",
+                parameters={
+                    "offset": offset,
+                    "endByte": offset + VALIDATION_SAMPLE_SIZE,
+                },
+                jsonResp=False,
+            ).content
+            if pbar is not None:
+                pbar.update(len(girder_bytes))
+            if girder_bytes != local_bytes:
+                return False
+    return True
+
+
+def validate_nothing(client, file_doc, expected, filepath=None, pbar=None):
+    """Skip validation entirely.
+
+    Returns:
+        bool: always True
+    """
+    _ = client, file_doc, expected, filepath, pbar
+    return True
+
+
+# Validation functions for each mode. Each one returns True if the upload is valid,
+# False if it isn't, or None if it can't be used to check the given file.
+VALIDATORS = {
+    "full": validate_full_download,
+    "server_hash": validate_server_hash,
+    "metadata": validate_size,
+    "sample": validate_samples,
+    "none": validate_nothing,
+}
+VALIDATION_MODES = tuple(VALIDATORS)
+DEFAULT_VALIDATION_MODE = "full"
@@ -0,0 +1,418 @@
+""" Offline throughput benchmarks for the uploaders and their helper functions, run
+against the in-process FakeGirderServer with configurable latency and bandwidth.
+
+Run from the root of the repository with:
+
+    python -m tests.benchmarks [--latency SECONDS] [--bandwidth BYTES_PER_SECOND] ...
+
+(add "-h" to see every option). Each benchmark reports the number of files (or
+Folders) processed per second, the upload throughput in MB/s, the CPU time used,
+and the number of REST calls made per file. The "buffered_reads" and "mapped_reads"
+targets also count the new chunk buffers allocated to read files, to compare reading
+and hashing files into bytes objects with reading and hashing them through memory
+maps (they measure only reading and hashing, not sending the chunks to Girder).
+"""
+
+# imports
+import os
+import json
+import time
+import hashlib
+import functools
+import random
+import asyncio
+import logging
+import pathlib
+import argparse
+import tempfile
+from imqcam_uploaders.uploaders.file_uploader import IMQCAMFileUploader
+from imqcam_uploaders.uploaders.directory_uploader import IMQCAMDirectoryUploader
+from imqcam_uploaders.uploaders.async_uploader import IMQCAMAsyncUploader
+from imqcam_uploaders.utilities.girder import GirderFolderIDCache, get_girder_folder_id
+from imqcam_uploaders.utilities.hashing import (
+    DEFAULT_HASH_READ_SIZE,
+    HashingReader,
+    get_on_disk_file_hash,
+    hash_files,
+)
+from imqcam_uploaders.utilities.mapped_files import MappedFileReader, iter_file_chunks
+from imqcam_uploaders.utilities.validation import DEFAULT_VALIDATION_MODE
+from .fake_girder import FakeGirderServer
+
+KB = 1024
+MB = 1024 * KB
+
+# Each scenario is a number of files, a function returning a random file size, the
+# depth of the Folder tree the files are spread over, and the number of
+# subdirectories in each directory of that tree
+SCENARIOS = {
+    "tiny": (1000, lambda rng: 1 * KB, 2, 8),
+    "mixed": (200, lambda rng: int(2 ** rng.uniform(10, 23)), 3, 4),
+    "huge": (2, lambda rng: 96 * MB, 1, 1),
+    "deep": (200, lambda rng: 16 * KB, 8, 2),
+}
+TARGETS = (
+    "file_uploader",
+    "directory_uploader",
+    "async_uploader",
+    "girder_helpers",
+    "hashing",
+    "batch_hashing",
+    "buffered_reads",
+    "mapped_reads",
+)
+# The targets that only read files, without uploading them
+HASHING_TARGETS = ("hashing", "batch_hashing", "buffered_reads", "mapped_reads")
+# The size of the chunks files are hashed in by the "buffered_reads" target (what
+# get_on_disk_file_hash used before files were memory-mapped)
+BUFFERED_HASH_READ_SIZE = 65536
+
+
+class BenchmarkResult:
+    """The outcome of running one benchmark target on one scenario
+
+    Args:
+        target (str): the name of what was benchmarked
+        scenario (str): the name of the scenario it was run on
+        n_files (int): the number of files (or Folders) processed
+        n_bytes (int): the number of bytes processed
+        seconds (float): the wall time taken
+        n_requests (int): the number of REST calls the fake server received
+        cpu_seconds (float, optional): the CPU time taken by the process
+        n_allocations (int, optional): the number of new chunk buffers allocated to
+            read files (only counted by the "buffered_reads" and "mapped_reads"
+            targets)
+    """
+
+    # pylint: disable-next=too-many-arguments
+    def __init__(
+        self,
+        target,
+        scenario,
+        n_files,
+        n_bytes,
+        seconds,
+        n_requests,
+        cpu_seconds=0.0,
+        n_allocations=None,
+    ):
+        self.target = target
+        self.scenario = scenario
+        self.n_files = n_files
+        self.n_bytes = n_bytes
+        self.seconds = seconds
+        self.n_requests = n_requests
+        self.cpu_seconds = cpu_seconds
+        self.n_allocations = n_allocations
+
+    @property
+    def files_per_second(self):
+        """The number of files (or Folders) processed per second"""
+        return self.n_files / self.seconds if self.seconds > 0 else float("inf")
+
+    @property
+    def mb_per_second(self):
+        """The number of megabytes (10^6 bytes) processed per second"""
+        return self.n_bytes / 1e6 / self.seconds if self.seconds > 0 else float("inf")
+
+    @property
+    def requests_per_file(self):
+        """The number of REST calls made per file (or Folder)"""
+        return self.n_requests / self.n_files if self.n_files else 0.0
+
+    def as_dict(self):
+        """Return the result as a JSON-serializable dictionary"""
+        return {
+            "target": self.target,
+            "scenario": self.scenario,
+            "n_files": self.n_files,
+            "n_bytes": self.n_bytes,
+            "seconds": self.seconds,
+            "files_per_second": self.files_per_second,
+            "mb_per_second": self.mb_per_second,
+            "requests_per_file": self.requests_per_file,
+            "cpu_seconds": self.cpu_seconds,
+            "n_allocations": self.n_allocations,
+        }
+
+    def __str__(self):
+        n_allocations = "-" if self.n_allocations is None else self.n_allocations
+        return (
+            f"{self.target:<20} {self.scenario:<8} {self.n_files:>7} "
+            f"{self.n_bytes / 1e6:>10.2f} {self.seconds:>8.3f} "
+            f"{self.files_per_second:>10.1f} {self.mb_per_second:>8.2f} "
+            f"{self.cpu_seconds:>8.3f} {n_allocations:>8} "
+            f"{self.requests_per_file:>9.2f}"
+        )
+
+    @staticmethod
+    def header():
+        """Return the header line for a table of results"""
+        return (
+            f"{'target':<20} {'scenario':<8} {'files':>7} {'MB':>10} "
+            f"{'seconds':>8} {'files/s':>10} {'MB/s':>8} {'CPU s':>8} "
+            f"{'allocs':>8} {'REST/file':>9}"
+        )
+
+
+def make_scenario_files(root_dir, scenario, scale=1.0, size_scale=1.0, seed=0):
+    """Write the files for a scenario in a new directory
+
+    Args:
+        root_dir (pathlib.Path): the directory to write the scenario's directory in
+        scenario (str): the name of the scenario (a key of SCENARIOS)
+        scale (float, optional): multiplies the number of files
+        size_scale (float, optional): multiplies the size of each file
+        seed (int, optional): seeds the random file sizes
+
+    Returns:
+        tuple(pathlib.Path, list): the scenario's directory and the paths to its files
+    """
+    n_files, get_size, depth, branching = SCENARIOS[scenario]
+    rng = random.Random(seed)
+    scenario_dir = root_dir / scenario
+    filepaths = []
+    for ifile in range(max(1, round(n_files * scale))):
+        parts = [
+            f"level_{level}_{(ifile // branching**level) % branching}"
+            for level in range(depth)
+        ]
+        filepath = scenario_dir.joinpath(*parts, f"file_{ifile}.bin")
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        filepath.write_bytes(os.urandom(max(1, int(get_size(rng) * size_scale))))
+        filepaths.append(filepath)
+    return scenario_dir, filepaths
+
+
+def read_file_twice(filepath, mapped):
+    """Hash a file on its own, then read it again through a HashingReader in chunks
+    as large as the uploaders send, either into new bytes objects (the way files
+    were read before they were memory-mapped) or through a MappedFileReader
+
+    Args:
+        filepath (pathlib.Path): the path to the file
+        mapped (bool): whether to read the file through a memory map
+
+    Returns:
+        int: the number of new chunk buffers the reads allocated
+    """
+    n_allocations = 0
+    with MappedFileReader(filepath) if mapped else open(filepath, "rb") as fobj:
+        if mapped:
+            chunks = iter_file_chunks(fobj, DEFAULT_HASH_READ_SIZE)
+        else:
+            chunks = iter(functools.partial(fobj.read, BUFFERED_HASH_READ_SIZE), b"")
+        file_hash = hashlib.sha256()
+        for chunk in chunks:
+            n_allocations += isinstance(chunk, bytes)
+            file_hash.update(chunk)
+    with MappedFileReader(filepath) if mapped else open(filepath, "rb") as fobj:
+        reader = HashingReader(fobj, ("sha256", "sha512"))
+        while True:
+            chunk = reader.read(IMQCAMAsyncUploader.UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            n_allocations += isinstance(chunk, bytes)
+    return n_allocations
+
+
+def benchmark_target(
+    target, server, scenario_dir, filepaths, validation_mode, concurrency
+):
+    """Run one benchmark target on the files for a scenario, uploading to a new
+    root Folder in the fake server
+
+    Args:
+        target (str): the name of the target to run (one of TARGETS)
+        server (FakeGirderServer): the running fake server
+        scenario_dir (pathlib.Path): the directory holding the scenario's files
+        filepaths (list): paths to the scenario's files
+        validation_mode (str): the validation mode to use for uploads
+        concurrency (int): the number of threads or requests in flight for the
+            directory and asyncio uploaders (or files hashed at once)
+
+    Returns:
+        BenchmarkResult: the result
+    """
+    root_folder_id = server.create_folder(
+        server.create_collection(f"{target}_{scenario_dir.name}_{time.time_ns()}"),
+        "root",
+        "collection",
+    )
+    n_files, n_bytes = len(filepaths), sum(fp.stat().st_size for fp in filepaths)
+    upload_kwargs = {
+        "relative_to": scenario_dir,
+        "root_folder_id": root_folder_id,
+        "validation_mode": validation_mode,
+    }
+    uploader_kwargs = {"streamlevel": logging.WARNING}
+    server.reset_request_log()
+    n_allocations = None
+    start, cpu_start = time.perf_counter(), time.process_time()
+    if target == "file_uploader":
+        uploader = IMQCAMFileUploader(server.api_url, server.API_KEY, **uploader_kwargs)
+        for filepath in filepaths:
+            uploader.upload_file(filepath, show_progress=False, **upload_kwargs)
+    elif target == "directory_uploader":
+        uploader = IMQCAMDirectoryUploader(
+            server.api_url, server.API_KEY, **uploader_kwargs
+        )
+        uploader.upload_directory(scenario_dir, n_threads=concurrency, **upload_kwargs)
+    elif target == "async_uploader":
+        uploader = IMQCAMAsyncUploader(
+            server.api_url, server.API_KEY, **uploader_kwargs
+        )
+        asyncio.run(
+            uploader.upload_directory_async(
+                scenario_dir, max_concurrency=concurrency, **upload_kwargs
+            )
+        )
+    elif target == "girder_helpers":
+        # find or create every Folder once with an empty cache, then again using it
+        uploader = IMQCAMFileUploader(server.api_url, server.API_KEY, **uploader_kwargs)
+        server.reset_request_log()
+        start, cpu_start = time.perf_counter(), time.process_time()
+        folder_paths = sorted({fp.parent.relative_to(scenario_dir) for fp in filepaths})
+        cache = GirderFolderIDCache()
+        for _ in range(2):
+            for folder_path in folder_paths:
+                get_girder_folder_id(
+                    uploader._girder_client,  # pylint: disable=protected-access
+                    folder_path,
+                    root_folder_id=root_folder_id,
+                    create_if_not_found=True,
+                    cache=cache,
+                )
+        n_files, n_bytes = 2 * len(folder_paths), 0
+    elif target == "hashing":
+        # hash every file on its own, then again through a HashingReader
+        for filepath in filepaths:
+            get_on_disk_file_hash(filepath)
+            with open(filepath, "rb") as fobj:
+                reader = HashingReader(fobj, ("sha256", "sha512"))
+                while reader.read(MB):
+                    pass
+        n_files, n_bytes = 2 * n_files, 2 * n_bytes
+    elif target == "batch_hashing":
+        # hash every file with the same two hashes, "concurrency" files at a time
+        for _ in hash_files(filepaths, ("sha256", "sha512"), n_workers=concurrency):
+            pass
+    elif target in ("buffered_reads", "mapped_reads"):
+        # hash every file, then read it again the way it's uploaded
+        n_allocations = sum(
+            read_file_twice(filepath, target == "mapped_reads")
+            for filepath in filepaths
+        )
+        n_files, n_bytes = 2 * n_files, 2 * n_bytes
+    else:
+        raise ValueError(f"Unrecognized benchmark target {target}")
+    seconds = time.perf_counter() - start
+    cpu_seconds = time.process_time() - cpu_start
+    if target not in HASHING_TARGETS:
+        uploader.close()
+    return BenchmarkResult(
+        target,
+        scenario_dir.name,
+        n_files,
+        n_bytes,
+        seconds,
+        server.count_requests(),
+        cpu_seconds,
+        n_allocations,
+    )
+
+
+def run_benchmarks(
+    scenarios=tuple(SCENARIOS),
+    targets=TARGETS,
+    latency=0.0,
+    bandwidth=None,
+    scale=1.0,
+    size_scale=1.0,
+    validation_mode=DEFAULT_VALIDATION_MODE,
+    concurrency=16,
+    work_dir=None,
+):
+    """Run every benchmark target on every scenario against a new fake server
+
+    Args:
+        scenarios (tuple, optional): the names of the scenarios to run
+        targets (tuple, optional): the names of the targets to benchmark
+        latency (float, optional): seconds the server waits before each response
+        bandwidth (float, optional): bytes per second each request and response
+            body is throttled to
+        scale (float, optional): multiplies the number of files in each scenario
+        size_scale (float, optional): multiplies the size of each file
+        validation_mode (str, optional): the validation mode to use for uploads
+        concurrency (int, optional): threads or requests in flight for the
+            directory and asyncio uploaders
+        work_dir (pathlib.Path, optional): where to write the scenarios' files (a
+            temporary directory by default)
+
+    Returns:
+        list: a BenchmarkResult for each target and scenario
+    """
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as temp_dir:
+        with FakeGirderServer(latency=latency, bandwidth=bandwidth) as server:
+            for scenario in scenarios:
+                scenario_dir, filepaths = make_scenario_files(
+                    pathlib.Path(temp_dir), scenario, scale, size_scale
+                )
+                for target in targets:
+                    results.append(
+                        benchmark_target(
+                            target,
+                            server,
+                            scenario_dir,
+                            filepaths,
+                            validation_mode,
+                            concurrency,
+                        )
+                    )
+                    # free the fake server's copies of the uploaded files
+                    with server.lock:
+                        server.file_contents.clear()
+    return results
+
+
+def main(args=None):
+    """Run the benchmarks from the command line and print a table of the results
+
+    Args:
+        args (list, optional): command line arguments (sys.argv by default)
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS))
+    parser.add_argument("--targets", nargs="+", default=list(TARGETS))
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=float, default=None)
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--size_scale", type=float, default=1.0)
+    parser.add_argument("--validation_mode", default=DEFAULT_VALIDATION_MODE)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--json_path", type=pathlib.Path, default=None)
+    parsed_args = parser.parse_args(args=args)
+    print(BenchmarkResult.header())
+    results = []
+    for scenario in parsed_args.scenarios:
+        for result in run_benchmarks(
+            scenarios=(scenario,),
+            targets=parsed_args.targets,
+            latency=parsed_args.latency,
+            bandwidth=parsed_args.bandwidth,
+            scale=parsed_args.scale,
+            size_scale=parsed_args.size_scale,
+            validation_mode=parsed_args.validation_mode,
+            concurrency=parsed_args.concurrency,
+        ):
+            print(result, flush=True)
+            results.append(result)
+    if parsed_args.json_path is not None:
+        parsed_args.json_path.write_text(
+            json.dumps([result.as_dict() for result in results], indent=2)
+        )
+
+
+if __name__ == "__main__":
+    main()
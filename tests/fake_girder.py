@@ -0,0 +1,559 @@
+" An in-process stand-in for the parts of the Girder REST API used by the uploaders "
+
+# imports
+import re
+import json
+import time
+import hashlib
+import threading
+import itertools
+import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeGirderServer:
+    """A minimal, thread-safe, in-memory Girder "server" that runs in a background
+    thread and answers the REST calls made by girder_client and the uploaders.
+
+    Args:
+        api_key (str, optional): the only API key that will be accepted
+        latency (float, optional): seconds to sleep before answering each request
+        bandwidth (float, optional): if given, request and response bodies will be
+            throttled to this many bytes per second
+        hashsum_algorithms (tuple, optional): hash algorithms to add to File documents
+            as if the Girder "hashsum_download" plugin were installed
+        fail_next (list, optional): HTTP status codes to return (in order) for the next
+            few requests instead of answering them, for testing retries
+        fail_routes (dict, optional): HTTP status codes to always return instead of
+            answering requests, keyed by (method, route regex)
+    """
+
+    API_KEY = "fake_girder_api_key"
+
+    def __init__(
+        self,
+        api_key=API_KEY,
+        latency=0.0,
+        bandwidth=None,
+        hashsum_algorithms=(),
+        fail_next=None,
+        fail_routes=None,
+    ):
+        self.api_key = api_key
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.hashsum_algorithms = tuple(hashsum_algorithms)
+        self.fail_next = list(fail_next) if fail_next is not None else []
+        self.fail_routes = dict(fail_routes) if fail_routes is not None else {}
+        self.lock = threading.RLock()
+        self.request_log = []
+        self.collections = {}
+        self.folders = {}
+        self.items = {}
+        self.files = {}
+        self.file_contents = {}
+        self.uploads = {}
+        self.__ids = itertools.count(1)
+        self.__httpd = None
+        self.__thread = None
+
+    # -------------------- server lifecycle --------------------
+
+    @property
+    def api_url(self):
+        """The full URL of the fake REST API"""
+        host, port = self.__httpd.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    def start(self):
+        """Start serving requests in a background thread"""
+        handler = type("_BoundHandler", (_FakeGirderHandler,), {"girder": self})
+        self.__httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.__httpd.daemon_threads = True
+        self.__thread = threading.Thread(
+            target=self.__httpd.serve_forever, kwargs={"poll_interval": 0.05}
+        )
+        self.__thread.daemon = True
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server and wait for its thread to finish"""
+        if self.__httpd is not None:
+            self.__httpd.shutdown()
+            self.__httpd.server_close()
+            self.__thread.join()
+            self.__httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # -------------------- helpers for tests --------------------
+
+    def reset_request_log(self):
+        """Clear the log of requests received"""
+        with self.lock:
+            self.request_log.clear()
+
+    def count_requests(self, method=None, route=None):
+        """Return the number of logged requests, optionally filtered by HTTP method
+        and/or a regex that must match the start of the route
+        """
+        with self.lock:
+            return sum(
+                1
+                for req_method, req_route in self.request_log
+                if (method is None or req_method == method)
+                and (route is None or re.match(route, req_route))
+            )
+
+    def create_collection(self, name, public=True):
+        """Create a Collection directly and return its ID"""
+        with self.lock:
+            doc = self._new_doc("collection", name=name, public=public)
+            self.collections[doc["_id"]] = doc
+            return doc["_id"]
+
+    def create_folder(self, parent_id, name, parent_type="folder"):
+        """Create a Folder directly and return its ID"""
+        with self.lock:
+            return self._create_folder(
+                {"parentType": parent_type, "parentId": parent_id, "name": name}
+            )["_id"]
+
+    def create_root_folder(self, name="Test"):
+        """Create a Collection with a top-level Folder in it (both called "name")
+        and return the ID of the Folder
+        """
+        return self.create_folder(self.create_collection(name), name, "collection")
+
+    def file_hash(self, file_id, algorithm="sha256"):
+        """Return the hexdigest of the contents of a stored File"""
+        with self.lock:
+            return hashlib.new(algorithm, self.file_contents[file_id]).hexdigest()
+
+    def find_item(self, folder_id, name):
+        """Return the Item document called "name" in a Folder, or None"""
+        with self.lock:
+            for item in self.items.values():
+                if item["folderId"] == folder_id and item["name"] == name:
+                    return item
+        return None
+
+    def child_folders(self, parent_id):
+        """Return the list of Folder documents directly inside a parent"""
+        with self.lock:
+            return [f for f in self.folders.values() if f["parentId"] == parent_id]
+
+    # -------------------- "database" operations --------------------
+
+    def _new_doc(self, model_type, **fields):
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        doc = {
+            "_id": f"{next(self.__ids):024x}",
+            "_modelType": model_type,
+            "created": now,
+            "updated": now,
+            "description": "",
+            "meta": {},
+        }
+        doc.update(fields)
+        return doc
+
+    def _find_parent(self, parent_type, parent_id):
+        if parent_type == "collection":
+            return self.collections.get(parent_id)
+        return self.folders.get(parent_id)
+
+    def _create_folder(self, params):
+        parent = self._find_parent(params["parentType"], params["parentId"])
+        if parent is None:
+            raise _HttpError(400, "Invalid parent.")
+        for folder in self.folders.values():
+            if folder["parentId"] == parent["_id"] and folder["name"] == params["name"]:
+                if params.get("reuseExisting", "false").lower() == "true":
+                    return folder
+                raise _HttpError(400, "A folder with that name already exists here.")
+        doc = self._new_doc(
+            "folder",
+            name=params["name"],
+            parentId=parent["_id"],
+            parentCollection=params["parentType"],
+            public=params.get("public", "true").lower() == "true",
+            baseParentType=(
+                "collection"
+                if params["parentType"] == "collection"
+                else parent["baseParentType"]
+            ),
+            baseParentId=(
+                parent["_id"]
+                if params["parentType"] == "collection"
+                else parent["baseParentId"]
+            ),
+        )
+        if params.get("metadata"):
+            doc["meta"] = json.loads(params["metadata"])
+        self.folders[doc["_id"]] = doc
+        return doc
+
+    def _create_item(self, folder_id, name, metadata=None, reuse_existing=False):
+        folder = self.folders.get(folder_id)
+        if folder is None:
+            raise _HttpError(400, "Invalid folderId.")
+        # like Girder, Items with the same names as others get numbered
+        names = {
+            item["name"]: item
+            for item in self.items.values()
+            if item["folderId"] == folder_id
+        }
+        if reuse_existing and name in names:
+            return names[name]
+        unique_name, n_duplicates = name, 0
+        while unique_name in names:
+            n_duplicates += 1
+            unique_name = f"{name} ({n_duplicates})"
+        doc = self._new_doc(
+            "item",
+            name=unique_name,
+            folderId=folder_id,
+            size=0,
+            baseParentType=folder["baseParentType"],
+            baseParentId=folder["baseParentId"],
+        )
+        if metadata:
+            doc["meta"] = json.loads(metadata)
+        self.items[doc["_id"]] = doc
+        return doc
+
+    def _create_file(self, item, name, contents, mime_type=None):
+        doc = self._new_doc(
+            "file",
+            name=name,
+            itemId=item["_id"],
+            size=len(contents),
+            mimeType=mime_type or "application/octet-stream",
+        )
+        del doc["meta"]
+        for algorithm in self.hashsum_algorithms:
+            doc[algorithm] = hashlib.new(algorithm, contents).hexdigest()
+        self.files[doc["_id"]] = doc
+        self.file_contents[doc["_id"]] = bytes(contents)
+        item["size"] += len(contents)
+        return doc
+
+    def _delete_item(self, item_id):
+        item = self.items.pop(item_id)
+        for file_id in [
+            fid for fid, fdoc in self.files.items() if fdoc["itemId"] == item["_id"]
+        ]:
+            del self.files[file_id]
+            del self.file_contents[file_id]
+
+    def _delete_file(self, file_id):
+        file_doc = self.files.pop(file_id)
+        del self.file_contents[file_id]
+        self.items[file_doc["itemId"]]["size"] -= file_doc["size"]
+
+    def _delete_folder(self, folder_id):
+        for child in self.child_folders(folder_id):
+            self._delete_folder(child["_id"])
+        for item_id in [
+            iid for iid, item in self.items.items() if item["folderId"] == folder_id
+        ]:
+            self._delete_item(item_id)
+        del self.folders[folder_id]
+
+    def _init_upload(self, params, body):
+        size = int(params.get("size", 0))
+        if params["parentType"] == "folder":
+            item = self._create_item(params["parentId"], params["name"])
+        else:
+            item = self.items.get(params["parentId"])
+            if item is None:
+                raise _HttpError(400, "Invalid parentId.")
+        if body or size == 0:
+            if len(body) != size:
+                raise _HttpError(400, "Received too many or too few bytes.")
+            return self._create_file(item, params["name"], body, params.get("mimeType"))
+        doc = self._new_doc(
+            "upload",
+            name=params["name"],
+            size=size,
+            received=0,
+            parentType="item",
+            parentId=item["_id"],
+            mimeType=params.get("mimeType"),
+        )
+        self.uploads[doc["_id"]] = (doc, bytearray())
+        return doc
+
+    def _upload_chunk(self, params, body):
+        upload_id = params["uploadId"]
+        if upload_id not in self.uploads:
+            raise _HttpError(400, "Upload not found.")
+        doc, buffer = self.uploads[upload_id]
+        offset = int(params.get("offset", 0))
+        if offset != doc["received"]:
+            raise _HttpError(
+                400,
+                f"Server has received {doc['received']} bytes, "
+                f"but client sent offset {offset}.",
+            )
+        buffer.extend(body)
+        doc["received"] = len(buffer)
+        if doc["received"] > doc["size"]:
+            raise _HttpError(400, "Received too many bytes.")
+        if doc["received"] < doc["size"]:
+            return doc
+        del self.uploads[upload_id]
+        item = self.items[doc["parentId"]]
+        return self._create_file(item, doc["name"], bytes(buffer), doc["mimeType"])
+
+    # -------------------- routing --------------------
+
+    def handle(self, method, route, params, body, headers):
+        """Answer a single request and return a tuple of (status, content_type,
+        body bytes, extra headers)
+        """
+        with self.lock:
+            self.request_log.append((method, route))
+            if self.fail_next:
+                status = self.fail_next.pop(0)
+                return status, "application/json", b'{"message": "injected"}', {}
+            for (fail_method, fail_route), status in self.fail_routes.items():
+                if method == fail_method and re.search(fail_route, route):
+                    return status, "application/json", b'{"message": "injected"}', {}
+        if route == "api_key/token" and method == "POST":
+            if params.get("key") != self.api_key:
+                raise _HttpError(400, "Invalid API key.")
+            return self.__json({"authToken": {"token": "fake-token"}, "user": {}})
+        if headers.get("Girder-Token") != "fake-token":
+            raise _HttpError(401, "You must be logged in.")
+        with self.lock:
+            if route == "file/chunk" or re.fullmatch(r"file/\w+/download", route):
+                return self.__route_data(method, route, params, body, headers)
+            return self.__json(self.__route(method, route, params, body))
+
+    def __route_data(self, method, route, params, body, headers):
+        if route == "file/chunk" and method == "POST":
+            return self.__json(self._upload_chunk(params, body))
+        file_id = route.split("/")[1]
+        if file_id not in self.files:
+            raise _HttpError(400, "Invalid file id.")
+        contents = self.file_contents[file_id]
+        start, end = int(params.get("offset", 0)), len(contents)
+        if "endByte" in params:
+            end = min(end, int(params["endByte"]))
+        extra = {}
+        range_match = re.fullmatch(r"bytes=(\d+)-(\d*)", headers.get("Range", ""))
+        if range_match:
+            start = int(range_match.group(1))
+            if range_match.group(2):
+                end = min(end, int(range_match.group(2)) + 1)
+            extra["Content-Range"] = f"bytes {start}-{end-1}/{len(contents)}"
+            return 206, "application/octet-stream", contents[start:end], extra
+        return 200, "application/octet-stream", contents[start:end], extra
+
+    def __route(self, method, route, params, body):  # pylint: disable=too-many-branches
+        parts = route.split("/")
+        if route == "system/version":
+            return {"release": "3.2.2", "apiVersion": "3.2.2"}
+        if parts[0] == "collection" and len(parts) == 1:
+            if method == "POST":
+                return self.collections[self.create_collection(params["name"])]
+            docs = [
+                c
+                for c in self.collections.values()
+                if params.get("text") is None or params["text"] in c["name"]
+            ]
+            return self.__page(docs, params)
+        if parts[0] == "folder":
+            if len(parts) == 1:
+                if method == "POST":
+                    return self._create_folder(params)
+                if self._find_parent(params["parentType"], params["parentId"]) is None:
+                    raise _HttpError(400, "Invalid parentId.")
+                docs = [
+                    f
+                    for f in self.folders.values()
+                    if f["parentId"] == params["parentId"]
+                    and ("name" not in params or f["name"] == params["name"])
+                ]
+                return self.__page(docs, params)
+            if parts[1] not in self.folders:
+                raise _HttpError(400, "Invalid folder id.")
+            if method == "DELETE":
+                self._delete_folder(parts[1])
+                return {"message": "Deleted folder."}
+            return self.folders[parts[1]]
+        if parts[0] == "item":
+            return self.__route_item(method, parts, params, body)
+        if parts[0] == "file":
+            return self.__route_file(method, parts, params, body)
+        raise _HttpError(404, f"No matching route for {method} {route}")
+
+    def __route_item(self, method, parts, params, body):
+        if len(parts) == 1:
+            if method == "POST":
+                return self._create_item(
+                    params["folderId"],
+                    params["name"],
+                    params.get("metadata"),
+                    params.get("reuseExisting", "false").lower() == "true",
+                )
+            if params["folderId"] not in self.folders:
+                raise _HttpError(400, "Invalid folderId.")
+            docs = [
+                i
+                for i in self.items.values()
+                if i["folderId"] == params["folderId"]
+                and ("name" not in params or i["name"] == params["name"])
+            ]
+            return self.__page(docs, params)
+        item = self.items.get(parts[1])
+        if item is None:
+            raise _HttpError(400, "Invalid item id.")
+        if len(parts) == 2:
+            if method == "DELETE":
+                self._delete_item(parts[1])
+                return {"message": "Deleted item."}
+            return item
+        if parts[2] == "metadata" and method == "PUT":
+            for key, value in json.loads(body).items():
+                if value is None:
+                    item["meta"].pop(key, None)
+                else:
+                    item["meta"][key] = value
+            return item
+        if parts[2] == "files":
+            docs = [f for f in self.files.values() if f["itemId"] == item["_id"]]
+            return self.__page(docs, params)
+        raise _HttpError(404, "No matching item route")
+
+    def __route_file(self, method, parts, params, body):
+        if len(parts) == 1 and method == "POST":
+            return self._init_upload(params, body)
+        if parts[1] == "offset":
+            if params["uploadId"] not in self.uploads:
+                raise _HttpError(400, "Upload not found.")
+            return {"offset": self.uploads[params["uploadId"]][0]["received"]}
+        if parts[1] == "upload" and method == "DELETE":
+            self.uploads.pop(parts[2], None)
+            return {"message": "Deleted upload."}
+        file_doc = self.files.get(parts[1])
+        if file_doc is None:
+            raise _HttpError(400, "Invalid file id.")
+        if len(parts) == 2:
+            if method == "PUT":
+                file_doc["name"] = params.get("name", file_doc["name"])
+            if method == "DELETE":
+                self._delete_file(parts[1])
+                return {"message": "Deleted file."}
+            return file_doc
+        if parts[2] == "copy" and method == "POST":
+            item = self.items.get(params["itemId"])
+            if item is None:
+                raise _HttpError(400, "Invalid item id.")
+            return self._create_file(
+                item,
+                file_doc["name"],
+                self.file_contents[file_doc["_id"]],
+                file_doc["mimeType"],
+            )
+        if parts[2] == "hashsum_file" and parts[3] in self.hashsum_algorithms:
+            return file_doc[parts[3]]
+        raise _HttpError(404, "No matching file route")
+
+    @staticmethod
+    def __page(docs, params):
+        docs = sorted(docs, key=lambda d: d["name"].lower())
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 50))
+        return docs[offset : offset + limit] if limit > 0 else docs[offset:]
+
+    @staticmethod
+    def __json(obj):
+        return 200, "application/json", json.dumps(obj).encode(), {}
+
+
+class _HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class _FakeGirderHandler(BaseHTTPRequestHandler):
+    """Request handler that forwards everything to a FakeGirderServer"""
+
+    girder = None
+    protocol_version = "HTTP/1.1"
+    # Like real web servers, don't hold back the body of a response until the
+    # headers sent just before it are acknowledged
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def __throttle(self, nbytes):
+        if self.girder.bandwidth:
+            time.sleep(nbytes / self.girder.bandwidth)
+
+    def __read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                body.extend(self.rfile.read(size))
+                self.rfile.readline()
+            body = bytes(body)
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.__throttle(len(body))
+        return body
+
+    def __handle(self, method):
+        url = urlparse(self.path)
+        route = url.path[len("/api/v1/") :].strip("/")
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = self.__read_body()
+        if self.girder.latency:
+            time.sleep(self.girder.latency)
+        try:
+            status, ctype, payload, extra = self.girder.handle(
+                method, route, params, body, self.headers
+            )
+        except _HttpError as exc:
+            status, ctype, extra = exc.status, "application/json", {}
+            payload = json.dumps({"message": exc.message, "type": "rest"}).encode()
+        except (KeyError, ValueError) as exc:
+            status, ctype, extra = 400, "application/json", {}
+            payload = json.dumps({"message": repr(exc), "type": "rest"}).encode()
+        self.__throttle(len(payload))
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in extra.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if method != "HEAD":
+            self.wfile.write(payload)
+
+    def do_GET(self):  # pylint: disable=invalid-name,missing-function-docstring
+        self.__handle("GET")
+
+    def do_POST(self):  # pylint: disable=invalid-name,missing-function-docstring
+        self.__handle("POST")
+
+    def do_PUT(self):  # pylint: disable=invalid-name,missing-function-docstring
+        self.__handle("PUT")
+
+    def do_DELETE(self):  # pylint: disable=invalid-name,missing-function-docstring
+        self.__handle("DELETE")
@@ -7,6 +7,8 @@ import pytest
 from faker import Faker
 import girder_client
 from imqcam_uploaders.utilities.argument_parsing import IMQCAMArgumentParser
+from imqcam_uploaders.utilities.timed_girder_client import TimedGirderClient
+from .fake_girder import FakeGirderServer
 
 
 @pytest.fixture
@@ -76,3 +78,16 @@ def static_file_name():
 @pytest.fixture
 def static_file_id():
     return "65e0ca7e02ad536bd833df3d"
+
+
+@pytest.fixture
+def fake_girder_server():
+    with FakeGirderServer() as server:
+        yield server
+
+
+@pytest.fixture
+def fake_girder_client(fake_girder_server):
+    client = TimedGirderClient(apiUrl=fake_girder_server.api_url)
+    client.authenticate(apiKey=fake_girder_server.API_KEY)
+    return client
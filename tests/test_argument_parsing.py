@@ -8,7 +8,10 @@ import shutil
 import json
 import pytest
 from faker import Faker
-from imqcam_uploaders.utilities.argument_parsing import json_str_or_filepath
+from imqcam_uploaders.utilities.argument_parsing import (
+    IMQCAMArgumentParser,
+    json_str_or_filepath,
+)
 
 # pylint: disable=wrong-import-order, unused-import
 from .fixtures import random_json_string
@@ -83,3 +86,39 @@ def test_json_str_or_filepath_fail_with_filepath(random_not_json_string):
             _ = json_str_or_filepath(test_file_path)
     finally:
         shutil.rmtree(test_file_path.parent)
+
+
+def test_bandwidth_arguments():
+    parser = IMQCAMArgumentParser()
+    parser.add_arguments("bandwidth_limit", "bandwidth_burst")
+    args = parser.parse_args(
+        ["--bandwidth_limit", "08:00-18:00=5MB,50MB", "--bandwidth_burst", "2Mi"]
+    )
+    assert args.bandwidth_limit.spec == "08:00-18:00=5MB,50MB"
+    assert args.bandwidth_burst == 2 * 1024 * 1024
+    with pytest.raises(SystemExit):
+        _ = parser.parse_args(["--bandwidth_limit", "fast"])
+
+
+def test_dedup_argument():
+    parser = IMQCAMArgumentParser()
+    parser.add_arguments("dedup")
+    assert not parser.parse_args([]).dedup
+    assert parser.parse_args(["--dedup"]).dedup
+
+
+def test_programs_without_every_argument():
+    # programs that leave out some of the uploader's arguments still get defaults
+    # for everything the uploader is constructed with
+    # pylint: disable=import-outside-toplevel
+    from imqcam_uploaders.uploaders.manifest_reconciler import IMQCAMManifestReconciler
+    from imqcam_uploaders.uploaders.folder_downloader import IMQCAMFolderDownloader
+
+    for runnable_class, args in (
+        (IMQCAMManifestReconciler, ["--manifest_path", "manifest.sqlite"]),
+        (IMQCAMFolderDownloader, [str(pathlib.Path(__file__).parent)]),
+    ):
+        parsed_args = runnable_class.get_argument_parser().parse_args(args)
+        _, kwargs = runnable_class.get_init_args_kwargs(parsed_args)
+        assert kwargs["bandwidth_limit"] is None
+        assert kwargs["dedup"] is False
@@ -0,0 +1,112 @@
+" Tests for the asyncio Girder client, using a local stand-in for Girder "
+
+# pylint: disable=redefined-outer-name
+
+# imports
+import asyncio
+import hashlib
+import pytest
+from girder_client import HttpError
+from imqcam_uploaders.utilities.async_girder import AsyncGirderClient
+from imqcam_uploaders.utilities.retries import RetryPolicy
+
+# pylint: disable=unused-import
+from .fixtures import fake_girder_server, random_100_kb
+
+
+def test_async_girder_client(fake_girder_server, random_100_kb):
+    server = fake_girder_server
+    collection_id = server.create_collection("Test")
+    folder_id = server.create_folder(collection_id, "folder", "collection")
+
+    async def run():
+        async with AsyncGirderClient(server.api_url, max_concurrency=4) as client:
+            # requests need to be authenticated
+            with pytest.raises(HttpError) as exc_info:
+                _ = await client.get("folder", parameters={"parentId": folder_id})
+            assert exc_info.value.status == 401
+            await client.authenticate(server.API_KEY)
+            # upload a file and read it back
+            file_doc = await client.post(
+                "file",
+                parameters={
+                    "parentType": "folder",
+                    "parentId": folder_id,
+                    "name": "test_file.bin",
+                    "size": len(random_100_kb),
+                },
+                data=random_100_kb,
+            )
+            file_hash = hashlib.sha256()
+            await client.get(
+                f"file/{file_doc['_id']}/download", consumer=file_hash.update
+            )
+            assert file_hash.hexdigest() == hashlib.sha256(random_100_kb).hexdigest()
+            # list more Items than fit on one page, many at once
+            await asyncio.gather(
+                *(
+                    client.post(
+                        "item", parameters={"folderId": folder_id, "name": f"item_{i}"}
+                    )
+                    for i in range(60)
+                )
+            )
+            items = await client.list_resource(
+                "item", parameters={"folderId": folder_id}
+            )
+            assert len(items) == 61
+            # errors from the server are raised
+            with pytest.raises(HttpError) as exc_info:
+                _ = await client.get("item/not_an_item_id")
+            assert exc_info.value.status == 400
+
+    asyncio.run(run())
+
+
+def test_async_girder_client_retries(fake_girder_server):
+    server = fake_girder_server
+    folder_id = server.create_folder(
+        server.create_collection("Test"), "folder", "collection"
+    )
+
+    async def run():
+        async with AsyncGirderClient(
+            server.api_url,
+            retry_policy=RetryPolicy(max_retries=2, backoff_seconds=0.01),
+        ) as client:
+            await client.authenticate(server.API_KEY)
+            # transient errors are retried for idempotent requests
+            server.reset_request_log()
+            server.fail_next = [502, 504]
+            assert (await client.get(f"folder/{folder_id}"))["_id"] == folder_id
+            assert server.count_requests("GET") == 3
+            # but not for requests that aren't safe to send twice
+            server.fail_next = [502]
+            with pytest.raises(HttpError) as exc_info:
+                _ = await client.post(
+                    "item", parameters={"folderId": folder_id, "name": "item"}
+                )
+            assert exc_info.value.status == 502
+            assert server.find_item(folder_id, "item") is None
+            # upload chunks are sent again if the server didn't receive them
+            contents = b"0123456789" * 3
+            upload_id = (
+                await client.post(
+                    "file",
+                    parameters={
+                        "parentType": "folder",
+                        "parentId": folder_id,
+                        "name": "a.bin",
+                        "size": len(contents),
+                    },
+                )
+            )["_id"]
+            server.fail_next = [503]
+            file_doc = await client.post(
+                "file/chunk",
+                parameters={"uploadId": upload_id, "offset": 0},
+                data=contents,
+            )
+            assert server.file_contents[file_doc["_id"]] == contents
+
+    asyncio.run(run())
@@ -0,0 +1,203 @@
+" Test the asyncio uploader, using a local stand-in for Girder "
+
+# pylint: disable=redefined-outer-name
+
+# imports
+import os
+import shutil
+import asyncio
+import hashlib
+import importlib.metadata
+import pytest
+from imqcam_uploaders.uploaders.async_uploader import IMQCAMAsyncUploader, main
+
+# pylint: disable=unused-import
+from .fixtures import local_tests_dir, fake_girder_server
+
+
+def make_test_tree(test_dir):
+    """Write some small files in a directory tree and return their paths"""
+    test_filepaths = []
+    for ifile in range(30):
+        test_filepath = (
+            test_dir / f"subdir_{ifile%3}" / f"sub_{ifile%2}" / f"{ifile}.bin"
+        )
+        test_filepath.parent.mkdir(parents=True, exist_ok=True)
+        test_filepath.write_bytes(os.urandom(1000 * ifile))
+        test_filepaths.append(test_filepath)
+    return test_filepaths
+
+
+def find_girder_file(server, root_folder_id, rel_filepath):
+    """Return the File document for a file at a relative path in the fake server"""
+    folder_id = root_folder_id
+    for folder_name in rel_filepath.parent.parts:
+        folder_id = next(
+            folder["_id"]
+            for folder in server.child_folders(folder_id)
+            if folder["name"] == folder_name
+        )
+    item = server.find_item(folder_id, rel_filepath.name)
+    return next(doc for doc in server.files.values() if doc["itemId"] == item["_id"])
+
+
+def test_async_uploader(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_async_uploader.__name__
+    assert not test_dir.is_dir()
+    try:
+        test_filepaths = make_test_tree(test_dir)
+        args = [
+            str(test_dir),
+            "--api_url",
+            server.api_url,
+            "--api_key",
+            server.API_KEY,
+            "--root_folder_id",
+            root_folder_id,
+            "--metadata_json",
+            '{"project": "async"}',
+            "--max_concurrency",
+            "8",
+        ]
+        main(args)
+        # make sure every file exists with the right contents and metadata
+        for test_filepath in test_filepaths:
+            file_doc = find_girder_file(
+                server, root_folder_id, test_filepath.relative_to(local_tests_dir)
+            )
+            file_hash = hashlib.sha256(test_filepath.read_bytes()).hexdigest()
+            assert server.file_hash(file_doc["_id"]) == file_hash
+            assert server.items[file_doc["itemId"]]["meta"] == {
+                "project": "async",
+                "uploaderVersion": importlib.metadata.version("imqcam_uploaders"),
+                "checksum": {"sha256": file_hash},
+                "validationMode": "full",
+            }
+        # every Folder was only created once
+        assert server.count_requests("POST", "folder") == 1 + 3 + 6
+        # run again and make sure nothing is uploaded
+        server.reset_request_log()
+        main(args)
+        assert server.count_requests("POST", "file") == 0
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_async_uploader_chunks_and_failures(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_async_uploader_chunks_and_failures.__name__
+    assert not test_dir.is_dir()
+    try:
+        test_filepaths = make_test_tree(test_dir)
+        uploader = IMQCAMAsyncUploader(server.api_url, server.API_KEY)
+        uploader.UPLOAD_CHUNK_SIZE = 10000
+        # if Folders can't be created, every file fails
+        server.fail_routes = {("POST", r"^folder$"): 500}
+        summary = asyncio.run(
+            uploader.upload_directory_async(
+                test_dir,
+                root_folder_id=root_folder_id,
+                max_concurrency=4,
+                validation_mode="sample",
+            )
+        )
+        assert summary.n_failed == len(test_filepaths)
+        assert summary.n_uploaded == 0
+        server.fail_routes = {}
+        # the next run uploads everything, with files bigger than one chunk
+        # sent in pieces
+        server.reset_request_log()
+        summary = asyncio.run(
+            uploader.upload_directory_async(
+                test_dir,
+                root_folder_id=root_folder_id,
+                max_concurrency=4,
+                validation_mode="sample",
+            )
+        )
+        assert summary.n_uploaded == len(test_filepaths)
+        assert server.count_requests("POST", "file/chunk") == sum(
+            (1000 * ifile + 9999) // 10000
+            for ifile in range(len(test_filepaths))
+            if 1000 * ifile > 10000
+        )
+        for test_filepath in test_filepaths:
+            file_doc = find_girder_file(
+                server, root_folder_id, test_filepath.relative_to(local_tests_dir)
+            )
+            assert server.file_contents[file_doc["_id"]] == test_filepath.read_bytes()
+        # files have to be relative to the "relative_to" directory
+        with pytest.raises(ValueError):
+            asyncio.run(
+                uploader.upload_directory_async(
+                    test_dir, relative_to=test_dir / "subdir_0"
+                )
+            )
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_async_uploader_folder_failures(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_async_uploader_folder_failures.__name__
+    assert not test_dir.is_dir()
+    try:
+        for ifile in range(3):
+            (test_dir / "subdir").mkdir(parents=True, exist_ok=True)
+            (test_dir / "subdir" / f"{ifile}.bin").write_bytes(os.urandom(100))
+        uploader = IMQCAMAsyncUploader(server.api_url, server.API_KEY)
+        # the first request (creating the Folder) fails, but the failure isn't
+        # remembered, so only the first file fails
+        server.fail_next = [500]
+        summary = asyncio.run(
+            uploader.upload_directory_async(
+                test_dir, root_folder_id=root_folder_id, max_concurrency=1
+            )
+        )
+        assert (summary.n_uploaded, summary.n_failed) == (2, 1)
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_async_uploader_adaptive_concurrency(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_async_uploader_adaptive_concurrency.__name__
+    assert not test_dir.is_dir()
+    try:
+        test_filepaths = make_test_tree(test_dir)
+        # a fixed number of requests in flight is never adjusted
+        uploader = IMQCAMAsyncUploader(server.api_url, server.API_KEY)
+        summary = asyncio.run(
+            uploader.upload_directory_async(
+                test_dir / "subdir_0",
+                relative_to=test_dir,
+                root_folder_id=root_folder_id,
+                min_concurrency=4,
+                max_concurrency=4,
+                validation_mode="metadata",
+            )
+        )
+        assert summary.n_uploaded == 10
+        assert uploader.timer.concurrency is None
+        # starting from one request at a time, the number in flight grows while
+        # the server keeps up
+        summary = asyncio.run(
+            uploader.upload_directory_async(
+                test_dir,
+                relative_to=test_dir,
+                root_folder_id=root_folder_id,
+                min_concurrency=1,
+                max_concurrency=8,
+                validation_mode="metadata",
+            )
+        )
+        assert summary.n_uploaded == len(test_filepaths) - 10
+        assert summary.n_failed == 0
+        assert uploader.timer.concurrency > 1
+    finally:
+        shutil.rmtree(test_dir)
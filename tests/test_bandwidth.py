@@ -0,0 +1,181 @@
+" Testing the token bucket that limits upload bandwidth "
+
+# imports
+import io
+import time
+import asyncio
+import datetime
+import threading
+import pytest
+from imqcam_uploaders.utilities.async_girder import AsyncGirderClient
+from imqcam_uploaders.utilities.bandwidth import (
+    BandwidthSchedule,
+    RateLimitedReader,
+    TokenBucket,
+    get_bandwidth_description,
+    get_shared_token_bucket,
+    parse_byte_size,
+)
+from imqcam_uploaders.utilities.girder import get_girder_upload_parameters
+from imqcam_uploaders.utilities.timed_girder_client import TimedGirderClient
+
+# pylint: disable=unused-import
+from .fixtures import fake_girder_server
+
+
+def at(hour, minute=0):
+    "Return a datetime on an arbitrary day at a time of day"
+    return datetime.datetime(2024, 1, 1, hour, minute)
+
+
+def test_parse_byte_size():
+    assert parse_byte_size("500") == 500
+    assert parse_byte_size("2.5M") == 2_500_000
+    assert parse_byte_size("10 MB") == 10_000_000
+    assert parse_byte_size("1GiB/s") == 1024**3
+    assert parse_byte_size("64ki") == 65536
+    for bad_size in ("", "fast", "-5MB", "5 XB"):
+        with pytest.raises(ValueError):
+            _ = parse_byte_size(bad_size)
+
+
+def test_bandwidth_schedule():
+    # a fixed limit applies all day
+    schedule = BandwidthSchedule("5MB")
+    assert schedule.get_rate(at(3)) == schedule.get_rate(at(15)) == 5_000_000
+    # windows (including one that wraps around midnight) with a default
+    schedule = BandwidthSchedule("08:00-18:00=5MB, 22:00-06:00=unlimited, 50MB")
+    assert schedule.get_rate(at(8)) == 5_000_000
+    assert schedule.get_rate(at(17, 59)) == 5_000_000
+    assert schedule.get_rate(at(18)) == 50_000_000
+    assert schedule.get_rate(at(23)) is None
+    assert schedule.get_rate(at(2)) is None
+    assert schedule.get_rate(at(6)) == 50_000_000
+    # no limit outside the windows if there's no default
+    schedule = BandwidthSchedule("09:00-17:00=1M")
+    assert schedule.get_rate(at(12)) == 1_000_000
+    assert schedule.get_rate(at(20)) is None
+    assert BandwidthSchedule("0").get_rate() is None
+    for bad_spec in ("09:00-25:00=1M", "09:00-17:00=slow", "fast"):
+        with pytest.raises(ValueError):
+            _ = BandwidthSchedule(bad_spec)
+
+
+def test_token_bucket_rate():
+    rate = 200_000
+    bucket = TokenBucket(BandwidthSchedule(str(rate)), burst_bytes=20_000)
+    # the burst is available right away
+    start = time.monotonic()
+    bucket.consume(20_000)
+    assert time.monotonic() - start < 0.05
+    # after that, bytes taken by many threads together go at the limit
+    n_threads, n_bytes = 4, 20_000
+
+    def send():
+        for _ in range(5):
+            bucket.consume(n_bytes // 5)
+
+    threads = [threading.Thread(target=send) for _ in range(n_threads)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+    assert elapsed == pytest.approx(n_threads * n_bytes / rate, abs=0.1)
+    assert bucket.throughput == pytest.approx(
+        (20_000 + n_threads * n_bytes) / TokenBucket.THROUGHPUT_WINDOW_SECONDS
+    )
+    assert get_bandwidth_description(bucket).endswith("(limit 200.0kB/s)")
+    assert get_bandwidth_description(None) == ""
+
+
+def test_token_bucket_async():
+    rate = 100_000
+    bucket = TokenBucket(BandwidthSchedule(str(rate)), burst_bytes=10_000)
+
+    async def send_all():
+        await asyncio.gather(*(bucket.consume_async(10_000) for _ in range(4)))
+
+    start = time.monotonic()
+    asyncio.run(send_all())
+    # the first 10 kB were the burst
+    assert time.monotonic() - start == pytest.approx(30_000 / rate, abs=0.1)
+
+
+def test_token_bucket_unlimited():
+    bucket = TokenBucket(BandwidthSchedule("08:00-08:00=0"), burst_bytes=10)
+    start = time.monotonic()
+    bucket.consume(100_000_000)
+    assert time.monotonic() - start < 0.05
+
+
+def test_shared_token_bucket():
+    assert get_shared_token_bucket(None) is None
+    bucket = get_shared_token_bucket("3MB")
+    assert get_shared_token_bucket(BandwidthSchedule("3MB")) is bucket
+    assert bucket.burst_bytes == TokenBucket.DEFAULT_BURST_BYTES
+    assert get_shared_token_bucket("3MB", burst_bytes=100) is not bucket
+    assert get_shared_token_bucket("4MB") is not bucket
+
+
+def test_rate_limited_reader():
+    bucket = TokenBucket(BandwidthSchedule("1G"))
+    reader = RateLimitedReader(b"0123456789", bucket)
+    assert len(reader) == 10
+    assert reader.read(4) == b"0123"
+    assert reader.tell() == 4
+    reader.seek(0)
+    assert reader.read() == b"0123456789"
+    assert bucket.throughput * TokenBucket.THROUGHPUT_WINDOW_SECONDS == 14
+    stream = io.BytesIO(b"abcdef")
+    stream.seek(2)
+    reader = RateLimitedReader(stream, bucket)
+    assert len(reader) == 6
+    assert reader.read() == b"cdef"
+
+
+def test_limited_uploads(fake_girder_server):
+    server = fake_girder_server
+    folder_id = server.create_root_folder()
+    rate, burst = 400_000, 50_000
+    contents = bytes(range(256)) * 1000
+    # chunks of an upload are sent no faster than the limit
+    client = TimedGirderClient(
+        apiUrl=server.api_url,
+        bandwidth_limiter=TokenBucket(BandwidthSchedule(str(rate)), burst),
+    )
+    client.authenticate(apiKey=server.API_KEY)
+    client.MAX_CHUNK_SIZE = 100_000
+    start = time.monotonic()
+    file_doc = client.uploadStreamToFolder(
+        folder_id, io.BytesIO(contents), "limited.bin", len(contents)
+    )
+    assert time.monotonic() - start >= (len(contents) - burst) / rate
+    assert server.file_contents[file_doc["_id"]] == contents
+    # worker clients share the limit
+    assert client.get_worker_client().bandwidth_limiter is client.bandwidth_limiter
+
+    # and so are the bodies of requests from the asyncio client
+    async def upload_async():
+        async with AsyncGirderClient(
+            server.api_url,
+            bandwidth_limiter=TokenBucket(BandwidthSchedule(str(rate)), burst),
+        ) as async_client:
+            await async_client.authenticate(server.API_KEY)
+            upload = await async_client.post(
+                "file",
+                parameters=get_girder_upload_parameters(
+                    folder_id, "limited_async.bin", len(contents)
+                ),
+            )
+            return await async_client.post(
+                "file/chunk",
+                parameters={"uploadId": upload["_id"], "offset": 0},
+                data=contents,
+            )
+
+    start = time.monotonic()
+    file_doc = asyncio.run(upload_async())
+    assert time.monotonic() - start >= (len(contents) - burst) / rate
+    assert server.file_contents[file_doc["_id"]] == contents
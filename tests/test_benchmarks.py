@@ -0,0 +1,75 @@
+" Make sure the offline benchmark suite runs, and check the REST calls it counts "
+
+# pylint: disable=redefined-outer-name
+
+# imports
+import json
+import shutil
+from .benchmarks import HASHING_TARGETS, SCENARIOS, TARGETS, run_benchmarks, main
+
+# pylint: disable=unused-import
+from .fixtures import local_tests_dir
+
+# The most REST calls each uploader should need to upload a single file (including
+# authenticating and creating its Folder) in the "huge" scenario
+REQUEST_BUDGETS = {
+    "file_uploader": 7,
+    "directory_uploader": 7,
+    "async_uploader": 5,
+}
+
+
+def test_benchmarks(local_tests_dir):
+    test_dir = local_tests_dir / test_benchmarks.__name__
+    assert not test_dir.is_dir()
+    test_dir.mkdir()
+    try:
+        results = run_benchmarks(
+            scale=0.02,
+            size_scale=0.001,
+            validation_mode="metadata",
+            concurrency=4,
+            work_dir=test_dir,
+        )
+        # the scenario files were cleaned up
+        assert not any(test_dir.iterdir())
+    finally:
+        shutil.rmtree(test_dir)
+    assert [(result.scenario, result.target) for result in results] == [
+        (scenario, target) for scenario in SCENARIOS for target in TARGETS
+    ]
+    for result in results:
+        assert result.n_files > 0
+        assert result.seconds > 0
+        if result.target in HASHING_TARGETS:
+            assert result.n_requests == 0
+        elif result.scenario == "huge" and result.target in REQUEST_BUDGETS:
+            assert result.n_files == 1
+            assert result.requests_per_file <= REQUEST_BUDGETS[result.target]
+
+
+def test_benchmarks_main(local_tests_dir, capsys):
+    json_path = local_tests_dir / "test_benchmarks_main.json"
+    assert not json_path.exists()
+    try:
+        main(
+            [
+                "--scenarios",
+                "tiny",
+                "--targets",
+                "async_uploader",
+                "hashing",
+                "--scale",
+                "0.01",
+                "--json_path",
+                str(json_path),
+            ]
+        )
+        output_lines = capsys.readouterr().out.splitlines()
+        assert len(output_lines) == 3
+        assert output_lines[0].split()[-1] == "REST/file"
+        results = json.loads(json_path.read_text())
+        assert [result["target"] for result in results] == ["async_uploader", "hashing"]
+        assert results[0]["n_files"] == 10
+    finally:
+        json_path.unlink(missing_ok=True)
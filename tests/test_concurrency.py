@@ -0,0 +1,111 @@
+" Testing the adaptive limit on the number of Girder requests in flight "
+
+# imports
+import asyncio
+import pytest
+from imqcam_uploaders.utilities.concurrency import (
+    AdaptiveConcurrencyLimit,
+    LatencyTracker,
+)
+
+KEY = ("GET", "item", 0)
+
+
+async def run_requests(limit, n_rounds, seconds=0.01, status=200):
+    """Record requests finishing one at a time for some number of round trips, with
+    new requests starting to keep the limit full
+    """
+    for _ in range(n_rounds):
+        for _ in range(limit.limit):
+            while limit.in_flight < limit.limit:
+                await limit.__aenter__()
+            limit.record(KEY, seconds, status)
+            await limit.__aexit__(None, None, None)
+    while limit.in_flight > 0:
+        await limit.__aexit__(None, None, None)
+
+
+def test_latency_tracker():
+    tracker = LatencyTracker(latency_tolerance=2.0)
+    assert not any(tracker.add(KEY, 0.1, n_bytes=100) for _ in range(10))
+    assert tracker.n_bytes_sent == 1000
+    assert tracker.throughput > 0
+    # other kinds of requests have their own baselines
+    assert not tracker.add(("POST", "file", 20), 10.0)
+    # requests that consistently take much longer look like congestion
+    assert any(tracker.add(KEY, 0.5) for _ in range(10))
+    assert tracker.latency_ratio > 2.0
+    # very fast requests aren't compared with each other too closely
+    tracker = LatencyTracker(latency_tolerance=2.0)
+    assert not any(tracker.add(KEY, seconds) for seconds in (1e-5, 1e-3) * 10)
+
+
+def test_concurrency_limit_aimd():
+    async def run():
+        limit = AdaptiveConcurrencyLimit(1, 20)
+        assert limit.limit == 1
+        # the limit doubles every round trip to start
+        await run_requests(limit, 1)
+        assert limit.limit == 2
+        await run_requests(limit, 1)
+        assert limit.limit == 4
+        # an overload error cuts it in half, only once per round trip
+        limit.record(KEY, 0.01, 503)
+        assert limit.limit == 2
+        limit.record_failure()
+        assert limit.limit == 2
+        # after that, it grows by about one every round trip
+        await run_requests(limit, 2)
+        assert limit.limit == 3
+        await run_requests(limit, 1)
+        assert limit.limit == 4
+        # requests taking much longer than usual lower it too
+        await run_requests(limit, 4, seconds=1.0)
+        assert limit.limit < 4
+        # other errors don't change it
+        old_limit = limit.limit
+        limit.record(KEY, 0.01, 400)
+        assert limit.limit == old_limit
+        # it never goes past the floor or ceiling
+        for _ in range(10):
+            limit.record_failure()
+            await run_requests(limit, 1)
+        assert limit.limit >= 1
+        await run_requests(limit, 100)
+        assert limit.limit == 20
+
+    asyncio.run(run())
+
+
+def test_concurrency_limit_waits():
+    async def run():
+        limit = AdaptiveConcurrencyLimit(2, 2)
+        # the limit doesn't grow unless it's being reached
+        async with limit:
+            limit.record(KEY, 0.01, 200)
+            assert limit.in_flight == 1
+        assert limit.limit == 2
+        order = []
+
+        async def request(name, seconds):
+            async with limit:
+                order.append(f"start {name}")
+                await asyncio.sleep(seconds)
+                order.append(f"end {name}")
+
+        await asyncio.gather(request("a", 0.05), request("b", 0.1), request("c", 0))
+        # "c" had to wait for "a" to finish
+        assert order.index("start c") > order.index("end a")
+        assert limit.in_flight == 0
+        # a fixed limit stays where it is
+        await run_requests(limit, 10)
+        assert limit.limit == 2
+
+    asyncio.run(run())
+
+
+def test_concurrency_limit_bounds():
+    with pytest.raises(ValueError):
+        _ = AdaptiveConcurrencyLimit(0, 4)
+    with pytest.raises(ValueError):
+        _ = AdaptiveConcurrencyLimit(5, 4)
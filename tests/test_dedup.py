@@ -0,0 +1,150 @@
+" Testing the index of file contents in Girder Collections, and copying files by it "
+
+# imports
+import io
+import hashlib
+import girder_client
+import requests
+import pytest
+from imqcam_uploaders.utilities.dedup import GirderContentIndex, copy_girder_file
+from imqcam_uploaders.utilities.manifest import UploadManifest
+
+# pylint: disable=unused-import
+from .fixtures import local_tests_dir, fake_girder_server, fake_girder_client
+
+
+def upload_with_checksum(client, folder_id, name, contents):
+    "Upload some bytes with their sha256 hash in the Item's metadata like the uploaders"
+    file_doc = client.uploadStreamToFolder(
+        folder_id, io.BytesIO(contents), name, len(contents)
+    )
+    client.addMetadataToItem(
+        file_doc["itemId"],
+        {"checksum": {"sha256": hashlib.sha256(contents).hexdigest()}},
+    )
+    return file_doc
+
+
+def test_girder_content_index(local_tests_dir, fake_girder_server, fake_girder_client):
+    server = fake_girder_server
+    collection_id = server.create_collection("Test")
+    root_folder_id = server.create_folder(collection_id, "Test", "collection")
+    nested_folder_id = server.create_folder(
+        server.create_folder(root_folder_id, "a"), "b"
+    )
+    other_root_folder_id = server.create_folder(
+        server.create_collection("Other"), "Other", "collection"
+    )
+    client = fake_girder_client
+    contents = b"calibration data" * 100
+    file_hash = hashlib.sha256(contents).hexdigest()
+    file_doc = upload_with_checksum(client, nested_folder_id, "cal.bin", contents)
+    # Items without a recorded checksum aren't indexed
+    client.uploadStreamToFolder(
+        root_folder_id, io.BytesIO(b"unknown"), "unknown.bin", len(b"unknown")
+    )
+    manifest_path = local_tests_dir / "test_girder_content_index.sqlite"
+    assert not manifest_path.exists()
+    try:
+        with UploadManifest(manifest_path) as manifest:
+            index = GirderContentIndex(server.api_url, manifest)
+            # files are found anywhere in the Collection, starting from any Folder
+            assert index.find(client, root_folder_id, file_hash, len(contents)) == {
+                "item_id": file_doc["itemId"],
+                "file_id": file_doc["_id"],
+            }
+            assert index.find(client, nested_folder_id, file_hash, len(contents))
+            assert index.find(client, root_folder_id, file_hash, 1) is None
+            # but only in the same Collection
+            assert (
+                index.find(client, other_root_folder_id, file_hash, len(contents))
+                is None
+            )
+            # files are copied without transferring their contents
+            server.reset_request_log()
+            new_file = index.copy(
+                client,
+                other_root_folder_id,
+                file_hash,
+                len(contents),
+                root_folder_id,
+                "copy.bin",
+            )
+            assert new_file is None
+            new_file = index.copy(
+                client,
+                root_folder_id,
+                file_hash,
+                len(contents),
+                root_folder_id,
+                "copy.bin",
+            )
+            assert new_file["name"] == "copy.bin"
+            assert server.find_item(root_folder_id, "copy.bin") is not None
+            assert server.file_contents[new_file["_id"]] == contents
+            assert server.count_requests("POST", "file$") == 0
+        # a new index with the same manifest doesn't list the Collection again
+        with UploadManifest(manifest_path) as manifest:
+            index = GirderContentIndex(server.api_url, manifest)
+            server.reset_request_log()
+            assert index.find(client, root_folder_id, file_hash, len(contents))
+            assert server.count_requests("GET", "(folder|item)$") == 0
+            # files that can't be copied anymore are forgotten
+            client.delete(f"item/{file_doc['itemId']}")
+            with pytest.raises(girder_client.HttpError):
+                _ = index.copy(
+                    client,
+                    root_folder_id,
+                    file_hash,
+                    len(contents),
+                    root_folder_id,
+                    "copy_2.bin",
+                )
+            assert server.find_item(root_folder_id, "copy_2.bin") is None
+            assert index.find(client, root_folder_id, file_hash, len(contents)) is None
+        with UploadManifest(manifest_path) as manifest:
+            assert manifest.get_girder_contents(server.api_url, collection_id) == []
+        # files whose Items can't be listed anymore are forgotten too
+        contents = b"other data"
+        file_doc = upload_with_checksum(client, root_folder_id, "other.bin", contents)
+        file_hash = hashlib.sha256(contents).hexdigest()
+        index = GirderContentIndex(server.api_url)
+        assert index.has_size(client, root_folder_id, len(contents))
+        assert not index.has_size(client, root_folder_id, len(contents) + 1)
+        client.delete(f"item/{file_doc['itemId']}")
+        with pytest.raises(girder_client.HttpError):
+            _ = index.find(client, root_folder_id, file_hash, len(contents))
+        assert not index.has_size(client, root_folder_id, len(contents))
+        assert index.find(client, root_folder_id, file_hash, len(contents)) is None
+    finally:
+        manifest_path.unlink(missing_ok=True)
+
+
+def test_copy_girder_file(fake_girder_server, fake_girder_client):
+    server = fake_girder_server
+    folder_id = server.create_root_folder()
+    client = fake_girder_client
+    file_doc = upload_with_checksum(client, folder_id, "part.stl", b"solid part")
+    new_file = copy_girder_file(client, file_doc["_id"], folder_id, "part_copy.stl")
+    assert new_file["name"] == "part_copy.stl"
+    assert new_file["itemId"] == server.find_item(folder_id, "part_copy.stl")["_id"]
+    assert server.file_contents[new_file["_id"]] == b"solid part"
+    # files can be copied to existing Items too
+    item_copy = copy_girder_file(
+        client, file_doc["_id"], folder_id, "item.stl", item_id=new_file["itemId"]
+    )
+    assert item_copy["name"] == "item.stl"
+    assert item_copy["itemId"] == new_file["itemId"]
+    # the new Item is removed again if the copy fails
+    with pytest.raises(girder_client.HttpError):
+        _ = copy_girder_file(client, "missing", folder_id, "missing.stl")
+    assert server.find_item(folder_id, "missing.stl") is None
+
+    # including when the connection fails instead of the server refusing the copy
+    def post_without_connection(*args, **kwargs):
+        raise requests.exceptions.ConnectionError("connection dropped")
+
+    client.post = post_without_connection
+    with pytest.raises(requests.exceptions.ConnectionError):
+        _ = copy_girder_file(client, file_doc["_id"], folder_id, "dropped.stl")
+    assert server.find_item(folder_id, "dropped.stl") is None
@@ -0,0 +1,207 @@
+" Test comparing and syncing directory trees with their copies in Girder "
+
+# imports
+import os
+import shutil
+import logging
+import pytest
+from imqcam_uploaders.uploaders.directory_uploader import IMQCAMDirectoryUploader
+from imqcam_uploaders.uploaders.directory_syncer import IMQCAMDirectorySyncer, main
+from imqcam_uploaders.utilities.downloads import PARTIAL_DOWNLOAD_SUFFIX
+from imqcam_uploaders.utilities.packing import PACK_METADATA_KEY
+
+# pylint: disable=unused-import
+from .fixtures import local_tests_dir, fake_girder_server
+
+# Requests that create or download Files
+UPLOAD_ROUTE = r"file$"
+DOWNLOAD_ROUTE = r"file/\w+/download"
+
+
+def write_and_upload_test_tree(server, root_folder_id, dirpath):
+    """Write some files in a directory tree (two of them small enough to be packed)
+    and upload them to the fake server, returning their "/"-separated paths
+    relative to the directory
+    """
+    rel_paths = []
+    for ifile in range(8):
+        rel_path = f"subdir_{ifile % 2}/{ifile}.bin" if ifile > 1 else f"{ifile}.bin"
+        filepath = dirpath / rel_path
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        filepath.write_bytes(os.urandom(1000 * ifile + 10))
+        rel_paths.append(rel_path)
+    uploader = IMQCAMDirectoryUploader(
+        server.api_url, server.API_KEY, streamlevel=logging.WARNING
+    )
+    try:
+        summary = uploader.upload_directory(
+            dirpath,
+            root_folder_id=root_folder_id,
+            pack_threshold=1500,
+            validation_mode="metadata",
+        )
+    finally:
+        uploader.close()
+    assert summary.n_failed == 0
+    return rel_paths
+
+
+def test_directory_syncer(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_directory_syncer.__name__
+    assert not test_dir.is_dir()
+    dirpath = test_dir / "data"
+    try:
+        rel_paths = write_and_upload_test_tree(server, root_folder_id, dirpath)
+        originals = {
+            rel_path: (dirpath / rel_path).read_bytes() for rel_path in rel_paths
+        }
+        # change a file without changing its size, add a file, and delete two files
+        # (one of which is in a pack)
+        (dirpath / "subdir_1/5.bin").write_bytes(
+            bytes(len(originals["subdir_1/5.bin"]))
+        )
+        (dirpath / "subdir_0/new.bin").write_bytes(b"new file")
+        for rel_path in ("0.bin", "subdir_0/4.bin"):
+            (dirpath / rel_path).unlink()
+        args = [
+            str(dirpath),
+            "--api_url",
+            server.api_url,
+            "--api_key",
+            server.API_KEY,
+            "--root_folder_id",
+            root_folder_id,
+            "--n_threads",
+            "3",
+        ]
+        # without "--apply", the differences are only reported
+        server.reset_request_log()
+        main(args)
+        assert server.count_requests("POST", UPLOAD_ROUTE) == 0
+        assert server.count_requests("GET", DOWNLOAD_ROUTE) == 0
+        assert not (dirpath / "0.bin").exists()
+        syncer = IMQCAMDirectorySyncer(
+            server.api_url, server.API_KEY, streamlevel=logging.WARNING
+        )
+        try:
+            diff = syncer.diff_directory(dirpath, root_folder_id=root_folder_id)
+        finally:
+            syncer.close()
+        assert diff.new == ["subdir_0/new.bin"]
+        assert diff.changed == ["subdir_1/5.bin"]
+        assert list(diff.missing) == ["0.bin", "subdir_0/4.bin"]
+        assert diff.n_unchanged == len(rel_paths) - 3
+        # with "--apply", new and changed files are uploaded and missing files are
+        # downloaded, after which the trees are the same
+        (changed_item,) = [
+            item for item in server.items.values() if item["name"] == "5.bin"
+        ]
+        main([*args, "--apply"])
+        assert server.count_requests("POST", UPLOAD_ROUTE) == 2
+        for rel_path in ("0.bin", "subdir_0/4.bin"):
+            assert (dirpath / rel_path).read_bytes() == originals[rel_path]
+        assert not list(dirpath.rglob(f"*{PARTIAL_DOWNLOAD_SUFFIX}"))
+        syncer = IMQCAMDirectorySyncer(
+            server.api_url, server.API_KEY, streamlevel=logging.WARNING
+        )
+        try:
+            diff = syncer.diff_directory(dirpath, root_folder_id=root_folder_id)
+        finally:
+            syncer.close()
+        assert (diff.n_differences, diff.n_unchanged) == (0, len(rel_paths) + 1)
+        # the changed file replaced the contents of its Item instead of being
+        # uploaded to a new one
+        assert [
+            item["_id"]
+            for item in server.items.values()
+            if item["name"].startswith("5.bin")
+        ] == [changed_item["_id"]]
+        assert [
+            server.file_contents[file_id]
+            for file_id, file_doc in server.files.items()
+            if file_doc["itemId"] == changed_item["_id"]
+        ] == [(dirpath / "subdir_1/5.bin").read_bytes()]
+        assert changed_item["size"] == len(originals["subdir_1/5.bin"])
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_directory_syncer_failures(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_directory_syncer_failures.__name__
+    assert not test_dir.is_dir()
+    dirpath = test_dir / "data"
+    try:
+        write_and_upload_test_tree(server, root_folder_id, dirpath)
+        (dirpath / "subdir_0/2.bin").unlink()
+        (dirpath / "subdir_0/4.bin").unlink()
+        # a missing file that doesn't match its recorded checksum isn't kept
+        bad_item = next(
+            item for item in server.items.values() if item["name"] == "2.bin"
+        )
+        bad_item["meta"]["checksum"]["sha256"] = "0" * 64
+        with pytest.raises(RuntimeError):
+            main(
+                [
+                    str(dirpath),
+                    "--api_url",
+                    server.api_url,
+                    "--api_key",
+                    server.API_KEY,
+                    "--root_folder_id",
+                    root_folder_id,
+                    "--apply",
+                ]
+            )
+        assert not (dirpath / "subdir_0/2.bin").exists()
+        assert (dirpath / "subdir_0/4.bin").is_file()
+        assert not list(dirpath.rglob(f"*{PARTIAL_DOWNLOAD_SUFFIX}"))
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_directory_syncer_unwritable_paths(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_directory_syncer_unwritable_paths.__name__
+    assert not test_dir.is_dir()
+    dirpath = test_dir / "data"
+    escape_path = dirpath / ".." / ".." / "escape.txt"
+    try:
+        write_and_upload_test_tree(server, root_folder_id, dirpath)
+        # a file in a pack whose name would write it outside of the tree
+        pack_item = next(
+            item
+            for item in server.items.values()
+            if PACK_METADATA_KEY in (item.get("meta") or {})
+        )
+        for member in pack_item["meta"][PACK_METADATA_KEY]["members"]:
+            if member["name"] == "0.bin":
+                member["name"] = "../../escape.txt"
+        # and missing files in a directory that can't be created, because there's
+        # a file in its place
+        shutil.rmtree(dirpath / "subdir_1")
+        (dirpath / "subdir_1").write_bytes(b"not a directory")
+        (dirpath / "subdir_0/4.bin").unlink()
+        syncer = IMQCAMDirectorySyncer(
+            server.api_url, server.API_KEY, streamlevel=logging.WARNING
+        )
+        try:
+            _, _, download_summary = syncer.sync_directory(
+                dirpath, root_folder_id=root_folder_id
+            )
+        finally:
+            syncer.close()
+        # every file that can't be written fails and is counted, and the rest are
+        # still downloaded
+        assert not escape_path.exists()
+        assert download_summary.n_failed == 1 + 3
+        assert download_summary.n_downloaded == 1
+        assert (dirpath / "subdir_0/4.bin").is_file()
+        assert (dirpath / "subdir_1").is_file()
+    finally:
+        escape_path.unlink(missing_ok=True)
+        shutil.rmtree(test_dir)
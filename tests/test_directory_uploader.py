@@ -0,0 +1,351 @@
+" Test the directory tree uploader "
+
+# pylint: disable=redefined-outer-name
+
+# imports
+import shutil
+import pathlib
+import pytest
+from imqcam_uploaders.utilities.hashing import (
+    get_on_disk_file_hash,
+    get_girder_file_hash,
+)
+from imqcam_uploaders.utilities.girder import get_girder_item_and_file_id
+from imqcam_uploaders.utilities.manifest import UploadManifest
+from imqcam_uploaders.utilities.packing import (
+    PACK_METADATA_KEY,
+    PACK_NAME_PREFIX,
+    get_file_pack_members,
+)
+from imqcam_uploaders.uploaders.directory_uploader import (
+    IMQCAMDirectoryUploader,
+    main,
+)
+
+# pylint: disable=wrong-import-order, unused-import
+from .fixtures import (
+    local_tests_dir,
+    random_100_kb,
+    random_json_string,
+    fake_girder_server,
+    fake_girder_client,
+)
+
+
+def test_directory_uploader(
+    local_tests_dir,
+    fake_girder_server,
+    fake_girder_client,
+    random_100_kb,
+    random_json_string,
+):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    client = fake_girder_client
+    test_dir = local_tests_dir / test_directory_uploader.__name__
+    test_filepaths = [
+        test_dir / "test_file_1.bin",
+        test_dir / "subdir_1" / "test_file_2.bin",
+        test_dir / "subdir_1" / "test_file_3.bin",
+        test_dir / "subdir_2" / "subsubdir" / "test_file_4.bin",
+    ]
+    # create the test directory and files
+    assert not test_dir.is_dir()
+    try:
+        for ifile, test_filepath in enumerate(test_filepaths):
+            test_filepath.parent.mkdir(parents=True, exist_ok=True)
+            with open(test_filepath, "wb") as fp:
+                fp.write(random_100_kb[: 25000 * (ifile + 1)])
+        # run the directory uploader from the "main" function
+        args = [
+            str(test_dir),
+            "--api_url",
+            server.api_url,
+            "--api_key",
+            server.API_KEY,
+            "--metadata_json",
+            random_json_string,
+            "--root_folder_id",
+            root_folder_id,
+            "--n_threads",
+            "3",
+        ]
+        main(args)
+        # make sure every file exists and its contents match
+        for test_filepath in test_filepaths:
+            _, file_id = get_girder_item_and_file_id(
+                client,
+                test_filepath.relative_to(local_tests_dir),
+                root_folder_id=root_folder_id,
+            )
+            hash_read_back = get_girder_file_hash(client, file_id)
+            assert hash_read_back == get_on_disk_file_hash(test_filepath)
+        # run again and make sure everything is skipped
+        uploader = IMQCAMDirectoryUploader(server.api_url, server.API_KEY)
+        try:
+            summary = uploader.upload_directory(test_dir, root_folder_id=root_folder_id)
+        finally:
+            uploader.close()
+        assert summary.n_uploaded == 0
+        assert summary.n_skipped == len(test_filepaths)
+        assert summary.n_failed == 0
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_directory_uploader_bad_relative_to(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    test_dir = local_tests_dir / test_directory_uploader_bad_relative_to.__name__
+    relative_to_dir = test_dir / "not_relative_to_this"
+    assert not test_dir.is_dir()
+    relative_to_dir.mkdir(parents=True)
+    try:
+        args = [
+            str(test_dir),
+            "--api_url",
+            server.api_url,
+            "--api_key",
+            server.API_KEY,
+            "--relative_to",
+            str(relative_to_dir),
+            "--root_folder_id",
+            server.create_root_folder(),
+        ]
+        with pytest.raises(ValueError):
+            IMQCAMDirectoryUploader.run_from_command_line(args)
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_directory_uploader_folder_requests(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_directory_uploader_folder_requests.__name__
+    assert not test_dir.is_dir()
+    try:
+        # 4 files in each of 2 x 2 leaf directories, two levels below data_dir
+        data_dir = test_dir / "data"
+        for first in ("a", "b"):
+            for second in ("c", "d"):
+                (data_dir / first / second).mkdir(parents=True)
+                for ifile in range(4):
+                    (data_dir / first / second / f"{ifile}.bin").write_bytes(b"0" * 10)
+        uploader = IMQCAMDirectoryUploader(
+            server.api_url, server.API_KEY, manifest_path=test_dir / "manifest.db"
+        )
+        upload_kwargs = {
+            "relative_to": data_dir,
+            "root_folder_id": root_folder_id,
+            "n_threads": 4,
+            "validation_mode": "metadata",
+        }
+        try:
+            summary = uploader.upload_directory(data_dir, **upload_kwargs)
+            assert summary.n_uploaded == 16
+            # each of the 6 Folders is looked for and created exactly once, instead
+            # of once for each file in it
+            assert server.count_requests("GET", r"^folder$") == 6
+            assert server.count_requests("POST", r"^folder$") == 6
+            assert len(server.folders) == 7
+            # after everything is recorded in the manifest, no Folders are looked up
+            server.reset_request_log()
+            summary = uploader.upload_directory(data_dir, **upload_kwargs)
+            assert summary.n_skipped == 16
+            assert server.count_requests("GET", r"^folder$") == 0
+        finally:
+            uploader.close()
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_directory_uploader_existence_check(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_directory_uploader_existence_check.__name__
+    assert not test_dir.is_dir()
+    try:
+        # 4 files in each of 2 x 2 leaf directories, two levels below data_dir
+        data_dir = test_dir / "data"
+        for first in ("a", "b"):
+            for second in ("c", "d"):
+                (data_dir / first / second).mkdir(parents=True)
+                for ifile in range(4):
+                    (data_dir / first / second / f"{ifile}.bin").write_bytes(
+                        bytes([ifile]) * 10
+                    )
+        upload_kwargs = {
+            "relative_to": data_dir,
+            "root_folder_id": root_folder_id,
+            "n_threads": 4,
+            "validation_mode": "metadata",
+        }
+        uploader = IMQCAMDirectoryUploader(server.api_url, server.API_KEY)
+        try:
+            summary = uploader.upload_directory(data_dir, **upload_kwargs)
+            assert summary.n_uploaded == 16
+        finally:
+            uploader.close()
+        # without a manifest, a new uploader lists each of the 4 Folders with files
+        # in them once instead of checking every file with its own requests
+        changed_filepath = data_dir / "a" / "c" / "0.bin"
+        changed_filepath.write_bytes(b"x" * 10)
+        (data_dir / "b" / "d" / "new.bin").write_bytes(b"new")
+        file_upload_kwargs = {
+            k: v for k, v in upload_kwargs.items() if k != "n_threads"
+        }
+        server.reset_request_log()
+        uploader = IMQCAMDirectoryUploader(server.api_url, server.API_KEY)
+        try:
+            summary = uploader.upload_directory(data_dir, **upload_kwargs)
+            # the changed file has the same size, so it's skipped by default
+            assert (summary.n_skipped, summary.n_uploaded) == (16, 1)
+            assert server.count_requests("GET", r"^item$") == 4
+            assert server.count_requests("GET", r"^item/") == 0
+            assert server.count_requests("GET", r"^file") == 0
+            # the same as in Folders that weren't listed
+            assert not uploader.upload_file(changed_filepath, **file_upload_kwargs)
+        finally:
+            uploader.close()
+        # when verifying existing files, their hashes are compared with the
+        # checksums recorded in their Items' metadata, in listed Folders or not
+        uploader = IMQCAMDirectoryUploader(
+            server.api_url, server.API_KEY, verify_existing=True
+        )
+        try:
+            summary = uploader.upload_directory(data_dir, **upload_kwargs)
+            assert (summary.n_skipped, summary.n_uploaded) == (16, 1)
+            changed_filepath.write_bytes(b"y" * 10)
+            assert uploader.upload_file(changed_filepath, **file_upload_kwargs)
+        finally:
+            uploader.close()
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_directory_uploader_packing(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_directory_uploader_packing.__name__
+    assert not test_dir.is_dir()
+    try:
+        # 20 small files and one large file in one directory, and a single small
+        # file in another
+        data_dir = test_dir / "data"
+        (data_dir / "many").mkdir(parents=True)
+        (data_dir / "one").mkdir(parents=True)
+        for ifile in range(20):
+            (data_dir / "many" / f"{ifile:02d}.txt").write_bytes(bytes([ifile]) * 100)
+        (data_dir / "many" / "large.bin").write_bytes(b"L" * 5000)
+        (data_dir / "one" / "alone.txt").write_bytes(b"alone")
+        upload_kwargs = {
+            "relative_to": data_dir,
+            "root_folder_id": root_folder_id,
+            "n_threads": 2,
+            "validation_mode": "full",
+            "pack_threshold": 1000,
+        }
+        uploader = IMQCAMDirectoryUploader(server.api_url, server.API_KEY)
+        try:
+            summary = uploader.upload_directory(data_dir, **upload_kwargs)
+        finally:
+            uploader.close()
+        assert summary.n_uploaded == 22
+        assert summary.n_bytes_uploaded == 20 * 100 + 5000 + 5
+        # the small files share one Item, and the others are uploaded on their own
+        folder_ids = {
+            folder["name"]: folder["_id"]
+            for folder in server.child_folders(root_folder_id)
+        }
+        items = {
+            item["name"]: item
+            for item in server.items.values()
+            if item["folderId"] == folder_ids["many"]
+        }
+        assert len(items) == 2 and "large.bin" in items
+        pack_name = next(name for name in items if name != "large.bin")
+        assert pack_name.startswith(PACK_NAME_PREFIX)
+        members = get_file_pack_members(items[pack_name])
+        assert sorted(members) == [f"{ifile:02d}.txt" for ifile in range(20)]
+        assert items[pack_name]["meta"]["checksum"]["sha256"]
+        assert server.find_item(folder_ids["one"], "alone.txt") is not None
+        # uploading again skips every file, including the packed ones, and changed
+        # small files are packed again
+        (data_dir / "many" / "00.txt").write_bytes(b"changed" * 10)
+        (data_dir / "many" / "01.txt").write_bytes(b"changed" * 10)
+        uploader = IMQCAMDirectoryUploader(server.api_url, server.API_KEY)
+        try:
+            summary = uploader.upload_directory(data_dir, **upload_kwargs)
+            assert summary.n_uploaded == 2
+            assert summary.n_skipped == 20
+            summary = uploader.upload_directory(data_dir, **upload_kwargs)
+            assert summary.n_uploaded == 0
+            assert summary.n_skipped == 22
+        finally:
+            uploader.close()
+        # files in different directories can't be packed together
+        uploader = IMQCAMDirectoryUploader(server.api_url, server.API_KEY)
+        try:
+            with pytest.raises(ValueError):
+                _ = uploader.upload_file_pack(
+                    [data_dir / "many" / "02.txt", data_dir / "one" / "alone.txt"],
+                    relative_to=data_dir,
+                    root_folder_id=root_folder_id,
+                )
+        finally:
+            uploader.close()
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_directory_uploader_packing_manifest(
+    local_tests_dir, fake_girder_server, fake_girder_client
+):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_directory_uploader_packing_manifest.__name__
+    assert not test_dir.is_dir()
+    try:
+        data_dir = test_dir / "data"
+        data_dir.mkdir(parents=True)
+        for ifile in range(5):
+            (data_dir / f"{ifile}.txt").write_bytes(bytes([ifile]) * (100 + ifile))
+        upload_kwargs = {
+            "relative_to": data_dir,
+            "root_folder_id": root_folder_id,
+            "pack_threshold": 1000,
+        }
+        # packed files are recorded in the manifest when they're uploaded, and when
+        # they're found in their pack by another upload (with a new manifest)
+        manifest_paths = [test_dir / "uploaded.db", test_dir / "found.db"]
+        for manifest_path in manifest_paths:
+            uploader = IMQCAMDirectoryUploader(
+                server.api_url, server.API_KEY, manifest_path=manifest_path
+            )
+            try:
+                summary = uploader.upload_directory(data_dir, **upload_kwargs)
+            finally:
+                uploader.close()
+            assert summary.n_failed == 0
+        assert summary.n_skipped == 5
+        # and the records of unchanged files in the pack are kept when reconciling
+        for manifest_path in manifest_paths:
+            with UploadManifest(manifest_path) as manifest:
+                assert manifest.reconcile(fake_girder_client, server.api_url) == (5, 0)
+                record = manifest.get_upload(
+                    data_dir / "3.txt",
+                    server.api_url,
+                    root_folder_id,
+                    pathlib.Path("3.txt"),
+                )
+                assert record["pack_member"] == "3.txt"
+        # a file that's no longer in its pack is forgotten
+        (pack_item,) = server.items.values()
+        pack_item["meta"][PACK_METADATA_KEY]["members"] = [
+            member
+            for member in pack_item["meta"][PACK_METADATA_KEY]["members"]
+            if member["name"] != "3.txt"
+        ]
+        with UploadManifest(manifest_paths[0]) as manifest:
+            assert manifest.reconcile(fake_girder_client, server.api_url) == (5, 1)
+    finally:
+        shutil.rmtree(test_dir)
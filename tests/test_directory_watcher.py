@@ -0,0 +1,162 @@
+" Test continuously uploading files as they're written into a directory tree "
+
+# pylint: disable=redefined-outer-name
+
+# imports
+import os
+import time
+import shutil
+import threading
+import pytest
+from imqcam_uploaders.uploaders.directory_watcher import IMQCAMDirectoryWatcher, main
+
+# pylint: disable=unused-import
+from .fixtures import local_tests_dir, random_100_kb, fake_girder_server
+
+
+def get_uploaded_contents(server, folder_id, name):
+    """Return the contents of the File in an Item in the fake server, or None"""
+    item = server.find_item(folder_id, name)
+    if item is None:
+        return None
+    with server.lock:
+        (file_id,) = [
+            file_id
+            for file_id, doc in server.files.items()
+            if doc["itemId"] == item["_id"]
+        ]
+        return server.file_contents[file_id]
+
+
+@pytest.mark.parametrize("use_polling", [True, False])
+def test_directory_watcher(
+    local_tests_dir, random_100_kb, fake_girder_server, use_polling
+):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / f"{test_directory_watcher.__name__}_{use_polling}"
+    assert not test_dir.is_dir()
+    test_dir.mkdir()
+    try:
+        (test_dir / "existing.bin").write_bytes(random_100_kb)
+        watcher = IMQCAMDirectoryWatcher(
+            server.api_url,
+            server.API_KEY,
+            stable_seconds=0.3,
+            poll_interval=0.05,
+            use_polling=use_polling,
+            manifest_path=test_dir / "manifest.db",
+        )
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(
+                watcher.watch_directory(
+                    test_dir,
+                    metadata={"instrument": "test"},
+                    relative_to=test_dir,
+                    root_folder_id=root_folder_id,
+                    n_threads=2,
+                    validation_mode="metadata",
+                )
+            )
+        )
+        thread.start()
+        try:
+            # the existing file is uploaded once it's been stable long enough
+            deadline = time.monotonic() + 10
+            while server.find_item(root_folder_id, "existing.bin") is None:
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+            # a file written slowly isn't uploaded until it's complete
+            (test_dir / "subdir").mkdir()
+            with open(test_dir / "subdir" / "slow.bin", "wb") as fp:
+                for ichunk in range(5):
+                    fp.write(random_100_kb[ichunk * 20000 : (ichunk + 1) * 20000])
+                    fp.flush()
+                    time.sleep(0.1)
+            (test_dir / "fast.bin").write_bytes(random_100_kb[:1000])
+            deadline = time.monotonic() + 10
+            while (
+                len(server.child_folders(root_folder_id)) == 0
+                or server.find_item(
+                    server.child_folders(root_folder_id)[0]["_id"], "slow.bin"
+                )
+                is None
+                or server.find_item(root_folder_id, "fast.bin") is None
+            ):
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+            # touching an uploaded file doesn't upload it again as a new Item
+            existing_stat = (test_dir / "existing.bin").stat()
+            os.utime(
+                test_dir / "existing.bin",
+                ns=(existing_stat.st_atime_ns, existing_stat.st_mtime_ns + 10**9),
+            )
+            time.sleep(1.0)
+        finally:
+            watcher.stop()
+            thread.join()
+            watcher.close()
+        (summary,) = results
+        (subdir,) = server.child_folders(root_folder_id)
+        assert summary.n_uploaded == 3
+        assert summary.n_skipped == 1
+        assert summary.n_failed == 0
+        assert [
+            item["name"]
+            for item in server.items.values()
+            if item["folderId"] == root_folder_id
+        ].count("existing.bin") == 1
+        assert get_uploaded_contents(server, root_folder_id, "existing.bin") == (
+            random_100_kb
+        )
+        assert get_uploaded_contents(server, subdir["_id"], "slow.bin") == (
+            random_100_kb
+        )
+        assert get_uploaded_contents(server, root_folder_id, "fast.bin") == (
+            random_100_kb[:1000]
+        )
+        item = server.find_item(root_folder_id, "fast.bin")
+        assert item["meta"]["instrument"] == "test"
+        # the manifest in the watched directory wasn't uploaded
+        assert server.find_item(root_folder_id, "manifest.db") is None
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_directory_watcher_main(local_tests_dir, random_100_kb, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_directory_watcher_main.__name__
+    assert not test_dir.is_dir()
+    test_dir.mkdir()
+    try:
+        (test_dir / "existing.bin").write_bytes(random_100_kb)
+        # watch for a limited time from the command line
+        start = time.monotonic()
+        main(
+            [
+                str(test_dir),
+                "--api_url",
+                server.api_url,
+                "--api_key",
+                server.API_KEY,
+                "--root_folder_id",
+                root_folder_id,
+                "--stable_seconds",
+                "0",
+                "--use_polling",
+                "--poll_interval",
+                "0.1",
+                "--watch_seconds",
+                "0.5",
+            ]
+        )
+        assert time.monotonic() - start < 5
+        (folder,) = server.child_folders(root_folder_id)
+        assert folder["name"] == test_dir.name
+        assert get_uploaded_contents(server, folder["_id"], "existing.bin") == (
+            random_100_kb
+        )
+    finally:
+        shutil.rmtree(test_dir)
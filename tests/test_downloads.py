@@ -0,0 +1,105 @@
+" Testing the helpers for downloading Girder Folder trees to disk "
+
+# imports
+import io
+import shutil
+import hashlib
+import pathlib
+import pytest
+from imqcam_uploaders.utilities.downloads import (
+    PARTIAL_DOWNLOAD_SUFFIX,
+    walk_girder_folder,
+    get_download_path,
+    get_expected_hashes,
+    local_file_matches,
+    download_girder_file,
+)
+
+# pylint: disable=unused-import
+from .fixtures import local_tests_dir, fake_girder_server, fake_girder_client
+
+
+def test_walk_girder_folder(fake_girder_server, fake_girder_client):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    client = fake_girder_client
+    folder_a = server.create_folder(root_folder_id, "a")
+    folder_b = server.create_folder(folder_a, "b")
+    server.create_folder(root_folder_id, "c")
+    for folder_id, name in ((root_folder_id, "top.bin"), (folder_b, "deep.bin")):
+        client.uploadStreamToFolder(folder_id, io.BytesIO(b"data"), name, 4)
+    walked = {
+        names: [item["name"] for item in items]
+        for names, items in walk_girder_folder(client, root_folder_id, n_threads=2)
+    }
+    assert walked == {
+        (): ["top.bin"],
+        ("a",): [],
+        ("c",): [],
+        ("a", "b"): ["deep.bin"],
+    }
+
+
+def test_get_download_path():
+    dirpath = pathlib.Path("mirror")
+    assert get_download_path(dirpath, ("a", "b.bin")) == dirpath / "a" / "b.bin"
+    for names in (("..", "b.bin"), ("a/b",), ("",)):
+        with pytest.raises(ValueError):
+            _ = get_download_path(dirpath, names)
+
+
+def test_get_expected_hashes():
+    item = {"meta": {"checksum": {"sha256": "abc"}}}
+    assert get_expected_hashes(item, {"sha512": "def"}, 1) == {
+        "sha256": "abc",
+        "sha512": "def",
+    }
+    # an Item's checksum doesn't apply to any one of several Files in it
+    assert get_expected_hashes(item, {}, 2) == {}
+    assert get_expected_hashes({"meta": {}}, {}, 1) == {}
+
+
+def test_download_girder_file(local_tests_dir, fake_girder_server, fake_girder_client):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    client = fake_girder_client
+    contents = b"0123456789" * 10000
+    file_doc = client.uploadStreamToFolder(
+        root_folder_id, io.BytesIO(contents), "data.bin", len(contents)
+    )
+    expected = {"sha256": hashlib.sha256(contents).hexdigest()}
+    test_dir = local_tests_dir / test_download_girder_file.__name__
+    assert not test_dir.is_dir()
+    test_dir.mkdir()
+    try:
+        filepath = test_dir / "data.bin"
+        partial_path = test_dir / f"data.bin{PARTIAL_DOWNLOAD_SUFFIX}"
+        assert not local_file_matches(filepath, len(contents), expected)
+        assert download_girder_file(client, file_doc, filepath, expected) == len(
+            contents
+        )
+        assert filepath.read_bytes() == contents
+        assert not partial_path.exists()
+        assert local_file_matches(filepath, len(contents), expected)
+        assert not local_file_matches(filepath, len(contents), {"sha256": "0" * 64})
+        # only the rest of a partial download is downloaded
+        filepath.unlink()
+        partial_path.write_bytes(contents[:30000])
+        assert download_girder_file(client, file_doc, filepath, expected) == 70000
+        assert filepath.read_bytes() == contents
+        # partial downloads longer than the File are started over
+        filepath.unlink()
+        partial_path.write_bytes(contents + b"extra")
+        assert download_girder_file(client, file_doc, filepath, expected) == len(
+            contents
+        )
+        assert filepath.read_bytes() == contents
+        # files that don't match their hashes are deleted
+        filepath.unlink()
+        partial_path.write_bytes(b"corrupted")
+        with pytest.raises(ValueError):
+            _ = download_girder_file(client, file_doc, filepath, expected)
+        assert not filepath.exists()
+        assert not partial_path.exists()
+    finally:
+        shutil.rmtree(test_dir)
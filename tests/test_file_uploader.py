@@ -3,8 +3,10 @@
 # pylint: disable=redefined-outer-name
 
 # imports
+import io
 import pathlib
 import json
+import hashlib
 import requests
 import shutil
 import importlib.metadata
@@ -28,6 +30,8 @@ from .fixtures import (
     ci_testing_girder_folder_id,
     random_100_kb,
     random_json_string,
+    fake_girder_server,
+    fake_girder_client,
 )
 
 
@@ -84,6 +88,7 @@ def test_file_uploader(
         ref_metadata["uploaderVersion"] = importlib.metadata.version("imqcam_uploaders")
         file_hash = get_on_disk_file_hash(test_filepath)
         ref_metadata["checksum"] = {"sha256": file_hash}
+        ref_metadata["validationMode"] = "full"
         assert ref_metadata == metadata_read_back
         hash_read_back = get_girder_file_hash(client, file_id)
         assert hash_read_back == file_hash
@@ -146,6 +151,8 @@ def test_file_uploader_root_folder_id(
             ci_testing_girder_folder_id,
             "--root_folder_path",
             "unused",
+            "--validation_mode",
+            "sample",
         ]
         # run it from the "main" function instead
         main(args)
@@ -161,6 +168,7 @@ def test_file_uploader_root_folder_id(
         ref_metadata["uploaderVersion"] = importlib.metadata.version("imqcam_uploaders")
         file_hash = get_on_disk_file_hash(test_filepath)
         ref_metadata["checksum"] = {"sha256": file_hash}
+        ref_metadata["validationMode"] = "sample"
         assert ref_metadata == metadata_read_back
         hash_read_back = get_girder_file_hash(client, file_id)
         assert hash_read_back == file_hash
@@ -227,3 +235,254 @@ def test_file_uploader_bad_relative_to(
             _ = client.delete(f"folder/{girder_test_folder_id}")
         # delete the local testing folder
         shutil.rmtree(test_dir)
+
+
+def test_file_uploader_resume(
+    local_tests_dir, fake_girder_server, fake_girder_client, random_100_kb
+):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_file_uploader_resume.__name__
+    test_filepath = test_dir / "test_file.bin"
+    assert not test_dir.is_dir()
+    test_dir.mkdir()
+    try:
+        with open(test_filepath, "wb") as fp:
+            fp.write(random_100_kb * 5)
+        init_args = (server.api_url, server.API_KEY)
+        # upload the file in small chunks, with the connection "dropping" partway
+        uploader = IMQCAMFileUploader(
+            *init_args, manifest_path=test_dir / "manifest.db"
+        )
+        uploader._girder_client.MAX_CHUNK_SIZE = 100000
+        chunk_offsets = []
+        original_post = uploader._girder_client.post
+
+        def dropping_post(path, *args, **kwargs):
+            if path == "file/chunk":
+                if len(chunk_offsets) == 3:
+                    raise requests.exceptions.ConnectionError("Dropped connection")
+                chunk_offsets.append(kwargs["parameters"]["offset"])
+            return original_post(path, *args, **kwargs)
+
+        uploader._girder_client.post = dropping_post
+        upload_kwargs = {
+            "relative_to": test_dir.parent,
+            "root_folder_id": root_folder_id,
+        }
+        with pytest.raises(requests.exceptions.ConnectionError):
+            uploader.upload_file(test_filepath, **upload_kwargs)
+        uploader.close()
+        # start again, and make sure only the rest of the file is sent
+        uploader = IMQCAMFileUploader(
+            *init_args, manifest_path=test_dir / "manifest.db"
+        )
+        uploader._girder_client.MAX_CHUNK_SIZE = 100000
+        original_post = uploader._girder_client.post
+        chunk_offsets.clear()
+
+        def counting_post(path, *args, **kwargs):
+            if path == "file/chunk":
+                chunk_offsets.append(kwargs["parameters"]["offset"])
+            return original_post(path, *args, **kwargs)
+
+        uploader._girder_client.post = counting_post
+        assert uploader.upload_file(test_filepath, **upload_kwargs)
+        uploader.close()
+        assert chunk_offsets == [300000, 400000]
+        _, file_id = get_girder_item_and_file_id(
+            fake_girder_client,
+            test_filepath.relative_to(test_dir.parent),
+            root_folder_id=root_folder_id,
+        )
+        assert server.file_hash(file_id) == get_on_disk_file_hash(test_filepath)
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_file_uploader_request_count(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_file_uploader_request_count.__name__
+    test_subdir = test_dir / "subdir"
+    assert not test_dir.is_dir()
+    test_subdir.mkdir(parents=True)
+    try:
+        test_filepaths = [test_subdir / f"test_file_{i}.bin" for i in range(3)]
+        for test_filepath in test_filepaths:
+            test_filepath.write_bytes(b"0123456789" * 100)
+        uploader = IMQCAMFileUploader(server.api_url, server.API_KEY)
+        upload_kwargs = {
+            "relative_to": test_dir.parent,
+            "root_folder_id": root_folder_id,
+            "show_progress": False,
+        }
+
+        def requests_for_upload(test_filepath, validation_mode):
+            server.reset_request_log()
+            uploader.upload_file(
+                test_filepath, validation_mode=validation_mode, **upload_kwargs
+            )
+            return [
+                (method, route.split("/")[0]) for method, route in server.request_log
+            ]
+
+        # the first upload also creates the Folders
+        _ = requests_for_upload(test_filepaths[0], "metadata")
+        # after that, a new file only needs to be looked for, uploaded (with one
+        # request to start the upload and one for its only chunk, so that both can be
+        # retried), and have its metadata set (which is checked from the response)
+        assert requests_for_upload(test_filepaths[1], "metadata") == [
+            ("GET", "item"),
+            ("POST", "file"),
+            ("POST", "file"),
+            ("PUT", "item"),
+        ]
+        # full validation adds one download
+        assert requests_for_upload(test_filepaths[2], "full") == [
+            ("GET", "item"),
+            ("POST", "file"),
+            ("POST", "file"),
+            ("PUT", "item"),
+            ("GET", "file"),
+        ]
+        # a file that already exists is found with two requests and not uploaded
+        assert requests_for_upload(test_filepaths[0], "metadata") == [
+            ("GET", "item"),
+            ("GET", "item"),
+        ]
+        item = server.find_item(
+            next(
+                folder["_id"]
+                for folder in server.child_folders(
+                    server.child_folders(root_folder_id)[0]["_id"]
+                )
+            ),
+            test_filepaths[0].name,
+        )
+        assert item["meta"]["validationMode"] == "metadata"
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_file_uploader_upload_stream(fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    contents = bytes(range(256)) * 100
+    uploader = IMQCAMFileUploader(server.api_url, server.API_KEY)
+    upload_kwargs = {"root_folder_id": root_folder_id, "show_progress": False}
+
+    def uploaded_contents(folder_id, name):
+        item = server.find_item(folder_id, name)
+        assert item is not None
+        (file_doc,) = [
+            doc for doc in server.files.values() if doc["itemId"] == item["_id"]
+        ]
+        return item, server.file_contents[file_doc["_id"]]
+
+    try:
+        # a seekable file object is uploaded without being buffered
+        with io.BytesIO(contents) as stream:
+            assert uploader.upload_stream(
+                stream, "from_file.bin", metadata={"source": "test"}, **upload_kwargs
+            )
+        item, uploaded = uploaded_contents(root_folder_id, "from_file.bin")
+        assert uploaded == contents
+        assert item["meta"]["source"] == "test"
+        assert (
+            item["meta"]["checksum"]["sha256"] == hashlib.sha256(contents).hexdigest()
+        )
+        # an iterator of chunks with no size is buffered, and a name with parent
+        # directories is uploaded to new Folders
+        assert uploader.upload_stream(
+            (contents[i : i + 1000] for i in range(0, len(contents), 1000)),
+            "sub/dir/from_chunks.bin",
+            validation_mode="full",
+            **upload_kwargs,
+        )
+        (sub_folder,) = server.child_folders(root_folder_id)
+        (dir_folder,) = server.child_folders(sub_folder["_id"])
+        _, uploaded = uploaded_contents(dir_folder["_id"], "from_chunks.bin")
+        assert uploaded == contents
+        # uploading the same name and size again is skipped
+        server.reset_request_log()
+        assert not uploader.upload_stream(
+            io.BytesIO(contents), "sub/dir/from_chunks.bin", **upload_kwargs
+        )
+        assert server.count_requests("POST") == 0
+        # streams that don't hold the given number of bytes are errors
+        with pytest.raises(ValueError):
+            uploader.upload_stream(
+                io.BytesIO(contents),
+                "too_long.bin",
+                size=len(contents) - 1,
+                **upload_kwargs,
+            )
+    finally:
+        uploader.close()
+
+
+def test_file_uploader_dedup(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_file_uploader_dedup.__name__
+    assert not test_dir.is_dir()
+    test_dir.mkdir(parents=True)
+    uploader = IMQCAMFileUploader(
+        server.api_url,
+        server.API_KEY,
+        manifest_path=test_dir / "manifest.sqlite",
+        dedup=True,
+    )
+    upload_kwargs = {
+        "relative_to": test_dir,
+        "root_folder_id": root_folder_id,
+        "show_progress": False,
+    }
+    try:
+        contents = b"the same calibration file" * 1000
+        for subdir in ("run_1", "run_2", "run_3"):
+            (test_dir / subdir).mkdir()
+            (test_dir / subdir / f"{subdir}_cal.bin").write_bytes(contents)
+        # the first copy is uploaded (and only hashed while it's uploaded, since
+        # there are no files of the same size to copy)
+        assert uploader.upload_file(
+            test_dir / "run_1" / "run_1_cal.bin", **upload_kwargs
+        )
+        assert server.count_requests("POST", "file$") == 1
+        assert uploader.timer.phase_totals()["hash"]["count"] == 1
+        # later copies in other Folders are copied on the server instead
+        server.reset_request_log()
+        assert uploader.upload_file(
+            test_dir / "run_2" / "run_2_cal.bin",
+            validation_mode="full",
+            **upload_kwargs,
+        )
+        assert server.count_requests("POST", "file$") == 0
+        assert server.count_requests("POST", r"file/\w+/copy") == 1
+        folder_id = get_girder_folder_id(
+            uploader._girder_client,  # pylint: disable=protected-access
+            "run_2",
+            root_folder_id=root_folder_id,
+        )
+        item = server.find_item(folder_id, "run_2_cal.bin")
+        assert (
+            item["meta"]["checksum"]["sha256"] == hashlib.sha256(contents).hexdigest()
+        )
+        (file_doc,) = [
+            doc for doc in server.files.values() if doc["itemId"] == item["_id"]
+        ]
+        assert file_doc["name"] == "run_2_cal.bin"
+        assert server.file_contents[file_doc["_id"]] == contents
+        # if the file can't be copied anymore, it's uploaded instead
+        server.reset_request_log()
+        uploader._girder_client.delete(  # pylint: disable=protected-access
+            f"item/{item['_id']}"
+        )
+        assert uploader.upload_file(
+            test_dir / "run_3" / "run_3_cal.bin", **upload_kwargs
+        )
+        assert server.count_requests("POST", "file$") == 1
+    finally:
+        uploader.close()
+        shutil.rmtree(test_dir)
@@ -113,6 +113,7 @@ def test_run_upload(
         ref_metadata["uploaderVersion"] = importlib.metadata.version("imqcam_uploaders")
         file_hash = get_on_disk_file_hash(test_filepath)
         ref_metadata["checksum"] = {"sha256": file_hash}
+        ref_metadata["validationMode"] = "full"
         assert ref_metadata == metadata_read_back
         hash_read_back = get_girder_file_hash(client, file_id)
         assert hash_read_back == file_hash
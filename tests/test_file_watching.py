@@ -0,0 +1,98 @@
+" Tests for finding files that are created or modified in a directory tree "
+
+# pylint: disable=redefined-outer-name
+
+# imports
+import time
+import shutil
+import pytest
+from imqcam_uploaders.utilities.file_watching import (
+    FileStabilityTracker,
+    PollingFileWatcher,
+    InotifyFileWatcher,
+    get_inotify_libc,
+    get_file_watcher,
+)
+
+# pylint: disable=unused-import
+from .fixtures import local_tests_dir
+
+
+def collect_changed_paths(watcher, seconds):
+    """Return every path a watcher reports in some amount of time"""
+    changed = set()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        changed.update(watcher.get_changed_paths(0.05))
+    return changed
+
+
+def test_file_stability_tracker(local_tests_dir):
+    test_dir = local_tests_dir / test_file_stability_tracker.__name__
+    assert not test_dir.is_dir()
+    test_dir.mkdir()
+    try:
+        test_filepath = test_dir / "test_file.bin"
+        test_filepath.write_bytes(b"0" * 100)
+        tracker = FileStabilityTracker(0.2)
+        tracker.add(test_filepath)
+        tracker.add(test_dir / "does_not_exist.bin")
+        # nothing is stable right away, and missing files are dropped
+        assert tracker.pop_stable() == []
+        assert len(tracker) == 1
+        # a file that keeps changing isn't stable
+        for _ in range(3):
+            time.sleep(0.1)
+            with open(test_filepath, "ab") as fp:
+                fp.write(b"1")
+            assert tracker.pop_stable() == []
+        time.sleep(0.25)
+        assert tracker.pop_stable() == [test_filepath]
+        assert len(tracker) == 0
+        # with no window, files are stable as soon as they're checked
+        tracker = FileStabilityTracker(0)
+        tracker.add(test_filepath)
+        assert tracker.pop_stable() == [test_filepath]
+    finally:
+        shutil.rmtree(test_dir)
+
+
+@pytest.mark.parametrize("use_polling", [True, False])
+def test_file_watchers(local_tests_dir, use_polling):
+    if not use_polling and get_inotify_libc() is None:
+        pytest.skip("inotify is not available on this system")
+    test_dir = local_tests_dir / f"{test_file_watchers.__name__}_{use_polling}"
+    assert not test_dir.is_dir()
+    (test_dir / "existing_dir").mkdir(parents=True)
+    try:
+        existing_filepath = test_dir / "existing_dir" / "existing.bin"
+        existing_filepath.write_bytes(b"0" * 100)
+        watcher = get_file_watcher(test_dir, use_polling=use_polling, poll_interval=0.1)
+        assert isinstance(
+            watcher, PollingFileWatcher if use_polling else InotifyFileWatcher
+        )
+        try:
+            # files that already exist aren't reported
+            assert collect_changed_paths(watcher, 0.3) == set()
+            # new files, modified files, and files in new directories are
+            new_filepath = test_dir / "new.bin"
+            new_filepath.write_bytes(b"1" * 100)
+            with open(existing_filepath, "ab") as fp:
+                fp.write(b"2" * 100)
+            (test_dir / "new_dir" / "new_subdir").mkdir(parents=True)
+            nested_filepath = test_dir / "new_dir" / "new_subdir" / "nested.bin"
+            nested_filepath.write_bytes(b"3" * 100)
+            assert collect_changed_paths(watcher, 0.5) == {
+                new_filepath,
+                existing_filepath,
+                nested_filepath,
+            }
+            # files moved into the tree are reported too
+            moved_filepath = test_dir / "new_dir" / "moved.bin"
+            (local_tests_dir / f"{test_dir.name}.tmp").write_bytes(b"4" * 100)
+            (local_tests_dir / f"{test_dir.name}.tmp").rename(moved_filepath)
+            assert collect_changed_paths(watcher, 0.5) == {moved_filepath}
+        finally:
+            watcher.close()
+    finally:
+        shutil.rmtree(test_dir)
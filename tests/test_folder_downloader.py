@@ -0,0 +1,209 @@
+" Test mirroring Girder Folder trees into local directories "
+
+# imports
+import os
+import shutil
+import logging
+import pathlib
+import pytest
+from imqcam_uploaders.uploaders.directory_uploader import IMQCAMDirectoryUploader
+from imqcam_uploaders.uploaders.folder_downloader import IMQCAMFolderDownloader, main
+from imqcam_uploaders.utilities.downloads import PARTIAL_DOWNLOAD_SUFFIX
+from imqcam_uploaders.utilities.packing import PACK_NAME_PREFIX
+from .fake_girder import FakeGirderServer
+
+# pylint: disable=unused-import
+from .fixtures import local_tests_dir, fake_girder_server
+
+# Requests that download the contents of Files
+DOWNLOAD_ROUTE = r"file/\w+/download"
+
+
+def upload_test_tree(server, root_folder_id, test_dir):
+    """Write some files in a directory tree and upload them to the fake server (with
+    their checksums in their metadata), returning their paths relative to the
+    directory's parent
+    """
+    rel_filepaths = []
+    for ifile in range(12):
+        rel_filepath = pathlib.Path(
+            test_dir.name, f"subdir_{ifile % 3}", f"{ifile}.bin"
+        )
+        filepath = test_dir.parent / rel_filepath
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        filepath.write_bytes(os.urandom(1000 * ifile + 1))
+        rel_filepaths.append(rel_filepath)
+    uploader = IMQCAMDirectoryUploader(
+        server.api_url, server.API_KEY, streamlevel=logging.WARNING
+    )
+    try:
+        summary = uploader.upload_directory(
+            test_dir, root_folder_id=root_folder_id, validation_mode="metadata"
+        )
+    finally:
+        uploader.close()
+    assert summary.n_uploaded == len(rel_filepaths)
+    return rel_filepaths
+
+
+def test_folder_downloader(local_tests_dir):
+    test_dir = local_tests_dir / test_folder_downloader.__name__
+    assert not test_dir.is_dir()
+    source_dir, mirror_dir = test_dir / "source" / "data", test_dir / "mirror"
+    with FakeGirderServer(hashsum_algorithms=("sha512",)) as server:
+        root_folder_id = server.create_root_folder()
+        try:
+            rel_filepaths = upload_test_tree(server, root_folder_id, source_dir)
+            args = [
+                str(mirror_dir),
+                "--api_url",
+                server.api_url,
+                "--api_key",
+                server.API_KEY,
+                "--root_folder_id",
+                root_folder_id,
+                "--n_threads",
+                "3",
+            ]
+            main(args)
+            for rel_filepath in rel_filepaths:
+                assert (mirror_dir / rel_filepath).read_bytes() == (
+                    source_dir.parent / rel_filepath
+                ).read_bytes()
+            assert not list(mirror_dir.rglob(f"*{PARTIAL_DOWNLOAD_SUFFIX}"))
+            # nothing is downloaded again if it's all there already
+            server.reset_request_log()
+            main(args)
+            assert server.count_requests("GET", DOWNLOAD_ROUTE) == 0
+            # files that changed are downloaded again, and partial downloads are
+            # resumed from where they stopped
+            changed, partial = rel_filepaths[4], rel_filepaths[7]
+            contents = (mirror_dir / changed).read_bytes()
+            (mirror_dir / changed).write_bytes(bytes(len(contents)))
+            contents = (mirror_dir / partial).read_bytes()
+            (mirror_dir / partial).unlink()
+            partial_path = mirror_dir / f"{partial}{PARTIAL_DOWNLOAD_SUFFIX}"
+            partial_path.write_bytes(contents[:5000])
+            downloader = IMQCAMFolderDownloader(
+                server.api_url, server.API_KEY, streamlevel=logging.WARNING
+            )
+            try:
+                summary = downloader.download_folder(
+                    mirror_dir, root_folder_id=root_folder_id
+                )
+            finally:
+                downloader.close()
+            assert (summary.n_downloaded, summary.n_skipped) == (2, 10)
+            assert summary.n_bytes_downloaded == len(contents) - 5000 + 4001
+            for rel_filepath in (changed, partial):
+                assert (mirror_dir / rel_filepath).read_bytes() == (
+                    source_dir.parent / rel_filepath
+                ).read_bytes()
+        finally:
+            shutil.rmtree(test_dir)
+
+
+def test_folder_downloader_packs(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_folder_downloader_packs.__name__
+    assert not test_dir.is_dir()
+    source_dir, mirror_dir = test_dir / "source", test_dir / "mirror"
+    try:
+        (source_dir / "subdir").mkdir(parents=True)
+        for name in ("a.txt", "c.txt"):
+            (source_dir / "subdir" / name).write_bytes(os.urandom(100))
+        (source_dir / "subdir" / "big.bin").write_bytes(os.urandom(5000))
+        uploader = IMQCAMDirectoryUploader(
+            server.api_url, server.API_KEY, streamlevel=logging.WARNING
+        )
+        try:
+            # a changed file goes in a new pack, which has the version to use
+            for size in (100, 200):
+                (source_dir / "subdir" / "b.txt").write_bytes(os.urandom(size))
+                summary = uploader.upload_directory(
+                    source_dir / "subdir",
+                    relative_to=source_dir,
+                    root_folder_id=root_folder_id,
+                    pack_threshold=1000,
+                    validation_mode="metadata",
+                )
+                assert summary.n_failed == 0
+        finally:
+            uploader.close()
+        downloader = IMQCAMFolderDownloader(
+            server.api_url, server.API_KEY, streamlevel=logging.WARNING
+        )
+        try:
+            server.reset_request_log()
+            summary = downloader.download_folder(
+                mirror_dir, root_folder_id=root_folder_id
+            )
+            assert (summary.n_downloaded, summary.n_failed) == (4, 0)
+            # each pack is downloaded once, and packs aren't written as files
+            assert server.count_requests("GET", DOWNLOAD_ROUTE) == 3
+            assert not list(mirror_dir.rglob(f"{PACK_NAME_PREFIX}*"))
+            rel_paths = [
+                path.relative_to(mirror_dir)
+                for path in mirror_dir.rglob("*")
+                if path.is_file()
+            ]
+            assert sorted(rel_paths) == sorted(
+                pathlib.Path("subdir", name)
+                for name in ("a.txt", "b.txt", "c.txt", "big.bin")
+            )
+            for rel_path in rel_paths:
+                assert (mirror_dir / rel_path).read_bytes() == (
+                    source_dir / rel_path
+                ).read_bytes()
+            # files from packs that are already there aren't downloaded again, and
+            # ones that changed are
+            (mirror_dir / "subdir" / "a.txt").write_bytes(b"changed")
+            server.reset_request_log()
+            summary = downloader.download_folder(
+                mirror_dir, root_folder_id=root_folder_id
+            )
+            assert (summary.n_downloaded, summary.n_skipped) == (1, 3)
+            assert server.count_requests("GET", DOWNLOAD_ROUTE) == 1
+            assert (mirror_dir / "subdir" / "a.txt").read_bytes() == (
+                source_dir / "subdir" / "a.txt"
+            ).read_bytes()
+        finally:
+            downloader.close()
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_folder_downloader_failures(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_folder_downloader_failures.__name__
+    assert not test_dir.is_dir()
+    source_dir, mirror_dir = test_dir / "source" / "data", test_dir / "mirror"
+    try:
+        rel_filepaths = upload_test_tree(server, root_folder_id, source_dir)
+        # a file that doesn't match its recorded checksum fails, and isn't kept
+        bad_item = next(
+            item for item in server.items.values() if item["name"] == "5.bin"
+        )
+        bad_item["meta"]["checksum"]["sha256"] = "0" * 64
+        with pytest.raises(RuntimeError):
+            main(
+                [
+                    str(mirror_dir),
+                    "--api_url",
+                    server.api_url,
+                    "--api_key",
+                    server.API_KEY,
+                    "--root_folder_id",
+                    root_folder_id,
+                ]
+            )
+        bad_rel_filepath = next(fp for fp in rel_filepaths if fp.name == "5.bin")
+        assert not (mirror_dir / bad_rel_filepath).exists()
+        assert not list(mirror_dir.rglob(f"*{PARTIAL_DOWNLOAD_SUFFIX}"))
+        for rel_filepath in rel_filepaths:
+            if rel_filepath != bad_rel_filepath:
+                assert (mirror_dir / rel_filepath).is_file()
+    finally:
+        shutil.rmtree(test_dir)
@@ -3,12 +3,20 @@
 # pylint: disable=redefined-outer-name
 
 # imports
+import io
 import pathlib
 import pytest
+from girder_client import HttpError
 from imqcam_uploaders.utilities.girder import (
+    GirderFolderIDCache,
+    GirderCollectionIndex,
+    GirderItemIndex,
+    get_folder_id_cache_root_key,
+    get_girder_collection_id,
     get_girder_folder_id,
     get_girder_item_id,
     get_girder_item_and_file_id,
+    plan_girder_folders,
 )
 
 # pylint: disable=unused-import
@@ -19,6 +27,8 @@ from .fixtures import (
     ci_testing_girder_folder_id,
     static_file_name,
     static_file_id,
+    fake_girder_server,
+    fake_girder_client,
 )
 
 
@@ -61,6 +71,14 @@ def test_get_girder_folder_id_with_root_folder_id(
     assert test_folder_id == static_folder_id
 
 
+def test_get_girder_collection_id(fake_girder_server, fake_girder_client):
+    server = fake_girder_server
+    collection_id = server.create_collection("Test")
+    assert get_girder_collection_id(fake_girder_client, "Test") == collection_id
+    with pytest.raises(ValueError):
+        _ = get_girder_collection_id(fake_girder_client, "never_name_a_collection_this")
+
+
 def test_get_girder_folder_id_arg_conflict(
     default_girder_client,
     default_collection_name,
@@ -162,3 +180,212 @@ def test_get_girder_item_and_file_id(
     )
     assert item_id == "65e0ca7e02ad536bd833df3c"
     assert file_id == static_file_id
+
+
+def test_folder_id_cache_longest_prefix():
+    cache = GirderFolderIDCache()
+    root_key = ("url", "folder", "root_id")
+    assert cache.get_longest_prefix(root_key, ("a", "b", "c")) == (0, None)
+    cache.add(root_key, ("a",), "a_id")
+    cache.add(root_key, ("a", "b"), "b_id")
+    assert cache.get_longest_prefix(root_key, ("a", "b", "c")) == (2, "b_id")
+    assert cache.get_longest_prefix(root_key, ("a", "d")) == (1, "a_id")
+    assert cache.get_longest_prefix(("url", "folder", "other"), ("a",)) == (0, None)
+
+
+def test_folder_id_cache_lru_eviction():
+    cache = GirderFolderIDCache(max_size=2)
+    root_key = ("url", "collection", "Test")
+    cache.add(root_key, ("a",), "a_id")
+    cache.add(root_key, ("b",), "b_id")
+    # using "a" makes "b" the least recently used
+    assert cache.get_longest_prefix(root_key, ("a",)) == (1, "a_id")
+    cache.add(root_key, ("c",), "c_id")
+    assert len(cache) == 2
+    assert cache.get_longest_prefix(root_key, ("b",)) == (0, None)
+    assert cache.get_longest_prefix(root_key, ("a",)) == (1, "a_id")
+
+
+def test_folder_id_cache_invalidate():
+    cache = GirderFolderIDCache()
+    root_key = ("url", "folder", "root_id")
+    cache.add(root_key, ("a",), "a_id")
+    cache.add(root_key, ("a", "b"), "b_id")
+    cache.add(root_key, ("c",), "c_id")
+    cache.invalidate(root_key, ("a",))
+    assert cache.get_longest_prefix(root_key, ("a", "b")) == (0, None)
+    assert cache.get_longest_prefix(root_key, ("c",)) == (1, "c_id")
+    cache.clear()
+    assert len(cache) == 0
+
+
+class CollectionListingClient:
+    "Just enough of a GirderClient to count how many times Collections are listed"
+
+    urlBase = "https://not.a.girder.instance/api/v1/"
+    token = "not_a_token"
+
+    def __init__(self, collection_names):
+        self.collection_names = collection_names
+        self.n_listings = 0
+
+    def listCollection(self):  # pylint: disable=invalid-name
+        self.n_listings += 1
+        for icoll, name in enumerate(self.collection_names):
+            yield {"_modelType": "collection", "name": name, "_id": f"id_{icoll}"}
+
+
+def test_collection_index_lists_once():
+    client = CollectionListingClient(["first", "second"])
+    index = GirderCollectionIndex()
+    assert index.get_id(client, "second") == "id_1"
+    assert index.get_id(client, "first") == "id_0"
+    assert client.n_listings == 1
+    # names that weren't found fail without listing Collections again
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            _ = index.get_id(client, "third")
+    assert client.n_listings == 1
+    # until the index is refreshed
+    client.collection_names.append("third")
+    with pytest.raises(ValueError):
+        _ = index.get_id(client, "third")
+    assert index.get_id(client, "third", refresh=True) == "id_2"
+    assert client.n_listings == 2
+
+
+def test_plan_girder_folders(fake_girder_server, fake_girder_client):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    client = fake_girder_client
+    cache = GirderFolderIDCache()
+    folder_rel_paths = [
+        pathlib.Path("a/b/c"),
+        pathlib.Path("a/b/d"),
+        pathlib.Path("a/b/c"),
+        pathlib.Path("e"),
+        pathlib.Path("."),
+    ]
+    # missing Folders aren't created unless asked
+    with pytest.raises(ValueError):
+        _ = plan_girder_folders(
+            client,
+            folder_rel_paths,
+            root_folder_id=root_folder_id,
+            create_if_not_found=False,
+            cache=cache,
+        )
+    # every unique Folder (a, a/b, a/b/c, a/b/d, and e) is looked for and created once
+    server.reset_request_log()
+    folder_ids = plan_girder_folders(
+        client, folder_rel_paths, root_folder_id=root_folder_id, cache=cache
+    )
+    assert server.count_requests("GET", r"^folder$") == 5
+    assert server.count_requests("POST", r"^folder$") == 5
+    assert set(folder_ids) == set(folder_rel_paths)
+    assert folder_ids[pathlib.Path(".")] == root_folder_id
+    for folder_rel_path, folder_id in folder_ids.items():
+        assert folder_id == get_girder_folder_id(
+            client, folder_rel_path, root_folder_id=root_folder_id, cache=None
+        )
+    # planning again only uses the cache
+    server.reset_request_log()
+    assert (
+        plan_girder_folders(
+            client, folder_rel_paths, root_folder_id=root_folder_id, cache=cache
+        )
+        == folder_ids
+    )
+    assert server.count_requests() == 0
+    # without a cache, existing Folders are found without creating anything
+    assert (
+        plan_girder_folders(
+            client, folder_rel_paths, root_folder_id=root_folder_id, cache=None
+        )
+        == folder_ids
+    )
+    assert server.count_requests("POST") == 0
+    # new Folders inside cached Folders that have since been deleted are created
+    # from the root again
+    client.delete(
+        f"folder/{get_girder_folder_id(client, 'a', root_folder_id=root_folder_id)}"
+    )
+    new_folder_ids = plan_girder_folders(
+        client, ["a/b/new", "e"], root_folder_id=root_folder_id, cache=cache
+    )
+    assert new_folder_ids[pathlib.Path("e")] == folder_ids[pathlib.Path("e")]
+    assert new_folder_ids[pathlib.Path("a/b/new")] == get_girder_folder_id(
+        client, "a/b/new", root_folder_id=root_folder_id, cache=None
+    )
+
+
+def test_plan_girder_folders_with_failing_listings(
+    fake_girder_server, fake_girder_client
+):
+    server = fake_girder_server
+    collection_id = server.create_collection("Test")
+    root_folder_id = server.create_folder(collection_id, "Test", "collection")
+    other_root_id = server.create_folder(collection_id, "Other", "collection")
+    client = fake_girder_client
+    cache = GirderFolderIDCache()
+    # cache Folders under both roots
+    for folder_id in (root_folder_id, other_root_id):
+        _ = plan_girder_folders(client, ["a/b"], root_folder_id=folder_id, cache=cache)
+    # if listing Folders always fails, the plan is retried once without the cached
+    # IDs under its root (which are forgotten), and then the error is raised
+    server.fail_routes[("GET", r"^folder$")] = 403
+    server.reset_request_log()
+    with pytest.raises(HttpError):
+        _ = plan_girder_folders(
+            client, ["a/b/c"], root_folder_id=root_folder_id, cache=cache
+        )
+    assert server.count_requests("GET", r"^folder$") == 2
+    root_key = get_folder_id_cache_root_key(client, root_folder_id, None)
+    assert cache.get_longest_prefix(root_key, ("a", "b"))[0] == 0
+    # errors that happen without any cached IDs aren't retried at all
+    server.reset_request_log()
+    with pytest.raises(HttpError):
+        _ = plan_girder_folders(
+            client, ["d"], root_folder_id=root_folder_id, cache=cache
+        )
+    assert server.count_requests("GET", r"^folder$") == 1
+
+
+def test_girder_item_index(fake_girder_server, fake_girder_client):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    folder_ids = [server.create_folder(root_folder_id, name) for name in "abc"]
+    client = fake_girder_client
+    # more Items than fit on one page of the listing
+    n_items = 60
+    for iitem in range(n_items):
+        item = client.createItem(folder_ids[0], f"{iitem}.bin")
+        client.uploadFile(item["_id"], io.BytesIO(b"0" * iitem), f"{iitem}.bin", iitem)
+    item = client.createItem(
+        folder_ids[1], "checked.bin", metadata={"checksum": {"sha256": "abc"}}
+    )
+    _ = client.createItem(folder_ids[1], "other.bin", metadata={"checksum": "abc"})
+    index = GirderItemIndex()
+    assert not index.has_folder(folder_ids[0])
+    server.reset_request_log()
+    index.add_folders(client, folder_ids * 2, n_threads=2)
+    # each Folder is listed once, in as many pages as it needs
+    assert server.count_requests("GET", r"^item$") == 3 + 1
+    assert server.count_requests() == server.count_requests("GET", r"^item$")
+    assert len(index) == 3
+    assert all(index.has_folder(folder_id) for folder_id in folder_ids)
+    for iitem in range(n_items):
+        item_id, size, checksum, _ = index.get_item(folder_ids[0], f"{iitem}.bin")
+        assert item_id == server.find_item(folder_ids[0], f"{iitem}.bin")["_id"]
+        assert size == iitem
+        assert checksum is None
+    assert index.get_item(folder_ids[1], "checked.bin") == (item["_id"], 0, "abc", None)
+    assert index.get_item(folder_ids[1], "other.bin")[2] is None
+    assert index.get_item(folder_ids[2], "0.bin") is None
+    # Folders that were already listed aren't listed again
+    server.reset_request_log()
+    index.add_folders(client, folder_ids[:1])
+    assert server.count_requests() == 0
+    index.clear()
+    assert len(index) == 0
+    assert index.get_item(folder_ids[0], "0.bin") is None
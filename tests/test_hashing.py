@@ -4,13 +4,23 @@
 
 # imports
 import shutil
+import hashlib
+import pytest
 from imqcam_uploaders.utilities.hashing import (
+    HashingReader,
     get_on_disk_file_hash,
+    get_on_disk_file_hashes,
     get_girder_file_hash,
+    hash_files,
 )
 
 # pylint: disable=unused-import
-from .fixtures import local_tests_dir, default_girder_client, static_file_id
+from .fixtures import (
+    local_tests_dir,
+    default_girder_client,
+    static_file_id,
+    random_100_kb,
+)
 
 
 def test_on_disk_file_hash(local_tests_dir):
@@ -30,8 +40,81 @@ def test_on_disk_file_hash(local_tests_dir):
         shutil.rmtree(test_dir_path)
 
 
+def test_hashing_reader(local_tests_dir, random_100_kb):
+    test_dir_path = local_tests_dir / test_hashing_reader.__name__
+    assert not test_dir_path.is_dir()
+    test_dir_path.mkdir()
+    try:
+        test_file_path = test_dir_path / "test_hash_file.bin"
+        with open(test_file_path, "wb") as fobj:
+            fobj.write(random_100_kb)
+        read_back = b""
+        with open(test_file_path, "rb") as fobj:
+            reader = HashingReader(fobj)
+            while True:
+                data = reader.read(30000)
+                if not data:
+                    break
+                read_back += data
+        assert read_back == random_100_kb
+        assert reader.n_bytes_read == len(random_100_kb)
+        assert reader.hexdigest() == get_on_disk_file_hash(test_file_path)
+    finally:
+        shutil.rmtree(test_dir_path)
+
+
 def test_girder_file_hash(default_girder_client, static_file_id):
     test_hash = get_girder_file_hash(default_girder_client, static_file_id)
     assert (
         test_hash == "30646dccdc85342957704a7902fb0946dd5451420feb92b76e347c721fc9d2d6"
     )
+
+
+@pytest.mark.parametrize("use_processes", [False, True])
+def test_hash_files(local_tests_dir, random_100_kb, use_processes):
+    test_dir_path = local_tests_dir / f"{test_hash_files.__name__}_{use_processes}"
+    assert not test_dir_path.is_dir()
+    test_dir_path.mkdir()
+    try:
+        filepaths = []
+        for ifile in range(20):
+            filepath = test_dir_path / f"test_file_{ifile}.bin"
+            filepath.write_bytes(random_100_kb[ifile * 1000 :])
+            filepaths.append(filepath)
+        missing_filepath = test_dir_path / "missing.bin"
+        algorithms = ("sha256", "md5", "blake2b")
+        # every file is hashed (from a generator) with every algorithm, using chunks
+        # smaller than the files
+        results = {
+            filepath: (file_hashes, file_stat)
+            for filepath, file_hashes, file_stat in hash_files(
+                (filepath for filepath in [*filepaths, missing_filepath]),
+                algorithms,
+                n_workers=4,
+                use_processes=use_processes,
+                chunk_size=30000,
+            )
+        }
+        assert set(results) == {*filepaths, missing_filepath}
+        # files that can't be read don't stop the others
+        assert results[missing_filepath] == (None, None)
+        for filepath in filepaths:
+            contents = filepath.read_bytes()
+            file_hashes, file_stat = results[filepath]
+            assert file_stat.st_size == file_hashes["size"] == len(contents)
+            for algorithm in algorithms:
+                assert (
+                    file_hashes[algorithm]
+                    == hashlib.new(algorithm, contents).hexdigest()
+                )
+        assert results[filepaths[0]][0]["sha256"] == get_on_disk_file_hash(filepaths[0])
+        assert get_on_disk_file_hashes(filepaths[0], ("md5",))[0] == {
+            "size": len(random_100_kb),
+            "md5": hashlib.md5(random_100_kb).hexdigest(),
+        }
+        # stopping early is fine
+        results = hash_files(filepaths, n_workers=2, use_processes=use_processes)
+        assert next(results)[0] in filepaths
+        results.close()
+    finally:
+        shutil.rmtree(test_dir_path)
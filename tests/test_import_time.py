@@ -0,0 +1,81 @@
+" Make sure the command line programs start quickly, without loading the network stack "
+
+# imports
+import sys
+import json
+import subprocess
+import pytest
+from .test_scripts import get_script_paths_from_pyproject_toml
+
+# Modules that shouldn't be imported until a connection to Girder is made
+DEFERRED_MODULES = (
+    "girder_client",
+    "requests",
+    "urllib3",
+    "tqdm",
+    "importlib.metadata",
+)
+
+# The most time (in seconds) importing an entry point module or printing its help
+# text may take (the fastest of a few runs, in a fresh interpreter)
+STARTUP_BUDGET = 0.75
+N_RUNS = 3
+
+# Run in a fresh interpreter: time some code, then print the time it took and which
+# of the deferred modules it imported as JSON
+STARTUP_SCRIPT = """
+import sys, json, time, contextlib, io
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        {code}
+    except SystemExit:
+        pass
+seconds = time.perf_counter() - start
+loaded = [name for name in {deferred!r} if name in sys.modules]
+print(json.dumps({{"seconds": seconds, "loaded": loaded}}))
+"""
+
+CLI_SCRIPTS = [
+    script_path
+    for script_path in get_script_paths_from_pyproject_toml()
+    if ".guis." not in script_path
+]
+
+
+def measure_startup(code):
+    """Run some code in new interpreters and return the fastest time it took, along
+    with the deferred modules it imported
+    """
+    results = []
+    for _ in range(N_RUNS):
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                STARTUP_SCRIPT.format(code=code, deferred=DEFERRED_MODULES),
+            ],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    return min(result["seconds"] for result in results), results[0]["loaded"]
+
+
+@pytest.mark.parametrize("script_path", CLI_SCRIPTS)
+def test_import_time(script_path):
+    module_name, _, _ = script_path.rpartition(":")
+    seconds, loaded = measure_startup(f"import {module_name}")
+    assert loaded == [], f"Importing {module_name} loaded {loaded}"
+    assert seconds < STARTUP_BUDGET, f"Importing {module_name} took {seconds:.3f} s"
+
+
+@pytest.mark.parametrize("script_path", CLI_SCRIPTS)
+def test_help_time(script_path):
+    module_name, _, function_name = script_path.rpartition(":")
+    seconds, loaded = measure_startup(
+        f"from {module_name} import {function_name}; {function_name}(['-h'])"
+    )
+    assert loaded == [], f"Printing help for {script_path} loaded {loaded}"
+    assert seconds < STARTUP_BUDGET, f"Printing help for {script_path} took {seconds}"
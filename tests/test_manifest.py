@@ -0,0 +1,228 @@
+" Tests for the local upload manifest "
+
+# pylint: disable=redefined-outer-name
+
+# imports
+import os
+import shutil
+import sqlite3
+import threading
+import pathlib
+from girder_client import HttpError
+from imqcam_uploaders.uploaders.manifest_reconciler import IMQCAMManifestReconciler
+from imqcam_uploaders.utilities.hashing import get_on_disk_file_hash
+from imqcam_uploaders.utilities.manifest import UploadManifest
+
+# pylint: disable=unused-import
+from .fixtures import local_tests_dir, random_100_kb, fake_girder_server
+
+API_URL = "https://not.a.girder.instance/api/v1"
+
+
+class FileGettingClient:
+    "Just enough of a GirderClient to look up the sizes of Files"
+
+    def __init__(self, file_sizes):
+        self.file_sizes = file_sizes
+
+    def getFile(self, file_id):  # pylint: disable=invalid-name
+        if file_id not in self.file_sizes:
+            raise HttpError(400, "Invalid file id", "GET", f"file/{file_id}")
+        return {"_id": file_id, "size": self.file_sizes[file_id]}
+
+
+def test_manifest_uploads_and_hashes(local_tests_dir, random_100_kb):
+    test_dir = local_tests_dir / test_manifest_uploads_and_hashes.__name__
+    assert not test_dir.is_dir()
+    test_dir.mkdir()
+    try:
+        test_filepath = test_dir / "test_file.bin"
+        test_filepath.write_bytes(random_100_kb)
+        girder_path = pathlib.Path(test_dir.name) / test_filepath.name
+        with UploadManifest(test_dir / "manifest.db") as manifest:
+            assert manifest.get_hash(test_filepath) is None
+            file_hash = manifest.get_file_hash(test_filepath)
+            assert file_hash == get_on_disk_file_hash(test_filepath)
+            assert manifest.get_hash(test_filepath) == file_hash
+            assert (
+                manifest.get_upload(test_filepath, API_URL, "root", girder_path) is None
+            )
+            manifest.add_upload(
+                test_filepath, API_URL, "root", girder_path, "item", "file", file_hash
+            )
+            record = manifest.get_upload(test_filepath, API_URL, "root", girder_path)
+            assert record["item_id"] == "item"
+            assert record["file_id"] == "file"
+            assert record["sha256"] == file_hash
+            # uploads to other places aren't found
+            assert (
+                manifest.get_upload(test_filepath, API_URL, "other", girder_path)
+                is None
+            )
+            assert len(manifest) == 1
+        # the records persist, and changing the file invalidates them
+        with UploadManifest(test_dir / "manifest.db") as manifest:
+            assert manifest.get_hash(test_filepath) == file_hash
+            stat = os.stat(test_filepath)
+            os.utime(test_filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+            assert manifest.get_hash(test_filepath) is None
+            assert (
+                manifest.get_upload(test_filepath, API_URL, "root", girder_path) is None
+            )
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_manifest_concurrent_writers(local_tests_dir):
+    test_dir = local_tests_dir / test_manifest_concurrent_writers.__name__
+    assert not test_dir.is_dir()
+    test_dir.mkdir()
+    try:
+        test_filepaths = []
+        for ifile in range(20):
+            test_filepaths.append(test_dir / f"test_file_{ifile}.bin")
+            test_filepaths[-1].write_bytes(os.urandom(100))
+
+        def add_uploads(db_path, filepaths):
+            with UploadManifest(db_path) as manifest:
+                for filepath in filepaths:
+                    manifest.add_upload(
+                        filepath, API_URL, "root", filepath.name, filepath.stem
+                    )
+
+        # two threads sharing a manifest, and two more each opening their own
+        with UploadManifest(test_dir / "manifest.db") as shared_manifest:
+            threads = [
+                threading.Thread(
+                    target=lambda i=i: [
+                        shared_manifest.add_upload(
+                            filepath, API_URL, "root", filepath.name, filepath.stem
+                        )
+                        for filepath in test_filepaths[i::4]
+                    ]
+                )
+                for i in range(2)
+            ]
+            threads += [
+                threading.Thread(
+                    target=add_uploads,
+                    args=(test_dir / "manifest.db", test_filepaths[i::4]),
+                )
+                for i in range(2, 4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert len(shared_manifest) == len(test_filepaths)
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_manifest_reconcile(local_tests_dir):
+    test_dir = local_tests_dir / test_manifest_reconcile.__name__
+    assert not test_dir.is_dir()
+    test_dir.mkdir()
+    try:
+        test_filepaths = []
+        for ifile in range(4):
+            test_filepaths.append(test_dir / f"test_file_{ifile}.bin")
+            test_filepaths[-1].write_bytes(os.urandom(100))
+        with UploadManifest(test_dir / "manifest.db") as manifest:
+            for ifile, filepath in enumerate(test_filepaths):
+                manifest.add_upload(
+                    filepath, API_URL, "root", filepath.name, "item", f"file_{ifile}"
+                )
+            # File 0 is fine, file 1 was deleted locally, file 2 was deleted from
+            # Girder, and file 3 has a different size in Girder
+            test_filepaths[1].unlink()
+            client = FileGettingClient({"file_0": 100, "file_1": 100, "file_3": 99})
+            assert manifest.reconcile(client, API_URL) == (4, 3)
+            assert len(manifest) == 1
+            assert manifest.reconcile(client, API_URL) == (1, 0)
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_manifest_adds_missing_columns(local_tests_dir):
+    test_dir = local_tests_dir / test_manifest_adds_missing_columns.__name__
+    assert not test_dir.is_dir()
+    test_dir.mkdir()
+    try:
+        test_filepath = test_dir / "test_file.bin"
+        test_filepath.write_bytes(os.urandom(100))
+        # a manifest written before packed files were recorded in it
+        db_path = test_dir / "manifest.db"
+        with sqlite3.connect(db_path) as connection:
+            connection.execute(
+                "CREATE TABLE uploads (filepath TEXT NOT NULL, size INTEGER NOT NULL, "
+                "mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, "
+                "api_url TEXT NOT NULL, root_folder_id TEXT NOT NULL, "
+                "girder_path TEXT NOT NULL, sha256 TEXT, item_id TEXT NOT NULL, "
+                "file_id TEXT, uploaded_at REAL NOT NULL, "
+                "PRIMARY KEY (filepath, api_url, root_folder_id, girder_path))"
+            )
+        connection.close()
+        args = (test_filepath, API_URL, "root", test_filepath.name)
+        with UploadManifest(db_path) as manifest:
+            manifest.add_upload(*args, "pack", pack_member=test_filepath.name)
+            assert manifest.get_upload(*args)["pack_member"] == test_filepath.name
+        with UploadManifest(db_path) as manifest:
+            assert manifest.get_upload(*args)["item_id"] == "pack"
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_manifest_pending_uploads(local_tests_dir):
+    test_dir = local_tests_dir / test_manifest_pending_uploads.__name__
+    assert not test_dir.is_dir()
+    test_dir.mkdir()
+    try:
+        test_filepath = test_dir / "test_file.bin"
+        test_filepath.write_bytes(os.urandom(100))
+        with UploadManifest(test_dir / "manifest.db") as manifest:
+            args = (test_filepath, API_URL, "folder", test_filepath.name)
+            assert manifest.get_pending_upload(*args) is None
+            manifest.add_pending_upload(*args, "upload_1")
+            manifest.set_pending_upload_offset("upload_1", 50)
+            assert manifest.get_pending_upload(*args) == {
+                "upload_id": "upload_1",
+                "offset": 50,
+            }
+            # starting a new upload of the same file replaces the old one
+            manifest.add_pending_upload(*args, "upload_2")
+            assert manifest.get_pending_upload(*args)["upload_id"] == "upload_2"
+            manifest.remove_pending_upload("upload_2")
+            assert manifest.get_pending_upload(*args) is None
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_manifest_reconciler_from_command_line(local_tests_dir, fake_girder_server):
+    # the reconciler leaves out most of the uploader's arguments, so it has to be
+    # buildable from the defaults for the rest
+    server = fake_girder_server
+    test_dir = local_tests_dir / test_manifest_reconciler_from_command_line.__name__
+    assert not test_dir.is_dir()
+    test_dir.mkdir()
+    try:
+        parser = IMQCAMManifestReconciler.get_argument_parser()
+        parsed_args = parser.parse_args(
+            [
+                "--api_url",
+                server.api_url,
+                "--api_key",
+                server.API_KEY,
+                "--manifest_path",
+                str(test_dir / "manifest.sqlite"),
+            ]
+        )
+        args, kwargs = IMQCAMManifestReconciler.get_init_args_kwargs(parsed_args)
+        assert kwargs["dedup"] is False
+        reconciler = IMQCAMManifestReconciler(*args, **kwargs)
+        try:
+            assert reconciler.reconcile_manifest() == (0, 0)
+        finally:
+            reconciler.close()
+    finally:
+        shutil.rmtree(test_dir)
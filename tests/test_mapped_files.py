@@ -0,0 +1,208 @@
+" Tests for reading files through memory maps "
+
+# pylint: disable=redefined-outer-name
+
+# imports
+import os
+import asyncio
+import logging
+import hashlib
+import shutil
+import pytest
+from imqcam_uploaders.utilities.hashing import get_on_disk_file_hashes
+from imqcam_uploaders.utilities import mapped_files
+from imqcam_uploaders.utilities.mapped_files import (
+    MappedFileReader,
+    open_file_reader,
+    iter_file_chunks,
+)
+from imqcam_uploaders.uploaders.file_uploader import IMQCAMFileUploader
+from imqcam_uploaders.uploaders.async_uploader import IMQCAMAsyncUploader
+from imqcam_uploaders.uploaders.directory_watcher import IMQCAMDirectoryWatcher
+
+# pylint: disable=unused-import
+from .fixtures import local_tests_dir, fake_girder_server
+
+
+@pytest.fixture
+def mapped_files_dir(local_tests_dir, request):
+    "A new directory for the files a test reads, removed again afterward"
+    dirpath = local_tests_dir / request.node.name.replace("[", "_").replace("]", "")
+    assert not dirpath.is_dir()
+    dirpath.mkdir()
+    yield dirpath
+    shutil.rmtree(dirpath)
+
+
+def test_mapped_file_reader(mapped_files_dir):
+    contents = os.urandom(100000)
+    filepath = mapped_files_dir / "data.bin"
+    filepath.write_bytes(contents)
+    with MappedFileReader(filepath) as fobj:
+        assert len(fobj) == len(contents)
+        assert fobj.readable() and fobj.seekable()
+        chunk = fobj.read(1000)
+        # reads return views of the map instead of copies
+        assert isinstance(chunk, memoryview)
+        assert chunk == contents[:1000]
+        assert fobj.tell() == 1000
+        assert fobj.seek(-10, os.SEEK_END) == len(contents) - 10
+        assert fobj.read() == contents[-10:]
+        assert fobj.read(10) == b""
+        assert fobj.seek(5) == 5
+        buffer = bytearray(20)
+        assert fobj.readinto(buffer) == 20
+        assert buffer == contents[5:25]
+        with pytest.raises(ValueError):
+            fobj.seek(-1)
+        # closing while views of the map are still around doesn't fail
+        held = fobj.read(10)
+    assert fobj.closed
+    assert held == contents[25:35]
+    # empty files can't be mapped, but can still be read
+    empty_path = mapped_files_dir / "empty.bin"
+    empty_path.write_bytes(b"")
+    with MappedFileReader(empty_path) as fobj:
+        assert len(fobj) == 0
+        assert fobj.read() == b""
+
+
+def test_open_file_reader(mapped_files_dir):
+    contents = os.urandom(10000)
+    filepath = mapped_files_dir / "data.bin"
+    filepath.write_bytes(contents)
+    for mapped_threshold, mapped in ((0, True), (10000, True), (10001, False)):
+        with open_file_reader(filepath, mapped_threshold) as fobj:
+            assert isinstance(fobj, MappedFileReader) == mapped
+            chunks = [bytes(chunk) for chunk in iter_file_chunks(fobj, 3000)]
+        assert [len(chunk) for chunk in chunks] == [3000, 3000, 3000, 1000]
+        assert b"".join(chunks) == contents
+    with open_file_reader(filepath, None) as fobj:
+        assert not isinstance(fobj, MappedFileReader)
+
+
+def test_mapped_file_hashes(mapped_files_dir):
+    contents = os.urandom(300000)
+    filepath = mapped_files_dir / "data.bin"
+    filepath.write_bytes(contents)
+    expected = {
+        "size": len(contents),
+        "sha256": hashlib.sha256(contents).hexdigest(),
+        "sha512": hashlib.sha512(contents).hexdigest(),
+    }
+    for mapped_threshold in (0, None):
+        hashes, _ = get_on_disk_file_hashes(
+            filepath,
+            ("sha256", "sha512"),
+            chunk_size=65536,
+            mapped_threshold=mapped_threshold,
+        )
+        assert hashes == expected
+
+
+@pytest.mark.parametrize("uploader_class", [IMQCAMFileUploader, IMQCAMAsyncUploader])
+def test_mapped_file_upload(mapped_files_dir, fake_girder_server, uploader_class):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    contents = os.urandom(300000)
+    filepath = mapped_files_dir / "data.bin"
+    filepath.write_bytes(contents)
+    uploader = uploader_class(
+        server.api_url, server.API_KEY, streamlevel=logging.WARNING
+    )
+    # map every file, and upload them in several chunks
+    uploader.MAPPED_READ_THRESHOLD = 0
+    uploader.HASH_CHUNK_SIZE = 65536
+    uploader.UPLOAD_CHUNK_SIZE = 100000
+    upload_kwargs = {
+        "relative_to": mapped_files_dir,
+        "root_folder_id": root_folder_id,
+        "validation_mode": "full",
+    }
+    try:
+        if uploader_class is IMQCAMAsyncUploader:
+            asyncio.run(
+                uploader.upload_directory_async(mapped_files_dir, **upload_kwargs)
+            )
+        else:
+            assert uploader.upload_file(filepath, show_progress=False, **upload_kwargs)
+    finally:
+        uploader.close()
+    item = server.find_item(root_folder_id, "data.bin")
+    file_ids = [
+        file_id
+        for file_id, file_doc in server.files.items()
+        if file_doc["itemId"] == item["_id"]
+    ]
+    assert [server.file_contents[file_id] for file_id in file_ids] == [contents]
+    assert item["meta"]["checksum"]["sha256"] == hashlib.sha256(contents).hexdigest()
+
+
+def test_mapped_chunks_are_sent_uncopied(mapped_files_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    contents = os.urandom(300000)
+    filepath = mapped_files_dir / "data.bin"
+    filepath.write_bytes(contents)
+    uploader = IMQCAMFileUploader(
+        server.api_url, server.API_KEY, streamlevel=logging.WARNING
+    )
+    uploader.MAPPED_READ_THRESHOLD = 0
+    uploader._girder_client.MAX_CHUNK_SIZE = 100000  # pylint: disable=protected-access
+    # record the type of every request body that reaches the transport adapter
+    session = uploader._girder_client._session  # pylint: disable=protected-access
+    original_send = session.send
+    chunk_body_types = []
+
+    def recording_send(request, **kwargs):
+        if "file/chunk" in request.url:
+            chunk_body_types.append(type(request.body))
+        return original_send(request, **kwargs)
+
+    session.send = recording_send
+    try:
+        assert uploader.upload_file(
+            filepath,
+            relative_to=mapped_files_dir,
+            root_folder_id=root_folder_id,
+            show_progress=False,
+        )
+    finally:
+        uploader.close()
+    # every chunk is sent as a view of the map, not as a copy of it
+    assert chunk_body_types == [memoryview] * 3
+
+
+def test_watcher_never_maps_files(mapped_files_dir, fake_girder_server, monkeypatch):
+    # files that instruments are still writing could be truncated while they're
+    # mapped, so the watcher reads every file normally, however large it is
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    filepath = mapped_files_dir / "data.bin"
+    filepath.write_bytes(os.urandom(300000))
+
+    class UnmappableFileReader(MappedFileReader):
+        "Fails the test if any file is memory-mapped"
+
+        def __init__(self, filepath):  # pylint: disable=super-init-not-called
+            raise AssertionError(f"{filepath} was memory-mapped")
+
+    monkeypatch.setattr(mapped_files, "MappedFileReader", UnmappableFileReader)
+    monkeypatch.setattr(IMQCAMFileUploader, "MAPPED_READ_THRESHOLD", 0)
+    upload_kwargs = {
+        "relative_to": mapped_files_dir,
+        "root_folder_id": root_folder_id,
+        "validation_mode": "full",
+    }
+    watcher = IMQCAMDirectoryWatcher(
+        server.api_url,
+        server.API_KEY,
+        verify_existing=True,
+        streamlevel=logging.WARNING,
+    )
+    try:
+        assert watcher.upload_file(filepath, show_progress=False, **upload_kwargs)
+        # (files that already exist are hashed to check them, without a map too)
+        assert not watcher.upload_file(filepath, show_progress=False, **upload_kwargs)
+    finally:
+        watcher.close()
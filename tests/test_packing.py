@@ -0,0 +1,123 @@
+" Testing packs of small files, and getting the files back out of them "
+
+# imports
+import io
+import shutil
+import hashlib
+import zipfile
+import pytest
+from imqcam_uploaders.utilities.packing import (
+    PACK_METADATA_KEY,
+    build_file_pack,
+    extract_file_pack,
+    find_packed_file,
+    get_file_pack_members,
+    get_file_pack_name,
+    get_packed_files,
+    read_packed_file,
+)
+
+# pylint: disable=unused-import
+from .fixtures import local_tests_dir, fake_girder_server, fake_girder_client
+
+
+def write_test_files(dirpath, n_files=5):
+    "Write some small files with different contents and return their paths"
+    dirpath.mkdir(parents=True)
+    filepaths = []
+    for ifile in range(n_files):
+        filepath = dirpath / f"file_{ifile}.txt"
+        filepath.write_bytes(f"contents of file {ifile}\n".encode() * (ifile + 1))
+        filepaths.append(filepath)
+    return filepaths
+
+
+def test_build_file_pack(local_tests_dir):
+    test_dir = local_tests_dir / test_build_file_pack.__name__
+    assert not test_dir.is_dir()
+    try:
+        filepaths = write_test_files(test_dir)
+        stream, size, members = build_file_pack(filepaths)
+        with stream:
+            data = stream.read()
+        assert len(data) == size
+        # the pack is a regular zip file, and each member's offset points to its data
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            assert archive.namelist() == [filepath.name for filepath in filepaths]
+        for filepath, member in zip(filepaths, members):
+            contents = filepath.read_bytes()
+            assert member["name"] == filepath.name
+            assert member["size"] == len(contents)
+            assert member["sha256"] == hashlib.sha256(contents).hexdigest()
+            assert (
+                data[member["offset"] : member["offset"] + member["size"]] == contents
+            )
+        # the name only depends on the files in the pack
+        assert get_file_pack_name(members) == get_file_pack_name(members[::-1])
+        assert get_file_pack_name(members) != get_file_pack_name(members[1:])
+        # files with the same names can't go in the same pack
+        (test_dir / "sub").mkdir()
+        shutil.copy(filepaths[0], test_dir / "sub")
+        with pytest.raises(ValueError):
+            _ = build_file_pack([filepaths[0], test_dir / "sub" / filepaths[0].name])
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_get_packed_files():
+    old_pack = {
+        "_id": "old",
+        "created": "2024-01-01T00:00:00",
+        "meta": {PACK_METADATA_KEY: {"members": [{"name": "a"}, {"name": "b"}]}},
+    }
+    new_pack = {
+        "_id": "new",
+        "created": "2024-01-02T00:00:00",
+        "meta": {PACK_METADATA_KEY: {"members": [{"name": "a"}]}},
+    }
+    not_a_pack = {"_id": "other", "meta": {"checksum": {"sha256": "0"}}}
+    assert not get_file_pack_members(not_a_pack)
+    assert set(get_file_pack_members(old_pack)) == {"a", "b"}
+    # files that were packed again are found in the newest pack
+    packed_files = get_packed_files([new_pack, not_a_pack, old_pack])
+    assert {name: item_id for name, (item_id, _) in packed_files.items()} == {
+        "a": "new",
+        "b": "old",
+    }
+
+
+def test_read_and_extract_file_pack(
+    local_tests_dir, fake_girder_server, fake_girder_client
+):
+    server = fake_girder_server
+    folder_id = server.create_root_folder()
+    client = fake_girder_client
+    test_dir = local_tests_dir / test_read_and_extract_file_pack.__name__
+    assert not test_dir.is_dir()
+    try:
+        filepaths = write_test_files(test_dir / "original")
+        stream, size, members = build_file_pack(filepaths)
+        with stream:
+            file_doc = client.uploadStreamToFolder(
+                folder_id, stream, get_file_pack_name(members), size
+            )
+        item = client.addMetadataToItem(
+            file_doc["itemId"], {PACK_METADATA_KEY: {"members": members}}
+        )
+        # single files are read with one byte-range request each
+        assert find_packed_file(client, folder_id, "missing.txt") is None
+        for filepath in filepaths:
+            item_id, member = find_packed_file(client, folder_id, filepath.name)
+            assert item_id == item["_id"]
+            assert read_packed_file(client, item_id, member) == filepath.read_bytes()
+        with pytest.raises(ValueError):
+            _ = read_packed_file(client, item_id, {**member, "sha256": "0" * 64})
+        # or the whole pack can be extracted at once
+        extracted = extract_file_pack(client, item["_id"], test_dir / "extracted")
+        assert [filepath.name for filepath in extracted] == [
+            filepath.name for filepath in filepaths
+        ]
+        for original, copy in zip(filepaths, extracted):
+            assert copy.read_bytes() == original.read_bytes()
+    finally:
+        shutil.rmtree(test_dir)
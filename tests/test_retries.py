@@ -0,0 +1,30 @@
+" Testing when and how long to wait before retrying failed Girder requests "
+
+# imports
+from imqcam_uploaders.utilities.retries import RetryPolicy
+
+
+def test_retry_policy_should_retry():
+    policy = RetryPolicy(max_retries=2)
+    # dropped connections and transient errors are retried, up to max_retries times
+    assert policy.should_retry(0)
+    assert policy.should_retry(1, 502)
+    assert policy.should_retry(0, 429)
+    assert not policy.should_retry(2, 503)
+    # errors that will happen again aren't retried
+    assert not policy.should_retry(0, 400)
+    assert not policy.should_retry(0, 500)
+    assert not RetryPolicy(max_retries=0).should_retry(0)
+
+
+def test_retry_policy_delays():
+    policy = RetryPolicy(backoff_seconds=1.0, max_backoff_seconds=5.0)
+    for attempt, backoff in ((0, 1.0), (1, 2.0), (2, 4.0), (3, 5.0), (10, 5.0)):
+        delays = [policy.get_delay(attempt) for _ in range(50)]
+        assert all(backoff / 2.0 <= delay <= backoff for delay in delays)
+        # the jitter spreads the delays out
+        assert len(set(delays)) > 1
+    # a "Retry-After" header sets the shortest wait, up to the longest backoff
+    assert policy.get_delay(0, retry_after="3") >= 3.0
+    assert policy.get_delay(0, retry_after="120") == 5.0
+    assert policy.get_delay(0, retry_after="Wed, 21 Oct 2015 07:28:00 GMT") <= 1.0
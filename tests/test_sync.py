@@ -0,0 +1,121 @@
+" Testing the helpers for comparing local directory trees with Girder Folder trees "
+
+# imports
+import os
+import shutil
+import hashlib
+import logging
+from imqcam_uploaders.uploaders.directory_uploader import IMQCAMDirectoryUploader
+from imqcam_uploaders.utilities.downloads import PARTIAL_DOWNLOAD_SUFFIX
+from imqcam_uploaders.utilities.manifest import UploadManifest
+from imqcam_uploaders.utilities.sync import (
+    scan_local_tree,
+    index_girder_tree,
+    diff_local_and_girder_trees,
+)
+
+# pylint: disable=unused-import
+from .fixtures import local_tests_dir, fake_girder_server, fake_girder_client
+
+
+def write_test_tree(dirpath):
+    """Write some files of different sizes in a directory tree, returning their
+    contents keyed by their "/"-separated paths relative to the directory
+    """
+    contents = {}
+    for ifile in range(6):
+        rel_path = f"subdir_{ifile % 2}/{ifile}.bin" if ifile > 1 else f"{ifile}.bin"
+        filepath = dirpath / rel_path
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        filepath.write_bytes(os.urandom(500 * ifile + 1))
+        contents[rel_path] = filepath.read_bytes()
+    return contents
+
+
+def test_scan_local_tree(local_tests_dir):
+    test_dir = local_tests_dir / test_scan_local_tree.__name__
+    assert not test_dir.is_dir()
+    try:
+        contents = write_test_tree(test_dir)
+        # partial downloads are left out
+        (test_dir / f"subdir_0/2.bin{PARTIAL_DOWNLOAD_SUFFIX}").write_bytes(b"part")
+        scanned = dict(scan_local_tree(test_dir))
+        assert sorted(scanned) == sorted(contents)
+        for rel_path, file_stat in scanned.items():
+            assert file_stat.st_size == len(contents[rel_path])
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_index_girder_tree(local_tests_dir, fake_girder_server, fake_girder_client):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_index_girder_tree.__name__
+    assert not test_dir.is_dir()
+    uploader = IMQCAMDirectoryUploader(
+        server.api_url, server.API_KEY, streamlevel=logging.WARNING
+    )
+    try:
+        contents = write_test_tree(test_dir / "data")
+        # the two smallest files (in the same directory) are uploaded in a pack
+        summary = uploader.upload_directory(
+            test_dir / "data",
+            root_folder_id=root_folder_id,
+            pack_threshold=1200,
+            validation_mode="metadata",
+        )
+        assert summary.n_failed == 0
+        client = fake_girder_client
+        (folder,) = server.child_folders(root_folder_id)
+        entries = index_girder_tree(client, folder["_id"], n_threads=2)
+        assert sorted(entries) == sorted(contents)
+        for rel_path, (size, checksum, _, member) in entries.items():
+            assert size == len(contents[rel_path])
+            assert checksum == hashlib.sha256(contents[rel_path]).hexdigest()
+            assert (member is not None) == (rel_path in ("0.bin", "1.bin"))
+    finally:
+        uploader.close()
+        shutil.rmtree(test_dir)
+
+
+def test_diff_local_and_girder_trees(local_tests_dir):
+    test_dir = local_tests_dir / test_diff_local_and_girder_trees.__name__
+    assert not test_dir.is_dir()
+    manifest = None
+    try:
+        contents = write_test_tree(test_dir / "data")
+        girder_entries = {
+            rel_path: (len(data), hashlib.sha256(data).hexdigest(), "id", None)
+            for rel_path, data in contents.items()
+        }
+        diff = diff_local_and_girder_trees(test_dir / "data", dict(girder_entries))
+        assert (diff.n_unchanged, diff.n_differences) == (6, 0)
+        # change one file's contents without changing its size, change another's
+        # size, delete one, and add one
+        (test_dir / "data" / "subdir_0/2.bin").write_bytes(bytes(1001))
+        (test_dir / "data" / "1.bin").write_bytes(b"longer than before")
+        (test_dir / "data" / "subdir_1/3.bin").unlink()
+        (test_dir / "data" / "subdir_1/new.bin").write_bytes(b"new")
+        # files without recorded checksums are only compared by size
+        girder_entries["0.bin"] = (1, None, "id", None)
+        manifest = UploadManifest(test_dir / "manifest.sqlite")
+        remaining = dict(girder_entries)
+        diff = diff_local_and_girder_trees(test_dir / "data", remaining, manifest)
+        assert not remaining
+        assert diff.new == ["subdir_1/new.bin"]
+        assert diff.changed == ["1.bin", "subdir_0/2.bin"]
+        assert list(diff.missing) == ["subdir_1/3.bin"]
+        assert diff.missing["subdir_1/3.bin"] == girder_entries["subdir_1/3.bin"]
+        assert (diff.n_unchanged, diff.n_differences) == (3, 4)
+        # hashes are recorded in the manifest, and used the next time
+        filepath = test_dir / "data" / "subdir_0/4.bin"
+        assert manifest.get_hash(filepath) == girder_entries["subdir_0/4.bin"][1]
+        manifest.add_hash(filepath, "0" * 64)
+        diff = diff_local_and_girder_trees(
+            test_dir / "data", dict(girder_entries), manifest
+        )
+        assert diff.changed == ["1.bin", "subdir_0/2.bin", "subdir_0/4.bin"]
+    finally:
+        if manifest is not None:
+            manifest.close()
+        shutil.rmtree(test_dir)
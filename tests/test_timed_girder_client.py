@@ -0,0 +1,181 @@
+" Testing the retries and shared connections of the timed Girder client "
+
+# pylint: disable=protected-access
+
+# imports
+import io
+import shutil
+import logging
+import pytest
+from girder_client import HttpError
+from imqcam_uploaders.utilities.girder import (
+    get_girder_upload_parameters,
+    upload_girder_chunks,
+)
+from imqcam_uploaders.utilities.retries import RetryPolicy
+from imqcam_uploaders.utilities.timed_girder_client import TimedGirderClient
+from imqcam_uploaders.utilities.timing import UploadTimer
+from imqcam_uploaders.uploaders.file_uploader import IMQCAMFileUploader
+
+# pylint: disable=unused-import
+from .fixtures import local_tests_dir, fake_girder_server
+
+
+def get_client(server, max_retries=3):
+    "Return a client authenticated to a fake Girder server that retries quickly"
+    client = TimedGirderClient(
+        apiUrl=server.api_url,
+        timer=UploadTimer(),
+        retry_policy=RetryPolicy(max_retries=max_retries, backoff_seconds=0.01),
+    )
+    client.authenticate(apiKey=server.API_KEY)
+    return client
+
+
+def test_retry_idempotent_requests(fake_girder_server):
+    server = fake_girder_server
+    client = get_client(server, max_retries=2)
+    collection_id = server.create_collection("Test")
+    folder_id = server.create_folder(collection_id, "Test", "collection")
+    # transient errors are retried, and every attempt is timed
+    server.reset_request_log()
+    server.fail_next = [502, 503]
+    assert client.getFolder(folder_id)["_id"] == folder_id
+    assert server.count_requests("GET", r"^folder/") == 3
+    assert client.timer.request_totals()[("GET", "folder/{id}")]["count"] == 3
+    # the request fails once it's been retried max_retries times
+    server.fail_next = [502, 502, 502]
+    with pytest.raises(HttpError) as exc_info:
+        _ = client.getFolder(folder_id)
+    assert exc_info.value.status == 502
+    # errors that would just happen again aren't retried
+    server.reset_request_log()
+    server.fail_next = [500]
+    with pytest.raises(HttpError):
+        _ = client.getFolder(folder_id)
+    assert server.count_requests() == 1
+    # requests that aren't safe to send twice aren't retried
+    server.fail_next = [502]
+    with pytest.raises(HttpError):
+        _ = client.createFolder(folder_id, "new")
+    assert not server.child_folders(folder_id)
+    # unless they reuse what the first attempt may have created
+    server.fail_next = [502]
+    new_folder = client.createFolder(folder_id, "new", reuseExisting=True)
+    assert [f["_id"] for f in server.child_folders(folder_id)] == [new_folder["_id"]]
+    server.fail_next = [502]
+    new_item = client.createItem(folder_id, "new.bin", reuseExisting=True)
+    assert server.find_item(folder_id, "new.bin")["_id"] == new_item["_id"]
+
+
+def test_retry_upload_chunks(fake_girder_server):
+    server = fake_girder_server
+    client = get_client(server)
+    root_folder_id = server.create_root_folder()
+    contents = bytes(range(256)) * 4
+    upload_id = client.post(
+        "file",
+        parameters=get_girder_upload_parameters(root_folder_id, "a.bin", len(contents)),
+    )["_id"]
+    client.MAX_CHUNK_SIZE = 100
+    # the first attempt at a chunk fails before the server receives any of it, so
+    # the server's offset is checked before the chunk is sent again
+    server.reset_request_log()
+    server.fail_next = [502]
+    file_doc = upload_girder_chunks(
+        client, upload_id, io.BytesIO(contents), len(contents)
+    )
+    assert server.file_contents[file_doc["_id"]] == contents
+    assert server.count_requests("GET", r"^file/offset") == 1
+    assert server.count_requests("POST", r"^file/chunk") == 11 + 1
+
+
+def test_retry_upload_starts(fake_girder_server):
+    server = fake_girder_server
+    client = get_client(server)
+    root_folder_id = server.create_root_folder()
+    # starting an upload without sending data doesn't create an Item, so it's safe
+    # to send again
+    server.reset_request_log()
+    server.fail_next = [502]
+    upload = client.post(
+        "file", parameters=get_girder_upload_parameters(root_folder_id, "a.bin", 10)
+    )
+    assert upload["_modelType"] == "upload"
+    assert server.count_requests("POST", r"^file$") == 2
+    # but requests that upload a whole file (or an empty one) at once aren't retried
+    for size, data in ((0, None), (4, b"data")):
+        server.fail_next = [502]
+        with pytest.raises(HttpError):
+            _ = client.post(
+                "file",
+                parameters=get_girder_upload_parameters(root_folder_id, "b.bin", size),
+                data=data,
+            )
+    assert server.find_item(root_folder_id, "b.bin") is None
+
+
+def test_retry_small_file_uploads(local_tests_dir, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_retry_small_file_uploads.__name__
+    assert not test_dir.is_dir()
+    test_dir.mkdir()
+    # the first request to start the upload and the first chunk both fail
+    failing_routes = {("POST", "file"), ("POST", "file/chunk")}
+    original_handle = server.handle
+
+    def failing_handle(method, route, *args):
+        if (method, route) in failing_routes:
+            failing_routes.remove((method, route))
+            server.request_log.append((method, route))
+            return 502, "application/json", b'{"message": "injected"}', {}
+        return original_handle(method, route, *args)
+
+    server.handle = failing_handle
+    uploader = IMQCAMFileUploader(
+        server.api_url, server.API_KEY, retry_backoff=0.01, streamlevel=logging.ERROR
+    )
+    try:
+        (test_dir / "small.bin").write_bytes(b"small file")
+        assert uploader.upload_file(
+            test_dir / "small.bin",
+            relative_to=test_dir,
+            root_folder_id=root_folder_id,
+            show_progress=False,
+        )
+    finally:
+        uploader.close()
+        shutil.rmtree(test_dir)
+    assert not failing_routes
+    item = server.find_item(root_folder_id, "small.bin")
+    (file_id,) = [f["_id"] for f in server.files.values() if f["itemId"] == item["_id"]]
+    assert server.file_contents[file_id] == b"small file"
+    assert len(server.items) == 1
+
+
+def test_worker_clients(fake_girder_server):
+    server = fake_girder_server
+    client = get_client(server)
+    folder_id = server.create_root_folder()
+    worker_client = client.get_worker_client()
+    assert worker_client is not client
+    # the worker client is already authenticated and records in the same timer
+    server.reset_request_log()
+    assert worker_client.getFolder(folder_id)["_id"] == folder_id
+    assert server.count_requests("POST") == 0
+    assert worker_client.timer is client.timer
+    assert worker_client.retry_policy is client.retry_policy
+    # and it knows the server's version without asking for it again
+    client.getServerVersion()
+    server.reset_request_log()
+    assert client.get_worker_client().getServerVersion() == client.getServerVersion()
+    assert server.count_requests() == 0
+    # the pool of connections is shared, and can be made bigger for more workers
+    adapter = client.get_worker_client()._session.get_adapter(server.api_url)
+    client.set_pool_size(32)
+    new_adapter = worker_client._session.get_adapter(server.api_url)
+    assert new_adapter is not adapter
+    assert new_adapter._pool_maxsize == 32
+    client.set_pool_size(4)
+    assert worker_client._session.get_adapter(server.api_url) is new_adapter
@@ -0,0 +1,169 @@
+" Tests for timing upload phases and Girder requests "
+
+# pylint: disable=redefined-outer-name
+
+# imports
+import json
+import shutil
+import threading
+from imqcam_uploaders.utilities.timing import get_girder_endpoint, UploadTimer
+from imqcam_uploaders.uploaders.file_uploader import IMQCAMFileUploader
+from imqcam_uploaders.uploaders.async_uploader import main as async_main
+
+# pylint: disable=unused-import
+from .fixtures import local_tests_dir, random_100_kb, fake_girder_server
+
+
+def test_get_girder_endpoint():
+    object_id = "65dfc5f002ad536bd833df10"
+    assert get_girder_endpoint("item") == "item"
+    assert get_girder_endpoint(f"item/{object_id}/metadata") == "item/{id}/metadata"
+    assert (
+        get_girder_endpoint(f"file/chunk?offset=0&uploadId={object_id}") == "file/chunk"
+    )
+    assert (
+        get_girder_endpoint(f"https://data.imqcam.org/api/v1/file/{object_id}/download")
+        == "file/{id}/download"
+    )
+    # names that just happen to be long aren't IDs
+    assert get_girder_endpoint("folder/not_an_object_id_at_all") == (
+        "folder/not_an_object_id_at_all"
+    )
+
+
+def test_upload_timer(local_tests_dir):
+    test_dir = local_tests_dir / test_upload_timer.__name__
+    assert not test_dir.is_dir()
+    test_dir.mkdir()
+    try:
+        timer = UploadTimer(json_lines_path=test_dir / "timing.jsonl")
+
+        def record(ithread):
+            for irecord in range(10):
+                timer.record_phase("transfer", 0.1 * ithread, filepath=test_dir)
+                timer.record_request("GET", "item", 0.01 * irecord)
+            timer.record_request("POST", "file", 1.0, status=500)
+
+        threads = [threading.Thread(target=record, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with timer.phase("validation"):
+            pass
+        assert timer.concurrency is None
+        timer.record_concurrency(6)
+        timer.close()
+        phase_totals = timer.phase_totals()
+        assert phase_totals["transfer"]["count"] == 40
+        assert abs(phase_totals["transfer"]["total"] - 6.0) < 1e-9
+        assert phase_totals["transfer"]["min"] == 0.0
+        assert abs(phase_totals["transfer"]["max"] - 0.3) < 1e-9
+        assert phase_totals["validation"]["count"] == 1
+        request_totals = timer.request_totals()
+        assert request_totals[("GET", "item")]["count"] == 40
+        assert request_totals[("POST", "file")]["count"] == 4
+        # every measurement was written as a line of JSON
+        records = [
+            json.loads(line)
+            for line in (test_dir / "timing.jsonl").read_text().splitlines()
+        ]
+        assert len(records) == 86
+        assert records[-1]["kind"] == "concurrency"
+        assert records[-1]["limit"] == 6
+        assert sum(1 for rec in records if rec.get("status") == 500) == 4
+        assert all(rec["file"] == str(test_dir) for rec in records if "file" in rec)
+        # the totals can be written for Prometheus
+        timer.write_prometheus(test_dir / "timing.prom")
+        prom_lines = (test_dir / "timing.prom").read_text().splitlines()
+        assert "# TYPE imqcam_upload_phase_seconds summary" in prom_lines
+        assert 'imqcam_upload_phase_seconds_count{phase="transfer"} 40' in prom_lines
+        assert (
+            'imqcam_girder_request_seconds_count{method="GET",endpoint="item"} 40'
+            in prom_lines
+        )
+        assert (
+            'imqcam_girder_request_seconds_max{method="POST",endpoint="file"} 1.000000'
+            in prom_lines
+        )
+        assert "imqcam_girder_request_concurrency 6" in prom_lines
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_uploaders_record_timing(local_tests_dir, random_100_kb, fake_girder_server):
+    server = fake_girder_server
+    root_folder_id = server.create_root_folder()
+    test_dir = local_tests_dir / test_uploaders_record_timing.__name__
+    test_subdir = test_dir / "subdir"
+    assert not test_dir.is_dir()
+    test_subdir.mkdir(parents=True)
+    try:
+        (test_subdir / "test_file.bin").write_bytes(random_100_kb)
+        # time a single upload, with every phase
+        uploader = IMQCAMFileUploader(
+            server.api_url,
+            server.API_KEY,
+            manifest_path=test_dir / "manifest.db",
+            timing_log_path=test_dir / "timing.jsonl",
+            timing_prometheus_path=test_dir / "timing.prom",
+        )
+        try:
+            uploader.upload_file(
+                test_subdir / "test_file.bin",
+                relative_to=test_dir,
+                root_folder_id=root_folder_id,
+                show_progress=False,
+            )
+        finally:
+            uploader.close()
+        # every phase but deduplication (which is off), reported in order
+        assert list(uploader.timer.phase_totals()) == [
+            phase for phase in UploadTimer.PHASES if phase != "dedup"
+        ]
+        assert str(uploader.timer).startswith("manifest_check: ")
+        request_totals = uploader.timer.request_totals()
+        assert request_totals[("POST", "api_key/token")]["count"] == 1
+        assert request_totals[("POST", "file")]["count"] == 1
+        assert request_totals[("PUT", "item/{id}/metadata")]["count"] == 1
+        assert request_totals[("GET", "file/{id}/download")]["count"] == 1
+        records = [
+            json.loads(line)
+            for line in (test_dir / "timing.jsonl").read_text().splitlines()
+        ]
+        assert len(records) == sum(
+            totals["count"]
+            for totals in [
+                *uploader.timer.phase_totals().values(),
+                *request_totals.values(),
+            ]
+        )
+        prom_text = (test_dir / "timing.prom").read_text()
+        assert 'imqcam_upload_phase_seconds_count{phase="transfer"} 1' in prom_text
+        # the asyncio uploader records the same phases for files it uploads (the
+        # first file is skipped because it's already in Girder)
+        (test_subdir / "test_file_2.bin").write_bytes(random_100_kb)
+        async_main(
+            [
+                str(test_subdir),
+                "--api_url",
+                server.api_url,
+                "--api_key",
+                server.API_KEY,
+                "--root_folder_id",
+                root_folder_id,
+                "--timing_prometheus_path",
+                str(test_dir / "timing_async.prom"),
+            ]
+        )
+        prom_text = (test_dir / "timing_async.prom").read_text()
+        for phase in UploadTimer.PHASES:
+            if phase == "dedup":
+                continue
+            assert f'imqcam_upload_phase_seconds_count{{phase="{phase}"}}' in prom_text
+        assert (
+            'imqcam_girder_request_seconds_count{method="POST",endpoint="file"} 1'
+            in prom_text
+        )
+    finally:
+        shutil.rmtree(test_dir)
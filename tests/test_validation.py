@@ -0,0 +1,95 @@
+" Tests for the post-upload validation functions "
+
+# pylint: disable=redefined-outer-name
+
+# imports
+import io
+import shutil
+import hashlib
+import girder_client
+from imqcam_uploaders.utilities.hashing import get_on_disk_file_hash
+from imqcam_uploaders.utilities.validation import (
+    SERVER_HASH_ALGORITHM,
+    VALIDATORS,
+    validate_full_download,
+    validate_server_hash,
+    validate_size,
+    validate_samples,
+)
+from .fake_girder import FakeGirderServer
+
+# pylint: disable=unused-import
+from .fixtures import local_tests_dir, fake_girder_server, fake_girder_client
+
+TEST_FILE_CONTENTS = bytes(range(256)) * 1000
+
+
+def upload_test_file(server, client):
+    "Upload the test file to a fake Girder server and return its File document"
+    return client.uploadStreamToFolder(
+        server.create_root_folder(),
+        io.BytesIO(TEST_FILE_CONTENTS),
+        "test_file.bin",
+        len(TEST_FILE_CONTENTS),
+    )
+
+
+def test_validate_size_and_nothing():
+    file_doc = {"_id": "not_an_id", "size": 10}
+    assert validate_size(None, file_doc, {"size": 10})
+    assert not validate_size(None, file_doc, {"size": 11})
+    assert VALIDATORS["none"](None, file_doc, {"size": 11})
+
+
+def test_validate_full_download(fake_girder_server, fake_girder_client):
+    file_doc = upload_test_file(fake_girder_server, fake_girder_client)
+    expected = {
+        "size": file_doc["size"],
+        "sha256": hashlib.sha256(TEST_FILE_CONTENTS).hexdigest(),
+    }
+    assert validate_full_download(fake_girder_client, file_doc, expected)
+    expected["sha256"] = "not_the_right_hash"
+    assert not validate_full_download(fake_girder_client, file_doc, expected)
+
+
+def test_validate_server_hash(fake_girder_server, fake_girder_client):
+    file_doc = upload_test_file(fake_girder_server, fake_girder_client)
+    expected = {"size": file_doc["size"], SERVER_HASH_ALGORITHM: "not_the_right_hash"}
+    # without the "hashsum_download" plugin, the server's hash can't be checked
+    assert validate_server_hash(fake_girder_client, file_doc, expected) is None
+    with FakeGirderServer(hashsum_algorithms=(SERVER_HASH_ALGORITHM,)) as server:
+        client = girder_client.GirderClient(apiUrl=server.api_url)
+        client.authenticate(apiKey=server.API_KEY)
+        file_doc = upload_test_file(server, client)
+        assert not validate_server_hash(client, file_doc, expected)
+        expected[SERVER_HASH_ALGORITHM] = hashlib.new(
+            SERVER_HASH_ALGORITHM, TEST_FILE_CONTENTS
+        ).hexdigest()
+        assert validate_server_hash(client, file_doc, expected)
+        # the hash is requested from the server if the File document doesn't have it
+        del file_doc[SERVER_HASH_ALGORITHM]
+        assert validate_server_hash(client, file_doc, expected)
+
+
+def test_validate_samples(local_tests_dir, fake_girder_server, fake_girder_client):
+    test_dir_path = local_tests_dir / test_validate_samples.__name__
+    assert not test_dir_path.is_dir()
+    test_dir_path.mkdir()
+    try:
+        file_doc = upload_test_file(fake_girder_server, fake_girder_client)
+        test_file_path = test_dir_path / file_doc["name"]
+        test_file_path.write_bytes(TEST_FILE_CONTENTS)
+        expected = {
+            "size": file_doc["size"],
+            "sha256": get_on_disk_file_hash(test_file_path),
+        }
+        assert validate_samples(fake_girder_client, file_doc, expected) is None
+        assert validate_samples(
+            fake_girder_client, file_doc, expected, filepath=test_file_path
+        )
+        expected["size"] += 1
+        assert not validate_samples(
+            fake_girder_client, file_doc, expected, filepath=test_file_path
+        )
+    finally:
+        shutil.rmtree(test_dir_path)